@@ -11,39 +11,48 @@ if [ ! -d havoc_deploy/aws/terraform/build ]; then
 fi
 echo " - Packaging havoc_control_api/authorizer"
 cd havoc_control_api/authorizer && zip -q -r ../../havoc_deploy/aws/terraform/build/authorizer.zip .
-cd .. && openssl dgst -sha256 -binary ../havoc_deploy/aws/terraform/build/authorizer.zip | openssl enc -base64 > ../havoc_deploy/aws/terraform/build/authorizer.zip.base64sha256
+cd .. && zip -q -j ../havoc_deploy/aws/terraform/build/authorizer.zip common/*.py
+openssl dgst -sha256 -binary ../havoc_deploy/aws/terraform/build/authorizer.zip | openssl enc -base64 > ../havoc_deploy/aws/terraform/build/authorizer.zip.base64sha256
 
 echo " - Packaging havoc_control_api/manage"
 cd manage && zip -q -r ../../havoc_deploy/aws/terraform/build/manage.zip .
-cd .. && openssl dgst -sha256 -binary ../havoc_deploy/aws/terraform/build/manage.zip | openssl enc -base64 > ../havoc_deploy/aws/terraform/build/manage.zip.base64sha256
+cd .. && zip -q -j ../havoc_deploy/aws/terraform/build/manage.zip common/*.py
+openssl dgst -sha256 -binary ../havoc_deploy/aws/terraform/build/manage.zip | openssl enc -base64 > ../havoc_deploy/aws/terraform/build/manage.zip.base64sha256
 
 echo " - Packaging havoc_control_api/playbook_operator_control"
 cd playbook_operator_control && zip -q -r ../../havoc_deploy/aws/terraform/build/playbook_operator_control.zip .
-cd .. && openssl dgst -sha256 -binary ../havoc_deploy/aws/terraform/build/playbook_operator_control.zip | openssl enc -base64 > ../havoc_deploy/aws/terraform/build/playbook_operator_control.zip.base64sha256
+cd .. && zip -q -j ../havoc_deploy/aws/terraform/build/playbook_operator_control.zip common/*.py
+openssl dgst -sha256 -binary ../havoc_deploy/aws/terraform/build/playbook_operator_control.zip | openssl enc -base64 > ../havoc_deploy/aws/terraform/build/playbook_operator_control.zip.base64sha256
 
 echo " - Packaging havoc_control_api/playbook_operator_result"
 cd playbook_operator_result && zip -q -r ../../havoc_deploy/aws/terraform/build/playbook_operator_result.zip .
-cd .. && openssl dgst -sha256 -binary ../havoc_deploy/aws/terraform/build/playbook_operator_result.zip | openssl enc -base64 > ../havoc_deploy/aws/terraform/build/playbook_operator_result.zip.base64sha256
+cd .. && zip -q -j ../havoc_deploy/aws/terraform/build/playbook_operator_result.zip common/*.py
+openssl dgst -sha256 -binary ../havoc_deploy/aws/terraform/build/playbook_operator_result.zip | openssl enc -base64 > ../havoc_deploy/aws/terraform/build/playbook_operator_result.zip.base64sha256
 
 echo " - Packaging havoc_control_api/remote_task"
 cd remote_task && zip -q -r ../../havoc_deploy/aws/terraform/build/remote_task.zip .
-cd .. && openssl dgst -sha256 -binary ../havoc_deploy/aws/terraform/build/remote_task.zip | openssl enc -base64 > ../havoc_deploy/aws/terraform/build/remote_task.zip.base64sha256
+cd .. && zip -q -j ../havoc_deploy/aws/terraform/build/remote_task.zip common/*.py
+openssl dgst -sha256 -binary ../havoc_deploy/aws/terraform/build/remote_task.zip | openssl enc -base64 > ../havoc_deploy/aws/terraform/build/remote_task.zip.base64sha256
 
 echo " - Packaging havoc_control_api/task_control"
 cd task_control && zip -q -r ../../havoc_deploy/aws/terraform/build/task_control.zip .
-cd .. && openssl dgst -sha256 -binary ../havoc_deploy/aws/terraform/build/task_control.zip | openssl enc -base64 > ../havoc_deploy/aws/terraform/build/task_control.zip.base64sha256
+cd .. && zip -q -j ../havoc_deploy/aws/terraform/build/task_control.zip common/*.py
+openssl dgst -sha256 -binary ../havoc_deploy/aws/terraform/build/task_control.zip | openssl enc -base64 > ../havoc_deploy/aws/terraform/build/task_control.zip.base64sha256
 
 echo " - Packaging havoc_control_api/task_result"
 cd task_result && zip -q -r ../../havoc_deploy/aws/terraform/build/task_result.zip .
-cd .. && openssl dgst -sha256 -binary ../havoc_deploy/aws/terraform/build/task_result.zip | openssl enc -base64 > ../havoc_deploy/aws/terraform/build/task_result.zip.base64sha256
+cd .. && zip -q -j ../havoc_deploy/aws/terraform/build/task_result.zip common/*.py
+openssl dgst -sha256 -binary ../havoc_deploy/aws/terraform/build/task_result.zip | openssl enc -base64 > ../havoc_deploy/aws/terraform/build/task_result.zip.base64sha256
 
 echo " - Packaging havoc_control_api/workspace_access_get"
 cd workspace_access_get && zip -q -r ../../havoc_deploy/aws/terraform/build/workspace_access_get.zip .
-cd .. && openssl dgst -sha256 -binary ../havoc_deploy/aws/terraform/build/workspace_access_get.zip | openssl enc -base64 > ../havoc_deploy/aws/terraform/build/workspace_access_get.zip.base64sha256
+cd .. && zip -q -j ../havoc_deploy/aws/terraform/build/workspace_access_get.zip common/*.py
+openssl dgst -sha256 -binary ../havoc_deploy/aws/terraform/build/workspace_access_get.zip | openssl enc -base64 > ../havoc_deploy/aws/terraform/build/workspace_access_get.zip.base64sha256
 
 echo " - Packaging havoc_control_api/workspace_access_put"
 cd workspace_access_put && zip -q -r ../../havoc_deploy/aws/terraform/build/workspace_access_put.zip .
-cd .. && openssl dgst -sha256 -binary ../havoc_deploy/aws/terraform/build/workspace_access_put.zip | openssl enc -base64 > ../havoc_deploy/aws/terraform/build/workspace_access_put.zip.base64sha256
+cd .. && zip -q -j ../havoc_deploy/aws/terraform/build/workspace_access_put.zip common/*.py
+openssl dgst -sha256 -binary ../havoc_deploy/aws/terraform/build/workspace_access_put.zip | openssl enc -base64 > ../havoc_deploy/aws/terraform/build/workspace_access_put.zip.base64sha256
 
 echo " - Packaging havoc_control_api/trigger_executor"
 if [ ! -d trigger_executor/havoc ]; then
@@ -58,7 +67,8 @@ fi
 ${pip_bin} --disable-pip-version-check install -q --upgrade --target ./trigger_executor/dpath dpath
 cd trigger_executor/dpath && zip -q -r ../../../havoc_deploy/aws/terraform/build/trigger_executor.zip .
 cd .. && zip -q -r ../../havoc_deploy/aws/terraform/build/trigger_executor.zip .
-cd .. && openssl dgst -sha256 -binary ../havoc_deploy/aws/terraform/build/trigger_executor.zip | openssl enc -base64 > ../havoc_deploy/aws/terraform/build/trigger_executor.zip.base64sha256
+cd .. && zip -q -j ../havoc_deploy/aws/terraform/build/trigger_executor.zip common/*.py
+openssl dgst -sha256 -binary ../havoc_deploy/aws/terraform/build/trigger_executor.zip | openssl enc -base64 > ../havoc_deploy/aws/terraform/build/trigger_executor.zip.base64sha256
 cd ..
 
 echo " - Packaging havoc_playbooks/conti_ransomware playbook"
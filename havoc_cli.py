@@ -464,33 +464,85 @@ class HavocCMD(Cmd):
         print('\n--start_time=<string> - (optional) retrieve results that occurred after the specified time')
         print('\n--end_time=<string> - (optional) retrieve results that occurred before the specified time')
     
+    def control_api_endpoint(self, endpoint_name):
+        """
+        Returns the named control API endpoint if the installed havoc client can post actions to it directly, or None so
+        the caller can fall back to the client's own methods.
+        """
+        if not hasattr(self.havoc_client, 'post'):
+            return None
+        return getattr(self.havoc_client, endpoint_name, None)
+
+    def follow_results(self, endpoint_name, detail, result_key, print_result, get_results):
+        """
+        Poll a results queue for new rows only. The server is asked for rows after the newest run_time seen so far, in
+        ascending order, following next_token until the new rows are exhausted. Clients that can't post to the control
+        API poll get_results instead, which returns every row since start_time on each pass.
+        """
+        api_endpoint = self.control_api_endpoint(endpoint_name)
+        seen = set()
+        after_run_time = None
+
+        def show_new(results):
+            nonlocal after_run_time
+            for result in results:
+                run_time = int(result['run_time'])
+                key = (run_time, result[result_key])
+                if key not in seen:
+                    seen.add(key)
+                    print_result(result)
+                if after_run_time is None or run_time > after_run_time:
+                    after_run_time = run_time
+
+        try:
+            while True:
+                if api_endpoint is None:
+                    show_new(get_results().get('queue', []))
+                    t.sleep(5)
+                    continue
+                poll_detail = dict(detail, sort_order='ascending')
+                if after_run_time is not None:
+                    # run_time has one second resolution, so re-read the newest second in case a row arrived late in it.
+                    poll_detail['after_run_time'] = after_run_time - 1
+                while True:
+                    response = self.havoc_client.post(api_endpoint, {'action': 'get_results', 'detail': poll_detail})
+                    show_new(response.get('queue', []))
+                    if 'next_token' not in response:
+                        break
+                    poll_detail['next_token'] = response['next_token']
+                # Rows older than the re-read window can't be returned again.
+                if after_run_time is not None:
+                    seen = {k for k in seen if k[0] >= after_run_time - 1}
+                t.sleep(5)
+        except KeyboardInterrupt:
+            return
+
     def do_tail_playbook_results(self, inp):
         args = {'playbook_name': ''}
         command_args = convert_input(args, inp)
         get_playbook_response = self.havoc_client.get_playbook(**command_args)
+        detail = {'playbook_name': command_args['playbook_name']}
         if get_playbook_response['last_execution_time'] != 'None':
-            command_args['start_time'] = get_playbook_response['last_execution_time']
-        playbook_results = []
-        try:
-            while True:
-                get_playbook_results_response = self.havoc_client.get_playbook_results(**command_args)
-                if 'queue' in get_playbook_results_response:
-                    queue = sorted(get_playbook_results_response['queue'], key=lambda d: d['run_time'])
-                    for result in queue:
-                        operator_command = result['operator_command']
-                        if operator_command not in playbook_results:
-                            playbook_results.append(operator_command)
-                            command_output = json.loads(result['command_output'])
-                            if 'outcome' in command_output:
-                                outcome = command_output['outcome']
-                            elif 'status' in command_output:
-                                outcome = command_output['status']
-                            else:
-                                outcome = 'None'
-                            print(f' - operator_command: {operator_command}, outcome: {outcome}')
-                t.sleep(5)
-        except KeyboardInterrupt:
-            print('tail_playbook_results stopped.')
+            detail['start_time'] = get_playbook_response['last_execution_time']
+
+        def print_result(result):
+            try:
+                command_output = json.loads(result['command_output'])
+            except (TypeError, ValueError):
+                command_output = {}
+            if 'outcome' in command_output:
+                outcome = command_output['outcome']
+            elif 'status' in command_output:
+                outcome = command_output['status']
+            else:
+                outcome = 'None'
+            print(f' - operator_command: {result["operator_command"]}, outcome: {outcome}')
+
+        self.follow_results(
+            'playbook_operator_control_api_endpoint', detail, 'operator_command', print_result,
+            lambda: self.havoc_client.get_playbook_results(**detail)
+        )
+        print('tail_playbook_results stopped.')
 
     def help_tail_playbook_results(self):
         print('\nFollow results for a given playbook.')
@@ -823,6 +875,41 @@ class HavocCMD(Cmd):
         print('\n--start_time=<string> - (optional) retrieve results that occurred after the specified time')
         print('\n--end_time=<string> - (optional) retrieve results that occurred before the specified time')
 
+    def do_tail_task_results(self, inp):
+        args = {'task_name': '', 'start_time': ''}
+        command_args = convert_input(args, inp)
+        # Large outputs are stored outside the queue row; resolve them so their outcome can be shown.
+        detail = {'task_name': command_args.get('task_name', ''), 'resolve_output': 'true'}
+        if 'start_time' in command_args:
+            detail['start_time'] = command_args['start_time']
+        else:
+            detail['start_time'] = str(int(t.time()))
+
+        def print_result(result):
+            try:
+                command_output = json.loads(result['instruct_command_output'])
+            except (TypeError, ValueError):
+                command_output = {}
+            if isinstance(command_output, dict) and 'outcome' in command_output:
+                outcome = command_output['outcome']
+            else:
+                outcome = 'None'
+            print(
+                f' - instruct_command: {result["instruct_command"]}, instruct_instance: {result["instruct_instance"]}, '
+                f'instruct_id: {result["instruct_id"]}, outcome: {outcome}'
+            )
+
+        self.follow_results(
+            'task_control_api_endpoint', detail, 'instruct_id', print_result,
+            lambda: self.havoc_client.get_task_results(task_name=detail['task_name'], start_time=detail['start_time'])
+        )
+        print('tail_task_results stopped.')
+
+    def help_tail_task_results(self):
+        print('\nFollow results for a given task.')
+        print('\n--task_name=<string> - (required) the name of the task to retrieve results from')
+        print('\n--start_time=<string> - (optional) also show results that occurred after the specified time (defaults to now)')
+
     def do_wait_for_c2(self, inp):
         args = {'task_name': '', 'time_skew': ''}
         command_args = convert_input(args, inp)
@@ -841,8 +928,22 @@ class HavocCMD(Cmd):
     def do_wait_for_idle_task(self, inp):
         args = {'task_name': ''}
         command_args = convert_input(args, inp)
+        detail = {'task_name': command_args.get('task_name', ''), 'task_status': 'idle', 'wait_seconds': 25}
+        api_endpoint = self.control_api_endpoint('task_control_api_endpoint')
         try:
-            response = self.havoc_client.wait_for_idle_task(**command_args)
+            if api_endpoint is None:
+                response = self.havoc_client.wait_for_idle_task(**command_args)
+                format_output('wait_for_idle_task', response)
+                return
+            # The task_control API holds each request until the task goes idle or 25 seconds pass, and fails once the
+            # task is terminated.
+            while True:
+                response = self.havoc_client.post(api_endpoint, {'action': 'wait_for_status', 'detail': detail})
+                if response.get('outcome') != 'success' or response.get('status_reached') == 'yes' or \
+                        response.get('task_status') == 'terminated':
+                    break
+            if response.get('outcome') == 'success' and response.get('status_reached') == 'yes':
+                response = self.havoc_client.get_task(detail['task_name'])
             format_output('wait_for_idle_task', response)
         except KeyboardInterrupt:
             print('wait_for_idle_task stopped.')
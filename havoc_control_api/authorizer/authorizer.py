@@ -1,7 +1,14 @@
-import boto3
+import botocore
+import havoc_aws
 import datetime
 import hashlib
 import hmac
+from key_cache import KeyCache
+
+
+# Survives across warm invocations of this container. manage/users.py bumps the cache epoch on the deployment entry
+# when keys are rotated or users change, and every container drops its cache once it sees the new epoch.
+key_cache = KeyCache()
 
 
 class Login:
@@ -28,8 +35,30 @@ class Login:
         kSigning = self.sign(k_region, self.api_domain_name)
         return kSigning
 
-    def authorize_keys(self):
-        client = boto3.client('dynamodb', region_name=self.region)
+    def get_cache_epoch(self):
+        """Returns the authorizer cache epoch recorded on the deployment entry"""
+        client = havoc_aws.client('dynamodb', self.region)
+        response = client.get_item(
+            TableName=f'{self.deployment_name}-deployment',
+            Key={
+                'deployment_name': {'S': self.deployment_name}
+            },
+            ProjectionExpression='authorizer_cache_epoch'
+        )
+        return response.get('Item', {}).get('authorizer_cache_epoch', {}).get('N', '0')
+
+    def get_user_record(self):
+        """Returns the authorizer record for self.api_key, or None if the api_key does not exist"""
+        try:
+            key_cache.check_epoch(self.get_cache_epoch)
+        except botocore.exceptions.ClientError as error:
+            # Without the epoch a cached record may be stale, so fall back to reading the user
+            print(f'Error reading authorizer cache epoch: {error}')
+            key_cache.invalidate()
+        hit, record = key_cache.get(self.api_key)
+        if hit:
+            return record
+        client = havoc_aws.client('dynamodb', self.region)
         response = client.query(
             TableName=f'{self.deployment_name}-authorizer',
             IndexName=f'{self.deployment_name}-ApiKeyIndex',
@@ -40,23 +69,31 @@ class Login:
                 }
             }
         )
-        resp_api_key = None
-        resp_secret_key = None
-        resp_user_id = None
+        record = None
         if response['Items']:
-            resp_api_key = response['Items'][0]['api_key']['S']
-            resp_secret_key = response['Items'][0]['secret_key']['S']
-            resp_user_id = response['Items'][0]['user_id']['S']
-            resp_remote_task = response['Items'][0]['remote_task']['S']
+            record = {
+                'api_key': response['Items'][0]['api_key']['S'],
+                'secret_key': response['Items'][0]['secret_key']['S'],
+                'user_id': response['Items'][0]['user_id']['S'],
+                'remote_task': response['Items'][0]['remote_task']['S']
+            }
+        key_cache.put(self.api_key, record)
+        return record
 
+    def authorize_keys(self):
         if not self.api_key:
             self.authorized = False
             print('Authorization failed due to missing api_key')
             return self.authorized
-        if not resp_user_id:
+
+        record = self.get_user_record()
+        if not record:
             self.authorized = False
             print('Authorization failed due to invalid api_key')
             return self.authorized
+        resp_api_key = record['api_key']
+        resp_user_id = record['user_id']
+        resp_remote_task = record['remote_task']
 
         # Create signing key elements
         sig_date = datetime.datetime.strptime(self.sig_date, '%Y%m%dT%H%M%SZ')
@@ -73,7 +110,7 @@ class Login:
             return self.authorized
 
         # Get signing_key
-        signing_key = self.getSignatureKey(resp_secret_key, local_date_stamp)
+        signing_key = key_cache.signing_key(record, local_date_stamp, self.getSignatureKey)
 
         # Setup string to sign
         algorithm = 'HMAC-SHA256'
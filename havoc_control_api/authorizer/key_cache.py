@@ -0,0 +1,75 @@
+import threading
+import time as t
+from collections import OrderedDict
+
+
+class KeyCache:
+
+    def __init__(self, max_entries=1024, ttl=300, negative_ttl=60, epoch_check_interval=5):
+        """
+        In-process LRU cache of authorizer user records keyed by api_key, with a TTL on every entry. Unknown api_keys
+        are cached as None for negative_ttl seconds. Derived signing keys are cached per date stamp alongside the
+        record they were derived from, so a key rotation drops them with the record.
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.epoch_check_interval = epoch_check_interval
+        self.epoch = None
+        self.epoch_checked = None
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def check_epoch(self, read_epoch):
+        """
+        Clears the cache when the invalidation epoch returned by read_epoch has moved since the cache was filled. The
+        epoch is read at most once per epoch_check_interval seconds, which bounds how long an invalidation takes.
+        """
+        now = t.monotonic()
+        with self.lock:
+            if self.epoch_checked is not None and now - self.epoch_checked < self.epoch_check_interval:
+                return
+        epoch = read_epoch()
+        with self.lock:
+            self.epoch_checked = now
+            if epoch != self.epoch:
+                self.entries.clear()
+                self.epoch = epoch
+
+    def get(self, api_key):
+        """Returns (True, record) on a cache hit, where record is None for a cached unknown api_key"""
+        with self.lock:
+            entry = self.entries.get(api_key)
+            if entry is None:
+                return False, None
+            expires, record = entry
+            if expires <= t.monotonic():
+                del self.entries[api_key]
+                return False, None
+            self.entries.move_to_end(api_key)
+            return True, record
+
+    def put(self, api_key, record):
+        ttl = self.ttl if record is not None else self.negative_ttl
+        with self.lock:
+            self.entries[api_key] = (t.monotonic() + ttl, record)
+            self.entries.move_to_end(api_key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def signing_key(self, record, date_stamp, derive):
+        """Returns the signing key for date_stamp from record, deriving and storing it on first use"""
+        signing_keys = record.setdefault('signing_keys', {})
+        if date_stamp not in signing_keys:
+            # Signing keys are derived from the current date, so older ones are never needed again.
+            for stale in [d for d in signing_keys if d < date_stamp]:
+                del signing_keys[stale]
+            signing_keys[date_stamp] = derive(record['secret_key'], date_stamp)
+        return signing_keys[date_stamp]
+
+    def invalidate(self, api_key=None):
+        with self.lock:
+            if api_key is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(api_key, None)
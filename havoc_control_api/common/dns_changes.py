@@ -0,0 +1,146 @@
+import re
+import random
+import botocore
+import time as t
+
+# Route53 accepts up to 1000 changes in one ChangeResourceRecordSets request.
+max_batch_changes = 1000
+# Route53 allows 5 requests per second per account; throttled requests are retried with jittered backoff.
+max_attempts = 8
+initial_backoff = 0.2
+max_backoff = 5
+throttling_error_codes = ['Throttling', 'ThrottlingException', 'PriorRequestNotComplete']
+# InvalidChangeBatch names each missing record, e.g.
+# Tried to delete resource record set [name='www.example.com.', type='A'] but it was not found
+record_not_found_pattern = re.compile(r"\[name='([^']*)', type='([^']*)'\] but it was not found")
+
+
+def record_key(name, record_type):
+    return name.rstrip('.').lower(), record_type
+
+
+def is_record_not_found(error):
+    if not isinstance(error, botocore.exceptions.ClientError):
+        return False
+    return error.response['Error']['Code'] == 'InvalidChangeBatch' and 'not found' in error.response['Error']['Message']
+
+
+def missing_records(error):
+    """Returns the name and type keys of the records a rejected batch tried to delete but Route53 could not find"""
+    return {
+        record_key(name, record_type)
+        for name, record_type in record_not_found_pattern.findall(error.response['Error']['Message'])
+    }
+
+
+class ChangeBatcher:
+    """
+    Queues resource record changes per hosted zone and sends them as multi-change batches.
+
+    A later change to the same record name and type replaces an earlier queued one, since Route53 rejects a batch
+    that changes one record twice. DELETEs of records that are already gone count as done, so a flush can be repeated.
+    """
+
+    def __init__(self, aws_route53_client):
+        self.aws_route53_client = aws_route53_client
+        self.changes = {}
+        self.change_ids = []
+
+    def add(self, hosted_zone, action, name, record_type, value, ttl=300):
+        zone_changes = self.changes.setdefault(hosted_zone, {})
+        zone_changes[record_key(name, record_type)] = {
+            'Action': action,
+            'ResourceRecordSet': {
+                'Name': name,
+                'Type': record_type,
+                'TTL': ttl,
+                'ResourceRecords': [
+                    {
+                        'Value': value
+                    }
+                ]
+            }
+        }
+
+    def upsert(self, hosted_zone, name, record_type, value, ttl=300):
+        self.add(hosted_zone, 'UPSERT', name, record_type, value, ttl)
+
+    def delete(self, hosted_zone, name, record_type, value, ttl=300):
+        self.add(hosted_zone, 'DELETE', name, record_type, value, ttl)
+
+    def submit(self, hosted_zone, changes):
+        """Sends one change batch, backing off while Route53 throttles. Returns the change ID or the error."""
+        attempt = 0
+        while True:
+            try:
+                response = self.aws_route53_client.change_resource_record_sets(
+                    HostedZoneId=hosted_zone,
+                    ChangeBatch={'Changes': changes}
+                )
+            except botocore.exceptions.ClientError as error:
+                attempt += 1
+                if error.response['Error']['Code'] not in throttling_error_codes or attempt >= max_attempts:
+                    return error
+                backoff = min(initial_backoff * (2 ** attempt), max_backoff)
+                t.sleep(backoff / 2 + random.uniform(0, backoff / 2))
+                continue
+            except botocore.exceptions.ParamValidationError as error:
+                return error
+            return response['ChangeInfo']['Id']
+
+    def send_batch(self, hosted_zone, batch):
+        """
+        Sends one batch. The whole batch is rejected if a DELETE targets a record that is already gone, so the DELETEs
+        named in the error are dropped and the rest resent; if the error names none of them, the batch is split in two.
+        Returns a list of errors.
+        """
+        while batch:
+            submit_response = self.submit(hosted_zone, batch)
+            if isinstance(submit_response, str):
+                self.change_ids.append(submit_response)
+                return []
+            if not is_record_not_found(submit_response):
+                return [submit_response]
+            missing = missing_records(submit_response)
+            remaining = [
+                change for change in batch
+                if change['Action'] != 'DELETE' or
+                record_key(change['ResourceRecordSet']['Name'], change['ResourceRecordSet']['Type']) not in missing
+            ]
+            if len(remaining) < len(batch):
+                batch = remaining
+                continue
+            if len(batch) == 1:
+                return [] if batch[0]['Action'] == 'DELETE' else [submit_response]
+            half = len(batch) // 2
+            return self.send_batch(hosted_zone, batch[:half]) + self.send_batch(hosted_zone, batch[half:])
+        return []
+
+    def flush_zone(self, hosted_zone, changes):
+        """Sends changes to one hosted zone in batches of up to max_batch_changes. Returns a list of errors."""
+        errors = []
+        for i in range(0, len(changes), max_batch_changes):
+            errors.extend(self.send_batch(hosted_zone, changes[i:i + max_batch_changes]))
+        return errors
+
+    def flush(self):
+        """Sends the queued changes. Returns 'resource_record_sets_changed' or a list of errors."""
+        errors = []
+        changes, self.changes = self.changes, {}
+        for hosted_zone, zone_changes in changes.items():
+            errors.extend(self.flush_zone(hosted_zone, list(zone_changes.values())))
+        if errors:
+            return errors
+        return 'resource_record_sets_changed'
+
+    def wait_for_changes(self, delay=5, max_wait_attempts=24):
+        """Waits until every flushed change has propagated to the Route53 name servers (INSYNC)"""
+        waiter = self.aws_route53_client.get_waiter('resource_record_sets_changed')
+        try:
+            for change_id in self.change_ids:
+                waiter.wait(Id=change_id, WaiterConfig={'Delay': delay, 'MaxAttempts': max_wait_attempts})
+        except botocore.exceptions.WaiterError as error:
+            return error
+        except botocore.exceptions.ClientError as error:
+            return error
+        return 'resource_record_sets_in_sync'
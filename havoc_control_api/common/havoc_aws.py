@@ -0,0 +1,35 @@
+import threading
+import boto3
+import botocore.config
+
+
+# Clients are created once per container and reused across warm invocations, so connections stay open between
+# requests instead of paying for client construction and a new TLS handshake every time.
+client_config = botocore.config.Config(
+    connect_timeout=5,
+    read_timeout=30,
+    max_pool_connections=32,
+    tcp_keepalive=True,
+    retries={
+        'max_attempts': 5,
+        'mode': 'standard'
+    }
+)
+
+_session = boto3.session.Session()
+_clients = {}
+_lock = threading.Lock()
+
+
+def client(service_name, region_name=None):
+    """Returns the shared boto3 client for service_name and region_name, creating it on first use"""
+    key = (service_name, region_name)
+    aws_client = _clients.get(key)
+    if aws_client is None:
+        # Client creation is not thread safe, but the clients themselves are.
+        with _lock:
+            aws_client = _clients.get(key)
+            if aws_client is None:
+                aws_client = _session.client(service_name, region_name=region_name, config=client_config)
+                _clients[key] = aws_client
+    return aws_client
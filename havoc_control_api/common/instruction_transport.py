@@ -0,0 +1,200 @@
+import json
+import botocore
+import havoc_aws
+import time as t
+from concurrent.futures import ThreadPoolExecutor
+
+# Instructions reach a task through a transport: send() queues one, pending() cheaply checks for any, receive() returns
+# [(handle, instruction)] in send order and ack() removes received instructions by handle.
+
+
+class S3Transport:
+    """
+    The original transport: one workspace object per instruction under <task_name>/. Kept as the default because task
+    containers read their instructions from the bucket.
+    """
+
+    name = 's3'
+    max_workers = 16
+
+    def __init__(self, aws_s3_client, deployment_name):
+        self.aws_s3_client = aws_s3_client
+        self.bucket = f'{deployment_name}-workspace'
+
+    def send(self, task_name, instruction, seq=None):
+        try:
+            self.aws_s3_client.put_object(
+                Body=json.dumps(instruction).encode('utf-8'),
+                Bucket=self.bucket,
+                Key=task_name + '/' + instruction['timestamp']
+            )
+        except botocore.exceptions.ClientError as error:
+            return error
+        except botocore.exceptions.ParamValidationError as error:
+            return error
+        return 'instruction_sent'
+
+    def pending(self, task_name):
+        try:
+            response = self.aws_s3_client.list_objects_v2(
+                Bucket=self.bucket,
+                Prefix=task_name + '/',
+                StartAfter=task_name + '/',
+                MaxKeys=1
+            )
+        except botocore.exceptions.ClientError as error:
+            return error
+        except botocore.exceptions.ParamValidationError as error:
+            return error
+        return response.get('KeyCount', 0) > 0
+
+    def get_instruction(self, key):
+        try:
+            response = self.aws_s3_client.get_object(Bucket=self.bucket, Key=key)
+        except botocore.exceptions.ClientError as error:
+            # A concurrent receive already picked this instruction up.
+            if error.response['Error']['Code'] == 'NoSuchKey':
+                return None
+            return error
+        except botocore.exceptions.ParamValidationError as error:
+            return error
+        return json.loads(response['Body'].read().decode('utf-8'))
+
+    def receive(self, task_name):
+        keys = []
+        try:
+            paginator = self.aws_s3_client.get_paginator('list_objects_v2')
+            for page in paginator.paginate(Bucket=self.bucket, Prefix=task_name + '/'):
+                for entry in page.get('Contents', []):
+                    if entry['Key'] != task_name + '/':
+                        keys.append(entry['Key'])
+        except botocore.exceptions.ClientError as error:
+            return error
+        except botocore.exceptions.ParamValidationError as error:
+            return error
+        if not keys:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(keys))) as executor:
+            instructions = list(executor.map(self.get_instruction, keys))
+        received = []
+        for key, instruction in zip(keys, instructions):
+            if instruction is None:
+                continue
+            if not isinstance(instruction, dict):
+                return instruction
+            received.append((key, instruction))
+        return received
+
+    def ack(self, task_name, handles):
+        for i in range(0, len(handles), 1000):
+            try:
+                response = self.aws_s3_client.delete_objects(
+                    Bucket=self.bucket,
+                    Delete={
+                        'Objects': [{'Key': key} for key in handles[i:i + 1000]],
+                        'Quiet': True
+                    }
+                )
+            except botocore.exceptions.ClientError as error:
+                return error
+            except botocore.exceptions.ParamValidationError as error:
+                return error
+            if response.get('Errors'):
+                return response['Errors']
+        return 'instructions_acked'
+
+
+class DynamoDBTransport:
+    """
+    An ordered per-task queue in the <deployment>-instruction-queue table, keyed by task_name and the task's
+    instruction sequence number, so instructions issued in the same second never overwrite each other.
+    """
+
+    name = 'dynamodb'
+    max_receive = 100
+    # Deletes a throttled BatchWriteItem hands back unprocessed are retried with backoff, up to this many times.
+    max_ack_attempts = 8
+
+    def __init__(self, aws_dynamodb_client, deployment_name):
+        self.aws_dynamodb_client = aws_dynamodb_client
+        self.table_name = f'{deployment_name}-instruction-queue'
+
+    def send(self, task_name, instruction, seq=None):
+        try:
+            self.aws_dynamodb_client.put_item(
+                TableName=self.table_name,
+                Item={
+                    'task_name': {'S': task_name},
+                    'seq': {'N': str(seq)},
+                    'instruction': {'S': json.dumps(instruction)}
+                }
+            )
+        except botocore.exceptions.ClientError as error:
+            return error
+        except botocore.exceptions.ParamValidationError as error:
+            return error
+        return 'instruction_sent'
+
+    def query(self, task_name, limit):
+        return self.aws_dynamodb_client.query(
+            TableName=self.table_name,
+            KeyConditionExpression='task_name = :task_name',
+            ExpressionAttributeValues={
+                ':task_name': {'S': task_name}
+            },
+            ConsistentRead=True,
+            Limit=limit
+        )
+
+    def pending(self, task_name):
+        try:
+            response = self.query(task_name, 1)
+        except botocore.exceptions.ClientError as error:
+            return error
+        return len(response['Items']) > 0
+
+    def receive(self, task_name):
+        try:
+            response = self.query(task_name, self.max_receive)
+        except botocore.exceptions.ClientError as error:
+            return error
+        return [(item['seq']['N'], json.loads(item['instruction']['S'])) for item in response['Items']]
+
+    def ack(self, task_name, handles):
+        pending = [
+            {'DeleteRequest': {'Key': {'task_name': {'S': task_name}, 'seq': {'N': seq}}}} for seq in handles
+        ]
+        attempt = 0
+        try:
+            while pending:
+                chunk, pending = pending[:25], pending[25:]
+                response = self.aws_dynamodb_client.batch_write_item(RequestItems={self.table_name: chunk})
+                unprocessed = response.get('UnprocessedItems', {}).get(self.table_name, [])
+                if unprocessed:
+                    attempt += 1
+                    if attempt >= self.max_ack_attempts:
+                        return f'instruction acks were still unprocessed after {attempt} attempts'
+                    pending.extend(unprocessed)
+                    t.sleep(min(0.05 * (2 ** attempt), 1))
+        except botocore.exceptions.ClientError as error:
+            return error
+        except botocore.exceptions.ParamValidationError as error:
+            return error
+        return 'instructions_acked'
+
+
+def get_transport(name, region, deployment_name):
+    """Returns the transport driver configured as name"""
+    if name == DynamoDBTransport.name:
+        return DynamoDBTransport(havoc_aws.client('dynamodb', region), deployment_name)
+    return S3Transport(havoc_aws.client('s3', region), deployment_name)
+
+
+def get_task_transport(name, ecs_task_id, region, deployment_name):
+    """
+    Returns the transport driver for a task. ECS task containers read their instructions straight from the workspace
+    bucket, so only remote tasks, which fetch them through get_commands, use the configured transport.
+    """
+    if ecs_task_id != 'remote_task':
+        name = S3Transport.name
+    return get_transport(name, region, deployment_name)
@@ -0,0 +1,105 @@
+import random
+import threading
+import botocore
+import time as t
+from datetime import datetime
+
+# put_log_events limits: events per call, bytes per call (each event counts 26 bytes on top of its message) and the
+# time span a single call may cover.
+max_batch_events = 10000
+max_batch_bytes = 1048576
+event_overhead_bytes = 26
+max_batch_span = 24 * 60 * 60 * 1000
+
+# Streams known to exist, shared by every writer in the container so warm invocations skip create_log_stream.
+_known_streams = set()
+_lock = threading.Lock()
+
+
+def log_stream_name(resource_name):
+    """Returns the daily results log stream name for a task or playbook"""
+    return f'{datetime.strftime(datetime.now(), "%Y/%m/%d")}/{resource_name}'
+
+
+class LogWriter:
+
+    def __init__(self, aws_logs_client, log_group_name, max_attempts=5):
+        """
+        Buffers log events per stream and writes them with as few put_log_events calls as the API limits allow.
+        Streams are only created the first time a container writes to them, and throttled calls are retried with
+        backoff.
+        """
+        self.aws_logs_client = aws_logs_client
+        self.log_group_name = log_group_name
+        self.max_attempts = max_attempts
+        self.events = {}
+
+    def add(self, stream_name, timestamp, message):
+        """Buffers a log event; timestamp is in milliseconds"""
+        self.events.setdefault(stream_name, []).append({'timestamp': timestamp, 'message': message})
+
+    def create_log_stream(self, stream_name):
+        try:
+            self.aws_logs_client.create_log_stream(logGroupName=self.log_group_name, logStreamName=stream_name)
+        except self.aws_logs_client.exceptions.ResourceAlreadyExistsException:
+            pass
+        with _lock:
+            _known_streams.add((self.log_group_name, stream_name))
+
+    def put_batch(self, stream_name, batch):
+        attempt = 0
+        while True:
+            try:
+                if (self.log_group_name, stream_name) not in _known_streams:
+                    self.create_log_stream(stream_name)
+                response = self.aws_logs_client.put_log_events(
+                    logGroupName=self.log_group_name,
+                    logStreamName=stream_name,
+                    logEvents=batch
+                )
+            except botocore.exceptions.ClientError as error:
+                attempt += 1
+                code = error.response['Error']['Code']
+                if code == 'ResourceNotFoundException':
+                    # The stream was deleted since it was cached.
+                    with _lock:
+                        _known_streams.discard((self.log_group_name, stream_name))
+                elif code not in ['ThrottlingException', 'ServiceUnavailableException']:
+                    return error
+                if attempt >= self.max_attempts:
+                    return error
+                if code != 'ResourceNotFoundException':
+                    t.sleep(random.uniform(0.5, 1) * min(0.2 * (2 ** attempt), 5))
+                continue
+            except botocore.exceptions.ParamValidationError as error:
+                return error
+            if 'rejectedLogEventsInfo' in response:
+                print(f'Log events rejected by {self.log_group_name}/{stream_name}: {response["rejectedLogEventsInfo"]}')
+            return 'log_events_written'
+
+    def batches(self, events):
+        """Splits events, in chronological order, into batches within the put_log_events limits"""
+        events = sorted(events, key=lambda e: e['timestamp'])
+        batches = [[]]
+        batch_bytes = 0
+        for event in events:
+            event_bytes = len(event['message'].encode('utf-8')) + event_overhead_bytes
+            batch = batches[-1]
+            if batch and (len(batch) >= max_batch_events or batch_bytes + event_bytes > max_batch_bytes
+                          or event['timestamp'] - batch[0]['timestamp'] > max_batch_span):
+                batches.append([])
+                batch_bytes = 0
+            batches[-1].append(event)
+            batch_bytes += event_bytes
+        return batches
+
+    def flush(self):
+        """Writes every buffered event. Returns 'log_events_written' or the first error encountered."""
+        first_error = None
+        events, self.events = self.events, {}
+        for stream_name, stream_events in events.items():
+            for batch in self.batches(stream_events):
+                put_batch_response = self.put_batch(stream_name, batch)
+                if put_batch_response != 'log_events_written' and first_error is None:
+                    first_error = put_batch_response
+        return first_error or 'log_events_written'
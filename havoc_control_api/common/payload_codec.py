@@ -0,0 +1,37 @@
+import zlib
+
+# Compressed payloads are stored as DynamoDB binary values that start with this marker, so readers can tell them
+# apart from other binary attributes and from a future codec.
+codec_marker = b'havoc.zlib.1:'
+# Below this size compression doesn't pay for the marker and the zlib header.
+min_compress_bytes = 256
+
+
+def encode(payload_json):
+    """Returns the DynamoDB attribute value for a JSON payload, compressed when that makes it smaller"""
+    data = payload_json.encode('utf-8')
+    if len(data) >= min_compress_bytes:
+        compressed = codec_marker + zlib.compress(data, 6)
+        if len(compressed) < len(data):
+            return {'B': compressed}
+    return {'S': payload_json}
+
+
+def is_encoded(value):
+    return isinstance(value, (bytes, bytearray)) and value.startswith(codec_marker)
+
+
+def decode(value):
+    """Returns the JSON text of a payload attribute value, whether it was stored compressed or as a plain string"""
+    if 'B' in value and is_encoded(value['B']):
+        return zlib.decompress(value['B'][len(codec_marker):]).decode('utf-8')
+    if 'S' in value:
+        return value['S']
+    return value.get('B')
+
+
+def attribute_size(value):
+    """Returns the stored size of a payload attribute value in bytes"""
+    if 'B' in value:
+        return len(value['B'])
+    return len(value['S'].encode('utf-8'))
@@ -0,0 +1,57 @@
+import botocore
+
+
+def update_active_resources(aws_dynamodb_client, deployment_name, resource_type, resource_names, action):
+    """
+    Atomically add or remove resource_names from the resource_type string set in the deployment's active_resources
+    map. Each call is a single UpdateItem using ADD/DELETE, so concurrent callers never overwrite each other.
+    """
+    if isinstance(resource_names, str):
+        resource_names = [resource_names]
+    resource_names = [name for name in set(resource_names) if name != 'None']
+    if not resource_names:
+        return 'deployment_updated'
+    try:
+        aws_dynamodb_client.update_item(
+            TableName=f'{deployment_name}-deployment',
+            Key={
+                'deployment_name': {'S': deployment_name}
+            },
+            UpdateExpression=f'{action} active_resources.#resource_type :resource_names',
+            ConditionExpression='attribute_exists(active_resources)',
+            ExpressionAttributeNames={
+                '#resource_type': resource_type
+            },
+            ExpressionAttributeValues={
+                ':resource_names': {'SS': resource_names}
+            }
+        )
+    except botocore.exceptions.ClientError as error:
+        return error
+    except botocore.exceptions.ParamValidationError as error:
+        return error
+    return 'deployment_updated'
+
+
+def add_active_resources(aws_dynamodb_client, deployment_name, resource_type, resource_names):
+    return update_active_resources(aws_dynamodb_client, deployment_name, resource_type, resource_names, 'ADD')
+
+
+def remove_active_resources(aws_dynamodb_client, deployment_name, resource_type, resource_names):
+    return update_active_resources(aws_dynamodb_client, deployment_name, resource_type, resource_names, 'DELETE')
+
+
+def list_active_resources(active_resources, resource_types=None):
+    """
+    Returns active_resources as {resource_type: [resource_names]}. Sets that were emptied by a DELETE no longer exist
+    and the 'None' placeholder written at deployment creation can sit alongside real members, so both are normalized
+    back to ['None'] only when a resource type has no members.
+    """
+    if resource_types is None:
+        resource_types = active_resources.keys()
+    normalized = {}
+    for resource_type in resource_types:
+        resource_names = active_resources.get(resource_type, {}).get('SS', [])
+        resource_names = sorted(name for name in resource_names if name != 'None')
+        normalized[resource_type] = resource_names or ['None']
+    return normalized
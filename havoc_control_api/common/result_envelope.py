@@ -0,0 +1,76 @@
+import re
+import ast
+import zlib
+import json
+import base64
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Results are logged as a single JSON line: {"havoc_result": <schema_version>, "payload": {...}}. Large payloads may be
+# carried as {"havoc_result": 1, "encoding": "zlib+base64", "body": "<base64 of zlib compressed payload JSON>"} instead.
+envelope_key = 'havoc_result'
+schema_versions = [1]
+encodings = ['zlib+base64']
+
+# Older task versions log the payload dict's repr behind a Twisted log prefix.
+legacy_prefix = re.compile(r'\d+-\d+-\d+ \d+:\d+:\d+\+\d+ \[-\] ')
+
+
+def loads(data):
+    """json.loads using orjson when it is available"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def build_envelope(payload, compress=False):
+    """Returns the envelope line for payload, as logged by task and playbook containers"""
+    if not compress:
+        return json.dumps({envelope_key: 1, 'payload': payload})
+    body = base64.b64encode(zlib.compress(json.dumps(payload).encode('utf-8'))).decode('ascii')
+    return json.dumps({envelope_key: 1, 'encoding': 'zlib+base64', 'body': body})
+
+
+def open_envelope(envelope):
+    """Returns the payload carried by an envelope. Raises ValueError for an unknown schema version or encoding."""
+    if envelope[envelope_key] not in schema_versions:
+        raise ValueError(f'unsupported result schema version {envelope[envelope_key]}')
+    if 'body' not in envelope:
+        return envelope['payload']
+    if envelope.get('encoding') not in encodings:
+        raise ValueError(f'unsupported result encoding {envelope.get("encoding")}')
+    return loads(zlib.decompress(base64.b64decode(envelope['body'])))
+
+
+def parse_result(message):
+    """
+    Returns the result payload from a logged message: an envelope, a bare JSON payload, or the legacy repr of a
+    payload behind a Twisted log prefix. Raises ValueError if the message holds none of them.
+    """
+    text = message.strip()
+    match = None
+    if not text.startswith('{'):
+        # The prefix is short, so only its neighbourhood is searched rather than the whole payload.
+        match = legacy_prefix.search(message, 0, 256)
+        if match:
+            text = message[match.end():].strip()
+    if not text.startswith('{'):
+        raise ValueError('message does not contain a result')
+    try:
+        payload = loads(text)
+    except ValueError:
+        if not match:
+            raise ValueError('message does not contain a result')
+        # Legacy path: a Python dict repr rather than JSON
+        try:
+            payload = ast.literal_eval(text)
+        except (SyntaxError, ValueError):
+            raise ValueError('message does not contain a result')
+    if not isinstance(payload, dict):
+        raise ValueError('message does not contain a result')
+    if envelope_key in payload:
+        return open_envelope(payload)
+    return payload
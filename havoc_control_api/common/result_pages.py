@@ -0,0 +1,144 @@
+import json
+import base64
+import binascii
+import payload_codec
+
+default_limit = 100
+max_limit = 1000
+# Leave headroom under the 6 MB Lambda response limit for the JSON envelope around the results.
+max_page_bytes = 4 * 1024 * 1024
+
+
+def encode_next_token(last_evaluated_key):
+    """Wraps a DynamoDB LastEvaluatedKey in an opaque, URL safe token"""
+    if not last_evaluated_key:
+        return None
+    return base64.urlsafe_b64encode(json.dumps(last_evaluated_key, sort_keys=True).encode('utf-8')).decode('ascii')
+
+
+def decode_next_token(next_token, partition_key, partition_value):
+    """
+    Returns the ExclusiveStartKey wrapped by next_token. partition_value may be a list when a listing spans several
+    partitions. Raises ValueError if the token is malformed or was issued for a different partition.
+    """
+    try:
+        start_key = json.loads(base64.urlsafe_b64decode(next_token.encode('ascii')))
+    except (binascii.Error, UnicodeError, ValueError, AttributeError):
+        raise ValueError('invalid next_token')
+    partition_values = partition_value if isinstance(partition_value, list) else [partition_value]
+    if not isinstance(start_key, dict) or start_key.get(partition_key) not in [{'S': v} for v in partition_values]:
+        raise ValueError('invalid next_token')
+    return start_key
+
+
+def parse_page_detail(detail, opt_in=False):
+    """
+    Returns (limit, next_token, newest_first) from a request detail. Raises ValueError on invalid values.
+
+    With opt_in, a request that names neither limit nor next_token is not paged: limit is None and the results come
+    oldest first, as they did before paging was added.
+    """
+    paged = not opt_in or bool(detail.get('limit') or detail.get('next_token'))
+    limit = None
+    if paged:
+        limit = detail.get('limit') or default_limit
+        try:
+            limit = int(limit)
+        except (TypeError, ValueError):
+            raise ValueError('limit must be an integer')
+        if limit < 1 or limit > max_limit:
+            raise ValueError(f'limit must be between 1 and {max_limit}')
+    next_token = detail.get('next_token') or None
+    sort_order = (detail.get('sort_order') or ('descending' if paged else 'ascending')).lower()
+    if sort_order not in ['ascending', 'descending']:
+        raise ValueError('sort_order must be ascending or descending')
+    return limit, next_token, sort_order == 'descending'
+
+
+def projection(fields, field_attributes, key_attributes):
+    """
+    Returns ProjectionExpression and ExpressionAttributeNames covering the requested output fields (plus the key
+    attributes needed to build a next_token), or (None, None) when all fields are wanted.
+    Raises ValueError for an unknown field.
+    """
+    if not fields:
+        return None, None
+    if isinstance(fields, str):
+        fields = [fields]
+    attributes = list(key_attributes)
+    for field in fields:
+        if field not in field_attributes:
+            raise ValueError(f'unknown field {field}')
+        if field_attributes[field] not in attributes:
+            attributes.append(field_attributes[field])
+    names = {f'#p{i}': attribute for i, attribute in enumerate(attributes)}
+    return ', '.join(names.keys()), names
+
+
+def query_results(aws_dynamodb_client, query_kwargs, key_attributes, limit, start_key=None, newest_first=True):
+    """
+    Runs query_kwargs until limit items (all items when limit is None) or max_page_bytes have been collected. Returns
+    the items and a next_token for the following page (None when the query is exhausted).
+    """
+    query_kwargs = dict(query_kwargs)
+    query_kwargs['ScanIndexForward'] = not newest_first
+    if start_key:
+        query_kwargs['ExclusiveStartKey'] = start_key
+    items = []
+    page_bytes = 0
+    while True:
+        if limit:
+            query_kwargs['Limit'] = limit - len(items)
+        response = aws_dynamodb_client.query(**query_kwargs)
+        for item in response['Items']:
+            # Compressed payloads grow again when they are decoded for the response.
+            item_bytes = len(json.dumps(item, default=str))
+            for value in item.values():
+                if 'B' in value and payload_codec.is_encoded(value['B']):
+                    item_bytes += len(payload_codec.decode(value))
+            if items and page_bytes + item_bytes > max_page_bytes:
+                last_key = {k: items[-1][k] for k in key_attributes}
+                return items, encode_next_token(last_key)
+            items.append(item)
+            page_bytes += item_bytes
+        last_evaluated_key = response.get('LastEvaluatedKey')
+        if not last_evaluated_key or (limit and len(items) >= limit):
+            return items, encode_next_token(last_evaluated_key)
+        query_kwargs['ExclusiveStartKey'] = last_evaluated_key
+
+
+def unpack_attribute(value):
+    """
+    Converts a DynamoDB attribute value to the JSON serializable value returned by get_results. Binary values that
+    weren't written by payload_codec are returned base64 encoded.
+    """
+    if 'S' in value:
+        return value['S']
+    if 'N' in value:
+        return value['N']
+    if 'SS' in value:
+        return value['SS']
+    if 'BOOL' in value:
+        return value['BOOL']
+    if 'B' in value:
+        if payload_codec.is_encoded(value['B']):
+            return payload_codec.decode(value)
+        return base64.b64encode(value['B']).decode('ascii')
+    if 'M' in value:
+        unpacked = {}
+        for k, v in value['M'].items():
+            if any(attribute_type in v for attribute_type in ['S', 'N', 'BOOL', 'B']):
+                unpacked[k] = unpack_attribute(v)
+        return unpacked
+    return None
+
+
+def unpack_item(item, field_attributes, fields=None):
+    """Returns the output fields of item, renamed from their table attributes"""
+    unpacked = {}
+    for field, attribute in field_attributes.items():
+        if fields and field not in fields:
+            continue
+        if attribute in item:
+            unpacked[field] = unpack_attribute(item[attribute])
+    return unpacked
@@ -0,0 +1,50 @@
+import gzip
+import botocore
+import payload_codec
+
+# Outputs larger than this are moved out of the results queue row, well under DynamoDB's 400 KB item limit.
+inline_limit = 64 * 1024
+# Kept apart from the workspace's shared/ and upload/ paths and from the task command prefixes.
+results_prefix = '_results'
+
+
+def output_key(resource_type, resource_name, run_time):
+    """Returns the workspace object key for a stored output. Rewrites of the same queue row reuse the key."""
+    return f'{results_prefix}/{resource_type}/{resource_name}/{run_time}.json.gz'
+
+
+def output_attributes(attribute_name):
+    """Returns every queue row attribute store_output may write for attribute_name"""
+    return [attribute_name, f'{attribute_name}_ref', f'{attribute_name}_size']
+
+
+def store_output(aws_s3_client, deployment_name, attribute_name, key, output_json):
+    """
+    Returns the queue row attributes for output_json: the encoded output itself when it is small, otherwise a
+    <attribute_name>_ref pointer to a compressed copy written to the workspace bucket under key, with the output's
+    uncompressed size in <attribute_name>_size so readers can budget fetches without downloading it.
+    Returns the error if the copy could not be written.
+    """
+    output = payload_codec.encode(output_json)
+    if payload_codec.attribute_size(output) <= inline_limit:
+        return {attribute_name: output}
+    output_bytes = output_json.encode('utf-8')
+    try:
+        aws_s3_client.put_object(
+            Bucket=f'{deployment_name}-workspace',
+            Key=key,
+            Body=gzip.compress(output_bytes),
+            ContentType='application/json',
+            ContentEncoding='gzip'
+        )
+    except botocore.exceptions.ClientError as error:
+        return error
+    except botocore.exceptions.ParamValidationError as error:
+        return error
+    return {f'{attribute_name}_ref': {'S': key}, f'{attribute_name}_size': {'N': str(len(output_bytes))}}
+
+
+def load_output(aws_s3_client, deployment_name, key):
+    """Returns the output JSON stored under key"""
+    response = aws_s3_client.get_object(Bucket=f'{deployment_name}-workspace', Key=key)
+    return gzip.decompress(response['Body'].read()).decode('utf-8')
@@ -0,0 +1,87 @@
+import botocore
+import time as t
+
+# Attributes a terminated task keeps in the tasks table after archival. They hold the task's name (so the name stays
+# reserved), its task_status and task_type keys in the status index, enough for a terminated check, and its instruction
+# sequence so a re-registered remote task does not reuse instruction history keys.
+tombstone_attributes = [
+    'task_name', 'task_type', 'task_version', 'task_context', 'task_status', 'user_id', 'create_time', 'ecs_task_id',
+    'instruct_seq'
+]
+
+
+def archive_task(aws_dynamodb_client, deployment_name, task_name):
+    """
+    Moves a terminated task's full row to the tasks archive table and strips the hot row down to a tombstone, in one
+    transaction. Safe to repeat: a task that is already archived, gone or not terminated is left alone.
+    """
+    try:
+        response = aws_dynamodb_client.get_item(
+            TableName=f'{deployment_name}-tasks',
+            Key={
+                'task_name': {'S': task_name}
+            },
+            ConsistentRead=True
+        )
+    except botocore.exceptions.ClientError as error:
+        return error
+    if 'Item' not in response:
+        return 'task_not_found'
+    task_item = response['Item']
+    if 'archived' in task_item:
+        return 'task_archived'
+    if task_item['task_status']['S'] != 'terminated':
+        return 'task_not_terminated'
+
+    archive_time = str(int(t.time()))
+    archive_item = dict(task_item)
+    archive_item['archive_time'] = {'N': archive_time}
+    removed_attributes = [attribute for attribute in task_item if attribute not in tombstone_attributes]
+    attribute_names = {f'#a{i}': attribute for i, attribute in enumerate(removed_attributes)}
+    update_expression = 'SET archived=:archive_time'
+    if removed_attributes:
+        update_expression += ' REMOVE ' + ', '.join(attribute_names.keys())
+    update = {
+        'TableName': f'{deployment_name}-tasks',
+        'Key': {
+            'task_name': {'S': task_name}
+        },
+        'UpdateExpression': update_expression,
+        # The row must not have been re-registered or archived since it was read.
+        'ConditionExpression': 'task_status = :terminated AND create_time = :create_time AND attribute_not_exists(archived)',
+        'ExpressionAttributeValues': {
+            ':archive_time': {'N': archive_time},
+            ':terminated': {'S': 'terminated'},
+            ':create_time': task_item['create_time']
+        }
+    }
+    if attribute_names:
+        update['ExpressionAttributeNames'] = attribute_names
+    try:
+        aws_dynamodb_client.transact_write_items(
+            TransactItems=[
+                {'Put': {'TableName': f'{deployment_name}-tasks-archive', 'Item': archive_item}},
+                {'Update': update}
+            ]
+        )
+    except botocore.exceptions.ClientError as error:
+        return error
+    except botocore.exceptions.ParamValidationError as error:
+        return error
+    return 'task_archived'
+
+
+def get_archived_task(aws_dynamodb_client, deployment_name, task_name):
+    """Returns the most recently archived row for task_name, or None"""
+    response = aws_dynamodb_client.query(
+        TableName=f'{deployment_name}-tasks-archive',
+        KeyConditionExpression='task_name = :task_name',
+        ExpressionAttributeValues={
+            ':task_name': {'S': task_name}
+        },
+        ScanIndexForward=False,
+        Limit=1
+    )
+    if not response['Items']:
+        return None
+    return response['Items'][0]
@@ -0,0 +1,246 @@
+import botocore
+import time as t
+from dns_changes import ChangeBatcher
+
+# A transaction holds at most 100 items; the deployment row takes one of them.
+max_transact_items = 100
+# Commits re-read the rows and retry this many times when a concurrent change cancels the transaction.
+max_attempts = 3
+# Keys a throttled BatchGetItem hands back unprocessed are retried with backoff, up to this many times.
+max_batch_attempts = 8
+
+
+def batch_get_entries(aws_dynamodb_client, request_items):
+    """
+    Returns the items found for request_items, keyed by table name, retrying any unprocessed keys. Raises RuntimeError
+    if keys are still unprocessed after max_batch_attempts.
+    """
+    found = {}
+    pending = []
+    for table_name, keys in request_items.items():
+        for key in keys:
+            pending.append((table_name, key))
+    attempt = 0
+    while pending:
+        chunk, pending = pending[:100], pending[100:]
+        request = {}
+        for table_name, key in chunk:
+            request.setdefault(table_name, {'Keys': []})['Keys'].append(key)
+        response = aws_dynamodb_client.batch_get_item(RequestItems=request)
+        for table_name, items in response['Responses'].items():
+            found.setdefault(table_name, []).extend(items)
+        unprocessed = response.get('UnprocessedKeys', {})
+        if unprocessed:
+            attempt += 1
+            if attempt >= max_batch_attempts:
+                raise RuntimeError(f'keys were still unprocessed after {attempt} attempts')
+            for table_name, table_request in unprocessed.items():
+                for key in table_request['Keys']:
+                    pending.append((table_name, key))
+            t.sleep(min(0.05 * (2 ** attempt), 1))
+    return found
+
+
+def remove_members(members, removed):
+    """Returns members without removed, or None if none of them were members. Emptied sets go back to ['None']."""
+    remaining = [member for member in members if member not in removed]
+    if len(remaining) == len(members):
+        return None
+    return remaining or ['None']
+
+
+class Teardown:
+    """
+    Releases a group of tasks' portgroups, domain host names, DNS records and active_resources entries.
+
+    Each task is a dict with task_name, portgroups, task_host_name, task_domain_name and public_ip. The affected
+    portgroup and domain rows are read once in a batch, then every membership removal, the deployment update and the
+    optional task status change are committed with TransactWriteItems. The DNS records are deleted with one change
+    batch per hosted zone. Every step is a no-op when already done, so a teardown can be repeated.
+    """
+
+    def __init__(self, aws_dynamodb_client, aws_route53_client, deployment_name, tasks, task_status=None):
+        self.aws_dynamodb_client = aws_dynamodb_client
+        self.aws_route53_client = aws_route53_client
+        self.deployment_name = deployment_name
+        self.tasks = tasks
+        self.task_status = task_status
+        self.portgroup_entries = {}
+        self.domain_entries = {}
+
+    def get_entries(self):
+        portgroup_names = {pg for task in self.tasks for pg in task['portgroups'] if pg != 'None'}
+        domain_names = {task['task_domain_name'] for task in self.tasks if task['task_domain_name'] != 'None'}
+        request_items = {}
+        if portgroup_names:
+            request_items[f'{self.deployment_name}-portgroups'] = [{'portgroup_name': {'S': p}} for p in portgroup_names]
+        if domain_names:
+            request_items[f'{self.deployment_name}-domains'] = [{'domain_name': {'S': d}} for d in domain_names]
+        entries = batch_get_entries(self.aws_dynamodb_client, request_items) if request_items else {}
+        self.portgroup_entries = {
+            i['portgroup_name']['S']: i for i in entries.get(f'{self.deployment_name}-portgroups', [])
+        }
+        self.domain_entries = {i['domain_name']['S']: i for i in entries.get(f'{self.deployment_name}-domains', [])}
+
+    def membership_updates(self, tasks):
+        """
+        Returns the updates removing tasks from the portgroup and domain rows read by get_entries, and the
+        (entry, new attributes) pairs they write
+        """
+        task_names = {task['task_name'] for task in tasks}
+        updates = []
+        new_entries = []
+        for portgroup_name, portgroup_entry in self.portgroup_entries.items():
+            current_tasks = portgroup_entry['tasks']['SS']
+            new_tasks = remove_members(current_tasks, task_names)
+            if new_tasks is None:
+                continue
+            updates.append({
+                'Update': {
+                    'TableName': f'{self.deployment_name}-portgroups',
+                    'Key': {
+                        'portgroup_name': {'S': portgroup_name}
+                    },
+                    'UpdateExpression': 'set tasks=:tasks',
+                    'ConditionExpression': 'tasks = :current_tasks',
+                    'ExpressionAttributeValues': {
+                        ':tasks': {'SS': new_tasks},
+                        ':current_tasks': {'SS': current_tasks}
+                    }
+                }
+            })
+            new_entries.append((portgroup_entry, {'tasks': new_tasks}))
+        for domain_name, domain_entry in self.domain_entries.items():
+            host_names = {
+                task['task_host_name'] for task in tasks
+                if task['task_domain_name'] == domain_name and task['task_host_name'] != 'None'
+            }
+            current_tasks = domain_entry['tasks']['SS']
+            current_host_names = domain_entry['host_names']['SS']
+            new_tasks = remove_members(current_tasks, task_names)
+            new_host_names = remove_members(current_host_names, host_names)
+            if new_tasks is None and new_host_names is None:
+                continue
+            new_tasks = new_tasks or current_tasks
+            new_host_names = new_host_names or current_host_names
+            updates.append({
+                'Update': {
+                    'TableName': f'{self.deployment_name}-domains',
+                    'Key': {
+                        'domain_name': {'S': domain_name}
+                    },
+                    'UpdateExpression': 'set tasks=:tasks, host_names=:host_names',
+                    'ConditionExpression': 'tasks = :current_tasks AND host_names = :current_host_names',
+                    'ExpressionAttributeValues': {
+                        ':tasks': {'SS': new_tasks},
+                        ':host_names': {'SS': new_host_names},
+                        ':current_tasks': {'SS': current_tasks},
+                        ':current_host_names': {'SS': current_host_names}
+                    }
+                }
+            })
+            new_entries.append((domain_entry, {'tasks': new_tasks, 'host_names': new_host_names}))
+        return updates, new_entries
+
+    def task_updates(self, tasks):
+        if self.task_status is None:
+            return []
+        return [{
+            'Update': {
+                'TableName': f'{self.deployment_name}-tasks',
+                'Key': {
+                    'task_name': {'S': task['task_name']}
+                },
+                'UpdateExpression': 'set task_status=:task_status',
+                'ConditionExpression': 'attribute_exists(task_name)',
+                'ExpressionAttributeValues': {
+                    ':task_status': {'S': self.task_status}
+                }
+            }
+        } for task in tasks]
+
+    def deployment_update(self, tasks):
+        return {
+            'Update': {
+                'TableName': f'{self.deployment_name}-deployment',
+                'Key': {
+                    'deployment_name': {'S': self.deployment_name}
+                },
+                'UpdateExpression': 'DELETE active_resources.#resource_type :resource_names',
+                'ConditionExpression': 'attribute_exists(active_resources)',
+                'ExpressionAttributeNames': {
+                    '#resource_type': 'tasks'
+                },
+                'ExpressionAttributeValues': {
+                    ':resource_names': {'SS': sorted({task['task_name'] for task in tasks})}
+                }
+            }
+        }
+
+    def transaction_groups(self):
+        """
+        Splits the tasks into groups whose transactions fit in max_transact_items. Rows shared between groups are
+        carried forward from one group's committed values to the next.
+        """
+        groups = []
+        group = []
+        for task in self.tasks:
+            candidate = group + [task]
+            updates, _ = self.membership_updates(candidate)
+            if group and len(updates) + len(self.task_updates(candidate)) + 1 > max_transact_items:
+                groups.append(group)
+                group = [task]
+            else:
+                group = candidate
+        if group:
+            groups.append(group)
+        return groups
+
+    def commit(self):
+        """Commits the DynamoDB side of the teardown, re-reading the rows if a concurrent change cancels it"""
+        for attempt in range(max_attempts):
+            try:
+                self.get_entries()
+            except (botocore.exceptions.ClientError, RuntimeError) as error:
+                return error
+            try:
+                for group in self.transaction_groups():
+                    updates, new_entries = self.membership_updates(group)
+                    transact_items = updates + self.task_updates(group) + [self.deployment_update(group)]
+                    self.aws_dynamodb_client.transact_write_items(TransactItems=transact_items)
+                    for entry, attributes in new_entries:
+                        for attribute, value in attributes.items():
+                            entry[attribute] = {'SS': value}
+            except botocore.exceptions.ClientError as error:
+                if error.response['Error']['Code'] != 'TransactionCanceledException' or attempt == max_attempts - 1:
+                    return error
+                t.sleep(0.05 * (2 ** attempt))
+                continue
+            except botocore.exceptions.ParamValidationError as error:
+                return error
+            return 'teardown_committed'
+
+    def delete_resource_record_sets(self):
+        """Deletes the tasks' A records with one change batch per hosted zone"""
+        dns_changes = ChangeBatcher(self.aws_route53_client)
+        for task in self.tasks:
+            if task['task_host_name'] == 'None' or task['task_domain_name'] == 'None':
+                continue
+            domain_entry = self.domain_entries.get(task['task_domain_name'])
+            if domain_entry is None or task.get('public_ip', 'None') == 'None':
+                continue
+            dns_changes.delete(
+                domain_entry['hosted_zone']['S'], f'{task["task_host_name"]}.{task["task_domain_name"]}', 'A',
+                task['public_ip']
+            )
+        return dns_changes.flush()
+
+    def run(self):
+        """Returns 'teardown_completed' or a list of errors"""
+        commit_response = self.commit()
+        if commit_response != 'teardown_committed':
+            return [f'Error committing teardown: {commit_response}']
+        delete_response = self.delete_resource_record_sets()
+        if delete_response != 'resource_record_sets_changed':
+            return [f'Error deleting resource record set: {error}' for error in delete_response]
+        return 'teardown_completed'
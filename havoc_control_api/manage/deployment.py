@@ -1,6 +1,7 @@
 import json
 import botocore
-import boto3
+import havoc_aws
+import resource_registry
 
 
 def format_response(status_code, result, message, log, **kwargs):
@@ -19,6 +20,10 @@ def format_response(status_code, result, message, log, **kwargs):
 
 class Deployment:
 
+    resource_types = [
+        'domains', 'listeners', 'playbook_types', 'playbooks', 'portgroups', 'task_types', 'tasks', 'triggers', 'workspace'
+    ]
+
     def __init__(self, deployment_name, region, user_id, detail: dict, log):
         """
         Instantiate a Deployment instance
@@ -34,7 +39,7 @@ class Deployment:
     def aws_dynamodb_client(self):
         """Returns the boto3 DynamoDB session (establishes one automatically if one does not already exist)"""
         if self.__aws_dynamodb_client is None:
-            self.__aws_dynamodb_client = boto3.client('dynamodb', region_name=self.region)
+            self.__aws_dynamodb_client = havoc_aws.client('dynamodb', self.region)
         return self.__aws_dynamodb_client
 
     def get_deployment_entry(self):
@@ -63,9 +68,7 @@ class Deployment:
             tfstate_s3_key = self.detail['tfstate_s3_key']
             tfstate_s3_region = self.detail['tfstate_s3_region']
             tfstate_dynamodb_table = self.detail['tfstate_dynamodb_table']
-            active_resources = {'domains': {'SS': ['None']}, 'listeners': {'SS': ['None']}, 'playbook_types': {'SS': ['None']}, 
-                                'playbooks': {'SS': ['None']}, 'portgroups': {'SS': ['None']}, 'task_types': {'SS': ['None']},
-                                'tasks': {'SS': ['None']}, 'triggers': {'SS': ['None']}, 'workspace': {'SS': ['None']}}
+            active_resources = {resource_type: {'SS': ['None']} for resource_type in self.resource_types}
             try:
                 self.aws_dynamodb_client.update_item(
                     TableName=f'{self.deployment_name}-deployment',
@@ -204,9 +207,9 @@ class Deployment:
         tfstate_s3_region = deployment_entry['Item']['tfstate_s3_region']['S']
         tfstate_dynamodb_table = deployment_entry['Item']['tfstate_dynamodb_table']['S']
         active_resources = deployment_entry['Item']['active_resources']['M']
-        active_resources_fixup = {}
-        for key, value in active_resources.items():
-            active_resources_fixup[key] = value['SS']
+        active_resources_fixup = resource_registry.list_active_resources(
+            active_resources, sorted(set(self.resource_types) | set(active_resources.keys()))
+        )
         return format_response(
             200,
             'success',
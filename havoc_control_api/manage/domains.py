@@ -1,7 +1,10 @@
+import os
 import json
 import botocore
-import boto3
+import havoc_aws
 import time as t
+import resource_registry
+from dns_changes import ChangeBatcher
 
 
 def format_response(status_code, result, message, log, **kwargs):
@@ -20,6 +23,16 @@ def format_response(status_code, result, message, log, **kwargs):
 
 class Domain:
 
+    # Certificate validation runs in the background: each invocation polls ACM for the validation record with backoff
+    # for up to validation_poll_seconds, then hands off to a fresh invocation, up to max_validation_invocations times.
+    validation_poll_seconds = 40
+    max_validation_invocations = 10
+    initial_poll_interval = 1
+    max_poll_interval = 8
+    # Waiting for the validation record to reach the Route53 name servers fits in what the invocation has left.
+    sync_poll_interval = 2
+    max_sync_attempts = 7
+
     def __init__(self, deployment_name, region, user_id, detail: dict, log):
         """
         Instantiate a Domain instance
@@ -36,28 +49,36 @@ class Domain:
         self.__aws_dynamodb_client = None
         self.__aws_route53_client = None
         self.__aws_acm_client = None
+        self.__aws_lambda_client = None
 
     @property
     def aws_dynamodb_client(self):
         """Returns the boto3 DynamoDB session (establishes one automatically if one does not already exist)"""
         if self.__aws_dynamodb_client is None:
-            self.__aws_dynamodb_client = boto3.client('dynamodb', region_name=self.region)
+            self.__aws_dynamodb_client = havoc_aws.client('dynamodb', self.region)
         return self.__aws_dynamodb_client
 
     @property
     def aws_route53_client(self):
         """Returns the boto3 Route53 session (establishes one automatically if one does not already exist)"""
         if self.__aws_route53_client is None:
-            self.__aws_route53_client = boto3.client('route53', region_name=self.region)
+            self.__aws_route53_client = havoc_aws.client('route53', self.region)
         return self.__aws_route53_client
     
     @property
     def aws_acm_client(self):
         """Returns the boto3 ACM session (establishes one automatically if one does not already exist)"""
         if self.__aws_acm_client is None:
-            self.__aws_acm_client = boto3.client('acm', region_name=self.region)
+            self.__aws_acm_client = havoc_aws.client('acm', self.region)
         return self.__aws_acm_client
 
+    @property
+    def aws_lambda_client(self):
+        """Returns the boto3 Lambda session (establishes one automatically if one does not already exist)"""
+        if self.__aws_lambda_client is None:
+            self.__aws_lambda_client = havoc_aws.client('lambda', self.region)
+        return self.__aws_lambda_client
+
     def query_domains(self):
         domains = {'Items': []}
         scan_kwargs = {'TableName': f'{self.deployment_name}-domains'}
@@ -128,7 +149,11 @@ class Domain:
             return error
         except botocore.exceptions.ParamValidationError as error:
             return error
-        resource_record = certificate_metadata['Certificate']['DomainValidationOptions'][0]['ResourceRecord']
+        # ACM publishes the validation record some time after the certificate is requested
+        validation_options = certificate_metadata['Certificate'].get('DomainValidationOptions', [])
+        if not validation_options or 'ResourceRecord' not in validation_options[0]:
+            return 'domain_validation_records_pending'
+        resource_record = validation_options[0]['ResourceRecord']
         name = resource_record['Name']
         value = resource_record['Value']
         self.validation_record = [name, value]
@@ -137,31 +162,16 @@ class Domain:
     def create_validate_cert(self):
         name = self.validation_record[0]
         value = self.validation_record[1]
-        try:
-            self.aws_route53_client.change_resource_record_sets(
-                HostedZoneId = self.hosted_zone,
-                ChangeBatch = {
-                    'Changes': [
-                        {
-                            'Action': 'UPSERT',
-                            'ResourceRecordSet':{
-                                'Name': name,
-                                'Type': 'CNAME',
-                                'TTL': 300,
-                                'ResourceRecords': [
-                                    {
-                                        'Value': value
-                                    }
-                                ]
-                            }
-                        }
-                    ]
-                }
-            )
-        except botocore.exceptions.ClientError as error:
-            return error
-        except botocore.exceptions.ParamValidationError as error:
-            return error
+        dns_changes = ChangeBatcher(self.aws_route53_client)
+        dns_changes.upsert(self.hosted_zone, name, 'CNAME', value)
+        flush_response = dns_changes.flush()
+        if flush_response != 'resource_record_sets_changed':
+            return flush_response
+        # ACM looks the record up through the zone's name servers, so it only counts once the change is INSYNC
+        wait_for_changes_response = dns_changes.wait_for_changes(self.sync_poll_interval, self.max_sync_attempts)
+        if wait_for_changes_response != 'resource_record_sets_in_sync':
+            print(f'Validation record for {self.domain_name} is not in sync yet: {wait_for_changes_response}')
+            return 'cert_validation_record_pending'
         return 'cert_validation_record_created'
     
     def delete_domain_cert(self):
@@ -178,59 +188,13 @@ class Domain:
     def delete_validate_cert(self):
         name = self.validation_record[0]
         value = self.validation_record[1]
-        try:
-            self.aws_route53_client.change_resource_record_sets(
-                HostedZoneId = self.hosted_zone,
-                ChangeBatch = {
-                    'Changes': [
-                        {
-                            'Action': 'DELETE',
-                            'ResourceRecordSet': {
-                                'Name': name,
-                                'Type': 'CNAME',
-                                'TTL': 300,
-                                'ResourceRecords': [
-                                    {
-                                        'Value': value
-                                    }
-                                ]
-                            }
-                        }
-                    ]
-                }
-            )
-        except botocore.exceptions.ClientError as error:
-            return error
-        except botocore.exceptions.ParamValidationError as error:
-            return error
+        dns_changes = ChangeBatcher(self.aws_route53_client)
+        dns_changes.delete(self.hosted_zone, name, 'CNAME', value)
+        flush_response = dns_changes.flush()
+        if flush_response != 'resource_record_sets_changed':
+            return flush_response
         return 'cert_validation_record_deleted'
 
-    def get_deployment_entry(self):
-        return self.aws_dynamodb_client.get_item(
-            TableName=f'{self.deployment_name}-deployment',
-            Key={
-                'deployment_name': {'S': self.deployment_name}
-            }
-        )
-    
-    def update_deployment_entry(self, active_resources):
-        try:
-            self.aws_dynamodb_client.update_item(
-                TableName=f'{self.deployment_name}-deployment',
-                Key={
-                    'deployment_name': {'S': self.deployment_name}
-                },
-                UpdateExpression='set active_resources=:active_resources',
-                ExpressionAttributeValues={
-                    ':active_resources': {'M': active_resources}
-                }
-            )
-        except botocore.exceptions.ClientError as error:
-            return error
-        except botocore.exceptions.ParamValidationError as error:
-            return error
-        return 'deployment_updated'
-
     def create_domain_entry(self):
         # Check for domain conflict
         existing_domain = self.get_domain_entry()
@@ -238,27 +202,17 @@ class Domain:
             return 'domain_exists'
         
         # Verify the hosted zone exists
-        valid_domain = self.verify_hosted_zone()
-        if valid_domain != 'valid_domain':
-            return valid_domain
+        verify_hosted_zone_response = self.verify_hosted_zone()
+        if verify_hosted_zone_response != 'valid_domain':
+            return verify_hosted_zone_response
         
-        # Create a wildcard certificate for the domain
+        # Request a wildcard certificate for the domain
         create_domain_cert_response = self.create_domain_cert()
         if create_domain_cert_response != 'domain_cert_created':
             return create_domain_cert_response
-        
-        # Wait a few seconds and then get the domain validation resource records from the certificate
-        t.sleep(15)
-        get_domain_validation_records_response = self.get_domain_validation_records()
-        if get_domain_validation_records_response != 'domain_validation_records_requested':
-            return get_domain_validation_records_response
-        
-        # Create the DNS entry that validates the certificate
-        create_validate_cert_response = self.create_validate_cert()
-        if create_validate_cert_response != 'cert_validation_record_created':
-            return create_validate_cert_response
-        
-        # Add the domain details to the DynamoDB domains table
+
+        # Add the domain details to the DynamoDB domains table. The domain stays pending_validation until the
+        # background validation step has written the certificate's validation record.
         api_domain = 'no'
         tasks = 'None'
         listeners = 'None'
@@ -271,7 +225,9 @@ class Domain:
                 },
                 UpdateExpression='set hosted_zone=:hosted_zone, api_domain=:api_domain, '
                                  'certificate_arn=:certificate_arn, tasks=:tasks, '
-                                 'listeners=:listeners, host_names=:host_names, user_id=:user_id',
+                                 'listeners=:listeners, host_names=:host_names, user_id=:user_id, '
+                                 'domain_status=:domain_status',
+                ConditionExpression='attribute_not_exists(domain_name)',
                 ExpressionAttributeValues={
                     ':hosted_zone': {'S': self.hosted_zone},
                     ':api_domain': {'S': api_domain},
@@ -279,32 +235,195 @@ class Domain:
                     ':tasks': {'SS': [tasks]},
                     ':listeners': {'SS': [listeners]},
                     ':host_names': {'SS': [host_names]},
-                    ':user_id': {'S': self.user_id}
+                    ':user_id': {'S': self.user_id},
+                    ':domain_status': {'S': 'pending_validation'}
                 }
             )
         except botocore.exceptions.ClientError as error:
+            if error.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                self.delete_domain_cert()
+                return 'domain_exists'
             return error
         except botocore.exceptions.ParamValidationError as error:
             return error
         
         # Add domain to active_resources in deployment table
-        deployment_details = self.get_deployment_entry()
-        active_resources = deployment_details['Item']['active_resources']['M']
-        active_domains = active_resources['domains']['SS']
-        if active_domains == ['None']:
-            active_domains = [self.domain_name]
-        else:
-            active_domains.append(self.domain_name)
-        active_resources['domains']['SS'] = active_domains
-        update_deployment_entry_response = self.update_deployment_entry(active_resources)
+        update_deployment_entry_response = resource_registry.add_active_resources(
+            self.aws_dynamodb_client, self.deployment_name, 'domains', self.domain_name
+        )
         if update_deployment_entry_response != 'deployment_updated':
-            return update_deployment_entry_response
-        return 'domain_created'
+            return self.abort_create(update_deployment_entry_response)
+
+        # Hand the certificate validation off to a background invocation
+        invoke_validate_domain_response = self.invoke_validate_domain(1)
+        if invoke_validate_domain_response != 'validate_domain_invoked':
+            return self.abort_create(invoke_validate_domain_response, active_resource_added=True)
+        return 'domain_pending_validation'
+
+    def abort_create(self, error, active_resource_added=False):
+        """
+        Undoes a create that failed after the domain row was written: removes the active_resources entry, the row and
+        the certificate, so the domain can be created again. Returns the original error.
+        """
+        cleanup_responses = []
+        if active_resource_added:
+            cleanup_responses.append(resource_registry.remove_active_resources(
+                self.aws_dynamodb_client, self.deployment_name, 'domains', self.domain_name
+            ))
+        cleanup_responses.append(self.delete_domain_row())
+        cleanup_responses.append(self.delete_domain_cert())
+        for cleanup_response in cleanup_responses:
+            if cleanup_response not in ['deployment_updated', 'domain_entry_deleted', 'domain_cert_deleted']:
+                print(f'Error cleaning up failed create for {self.domain_name}: {cleanup_response}')
+        return error
+
+    def delete_domain_row(self):
+        """Deletes the domain row written for this certificate; a row that is gone or has a new certificate is kept"""
+        try:
+            self.aws_dynamodb_client.delete_item(
+                TableName=f'{self.deployment_name}-domains',
+                Key={
+                    'domain_name': {'S': self.domain_name}
+                },
+                ConditionExpression='certificate_arn = :certificate_arn',
+                ExpressionAttributeValues={
+                    ':certificate_arn': {'S': self.certificate_arn}
+                }
+            )
+        except botocore.exceptions.ClientError as error:
+            if error.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return 'domain_entry_deleted'
+            return error
+        except botocore.exceptions.ParamValidationError as error:
+            return error
+        return 'domain_entry_deleted'
+
+    def invoke_validate_domain(self, invocation):
+        payload = {
+            'action': 'validate_domain',
+            'user_id': self.user_id,
+            'detail': {
+                'domain_name': self.domain_name,
+                'hosted_zone': self.hosted_zone,
+                'certificate_arn': self.certificate_arn,
+                'invocation': invocation
+            }
+        }
+        try:
+            self.aws_lambda_client.invoke(
+                FunctionName=os.environ['AWS_LAMBDA_FUNCTION_NAME'],
+                InvocationType='Event',
+                Payload=json.dumps(payload).encode('utf-8')
+            )
+        except botocore.exceptions.ClientError as error:
+            return error
+        except botocore.exceptions.ParamValidationError as error:
+            return error
+        return 'validate_domain_invoked'
+
+    def update_domain_status(self, domain_status):
+        """Moves the domain out of pending_validation; a domain deleted or already moved on is left alone"""
+        try:
+            self.aws_dynamodb_client.update_item(
+                TableName=f'{self.deployment_name}-domains',
+                Key={
+                    'domain_name': {'S': self.domain_name}
+                },
+                UpdateExpression='set domain_status=:domain_status',
+                ConditionExpression='domain_status = :pending_validation AND certificate_arn = :certificate_arn',
+                ExpressionAttributeValues={
+                    ':domain_status': {'S': domain_status},
+                    ':pending_validation': {'S': 'pending_validation'},
+                    ':certificate_arn': {'S': self.certificate_arn}
+                }
+            )
+        except botocore.exceptions.ClientError as error:
+            if error.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return 'domain_not_pending'
+            return error
+        except botocore.exceptions.ParamValidationError as error:
+            return error
+        return 'domain_status_updated'
+
+    def continue_validation(self, invocation, error):
+        """Hands validation off to a fresh invocation, or marks the domain validation_failed after the last one"""
+        if invocation >= self.max_validation_invocations:
+            self.update_domain_status('validation_failed')
+            return format_response(500, 'failed', error, self.log)
+        invoke_validate_domain_response = self.invoke_validate_domain(invocation + 1)
+        if invoke_validate_domain_response != 'validate_domain_invoked':
+            self.update_domain_status('validation_failed')
+            return format_response(
+                500, 'failed', f'validate domain failed with error {invoke_validate_domain_response}', self.log
+            )
+        return format_response(200, 'success', 'validate domain continued', None)
+
+    def validate_domain(self):
+        """
+        Background step of create: polls ACM with backoff until the certificate's validation record is published,
+        writes the validation CNAME and marks the domain ready once the record is in sync. Hands off to a new invocation
+        when the poll budget runs out and marks the domain validation_failed after max_validation_invocations.
+        """
+        for i in ['domain_name', 'hosted_zone', 'certificate_arn', 'invocation']:
+            if i not in self.detail:
+                return format_response(400, 'failed', f'invalid detail: missing {i}', self.log)
+        self.domain_name = self.detail['domain_name']
+        self.hosted_zone = self.detail['hosted_zone']
+        self.certificate_arn = self.detail['certificate_arn']
+        invocation = int(self.detail['invocation'])
+
+        deadline = t.monotonic() + self.validation_poll_seconds
+        poll_interval = self.initial_poll_interval
+        while True:
+            get_domain_validation_records_response = self.get_domain_validation_records()
+            if get_domain_validation_records_response == 'domain_validation_records_requested':
+                break
+            if get_domain_validation_records_response != 'domain_validation_records_pending':
+                print(f'Error getting validation records for {self.domain_name}: {get_domain_validation_records_response}')
+            remaining = deadline - t.monotonic()
+            if remaining <= 0:
+                return self.continue_validation(
+                    invocation, f'validation records for {self.domain_name} were not published'
+                )
+            t.sleep(min(poll_interval, remaining))
+            poll_interval = min(poll_interval * 2, self.max_poll_interval)
+
+        # Skip the record if the domain was deleted while validation was pending
+        domain_entry = self.get_domain_entry()
+        if 'Item' not in domain_entry or domain_entry['Item']['certificate_arn']['S'] != self.certificate_arn or \
+                domain_entry['Item'].get('domain_status', {}).get('S') != 'pending_validation':
+            return format_response(200, 'success', 'validate domain skipped', None)
+
+        # Create the DNS entry that validates the certificate
+        create_validate_cert_response = self.create_validate_cert()
+        if create_validate_cert_response == 'cert_validation_record_pending':
+            return self.continue_validation(
+                invocation, f'validation record for {self.domain_name} did not reach the name servers'
+            )
+        if create_validate_cert_response != 'cert_validation_record_created':
+            self.update_domain_status('validation_failed')
+            return format_response(
+                500, 'failed', f'validate domain failed with error {create_validate_cert_response}', self.log
+            )
+        update_domain_status_response = self.update_domain_status('ready')
+        if update_domain_status_response == 'domain_not_pending':
+            # A delete started after the check above and may have looked for the record before it was written
+            delete_validate_cert_response = self.delete_validate_cert()
+            if delete_validate_cert_response != 'cert_validation_record_deleted':
+                return format_response(
+                    500, 'failed', f'validate domain failed with error {delete_validate_cert_response}', self.log
+                )
+            return format_response(200, 'success', 'validate domain skipped', None)
+        if update_domain_status_response != 'domain_status_updated':
+            return format_response(
+                500, 'failed', f'validate domain failed with error {update_domain_status_response}', self.log
+            )
+        return format_response(200, 'success', 'validate domain succeeded', self.log)
 
     def delete_domain_entry(self):
         # Verify the domain exists
         domain_entry = self.get_domain_entry()
-        if not domain_entry:
+        if 'Item' not in domain_entry:
             return 'domain_entry_not_found'
         
         # Verify that the domain can be deleted
@@ -315,40 +434,38 @@ class Domain:
         if 'None' not in tasks:
             return 'has_associated_tasks'
         
-        # Delete the wildcard certificate and certificate validation resource record for the domain
+        # Take a domain out of pending_validation before looking for its validation record, so a background
+        # validation that writes the record after this point deletes it again instead of marking the domain ready
+        self.hosted_zone = domain_entry['Item']['hosted_zone']['S']
         self.certificate_arn = domain_entry['Item']['certificate_arn']['S']
+        update_domain_status_response = self.update_domain_status('deleting')
+        if update_domain_status_response not in ['domain_status_updated', 'domain_not_pending']:
+            return update_domain_status_response
+
+        # Delete the wildcard certificate and certificate validation resource record for the domain
         get_domain_validation_records_response = self.get_domain_validation_records()
-        if get_domain_validation_records_response != 'domain_validation_records_requested':
+        if get_domain_validation_records_response not in [
+            'domain_validation_records_requested', 'domain_validation_records_pending'
+        ]:
             return get_domain_validation_records_response
         delete_domain_cert_response = self.delete_domain_cert()
         if delete_domain_cert_response != 'domain_cert_deleted':
             return delete_domain_cert_response
-        delete_validate_cert_response = self.delete_validate_cert()
-        if delete_validate_cert_response != 'cert_validation_record_deleted':
-            return delete_validate_cert_response
+        # A domain deleted before validation finished may not have a validation record yet
+        if get_domain_validation_records_response == 'domain_validation_records_requested':
+            delete_validate_cert_response = self.delete_validate_cert()
+            if delete_validate_cert_response != 'cert_validation_record_deleted':
+                return delete_validate_cert_response
 
         # Delete the domain details from the DynamoDB domains table
-        try:
-            self.aws_dynamodb_client.delete_item(
-                TableName=f'{self.deployment_name}-domains',
-                Key={
-                    'domain_name': {'S': self.domain_name}
-                }
-            )
-        except botocore.exceptions.ClientError as error:
-            return error
-        except botocore.exceptions.ParamValidationError as error:
-            return error
-        
+        delete_domain_row_response = self.delete_domain_row()
+        if delete_domain_row_response != 'domain_entry_deleted':
+            return delete_domain_row_response
+
         # Remove domain from active_resources in deployment table
-        deployment_details = self.get_deployment_entry()
-        active_resources = deployment_details['Item']['active_resources']['M']
-        active_domains = active_resources['domains']['SS']
-        active_domains.remove(self.domain_name)
-        if len(active_domains) == 0:
-            active_domains = ['None']
-        active_resources['domains']['SS'] = active_domains
-        update_deployment_entry_response = self.update_deployment_entry(active_resources)
+        update_deployment_entry_response = resource_registry.remove_active_resources(
+            self.aws_dynamodb_client, self.deployment_name, 'domains', self.domain_name
+        )
         if update_deployment_entry_response != 'deployment_updated':
             return update_deployment_entry_response
         return 'domain_deleted'
@@ -367,8 +484,10 @@ class Domain:
             return format_response(409, 'failed', f'{self.domain_name} already exists', self.log)
         elif create_domain_entry_response == 'invalid_domain':
             return format_response(404, 'failed', f'hosted_zone {self.hosted_zone} does not exist', self.log)
-        elif create_domain_entry_response == 'domain_created':
-            return format_response(200, 'success', 'create domain succeeded', None)
+        elif create_domain_entry_response == 'domain_pending_validation':
+            return format_response(
+                200, 'success', 'create domain succeeded', None, domain_status='pending_validation'
+            )
         else:
             return format_response(500, 'failed', f'create domain failed with error {create_domain_entry_response}', self.log)
 
@@ -405,10 +524,12 @@ class Domain:
         associated_listeners = domain_entry['Item']['listeners']['SS']
         associated_host_names = domain_entry['Item']['host_names']['SS']
         domain_creator_id = domain_entry['Item']['user_id']['S']
+        # Domains created before validation moved to the background have no domain_status
+        domain_status = domain_entry['Item'].get('domain_status', {}).get('S', 'ready')
         return format_response(200, 'success', 'get domain succeeded', None, domain_name=self.domain_name,
                                hosted_zone=hosted_zone, api_domain=api_domain, associated_tasks=associated_tasks,
                                associated_listeners=associated_listeners, associated_host_names=associated_host_names,
-                               domain_creator_id=domain_creator_id)
+                               domain_creator_id=domain_creator_id, domain_status=domain_status)
 
     def list(self):
         domains_list = []
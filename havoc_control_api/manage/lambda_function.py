@@ -1,17 +1,31 @@
 import os
 import re
 import json
-import deployment
-import domains
-import listeners
-import playbooks
-import playbook_types
-import portgroups
-import task_type
-import tasks
-import trigger
-import users
-import workspace
+import importlib
+
+
+# Maps each resource to the module and class that handle it. Modules are imported on first use so a request only pays
+# for the resource it touches.
+resource_handlers = {
+    'deployment': ('deployment', 'Deployment'),
+    'domain': ('domains', 'Domain'),
+    'listener': ('listeners', 'Listener'),
+    'playbook': ('playbooks', 'Playbook'),
+    'playbook_type': ('playbook_types', 'Registration'),
+    'portgroup': ('portgroups', 'Portgroup'),
+    'task_type': ('task_type', 'Registration'),
+    'task': ('tasks', 'Tasks'),
+    'trigger': ('trigger', 'Trigger'),
+    'user': ('users', 'Users'),
+    'workspace': ('workspace', 'Workspace')
+}
+
+allowed_commands = ['create', 'delete', 'get', 'kill', 'list', 'update']
+
+# Background steps this function hands to its own asynchronous invocations, mapped to the resource that runs them.
+internal_actions = {
+    'validate_domain': 'domain'
+}
 
 
 def format_response(status_code, result, message, log, **kwargs):
@@ -29,44 +43,34 @@ def format_response(status_code, result, message, log, **kwargs):
 
 
 def action(resource, command, region, deployment_name, user_id, detail, log):
-    resources = {
-        'deployment': deployment.Deployment(deployment_name, region, user_id, detail, log),
-        'domain': domains.Domain(deployment_name, region, user_id, detail, log),
-        'listener': listeners.Listener(deployment_name, region, user_id, detail, log),
-        'playbook': playbooks.Playbook(deployment_name, region, user_id, detail, log),
-        'playbook_type': playbook_types.Registration(deployment_name, region, user_id, detail, log),
-        'portgroup': portgroups.Portgroup(deployment_name, region, user_id, detail, log),
-        'task_type': task_type.Registration(deployment_name, region, user_id, detail, log),
-        'task': tasks.Tasks(deployment_name, region, user_id, detail, log),
-        'trigger': trigger.Trigger(deployment_name, region, user_id, detail, log),
-        'user': users.Users(deployment_name, region, user_id, detail, log),
-        'workspace': workspace.Workspace(deployment_name, region, user_id, detail, log)
-    }
-    r = resources[resource]
-    functions = {
-        'create': r.create,
-        'delete': r.delete,
-        'get': r.get,
-        'kill': r.kill,
-        'list': r.list,
-        'update': r.update
-    }
-    call_function = functions[command]()
+    module_name, class_name = resource_handlers[resource]
+    resource_class = getattr(importlib.import_module(module_name), class_name)
+    r = resource_class(deployment_name, region, user_id, detail, log)
+    call_function = getattr(r, command)()
     return call_function
 
 
 def lambda_handler(event, context):
     region = re.search('arn:aws:lambda:([^:]+):.*', context.invoked_function_arn).group(1)
-    user_id = event['requestContext']['authorizer']['user_id']
     deployment_name = os.environ['DEPLOYMENT_NAME']
     log = {'event': event}
 
+    # Internal actions are only accepted from this function's own async invocations, never through API Gateway
+    if 'requestContext' not in event:
+        if event.get('action') not in internal_actions:
+            return format_response(400, 'failed', 'invalid action', log)
+        internal_action = event['action']
+        return action(
+            internal_actions[internal_action], internal_action, region, deployment_name, event['user_id'],
+            event.get('detail', {}), log
+        )
+    user_id = event['requestContext']['authorizer']['user_id']
+
     data = json.loads(event['body'])
     if 'command' not in data:
         return format_response(400, 'failed', 'missing command', log)
     command = data['command']
 
-    allowed_commands = ['create', 'delete', 'get', 'kill', 'list', 'update']
     if command not in allowed_commands:
         return format_response(400, 'failed', 'invalid command', log)
 
@@ -74,8 +78,7 @@ def lambda_handler(event, context):
         return format_response(400, 'failed', 'missing resource', log)
     resource = data['resource']
 
-    allowed_resources = ['deployment', 'domain', 'listener', 'playbook', 'playbook_type', 'portgroup', 'task_type', 'task', 'trigger', 'user', 'workspace']
-    if resource not in allowed_resources:
+    if resource not in resource_handlers:
         return format_response(400, 'failed', 'invalid resource', log)
 
     if 'detail' in data:
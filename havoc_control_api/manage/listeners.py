@@ -3,9 +3,15 @@ import re
 import ast
 import json
 import botocore
-import boto3
+import havoc_aws
 import time as t
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import resource_registry
+from dns_changes import ChangeBatcher
+
+# Certificate ARNs by domain name, kept for the life of a warm container.
+_certificate_arns = {}
 
 
 def format_response(status_code, result, message, log, **kwargs):
@@ -24,6 +30,9 @@ def format_response(status_code, result, message, log, **kwargs):
 
 class Listener:
 
+    # Ports of a listener are provisioned and deprovisioned concurrently, at most this many at a time.
+    max_workers = 8
+
     def __init__(self, deployment_name, region, user_id, detail: dict, log):
         """
         Instantiate a Portgroup instance
@@ -59,35 +68,35 @@ class Listener:
     def aws_dynamodb_client(self):
         """Returns the boto3 DynamoDB session (establishes one automatically if one does not already exist)"""
         if self.__aws_dynamodb_client is None:
-            self.__aws_dynamodb_client = boto3.client('dynamodb', region_name=self.region)
+            self.__aws_dynamodb_client = havoc_aws.client('dynamodb', self.region)
         return self.__aws_dynamodb_client
     
     @property
     def aws_elbv2_client(self):
         """Returns the boto3 ELBv2 session (establishes one automatically if one does not already exist)"""
         if self.__aws_elbv2_client is None:
-            self.__aws_elbv2_client = boto3.client('elbv2', region_name=self.region)
+            self.__aws_elbv2_client = havoc_aws.client('elbv2', self.region)
         return self.__aws_elbv2_client
     
     @property
     def aws_acm_client(self):
         """Returns the boto3 ACM session (establishes one automatically if one does not already exist)"""
         if self.__aws_acm_client is None:
-            self.__aws_acm_client = boto3.client('acm', region_name=self.region)
+            self.__aws_acm_client = havoc_aws.client('acm', self.region)
         return self.__aws_acm_client
     
     @property
     def aws_ecs_client(self):
         """Returns the boto3 ECS session (establishes one automatically if one does not already exist)"""
         if self.__aws_ecs_client is None:
-            self.__aws_ecs_client = boto3.client('ecs', region_name=self.region)
+            self.__aws_ecs_client = havoc_aws.client('ecs', self.region)
         return self.__aws_ecs_client
     
     @property
     def aws_route53_client(self):
         """Returns the boto3 Route53 session for this project (establishes one automatically if one does not already exist)"""
         if self.__aws_route53_client is None:
-            self.__aws_route53_client = boto3.client('route53')
+            self.__aws_route53_client = havoc_aws.client('route53')
         return self.__aws_route53_client
 
     def query_listeners(self):
@@ -204,6 +213,9 @@ class Listener:
                 TargetGroupArn = target_group_arn
             )
         except botocore.exceptions.ClientError as error:
+            # Already deleted by an earlier, partially failed delete
+            if error.response['Error']['Code'] == 'TargetGroupNotFound':
+                return 'target_group_deleted'
             return error
         except botocore.exceptions.ParamValidationError as error:
             return error
@@ -227,15 +239,37 @@ class Listener:
             return error
         return 'target_registered'
     
-    def get_certificate(self):
-        response = self.aws_acm_client.list_certificates(
-            CertificateStatuses = ['ISSUED']
-            )
-        if 'CertificateSummaryList' in response:
-            certificate_summary_list = response['CertificateSummaryList']
-            for certificate in certificate_summary_list:
+    def certificate_issued(self, certificate_arn):
+        try:
+            response = self.aws_acm_client.describe_certificate(CertificateArn=certificate_arn)
+        except botocore.exceptions.ClientError:
+            return False
+        return response['Certificate']['Status'] == 'ISSUED'
+
+    def get_certificate(self, domain_certificate_arn=None):
+        """
+        Sets certificate_arn to the domain's issued certificate. A domain entry that records its certificate is only
+        served by that certificate. Entries without one fall back to a list_certificates scan, whose result is cached
+        per domain and checked again before each use.
+        """
+        if domain_certificate_arn:
+            if self.certificate_issued(domain_certificate_arn):
+                self.certificate_arn = domain_certificate_arn
+            return
+        cached_certificate_arn = _certificate_arns.get(self.domain_name)
+        if cached_certificate_arn:
+            if self.certificate_issued(cached_certificate_arn):
+                self.certificate_arn = cached_certificate_arn
+                return
+            # Deleted or no longer issued; scan again
+            del _certificate_arns[self.domain_name]
+        paginator = self.aws_acm_client.get_paginator('list_certificates')
+        for page in paginator.paginate(CertificateStatuses=['ISSUED']):
+            for certificate in page.get('CertificateSummaryList', []):
                 if self.domain_name in certificate['DomainName']:
                     self.certificate_arn = certificate['CertificateArn']
+        if self.certificate_arn:
+            _certificate_arns[self.domain_name] = self.certificate_arn
 
     def create_lb_listener(self, port):
         listener_type = self.listener_config[port]['listener_type']
@@ -261,11 +295,60 @@ class Listener:
                 ListenerArn = listener_arn
             )
         except botocore.exceptions.ClientError as error:
+            # Already deleted by an earlier, partially failed delete
+            if error.response['Error']['Code'] == 'ListenerNotFound':
+                return 'lb_listener_deleted'
             return error
         except botocore.exceptions.ParamValidationError as error:
             return error
         return 'lb_listener_deleted'
     
+    def provision_port(self, port):
+        """
+        Creates a port's target group, registers the task as its target and creates its lb listener. The ARNs are
+        recorded in listener_config as each step completes, so a failed port can be rolled back from where it stopped.
+        """
+        create_target_group_response = self.create_target_group(port)
+        if create_target_group_response != 'target_group_created':
+            return create_target_group_response
+        register_target_response = self.register_target(port)
+        if register_target_response != 'target_registered':
+            return register_target_response
+        create_listener_response = self.create_lb_listener(port)
+        if create_listener_response != 'lb_listner_created':
+            return create_listener_response
+        return 'port_provisioned'
+
+    def deprovision_port(self, port):
+        """Deletes whatever provision_port created for a port, in reverse order"""
+        if 'listener_arn' in self.listener_config[port]:
+            delete_lb_listener_response = self.delete_lb_listener(port)
+            if delete_lb_listener_response != 'lb_listener_deleted':
+                return delete_lb_listener_response
+        if 'target_group_arn' in self.listener_config[port]:
+            delete_target_group_response = self.delete_target_group(port)
+            if delete_target_group_response != 'target_group_deleted':
+                return delete_target_group_response
+        return 'port_deprovisioned'
+
+    def run_ports(self, port_function, expected_response):
+        """Runs port_function for every port concurrently. Returns {port: error} for the ports that failed."""
+        ports = list(self.listener_config)
+        if not ports:
+            return {}
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(ports))) as executor:
+            responses = list(executor.map(port_function, ports))
+        return {port: response for port, response in zip(ports, responses) if response != expected_response}
+
+    def rollback_load_balancer(self):
+        """Removes the load balancer and every port resource created for a listener whose creation failed"""
+        failed_ports = self.run_ports(self.deprovision_port, 'port_deprovisioned')
+        for port, error in failed_ports.items():
+            print(f'Error rolling back listener {self.listener_name} port {port}: {error}')
+        delete_load_balancer_response = self.delete_load_balancer()
+        if delete_load_balancer_response != 'load_balancer_deleted':
+            print(f'Error rolling back listener {self.listener_name} load balancer: {delete_load_balancer_response}')
+
     def create_listener_entry(self):
         timestamp = datetime.now().strftime('%s')
         listener_config = json.dumps(self.listener_config)
@@ -374,59 +457,19 @@ class Listener:
         )
 
     def create_resource_record_set(self):
-        try:
-            self.aws_route53_client.change_resource_record_sets(
-                HostedZoneId=self.hosted_zone,
-                ChangeBatch={
-                    'Changes': [
-                        {
-                            'Action': 'UPSERT',
-                            'ResourceRecordSet':{
-                                'Name': f'{self.host_name}.{self.domain_name}',
-                                'Type': 'CNAME',
-                                'TTL': 300,
-                                'ResourceRecords': [
-                                    {
-                                        'Value': self.load_balancer_dns_name
-                                    }
-                                ]
-                            }
-                        }
-                    ]
-                }
-            )
-        except botocore.exceptions.ClientError as error:
-            return error
-        except botocore.exceptions.ParamValidationError as error:
-            return error
+        dns_changes = ChangeBatcher(self.aws_route53_client)
+        dns_changes.upsert(self.hosted_zone, f'{self.host_name}.{self.domain_name}', 'CNAME', self.load_balancer_dns_name)
+        flush_response = dns_changes.flush()
+        if flush_response != 'resource_record_sets_changed':
+            return flush_response
         return 'resource_record_set_created'
-    
+
     def delete_resource_record_set(self):
-        try:
-            self.aws_route53_client.change_resource_record_sets(
-                HostedZoneId=self.hosted_zone,
-                ChangeBatch={
-                    'Changes': [
-                        {
-                            'Action': 'DELETE',
-                            'ResourceRecordSet': {
-                                'Name': f'{self.host_name}.{self.domain_name}',
-                                'Type': 'CNAME',
-                                'TTL': 300,
-                                'ResourceRecords': [
-                                    {
-                                        'Value': self.load_balancer_dns_name
-                                    }
-                                ]
-                            }
-                        }
-                    ]
-                }
-            )
-        except botocore.exceptions.ClientError as error:
-            return error
-        except botocore.exceptions.ParamValidationError as error:
-            return error
+        dns_changes = ChangeBatcher(self.aws_route53_client)
+        dns_changes.delete(self.hosted_zone, f'{self.host_name}.{self.domain_name}', 'CNAME', self.load_balancer_dns_name)
+        flush_response = dns_changes.flush()
+        if flush_response != 'resource_record_sets_changed':
+            return flush_response
         return 'resource_record_set_deleted'
 
     def update_domain_entry(self, domain_listeners, host_names):
@@ -447,32 +490,68 @@ class Listener:
         except botocore.exceptions.ParamValidationError as error:
             return error
         return 'domain_entry_updated'
-    
-    def get_deployment_entry(self):
-        return self.aws_dynamodb_client.get_item(
-            TableName=f'{self.deployment_name}-deployment',
-            Key={
-                'deployment_name': {'S': self.deployment_name}
-            }
-        )
-    
-    def update_deployment_entry(self, active_resources):
-        try:
-            self.aws_dynamodb_client.update_item(
-                TableName=f'{self.deployment_name}-deployment',
-                Key={
-                    'deployment_name': {'S': self.deployment_name}
-                },
-                UpdateExpression='set active_resources=:active_resources',
-                ExpressionAttributeValues={
-                    ':active_resources': {'M': active_resources}
-                }
-            )
-        except botocore.exceptions.ClientError as error:
-            return error
-        except botocore.exceptions.ParamValidationError as error:
-            return error
-        return 'deployment_updated'
+
+    def remove_domain_references(self):
+        """Deletes the listener's DNS record and removes it and its host name from the domain. Safe to repeat."""
+        get_domain_entry_response = self.get_domain_entry()
+        if 'Item' not in get_domain_entry_response:
+            return 'domain_name_not_found'
+        self.hosted_zone = get_domain_entry_response['Item']['hosted_zone']['S']
+        delete_resource_record_set_response = self.delete_resource_record_set()
+        if delete_resource_record_set_response != 'resource_record_set_deleted':
+            return delete_resource_record_set_response
+        current_listeners = get_domain_entry_response['Item']['listeners']['SS']
+        current_host_names = get_domain_entry_response['Item']['host_names']['SS']
+        if self.listener_name not in current_listeners and self.host_name not in current_host_names:
+            return 'domain_entry_updated'
+        domain_listeners = [i for i in current_listeners if i != self.listener_name] or ['None']
+        associated_host_names = [i for i in current_host_names if i != self.host_name] or ['None']
+        return self.update_domain_entry(domain_listeners, associated_host_names)
+
+    def remove_portgroup_references(self):
+        """Removes the listener from its portgroups' associated listeners. Safe to repeat."""
+        for portgroup in self.portgroups:
+            portgroup_entry = self.get_portgroup_entry(portgroup)
+            if 'Item' not in portgroup_entry:
+                continue
+            current_listeners = portgroup_entry['Item']['listeners']['SS']
+            if self.listener_name not in current_listeners:
+                continue
+            portgroup_listeners = [i for i in current_listeners if i != self.listener_name] or ['None']
+            update_portgroup_entry_response = self.update_portgroup_entry(portgroup, portgroup_listeners)
+            if update_portgroup_entry_response != 'portgroup_updated':
+                return update_portgroup_entry_response
+        return 'portgroup_updated'
+
+    def remove_task_reference(self):
+        """Removes the listener from its task's associated listeners. Safe to repeat."""
+        task_entry = self.get_task_entry()
+        if 'Item' not in task_entry or 'listeners' not in task_entry['Item']:
+            return 'task_updated'
+        current_listeners = task_entry['Item']['listeners']['SS']
+        if self.listener_name not in current_listeners:
+            return 'task_updated'
+        task_listeners = [i for i in current_listeners if i != self.listener_name] or ['None']
+        return self.update_task_entry(task_listeners)
+
+    def rollback_listener(self, error):
+        """
+        Undoes a create_listener that failed after its ports were provisioned: removes whatever it recorded in
+        DynamoDB and Route53, then the load balancer and its ports. Returns error.
+        """
+        cleanup_responses = [self.remove_portgroup_references(), self.remove_task_reference()]
+        if self.domain_name:
+            cleanup_responses.append(self.remove_domain_references())
+        cleanup_responses.append(self.delete_listener_entry())
+        cleanup_responses.append(resource_registry.remove_active_resources(
+            self.aws_dynamodb_client, self.deployment_name, 'listeners', self.listener_name
+        ))
+        for cleanup_response in cleanup_responses:
+            if cleanup_response not in ['portgroup_updated', 'task_updated', 'domain_entry_updated',
+                                        'listener_entry_deleted', 'deployment_updated']:
+                print(f'Error rolling back listener {self.listener_name}: {cleanup_response}')
+        self.rollback_load_balancer()
+        return error
     
     def create_listener(self, listener_config):
         # Validate inputs
@@ -493,9 +572,14 @@ class Listener:
             get_domain_entry_response = self.get_domain_entry()
             if 'Item' not in get_domain_entry_response:
                 return 'failed_domain_name_not_found'
+            # Domains created before validation moved to the background have no domain_status
+            domain_status = get_domain_entry_response['Item'].get('domain_status', {}).get('S', 'ready')
+            if domain_status != 'ready':
+                return f'failed_domain_{domain_status}'
             if self.host_name in get_domain_entry_response['Item']['host_names']['SS']:
                 return 'failed_host_name_exists_for_domain'
             self.hosted_zone = get_domain_entry_response['Item']['hosted_zone']['S']
+            domain_certificate_arn = get_domain_entry_response['Item'].get('certificate_arn', {}).get('S')
             if 'None' in get_domain_entry_response['Item']['listeners']['SS']:
                 domain_listeners = []
             else:
@@ -517,24 +601,45 @@ class Listener:
 
         # If HTTPS listener type, get the certificate details
         if https_listener:
-            self.get_certificate()
+            self.get_certificate(domain_certificate_arn)
             if self.certificate_arn is None:
                 return 'failed_no_certificate_found_for_domain'
         
-        # Validate portgroups and update portgroup's associated listeners
+        # Validate portgroups and collect their security groups
+        portgroup_listeners = {}
         for portgroup in self.portgroups:
             portgroup_entry = self.get_portgroup_entry(portgroup)
             if 'Item' not in portgroup_entry:
                 return 'failed_portgroup_not_found'
             self.security_groups.append(portgroup_entry['Item']['securitygroup_id']['S'])
             if 'None' in portgroup_entry['Item']['listeners']['SS']:
-                portgroup_listeners = []
+                portgroup_listeners[portgroup] = []
             else:
-                portgroup_listeners = portgroup_entry['Item']['listeners']['SS']
-            portgroup_listeners.append(self.listener_name)
-            update_portgroup_entry_response = self.update_portgroup_entry(portgroup, portgroup_listeners)
+                portgroup_listeners[portgroup] = portgroup_entry['Item']['listeners']['SS']
+            portgroup_listeners[portgroup].append(self.listener_name)
+        
+        # Create a new load balancer
+        create_load_balancer_response = self.create_load_balancer()
+        if create_load_balancer_response != 'load_balancer_created':
+            if self.load_balancer_arn:
+                self.delete_load_balancer()
+            return create_load_balancer_response
+
+        # Create each port's target group, target registration and lb listener concurrently. If any port fails, the
+        # ports that were provisioned and the load balancer are removed so the listener can be created again.
+        failed_ports = self.run_ports(self.provision_port, 'port_provisioned')
+        if failed_ports:
+            self.rollback_load_balancer()
+            port, error = next(iter(failed_ports.items()))
+            return f'Port {port}: {error}'
+
+        # From here on a failure rolls back everything recorded so far along with the load balancer, so nothing is
+        # left behind without a listener entry to delete it by.
+        # Update portgroup's associated listeners
+        for portgroup in self.portgroups:
+            update_portgroup_entry_response = self.update_portgroup_entry(portgroup, portgroup_listeners[portgroup])
             if update_portgroup_entry_response != 'portgroup_updated':
-                return update_portgroup_entry_response
+                return self.rollback_listener(update_portgroup_entry_response)
         
         # Update associated listeners for the task
         if 'None' in task_entry['Item']['listeners']['SS']:
@@ -544,53 +649,28 @@ class Listener:
         task_listeners.append(self.listener_name)
         update_task_entry_response = self.update_task_entry(task_listeners)
         if update_task_entry_response != 'task_updated':
-            return update_task_entry_response
-        
-        # Create a new load balancer
-        create_load_balancer_response = self.create_load_balancer()
-        if create_load_balancer_response != 'load_balancer_created':
-            return create_load_balancer_response
-
-        # Create a target group, register the task as a target and create the lb listener
-        for listener_port in self.listener_config:
-            create_target_group_response = self.create_target_group(listener_port)
-            if create_target_group_response != 'target_group_created':
-                return create_target_group_response
-                
-            register_target_response = self.register_target(listener_port)
-            if register_target_response != 'target_registered':
-                return register_target_response
-        
-            create_listener_response = self.create_lb_listener(listener_port)
-            if create_listener_response != 'lb_listner_created':
-                return create_listener_response
+            return self.rollback_listener(update_task_entry_response)
         
         # Set up Route53 entry if a domain name is present
         if self.domain_name:
             create_resource_record_set_response = self.create_resource_record_set()
             if create_resource_record_set_response != 'resource_record_set_created':
-                return create_resource_record_set_response
+                return self.rollback_listener(create_resource_record_set_response)
             update_domain_entry_response = self.update_domain_entry(domain_listeners, associated_host_names)
             if update_domain_entry_response != 'domain_entry_updated':
-                return update_domain_entry_response
+                return self.rollback_listener(update_domain_entry_response)
 
         # Create a listener entry in DynamoDB
         create_listener_entry_response = self.create_listener_entry()
         if create_listener_entry_response != 'listener_entry_created':
-            return create_listener_entry_response
+            return self.rollback_listener(create_listener_entry_response)
         
         # Add listener to active_resources in deployment table
-        deployment_details = self.get_deployment_entry()
-        active_resources = deployment_details['Item']['active_resources']['M']
-        active_listeners = active_resources['listeners']['SS']
-        if active_listeners == ['None']:
-            active_listeners = [self.listener_name]
-        else:
-            active_listeners.append(self.listener_name)
-        active_resources['listeners']['SS'] = active_listeners
-        update_deployment_entry_response = self.update_deployment_entry(active_resources)
+        update_deployment_entry_response = resource_registry.add_active_resources(
+            self.aws_dynamodb_client, self.deployment_name, 'listeners', self.listener_name
+        )
         if update_deployment_entry_response != 'deployment_updated':
-            return update_deployment_entry_response
+            return self.rollback_listener(update_deployment_entry_response)
         return 'listener_created'
     
     def delete_listener(self):
@@ -609,36 +689,18 @@ class Listener:
         self.portgroups = listener_entry['Item']['portgroups']['SS']
         self.listener_config = json.loads(listener_entry['Item']['listener_config']['S'])
 
+        # Every step below is a no-op when already done, so a delete that failed part way can be run again.
         # Delete Route53 entry if a domain name is present
         if self.domain_name:
-            get_domain_entry_response = self.get_domain_entry()
-            if 'Item' not in get_domain_entry_response:
-                return 'domain_name_not_found'
-            self.hosted_zone = get_domain_entry_response['Item']['hosted_zone']['S']
-            domain_listeners = get_domain_entry_response['Item']['listeners']['SS']
-            domain_listeners.remove(self.listener_name)
-            if not domain_listeners:
-                domain_listeners = ['None']
-            associated_host_names = get_domain_entry_response['Item']['host_names']['SS']
-            associated_host_names.remove(self.host_name)
-            if not associated_host_names:
-                associated_host_names = ['None']
-            delete_resource_record_set_response = self.delete_resource_record_set()
-            if delete_resource_record_set_response != 'resource_record_set_deleted':
-                return delete_resource_record_set_response
-            update_domain_entry_response = self.update_domain_entry(domain_listeners, associated_host_names)
-            if update_domain_entry_response != 'domain_entry_updated':
-                return update_domain_entry_response
+            remove_domain_references_response = self.remove_domain_references()
+            if remove_domain_references_response != 'domain_entry_updated':
+                return remove_domain_references_response
         
-        # Delete lb listener and target group
-        for listener_port in self.listener_config:
-            delete_lb_listener_response = self.delete_lb_listener(listener_port)
-            if delete_lb_listener_response != 'lb_listener_deleted':
-                return delete_lb_listener_response
-
-            delete_target_group_response = self.delete_target_group(listener_port)
-            if delete_target_group_response != 'target_group_deleted':
-                return delete_target_group_response
+        # Delete each port's lb listener and target group concurrently
+        failed_ports = self.run_ports(self.deprovision_port, 'port_deprovisioned')
+        if failed_ports:
+            port, error = next(iter(failed_ports.items()))
+            return f'Port {port}: {error}'
             
         # Delete load balancer
         delete_load_balancer_response = self.delete_load_balancer()
@@ -646,25 +708,14 @@ class Listener:
             return delete_load_balancer_response
         
         # Update portgroup listener reference
-        for portgroup in self.portgroups:
-            portgroup_entry = self.get_portgroup_entry(portgroup)
-            portgroup_listeners = portgroup_entry['Item']['listeners']['SS']
-            portgroup_listeners.remove(self.listener_name)
-            if not portgroup_listeners:
-                portgroup_listeners = ['None']
-            update_portgroup_entry_response = self.update_portgroup_entry(portgroup, portgroup_listeners)
-            if update_portgroup_entry_response != 'portgroup_updated':
-                return update_portgroup_entry_response
+        remove_portgroup_references_response = self.remove_portgroup_references()
+        if remove_portgroup_references_response != 'portgroup_updated':
+            return remove_portgroup_references_response
         
         # Update task listener reference
-        task_entry = self.get_task_entry()
-        task_listeners = task_entry['Item']['listeners']['SS']
-        task_listeners.remove(self.listener_name)
-        if not task_listeners:
-            task_listeners = ['None']
-        update_task_entry_response = self.update_task_entry(task_listeners)
-        if update_task_entry_response != 'task_updated':
-            return update_task_entry_response
+        remove_task_reference_response = self.remove_task_reference()
+        if remove_task_reference_response != 'task_updated':
+            return remove_task_reference_response
 
         # Delete the listener entry in DynamoDB
         delete_listener_entry_response = self.delete_listener_entry()
@@ -672,14 +723,9 @@ class Listener:
             return delete_listener_entry_response
         
         # Remove listener from active_resources in deployment table
-        deployment_details = self.get_deployment_entry()
-        active_resources = deployment_details['Item']['active_resources']['M']
-        active_listeners = active_resources['listeners']['SS']
-        active_listeners.remove(self.listener_name)
-        if len(active_listeners) == 0:
-            active_listeners = ['None']
-        active_resources['listeners']['SS'] = active_listeners
-        update_deployment_entry_response = self.update_deployment_entry(active_resources)
+        update_deployment_entry_response = resource_registry.remove_active_resources(
+            self.aws_dynamodb_client, self.deployment_name, 'listeners', self.listener_name
+        )
         if update_deployment_entry_response != 'deployment_updated':
             return update_deployment_entry_response
         return 'listener_deleted'
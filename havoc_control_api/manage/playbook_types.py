@@ -1,6 +1,7 @@
 import json
 import botocore
-import boto3
+import havoc_aws
+import resource_registry
 
 
 def format_response(status_code, result, message, log, **kwargs):
@@ -39,14 +40,14 @@ class Registration:
     def aws_s3_client(self):
         """Returns the boto3 S3 session (establishes one automatically if one does not already exist)"""
         if self.__aws_s3_client is None:
-            self.__aws_s3_client = boto3.client('s3', region_name=self.region)
+            self.__aws_s3_client = havoc_aws.client('s3', self.region)
         return self.__aws_s3_client
     
     @property
     def aws_dynamodb_client(self):
         """Returns the boto3 DynamoDB session (establishes one automatically if one does not already exist)"""
         if self.__aws_dynamodb_client is None:
-            self.__aws_dynamodb_client = boto3.client('dynamodb', region_name=self.region)
+            self.__aws_dynamodb_client = havoc_aws.client('dynamodb', self.region)
         return self.__aws_dynamodb_client
     
     def query_playbook_types(self):
@@ -146,32 +147,6 @@ class Registration:
             return error
         return 'object_deleted'
     
-    def get_deployment_entry(self):
-        return self.aws_dynamodb_client.get_item(
-            TableName=f'{self.deployment_name}-deployment',
-            Key={
-                'deployment_name': {'S': self.deployment_name}
-            }
-        )
-    
-    def update_deployment_entry(self, active_resources):
-        try:
-            self.aws_dynamodb_client.update_item(
-                TableName=f'{self.deployment_name}-deployment',
-                Key={
-                    'deployment_name': {'S': self.deployment_name}
-                },
-                UpdateExpression='set active_resources=:active_resources',
-                ExpressionAttributeValues={
-                    ':active_resources': {'M': active_resources}
-                }
-            )
-        except botocore.exceptions.ClientError as error:
-            return error
-        except botocore.exceptions.ParamValidationError as error:
-            return error
-        return 'deployment_updated'
-    
     def add_playbook_type(self):
         existing_playbook_type = self.get_playbook_type_entry()
         if 'Item' in existing_playbook_type:
@@ -184,15 +159,9 @@ class Registration:
             return upload_object_response
         
         # Add playbook_type to active_resources in deployment table
-        deployment_details = self.get_deployment_entry()
-        active_resources = deployment_details['Item']['active_resources']['M']
-        active_playbook_types = active_resources['playbook_types']['SS']
-        if active_playbook_types == ['None']:
-            active_playbook_types = [self.playbook_type]
-        else:
-            active_playbook_types.append(self.playbook_type)
-        active_resources['playbook_types']['SS'] = active_playbook_types
-        update_deployment_entry_response = self.update_deployment_entry(active_resources)
+        update_deployment_entry_response = resource_registry.add_active_resources(
+            self.aws_dynamodb_client, self.deployment_name, 'playbook_types', self.playbook_type
+        )
         if update_deployment_entry_response != 'deployment_updated':
             return update_deployment_entry_response
         return 'playbook_type_created'
@@ -210,14 +179,9 @@ class Registration:
             return delete_object_response
         
         # Remove playbook_type from active_resources in deployment table
-        deployment_details = self.get_deployment_entry()
-        active_resources = deployment_details['Item']['active_resources']['M']
-        active_playbook_types = active_resources['playbook_types']['SS']
-        active_playbook_types.remove(self.playbook_type)
-        if len(active_playbook_types) == 0:
-            active_playbook_types = ['None']
-        active_resources['playbook_types']['SS'] = active_playbook_types
-        update_deployment_entry_response = self.update_deployment_entry(active_resources)
+        update_deployment_entry_response = resource_registry.remove_active_resources(
+            self.aws_dynamodb_client, self.deployment_name, 'playbook_types', self.playbook_type
+        )
         if update_deployment_entry_response != 'deployment_updated':
             return update_deployment_entry_response
         return 'playbook_type_deleted'
@@ -1,9 +1,10 @@
 import os
 import json
 import botocore
-import boto3
+import havoc_aws
 import time as t
 from datetime import datetime
+import resource_registry
 
 
 def format_response(status_code, result, message, log, **kwargs):
@@ -40,14 +41,14 @@ class Portgroup:
     def aws_dynamodb_client(self):
         """Returns the boto3 DynamoDB session (establishes one automatically if one does not already exist)"""
         if self.__aws_dynamodb_client is None:
-            self.__aws_dynamodb_client = boto3.client('dynamodb', region_name=self.region)
+            self.__aws_dynamodb_client = havoc_aws.client('dynamodb', self.region)
         return self.__aws_dynamodb_client
 
     @property
     def aws_ec2_client(self):
         """Returns the boto3 EC2 session (establishes one automatically if one does not already exist)"""
         if self.__aws_ec2_client is None:
-            self.__aws_ec2_client = boto3.client('ec2', region_name=self.region)
+            self.__aws_ec2_client = havoc_aws.client('ec2', self.region)
         return self.__aws_ec2_client
 
     def query_portgroups(self):
@@ -78,32 +79,6 @@ class Portgroup:
             GroupIds=[securitygroup_id]
         )
     
-    def get_deployment_entry(self):
-        return self.aws_dynamodb_client.get_item(
-            TableName=f'{self.deployment_name}-deployment',
-            Key={
-                'deployment_name': {'S': self.deployment_name}
-            }
-        )
-    
-    def update_deployment_entry(self, active_resources):
-        try:
-            self.aws_dynamodb_client.update_item(
-                TableName=f'{self.deployment_name}-deployment',
-                Key={
-                    'deployment_name': {'S': self.deployment_name}
-                },
-                UpdateExpression='set active_resources=:active_resources',
-                ExpressionAttributeValues={
-                    ':active_resources': {'M': active_resources}
-                }
-            )
-        except botocore.exceptions.ClientError as error:
-            return error
-        except botocore.exceptions.ParamValidationError as error:
-            return error
-        return 'deployment_updated'
-
     def create_portgroup_entry(self, description, timestamp):
         get_portgroup_entry_response = self.get_portgroup_entry()
         if 'Item' in get_portgroup_entry_response:
@@ -144,15 +119,9 @@ class Portgroup:
             return error
         
         # Add portgroup to active_resources in deployment table
-        deployment_details = self.get_deployment_entry()
-        active_resources = deployment_details['Item']['active_resources']['M']
-        active_portgroups = active_resources['portgroups']['SS']
-        if active_portgroups == ['None']:
-            active_portgroups = [self.portgroup_name]
-        else:
-            active_portgroups.append(self.portgroup_name)
-        active_resources['portgroups']['SS'] = active_portgroups
-        update_deployment_entry_response = self.update_deployment_entry(active_resources)
+        update_deployment_entry_response = resource_registry.add_active_resources(
+            self.aws_dynamodb_client, self.deployment_name, 'portgroups', self.portgroup_name
+        )
         if update_deployment_entry_response != 'deployment_updated':
             return update_deployment_entry_response
         return 'portgroup_created'
@@ -180,14 +149,9 @@ class Portgroup:
             return error
         
         # Remove portgroup from active_resources in deployment table
-        deployment_details = self.get_deployment_entry()
-        active_resources = deployment_details['Item']['active_resources']['M']
-        active_portgroups = active_resources['portgroups']['SS']
-        active_portgroups.remove(self.portgroup_name)
-        if len(active_portgroups) == 0:
-            active_portgroups = ['None']
-        active_resources['portgroups']['SS'] = active_portgroups
-        update_deployment_entry_response = self.update_deployment_entry(active_resources)
+        update_deployment_entry_response = resource_registry.remove_active_resources(
+            self.aws_dynamodb_client, self.deployment_name, 'portgroups', self.portgroup_name
+        )
         if update_deployment_entry_response != 'deployment_updated':
             return update_deployment_entry_response
         return 'portgroup_deleted'
@@ -1,6 +1,7 @@
 import json
 import botocore
-import boto3
+import havoc_aws
+import resource_registry
 
 
 def format_response(status_code, result, message, log, **kwargs):
@@ -41,14 +42,14 @@ class Registration:
     def aws_dynamodb_client(self):
         """Returns the boto3 DynamoDB session (establishes one automatically if one does not already exist)"""
         if self.__aws_dynamodb_client is None:
-            self.__aws_dynamodb_client = boto3.client('dynamodb', region_name=self.region)
+            self.__aws_dynamodb_client = havoc_aws.client('dynamodb', self.region)
         return self.__aws_dynamodb_client
 
     @property
     def aws_ecs_client(self):
         """Returns the boto3 ECS session (establishes one automatically if one does not already exist)"""
         if self.__aws_ecs_client is None:
-            self.__aws_ecs_client = boto3.client('ecs', region_name=self.region)
+            self.__aws_ecs_client = havoc_aws.client('ecs', self.region)
         return self.__aws_ecs_client
 
     def query_task_types(self):
@@ -120,32 +121,6 @@ class Registration:
             return error
         return 'task_type_entry_removed'
     
-    def get_deployment_entry(self):
-        return self.aws_dynamodb_client.get_item(
-            TableName=f'{self.deployment_name}-deployment',
-            Key={
-                'deployment_name': {'S': self.deployment_name}
-            }
-        )
-    
-    def update_deployment_entry(self, active_resources):
-        try:
-            self.aws_dynamodb_client.update_item(
-                TableName=f'{self.deployment_name}-deployment',
-                Key={
-                    'deployment_name': {'S': self.deployment_name}
-                },
-                UpdateExpression='set active_resources=:active_resources',
-                ExpressionAttributeValues={
-                    ':active_resources': {'M': active_resources}
-                }
-            )
-        except botocore.exceptions.ClientError as error:
-            return error
-        except botocore.exceptions.ParamValidationError as error:
-            return error
-        return 'deployment_updated'
-
     def add_ecs_task_definition(self):
         existing_task_type = self.get_task_type_entry()
         if existing_task_type:
@@ -205,15 +180,9 @@ class Registration:
             return add_task_type_entry_response
         
         # Add task_type to active_resources in deployment table
-        deployment_details = self.get_deployment_entry()
-        active_resources = deployment_details['Item']['active_resources']['M']
-        active_task_types = active_resources['task_types']['SS']
-        if active_task_types == ['None']:
-            active_task_types = [self.task_type]
-        else:
-            active_task_types.append(self.task_type)
-        active_resources['task_types']['SS'] = active_task_types
-        update_deployment_entry_response = self.update_deployment_entry(active_resources)
+        update_deployment_entry_response = resource_registry.add_active_resources(
+            self.aws_dynamodb_client, self.deployment_name, 'task_types', self.task_type
+        )
         if update_deployment_entry_response != 'deployment_updated':
             return update_deployment_entry_response
         return 'task_type_created'
@@ -236,14 +205,9 @@ class Registration:
             return remove_task_type_entry_response
         
         # Remove task_type from active_resources in deployment table
-        deployment_details = self.get_deployment_entry()
-        active_resources = deployment_details['Item']['active_resources']['M']
-        active_task_types = active_resources['task_types']['SS']
-        active_task_types.remove(self.task_type)
-        if len(active_task_types) == 0:
-            active_task_types = ['None']
-        active_resources['task_types']['SS'] = active_task_types
-        update_deployment_entry_response = self.update_deployment_entry(active_resources)
+        update_deployment_entry_response = resource_registry.remove_active_resources(
+            self.aws_dynamodb_client, self.deployment_name, 'task_types', self.task_type
+        )
         if update_deployment_entry_response != 'deployment_updated':
             return update_deployment_entry_response
         return 'task_definition_removed'
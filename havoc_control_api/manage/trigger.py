@@ -2,7 +2,8 @@ import os
 import ast
 import json
 import botocore
-import boto3
+import havoc_aws
+import resource_registry
 
 
 def format_response(status_code, result, message, log, **kwargs):
@@ -42,14 +43,14 @@ class Trigger:
     def aws_dynamodb_client(self):
         """Returns the boto3 DynamoDB session (establishes one automatically if one does not already exist)"""
         if self.__aws_dynamodb_client is None:
-            self.__aws_dynamodb_client = boto3.client('dynamodb', region_name=self.region)
+            self.__aws_dynamodb_client = havoc_aws.client('dynamodb', self.region)
         return self.__aws_dynamodb_client
     
     @property
     def aws_cloudwatch_events_client(self):
         """Returns the boto3 CloudWatch Events session (establishes one automatically if one does not already exist)"""
         if self.__aws_cloudwatch_events_client is None:
-            self.__aws_cloudwatch_events_client = boto3.client('events', region_name=self.region)
+            self.__aws_cloudwatch_events_client = havoc_aws.client('events', self.region)
         return self.__aws_cloudwatch_events_client
 
     def query_triggers(self):
@@ -167,32 +168,6 @@ class Trigger:
             return error
         return 'targets_removed'
     
-    def get_deployment_entry(self):
-        return self.aws_dynamodb_client.get_item(
-            TableName=f'{self.deployment_name}-deployment',
-            Key={
-                'deployment_name': {'S': self.deployment_name}
-            }
-        )
-    
-    def update_deployment_entry(self, active_resources):
-        try:
-            self.aws_dynamodb_client.update_item(
-                TableName=f'{self.deployment_name}-deployment',
-                Key={
-                    'deployment_name': {'S': self.deployment_name}
-                },
-                UpdateExpression='set active_resources=:active_resources',
-                ExpressionAttributeValues={
-                    ':active_resources': {'M': active_resources}
-                }
-            )
-        except botocore.exceptions.ClientError as error:
-            return error
-        except botocore.exceptions.ParamValidationError as error:
-            return error
-        return 'deployment_updated'
-
     def create_trigger_entry(self):
 
         # Check for trigger conflict
@@ -269,15 +244,9 @@ class Trigger:
             return error
         
         # Add trigger to active_resources in deployment table
-        deployment_details = self.get_deployment_entry()
-        active_resources = deployment_details['Item']['active_resources']['M']
-        active_triggers = active_resources['triggers']['SS']
-        if active_triggers == ['None']:
-            active_triggers = [self.trigger_name]
-        else:
-            active_triggers.append(self.trigger_name)
-        active_resources['triggers']['SS'] = active_triggers
-        update_deployment_entry_response = self.update_deployment_entry(active_resources)
+        update_deployment_entry_response = resource_registry.add_active_resources(
+            self.aws_dynamodb_client, self.deployment_name, 'triggers', self.trigger_name
+        )
         if update_deployment_entry_response != 'deployment_updated':
             return update_deployment_entry_response
         return 'trigger_created'
@@ -314,14 +283,9 @@ class Trigger:
             return error
         
         # Remove trigger from active_resources in deployment table
-        deployment_details = self.get_deployment_entry()
-        active_resources = deployment_details['Item']['active_resources']['M']
-        active_triggers = active_resources['triggers']['SS']
-        active_triggers.remove(self.trigger_name)
-        if len(active_triggers) == 0:
-            active_triggers = ['None']
-        active_resources['triggers']['SS'] = active_triggers
-        update_deployment_entry_response = self.update_deployment_entry(active_resources)
+        update_deployment_entry_response = resource_registry.remove_active_resources(
+            self.aws_dynamodb_client, self.deployment_name, 'triggers', self.trigger_name
+        )
         if update_deployment_entry_response != 'deployment_updated':
             return update_deployment_entry_response
         return 'trigger_deleted'
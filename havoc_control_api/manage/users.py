@@ -1,6 +1,6 @@
 import json
 import botocore
-import boto3
+import havoc_aws
 import string, random
 
 
@@ -46,7 +46,7 @@ class Users:
     def aws_dynamodb_client(self):
         """Returns the boto3 DynamoDB session (establishes one automatically if one does not already exist)"""
         if self.__aws_dynamodb_client is None:
-            self.__aws_dynamodb_client = boto3.client('dynamodb', region_name=self.region)
+            self.__aws_dynamodb_client = havoc_aws.client('dynamodb', self.region)
         return self.__aws_dynamodb_client
 
     def query_api_keys(self, api_key):
@@ -122,6 +122,30 @@ class Users:
             return error
         return 'user_id_deleted'
 
+    def invalidate_authorizer_cache(self):
+        """
+        Drop the authorizer's cached user records and signing keys. Bumps the cache epoch on the deployment entry;
+        every warm authorizer container compares it with the epoch its cache was filled under and starts over when it
+        has moved.
+        """
+        try:
+            self.aws_dynamodb_client.update_item(
+                TableName=f'{self.deployment_name}-deployment',
+                Key={
+                    'deployment_name': {'S': self.deployment_name}
+                },
+                UpdateExpression='add authorizer_cache_epoch :one',
+                ConditionExpression='attribute_exists(deployment_name)',
+                ExpressionAttributeValues={
+                    ':one': {'N': '1'}
+                }
+            )
+        except botocore.exceptions.ClientError as error:
+            return error
+        except botocore.exceptions.ParamValidationError as error:
+            return error
+        return 'authorizer_cache_invalidated'
+
     def create(self):
         calling_user = self.get_user_details(self.user_id)
         if calling_user['Item']['admin']['S'] != 'yes':
@@ -189,6 +213,9 @@ class Users:
             return format_response(404, 'failed', f'user_id {self.manage_user_id} does not exist', self.log)
         delete_user_id_response = self.delete_user_id()
         if delete_user_id_response == 'user_id_deleted':
+            invalidate_response = self.invalidate_authorizer_cache()
+            if invalidate_response != 'authorizer_cache_invalidated':
+                print(f'Error invalidating authorizer cache: {invalidate_response}')
             return format_response(200, 'success', 'delete user succeeded', self.log)
         else:
             return format_response(500, 'failed', f'delete user failed with error {delete_user_id_response}', self.log)
@@ -247,6 +274,9 @@ class Users:
                 user_attributes['secret_key'] = secret_key
                 add_user_attribute_response = self.add_user_attribute(user_attributes)
                 if add_user_attribute_response == 'user_attributes_added':
+                    invalidate_response = self.invalidate_authorizer_cache()
+                    if invalidate_response != 'authorizer_cache_invalidated':
+                        print(f'Error invalidating authorizer cache: {invalidate_response}')
                     return format_response(
                         200, 'success', 'update user succeeded', self.log, user_id=self.manage_user_id, api_key=api_key,
                         secret_key=secret_key
@@ -306,6 +336,9 @@ class Users:
             return format_response(400, 'failed', 'invalid detail', self.log)
         add_user_attribute_response = self.add_user_attribute(user_attributes)
         if add_user_attribute_response == 'user_attributes_added':
+            invalidate_response = self.invalidate_authorizer_cache()
+            if invalidate_response != 'authorizer_cache_invalidated':
+                print(f'Error invalidating authorizer cache: {invalidate_response}')
             return format_response(
                 200, 'success', 'user update succeeded', self.log, user_id=new_user_id, api_key=api_key, secret_key=secret_key,
                 admin=admin
@@ -2,8 +2,9 @@ import re
 import sys
 import json
 import botocore
-import boto3
+import havoc_aws
 import base64
+import resource_registry
 
 
 def format_response(status_code, result, message, log, **kwargs):
@@ -38,14 +39,14 @@ class Workspace:
     def aws_s3_client(self):
         """Returns the boto3 S3 session (establishes one automatically if one does not already exist)"""
         if self.__aws_s3_client is None:
-            self.__aws_s3_client = boto3.client('s3', region_name=self.region)
+            self.__aws_s3_client = havoc_aws.client('s3', self.region)
         return self.__aws_s3_client
 
     @property
     def aws_dynamodb_client(self):
         """Returns the boto3 DynamoDB session (establishes one automatically if one does not already exist)"""
         if self.__aws_dynamodb_client is None:
-            self.__aws_dynamodb_client = boto3.client('dynamodb', region_name=self.region)
+            self.__aws_dynamodb_client = havoc_aws.client('dynamodb', self.region)
         return self.__aws_dynamodb_client
 
     def upload_object(self):
@@ -107,32 +108,6 @@ class Workspace:
             return error
         return 'object_deleted'
     
-    def get_deployment_entry(self):
-        return self.aws_dynamodb_client.get_item(
-            TableName=f'{self.deployment_name}-deployment',
-            Key={
-                'deployment_name': {'S': self.deployment_name}
-            }
-        )
-    
-    def update_deployment_entry(self, active_resources):
-        try:
-            self.aws_dynamodb_client.update_item(
-                TableName=f'{self.deployment_name}-deployment',
-                Key={
-                    'deployment_name': {'S': self.deployment_name}
-                },
-                UpdateExpression='set active_resources=:active_resources',
-                ExpressionAttributeValues={
-                    ':active_resources': {'M': active_resources}
-                }
-            )
-        except botocore.exceptions.ClientError as error:
-            return error
-        except botocore.exceptions.ParamValidationError as error:
-            return error
-        return 'deployment_updated'
-
     def list(self):
         if 'path' in self.detail:
             if self.detail['path'] not in ['shared/', 'upload/']:
@@ -203,15 +178,9 @@ class Workspace:
         upload_object_response = self.upload_object()
         if upload_object_response == 'object_uploaded':
             # Add file to active_resources in deployment table
-            deployment_details = self.get_deployment_entry()
-            active_resources = deployment_details['Item']['active_resources']['M']
-            active_files = active_resources['workspace']['SS']
-            if active_files == ['None']:
-                active_files = [f'{self.path}{self.file_name}']
-            else:
-                active_files.append(f'{self.path}{self.file_name}')
-            active_resources['workspace']['SS'] = active_files
-            update_deployment_entry_response = self.update_deployment_entry(active_resources)
+            update_deployment_entry_response = resource_registry.add_active_resources(
+                self.aws_dynamodb_client, self.deployment_name, 'workspace', f'{self.path}{self.file_name}'
+            )
             if update_deployment_entry_response != 'deployment_updated':
                 return format_response(500, 'failed', f'create_file failed with error {update_deployment_entry_response}', self.log)
             return format_response(200, 'success', 'create_file succeeded', None)
@@ -237,14 +206,9 @@ class Workspace:
         delete_object_response = self.delete_object()
         if delete_object_response == 'object_deleted':
             # Remove file from active_resources in deployment table
-            deployment_details = self.get_deployment_entry()
-            active_resources = deployment_details['Item']['active_resources']['M']
-            active_files = active_resources['workspace']['SS']
-            active_files.remove(f'{self.path}{self.file_name}')
-            if len(active_files) == 0:
-                active_files = ['None']
-            active_resources['workspace']['SS'] = active_files
-            update_deployment_entry_response = self.update_deployment_entry(active_resources)
+            update_deployment_entry_response = resource_registry.remove_active_resources(
+                self.aws_dynamodb_client, self.deployment_name, 'workspace', f'{self.path}{self.file_name}'
+            )
             if update_deployment_entry_response != 'deployment_updated':
                 return format_response(500, 'failed', f'delete_file failed with error {update_deployment_entry_response}', self.log)
             return format_response(200, 'success', 'delete_file succeeded', None)
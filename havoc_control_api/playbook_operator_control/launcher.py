@@ -1,9 +1,10 @@
 import ast
 import json
 import botocore
-import boto3
+import havoc_aws
 import datetime
 import time as t
+import resource_registry
 
 
 def format_response(status_code, result, message, log, **kwargs):
@@ -46,21 +47,21 @@ class Playbook:
     def aws_dynamodb_client(self):
         """Returns the boto3 DynamoDB session (establishes one automatically if one does not already exist)"""
         if self.__aws_dynamodb_client is None:
-            self.__aws_dynamodb_client = boto3.client('dynamodb', region_name=self.region)
+            self.__aws_dynamodb_client = havoc_aws.client('dynamodb', self.region)
         return self.__aws_dynamodb_client
 
     @property
     def aws_ecs_client(self):
         """Returns the boto3 ECS session (establishes one automatically if one does not already exist)"""
         if self.__aws_ecs_client is None:
-            self.__aws_ecs_client = boto3.client('ecs', region_name=self.region)
+            self.__aws_ecs_client = havoc_aws.client('ecs', self.region)
         return self.__aws_ecs_client
 
     @property
     def aws_s3_client(self):
         """Returns the boto3 S3 session (establishes one automatically if one does not already exist)"""
         if self.__aws_s3_client is None:
-            self.__aws_s3_client = boto3.client('s3', region_name=self.region)
+            self.__aws_s3_client = havoc_aws.client('s3', self.region)
         return self.__aws_s3_client
     
     def get_playbook_entry(self):
@@ -193,32 +194,6 @@ class Playbook:
             return error
         return 'playbook_entry_updated'
     
-    def get_deployment_entry(self):
-        return self.aws_dynamodb_client.get_item(
-            TableName=f'{self.deployment_name}-deployment',
-            Key={
-                'deployment_name': {'S': self.deployment_name}
-            }
-        )
-    
-    def update_deployment_entry(self, active_resources):
-        try:
-            self.aws_dynamodb_client.update_item(
-                TableName=f'{self.deployment_name}-deployment',
-                Key={
-                    'deployment_name': {'S': self.deployment_name}
-                },
-                UpdateExpression='set active_resources=:active_resources',
-                ExpressionAttributeValues={
-                    ':active_resources': {'M': active_resources}
-                }
-            )
-        except botocore.exceptions.ClientError as error:
-            return error
-        except botocore.exceptions.ParamValidationError as error:
-            return error
-        return 'deployment_updated'
-
     def launch(self):
         if 'playbook_type' in self.detail:
             self.playbook_type = self.detail['playbook_type']
@@ -325,15 +300,9 @@ class Playbook:
             return format_response(500, 'failed', f'launch playbook failed with error {update_playbook_entry_response}', self.log)
         
         # Add playbook to active_resources in deployment table
-        deployment_details = self.get_deployment_entry()
-        active_resources = deployment_details['Item']['active_resources']['M']
-        active_playbooks = active_resources['playbooks']['SS']
-        if active_playbooks == ['None']:
-            active_playbooks = [self.playbook_name]
-        else:
-            active_playbooks.append(self.playbook_name)
-        active_resources['playbooks']['SS'] = active_playbooks
-        update_deployment_entry_response = self.update_deployment_entry(active_resources)
+        update_deployment_entry_response = resource_registry.add_active_resources(
+            self.aws_dynamodb_client, self.deployment_name, 'playbooks', self.playbook_name
+        )
         if update_deployment_entry_response != 'deployment_updated':
             return update_deployment_entry_response
 
@@ -1,22 +1,26 @@
-import re
-import ast
 import json
 import copy
 import botocore
-import boto3
+import havoc_aws
 import time as t
 from datetime import datetime, timedelta
+import resource_registry
+import result_envelope
+import payload_codec
+from log_writer import LogWriter, log_stream_name
 
 
 class Deliver:
 
-    def __init__(self, region, deployment_name, results_queue_expiration, enable_playbook_results_logging, results):
+    def __init__(self, region, deployment_name, results_queue_expiration, enable_playbook_results_logging, results,
+                 log_writer=None):
         self.region = region
         self.deployment_name = deployment_name
         self.results_queue_expiration = results_queue_expiration
         self.enable_playbook_results_logging = enable_playbook_results_logging
         self.user_id = None
         self.results = results
+        self.log_writer = log_writer
         self.playbook_name = None
         self.playbook_type = None
         self.playbook_operator_version = None
@@ -27,14 +31,14 @@ class Deliver:
     def aws_dynamodb_client(self):
         """Returns the Dynamodb boto3 session (establishes one automatically if one does not already exist)"""
         if self.__aws_dynamodb_client is None:
-            self.__aws_dynamodb_client = boto3.client('dynamodb', region_name=self.region)
+            self.__aws_dynamodb_client = havoc_aws.client('dynamodb', self.region)
         return self.__aws_dynamodb_client
     
     @property
     def aws_logs_client(self):
         """Returns the boto3 logs session (establishes one automatically if one does not already exist)"""
         if self.__aws_logs_client is None:
-            self.__aws_logs_client = boto3.client('logs', region_name=self.region)
+            self.__aws_logs_client = havoc_aws.client('logs', self.region)
         return self.__aws_logs_client
 
     def add_queue_attribute(self, stime, expire_time, operator_command, command_args, json_payload):
@@ -60,7 +64,7 @@ class Deliver:
                     ':playbook_operator_version': {'S': self.playbook_operator_version},
                     ':operator_command': {'S': operator_command},
                     ':command_args': {'M': command_args},
-                    ':payload': {'S': json_payload}
+                    ':payload': payload_codec.encode(json_payload)
                 }
             )
         except botocore.exceptions.ClientError as error:
@@ -99,68 +103,19 @@ class Deliver:
         return 'playbook_entry_updated'
     
     def put_log_event(self, payload, stime):
-        log_stream_time = datetime.strftime(datetime.now(), '%Y/%m/%d')
-        log_stream_name = f'{log_stream_time}/{self.playbook_name}'
-        try:
-            self.aws_logs_client.create_log_stream(
-                logGroupName=f'{self.deployment_name}/playbook_results_logging',
-                logStreamName=log_stream_name
-            )
-        except self.aws_logs_client.exceptions.ResourceAlreadyExistsException:
-            pass
-        try:
-            self.aws_logs_client.put_log_events(
-                logGroupName=f'{self.deployment_name}/playbook_results_logging',
-                logStreamName=log_stream_name,
-                logEvents=[
-                    {
-                        'timestamp': int(stime) * 1000,
-                        'message': payload
-                    }
-                ]
-            )
-        except botocore.exceptions.ClientError as error:
-            return error
-        except botocore.exceptions.ParamValidationError as error:
-            return error
+        """Buffers a result log event on the shared log_writer, or writes it immediately if there is none"""
+        log_writer = self.log_writer or LogWriter(self.aws_logs_client, f'{self.deployment_name}/playbook_results_logging')
+        log_writer.add(log_stream_name(self.playbook_name), int(stime) * 1000, payload)
+        if self.log_writer:
+            return 'log_event_written'
+        flush_response = log_writer.flush()
+        if flush_response != 'log_events_written':
+            return flush_response
         return 'log_event_written'
-    
-    def get_deployment_entry(self):
-        return self.aws_dynamodb_client.get_item(
-            TableName=f'{self.deployment_name}-deployment',
-            Key={
-                'deployment_name': {'S': self.deployment_name}
-            }
-        )
-    
-    def update_deployment_entry(self, active_resources):
-        try:
-            self.aws_dynamodb_client.update_item(
-                TableName=f'{self.deployment_name}-deployment',
-                Key={
-                    'deployment_name': {'S': self.deployment_name}
-                },
-                UpdateExpression='set active_resources=:active_resources',
-                ExpressionAttributeValues={
-                    ':active_resources': {'M': active_resources}
-                }
-            )
-        except botocore.exceptions.ClientError as error:
-            return error
-        except botocore.exceptions.ParamValidationError as error:
-            return error
-        return 'deployment_updated'
 
     def deliver_result(self):
         # Set vars
-        payload = None
-        try:
-            payload = json.loads(self.results['message'])
-        except:
-            pass
-        if not payload:
-            raw = re.search('\d+-\d+-\d+ \d+:\d+:\d+\+\d+ \[-\] ({.+})', self.results['message']).group(1)
-            payload = ast.literal_eval(raw)
+        payload = result_envelope.parse_result(self.results['message'])
 
         self.user_id = payload['user_id']
         self.playbook_name = payload['playbook_name']
@@ -213,14 +168,9 @@ class Deliver:
             if completed_instruction != 'playbook_entry_updated':
                 print(f'Error updating playbook entry: {completed_instruction}')
             # Remove playbook from active_resources in deployment table
-            deployment_details = self.get_deployment_entry()
-            active_resources = deployment_details['Item']['active_resources']['M']
-            active_playbooks = active_resources['playbooks']['SS']
-            active_playbooks.remove(self.playbook_name)
-            if len(active_playbooks) == 0:
-                active_playbooks = ['None']
-            active_resources['playbooks']['SS'] = active_playbooks
-            update_deployment_entry_response = self.update_deployment_entry(active_resources)
+            update_deployment_entry_response = resource_registry.remove_active_resources(
+                self.aws_dynamodb_client, self.deployment_name, 'playbooks', self.playbook_name
+            )
             if update_deployment_entry_response != 'deployment_updated':
                 print(f'Error updating deployment entry: {update_deployment_entry_response}')
 
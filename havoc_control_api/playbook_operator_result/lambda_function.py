@@ -3,7 +3,9 @@ import re
 import json
 import base64
 import zlib
+import havoc_aws
 from deliver import Deliver
+from log_writer import LogWriter
 
 
 def lambda_handler(event, context):
@@ -16,6 +18,12 @@ def lambda_handler(event, context):
     data = json.loads(raw.decode('utf-8'))
     log_events = data['logEvents']
 
+    # Result log events are buffered across the batch and written once per stream
+    log_writer = LogWriter(havoc_aws.client('logs', region), f'{deployment_name}/playbook_results_logging')
     for event in log_events:
-        d = Deliver(region, deployment_name, results_queue_expiration, enable_playbook_results_logging, event)
+        d = Deliver(region, deployment_name, results_queue_expiration, enable_playbook_results_logging, event,
+                    log_writer=log_writer)
         d.deliver_result()
+    flush_response = log_writer.flush()
+    if flush_response != 'log_events_written':
+        print(f'Error writing playbook result log entries to CloudWatch Logs: {flush_response}')
@@ -1,7 +1,9 @@
-import re
+import os
 import json
 import botocore
-import boto3
+import time as t
+import havoc_aws
+import instruction_transport
 
 
 def format_response(status_code, result, message, log, **kwargs):
@@ -20,6 +22,11 @@ def format_response(status_code, result, message, log, **kwargs):
 
 class Retrieve:
 
+    # Long-polls must return inside API Gateway's 29 second integration timeout.
+    max_wait_seconds = 25
+    initial_poll_interval = 0.25
+    max_poll_interval = 2
+
     def __init__(self, region, deployment_name, user_id, detail: dict, log):
         self.region = region
         self.deployment_name = deployment_name
@@ -27,21 +34,14 @@ class Retrieve:
         self.detail = detail
         self.log = log
         self.task_name = None
-        self.__aws_s3_client = None
         self.__aws_dynamodb_client = None
-
-    @property
-    def aws_s3_client(self):
-        """Returns the boto3 S3 session (establishes one automatically if one does not already exist)"""
-        if self.__aws_s3_client is None:
-            self.__aws_s3_client = boto3.client('s3', region_name=self.region)
-        return self.__aws_s3_client
+        self.__transport = None
 
     @property
     def aws_dynamodb_client(self):
         """Returns the Dynamodb boto3 session (establishes one automatically if one does not already exist)"""
         if self.__aws_dynamodb_client is None:
-            self.__aws_dynamodb_client = boto3.client('dynamodb', region_name=self.region)
+            self.__aws_dynamodb_client = havoc_aws.client('dynamodb', self.region)
         return self.__aws_dynamodb_client
 
     def get_user_details(self):
@@ -62,10 +62,55 @@ class Retrieve:
             }
         )
 
+    @property
+    def transport(self):
+        """Returns the instruction transport configured for remote tasks"""
+        if self.__transport is None:
+            self.__transport = instruction_transport.get_task_transport(
+                os.environ.get('INSTRUCTION_TRANSPORT', 's3'), 'remote_task', self.region, self.deployment_name
+            )
+        return self.__transport
+
+    def commands_pending(self):
+        """Returns True if at least one command is queued for the task"""
+        return self.transport.pending(self.task_name)
+
+    def wait_for_commands(self, wait_seconds):
+        """Polls with backoff until a command is queued or wait_seconds elapse. Returns True, False or an error."""
+        deadline = t.monotonic() + wait_seconds
+        poll_interval = self.initial_poll_interval
+        while True:
+            commands_pending_response = self.commands_pending()
+            if commands_pending_response is not False:
+                return commands_pending_response
+            remaining = deadline - t.monotonic()
+            if remaining <= 0:
+                return False
+            t.sleep(min(poll_interval, remaining))
+            poll_interval = min(poll_interval * 1.5, self.max_poll_interval)
+
+    @staticmethod
+    def command_order(command):
+        """
+        Sort key for a command: the timestamp it was issued at. Transports return commands in the order they were
+        queued, so a stable sort keeps that order for commands issued in the same second.
+        """
+        try:
+            return int(command.get('timestamp'))
+        except (TypeError, ValueError):
+            return 0
+
     def retrieve_commands(self):
         if 'task_name' not in self.detail:
             return format_response(400, 'failed', 'invalid detail', self.log)
         self.task_name = self.detail['task_name']
+        wait_seconds = self.detail.get('wait_seconds') or 0
+        try:
+            wait_seconds = min(float(wait_seconds), self.max_wait_seconds)
+        except (TypeError, ValueError):
+            return format_response(400, 'failed', 'invalid detail: wait_seconds must be a number', self.log)
+        if wait_seconds < 0:
+            return format_response(400, 'failed', 'invalid detail: wait_seconds must not be negative', self.log)
 
         user_details = self.get_user_details()
         user_associated_task_name = user_details['Item']['task_name']['S']
@@ -77,43 +122,23 @@ class Retrieve:
         if 'Item' not in task_entry:
             return format_response(404, 'failed', f'task {self.task_name} does not exist', self.log)
 
-        try:
-            list_objects_response = self.aws_s3_client.list_objects_v2(
-                Bucket=f'{self.deployment_name}-workspace',
-                Prefix=self.task_name + '/'
-            )
-        except botocore.exceptions.ClientError as error:
-            return format_response(500, 'failed', f'get_commands failed with error {error["Error"]}', self.log)
-        except botocore.exceptions.ParamValidationError as error:
-            return format_response(500, 'failed', f'get_commands failed with error {error["Error"]}', self.log)
-        
-        file_list = []
-        regex = f'{self.task_name}/(.*)'
-        if 'Contents' in list_objects_response:
-            for l in list_objects_response['Contents']:
-                search = re.search(regex, l['Key'])
-                if search.group(1):
-                    file_list.append(l['Key'])
-            for file_entry in file_list:
-                try:
-                    get_object_response = self.aws_s3_client.get_object(
-                        Bucket=f'{self.deployment_name}-workspace',
-                        Key=file_entry
-                    )
-                except botocore.exceptions.ClientError as error:
-                    return format_response(500, 'failed', f'get_commands failed with error {error["Error"]}', self.log)
-                except botocore.exceptions.ParamValidationError as error:
-                    return format_response(500, 'failed', f'get_commands failed with error {error["Error"]}', self.log)
-                interaction = json.loads(get_object_response['Body'].read().decode('utf-8'))
-                command_list.append(interaction)
-                try:
-                    self.aws_s3_client.delete_object(
-                        Bucket=f'{self.deployment_name}-workspace',
-                        Key=file_entry
-                    )
-                except botocore.exceptions.ClientError as error:
-                    return format_response(500, 'failed', f'get_commands failed with error {error["Error"]}', self.log)
-                except botocore.exceptions.ParamValidationError as error:
-                    return format_response(500, 'failed', f'get_commands failed with error {error["Error"]}', self.log)
+        # The user and task checks above are only made once; a long-poll re-checks the queue with a cheap listing.
+        if wait_seconds:
+            wait_for_commands_response = self.wait_for_commands(wait_seconds)
+            if wait_for_commands_response is False:
+                return format_response(200, 'success', 'get_commands succeeded', None, commands=command_list)
+            if wait_for_commands_response is not True:
+                return format_response(500, 'failed', f'get_commands failed with error {wait_for_commands_response}', self.log)
+
+        commands = self.transport.receive(self.task_name)
+        if not isinstance(commands, list):
+            return format_response(500, 'failed', f'get_commands failed with error {commands}', self.log)
+        if commands:
+            ack_response = self.transport.ack(self.task_name, [handle for handle, _ in commands])
+            if ack_response != 'instructions_acked':
+                return format_response(500, 'failed', f'get_commands failed with error {ack_response}', self.log)
 
+        # Return the commands in the order they were issued.
+        for _, command in sorted(commands, key=lambda c: self.command_order(c[1])):
+            command_list.append(command)
         return format_response(200, 'success', 'get_commands succeeded', None, commands=command_list)
@@ -3,8 +3,11 @@ import copy
 import zlib
 import base64
 import botocore
-import boto3
+import havoc_aws
 from datetime import datetime, timedelta
+import result_store
+import task_archive
+from log_writer import LogWriter, log_stream_name
 
 
 def format_response(status_code, result, message, log, **kwargs):
@@ -37,25 +40,43 @@ class Deliver:
         self.task_version = None
         self.__aws_dynamodb_client = None
         self.__aws_logs_client = None
+        self.__aws_s3_client = None
 
     @property
     def aws_dynamodb_client(self):
         """Returns the Dynamodb boto3 session (establishes one automatically if one does not already exist)"""
         if self.__aws_dynamodb_client is None:
-            self.__aws_dynamodb_client = boto3.client('dynamodb', region_name=self.region)
+            self.__aws_dynamodb_client = havoc_aws.client('dynamodb', self.region)
         return self.__aws_dynamodb_client
     
+    @property
+    def aws_s3_client(self):
+        """Returns the boto3 S3 session (establishes one automatically if one does not already exist)"""
+        if self.__aws_s3_client is None:
+            self.__aws_s3_client = havoc_aws.client('s3', self.region)
+        return self.__aws_s3_client
+
     @property
     def aws_logs_client(self):
         """Returns the boto3 logs session (establishes one automatically if one does not already exist)"""
         if self.__aws_logs_client is None:
-            self.__aws_logs_client = boto3.client('logs', region_name=self.region)
+            self.__aws_logs_client = havoc_aws.client('logs', self.region)
         return self.__aws_logs_client
 
     def add_queue_attribute(self, stime, expire_time, task_instruct_id, task_instruct_instance, task_instruct_command,
                             task_instruct_args, task_public_ip, task_local_ip, json_payload):
         task_host_name = 'None'
         task_domain_name = 'None'
+        output = result_store.store_output(
+            self.aws_s3_client, self.deployment_name, 'instruct_command_output',
+            result_store.output_key('task', self.task_name, stime), json_payload
+        )
+        if not isinstance(output, dict):
+            return output
+        # A rewritten row must not keep the output from the other storage tier.
+        stale_attributes = [a for a in result_store.output_attributes('instruct_command_output') if a not in output]
+        output_expression = ', '.join(f'{a}=:{a}' for a in output) + ' REMOVE ' + ', '.join(stale_attributes)
+        output_values = {f':{a}': v for a, v in output.items()}
         try:
             self.aws_dynamodb_client.update_item(
                 TableName=f'{self.deployment_name}-task-queue',
@@ -77,7 +98,7 @@ class Deliver:
                                 'task_domain_name=:task_domain_name,'
                                 'public_ip=:public_ip, '
                                 'local_ip=:local_ip, '
-                                'instruct_command_output=:payload',
+                                + output_expression,
                 ExpressionAttributeValues={
                     ':expire_time': {'N': expire_time},
                     ':user_id': {'S': self.user_id},
@@ -92,7 +113,7 @@ class Deliver:
                     ':task_domain_name': {'S': task_domain_name},
                     ':public_ip': {'S': task_public_ip},
                     ':local_ip': {'SS': task_local_ip},
-                    ':payload': {'S': json_payload}
+                    **output_values
                 }
             )
         except botocore.exceptions.ClientError as error:
@@ -141,30 +162,11 @@ class Deliver:
         return 'task_entry_updated'
     
     def put_log_event(self, payload, stime):
-        log_stream_time = datetime.strftime(datetime.now(), '%Y/%m/%d')
-        log_stream_name = f'{log_stream_time}/{self.task_name}'
-        try:
-            self.aws_logs_client.create_log_stream(
-                logGroupName=f'{self.deployment_name}/task_results_logging',
-                logStreamName=log_stream_name
-            )
-        except self.aws_logs_client.exceptions.ResourceAlreadyExistsException:
-            pass
-        try:
-            self.aws_logs_client.put_log_events(
-                logGroupName=f'{self.deployment_name}/task_results_logging',
-                logStreamName=log_stream_name,
-                logEvents=[
-                    {
-                        'timestamp': int(stime) * 1000,
-                        'message': payload
-                    }
-                ]
-            )
-        except botocore.exceptions.ClientError as error:
-            return error
-        except botocore.exceptions.ParamValidationError as error:
-            return error
+        log_writer = LogWriter(self.aws_logs_client, f'{self.deployment_name}/task_results_logging')
+        log_writer.add(log_stream_name(self.task_name), int(stime) * 1000, payload)
+        flush_response = log_writer.flush()
+        if flush_response != 'log_events_written':
+            return flush_response
         return 'log_event_written'
 
     def deliver_result(self):
@@ -270,6 +272,9 @@ class Deliver:
             update_task_entry_response = self.update_task_entry(stime, 'terminated', task_end_time)
             if update_task_entry_response != 'task_entry_updated':
                 return format_response(500, 'failed', f'post_results failed with error {update_task_entry_response}', self.log)
+            archive_task_response = task_archive.archive_task(self.aws_dynamodb_client, self.deployment_name, self.task_name)
+            if archive_task_response != 'task_archived':
+                print(f'Error archiving task {self.task_name}: {archive_task_response}')
         else:
             update_task_entry_response = self.update_task_entry(stime, 'idle', task_end_time)
             if update_task_entry_response != 'task_entry_updated':
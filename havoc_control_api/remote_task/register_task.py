@@ -1,8 +1,10 @@
+import os
 import json
 import random
 import string
 import botocore
-import boto3
+import havoc_aws
+import instruction_transport
 from datetime import datetime
 
 
@@ -42,14 +44,14 @@ class Task:
     def aws_dynamodb_client(self):
         """Returns the boto3 DynamoDB session (establishes one automatically if one does not already exist)"""
         if self.__aws_dynamodb_client is None:
-            self.__aws_dynamodb_client = boto3.client('dynamodb', region_name=self.region)
+            self.__aws_dynamodb_client = havoc_aws.client('dynamodb', self.region)
         return self.__aws_dynamodb_client
 
     @property
     def aws_s3_client(self):
         """Returns the boto3 S3 session (establishes one automatically if one does not already exist)"""
         if self.__aws_s3_client is None:
-            self.__aws_s3_client = boto3.client('s3', region_name=self.region)
+            self.__aws_s3_client = havoc_aws.client('s3', self.region)
         return self.__aws_s3_client
 
     def get_user_details(self):
@@ -84,6 +86,16 @@ class Task:
             'instruct_command': instruct_command, 'instruct_args': instruct_args, 'timestamp': timestamp,
             'end_time': end_time
         }
+        transport_name = os.environ.get('INSTRUCTION_TRANSPORT', 's3')
+        if transport_name != instruction_transport.S3Transport.name:
+            # Queued ahead of any instruction: interact numbers instructions from 1
+            transport = instruction_transport.get_task_transport(
+                transport_name, 'remote_task', self.region, self.deployment_name
+            )
+            send_response = transport.send(self.task_name, payload, seq=0)
+            if send_response != 'instruction_sent':
+                return send_response
+            return 'object_uploaded'
         payload_bytes = json.dumps(payload).encode('utf-8')
         try:
             self.aws_s3_client.put_object(
@@ -122,7 +134,6 @@ class Task:
                                 'listeners=:listeners, '
                                 'task_type=:task_type, '
                                 'task_version=:task_version, '
-                                'instruct_ids=:instruct_ids, '
                                 'instruct_instances=:instruct_instances, '
                                 'last_instruct_user_id=:last_instruct_user_id, '
                                 'last_instruct_id=:last_instruct_id, '
@@ -133,7 +144,8 @@ class Task:
                                 'create_time=:create_time, '
                                 'scheduled_end_time=:scheduled_end_time, '
                                 'user_id=:user_id, '
-                                'ecs_task_id=:ecs_task_id',
+                                'ecs_task_id=:ecs_task_id '
+                                'REMOVE archived',
                 ExpressionAttributeValues={
                     ':task_context': {'S': self.task_context},
                     ':task_status': {'S': task_status},
@@ -145,7 +157,6 @@ class Task:
                     ':listeners': {'SS': listeners},
                     ':task_type': {'S': self.task_type},
                     ':task_version': {'S': self.task_version},
-                    ':instruct_ids': {'SS': [instruct_id]},
                     ':instruct_instances': {'SS': [instruct_instance]},
                     ':last_instruct_user_id': {'S': user_id},
                     ':last_instruct_id': {'S': instruct_id},
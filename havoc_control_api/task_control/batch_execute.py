@@ -0,0 +1,607 @@
+import re
+import json
+import random
+import string
+import botocore
+import havoc_aws
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import time as t
+from readiness import TaskReadinessWaiter
+from dns_changes import ChangeBatcher
+import resource_registry
+import task_teardown
+
+
+def format_response(status_code, result, message, log, **kwargs):
+    response = {'outcome': result}
+    if message:
+        response['message'] = message
+    if kwargs:
+        for k, v in kwargs.items():
+            if v:
+                response[k] = v
+    if log:
+        log['response'] = response
+        print(log)
+    return {'statusCode': status_code, 'body': json.dumps(response)}
+
+
+class TaskBatch:
+
+    max_tasks = 50
+    max_workers = 10
+    # A transaction holds at most 100 items; the deployment row takes one of them.
+    max_transact_items = 100
+    # Commits re-read the rows and retry this many times when a concurrent change cancels the transaction.
+    max_commit_attempts = 3
+
+    def __init__(self, deployment_name, subnet, default_security_group, region, detail: dict, user_id, log):
+        """
+        Instantiate a TaskBatch instance
+        """
+        self.deployment_name = deployment_name
+        self.task_context = f'{self.deployment_name}-{region}'
+        self.subnet = subnet
+        self.default_security_group = default_security_group
+        self.region = region
+        self.detail = detail
+        self.user_id = user_id
+        self.log = log
+        self.task_type = None
+        self.task_version = None
+        self.outcomes = {}
+        self.__aws_dynamodb_client = None
+        self.__aws_ecs_client = None
+        self.__aws_ec2_client = None
+        self.__aws_s3_client = None
+        self.__aws_route53_client = None
+
+    @property
+    def aws_dynamodb_client(self):
+        """Returns the boto3 DynamoDB session (establishes one automatically if one does not already exist)"""
+        if self.__aws_dynamodb_client is None:
+            self.__aws_dynamodb_client = havoc_aws.client('dynamodb', self.region)
+        return self.__aws_dynamodb_client
+
+    @property
+    def aws_ecs_client(self):
+        """Returns the boto3 ECS session (establishes one automatically if one does not already exist)"""
+        if self.__aws_ecs_client is None:
+            self.__aws_ecs_client = havoc_aws.client('ecs', self.region)
+        return self.__aws_ecs_client
+
+    @property
+    def aws_ec2_client(self):
+        """Returns the boto3 EC2 session (establishes one automatically if one does not already exist)"""
+        if self.__aws_ec2_client is None:
+            self.__aws_ec2_client = havoc_aws.client('ec2', self.region)
+        return self.__aws_ec2_client
+
+    @property
+    def aws_s3_client(self):
+        """Returns the boto3 S3 session (establishes one automatically if one does not already exist)"""
+        if self.__aws_s3_client is None:
+            self.__aws_s3_client = havoc_aws.client('s3', self.region)
+        return self.__aws_s3_client
+
+    @property
+    def aws_route53_client(self):
+        """Returns the boto3 Route53 session for this project (establishes one automatically if one does not already exist)"""
+        if self.__aws_route53_client is None:
+            self.__aws_route53_client = havoc_aws.client('route53')
+        return self.__aws_route53_client
+
+    def task_failed(self, task_name, message):
+        self.outcomes[task_name] = {'task_name': task_name, 'outcome': 'failed', 'message': message}
+
+    def get_task_type_entry(self):
+        return self.aws_dynamodb_client.get_item(
+            TableName=f'{self.deployment_name}-task-types',
+            Key={
+                'task_type': {'S': self.task_type}
+            }
+        )
+
+    def batch_get_entries(self, request_items):
+        """
+        Returns the items found for request_items, keyed by table name, retrying any unprocessed keys. Raises
+        RuntimeError if keys are still unprocessed after task_teardown.max_batch_attempts.
+        """
+        return task_teardown.batch_get_entries(self.aws_dynamodb_client, request_items)
+
+    def membership_updates(self, tasks, domains, portgroups):
+        """
+        Returns the TransactWriteItems updates that add tasks to their domains and portgroups, and the (entry, new
+        attributes) pairs they write. Each update is conditioned on the sets it replaces, so a concurrent change cancels
+        the transaction instead of being overwritten.
+        """
+        updates = []
+        new_entries = []
+        for domain_name, domain_entry in domains.items():
+            domain_tasks = [task for task in tasks if task['task_domain_name'] == domain_name]
+            if not domain_tasks:
+                continue
+            current_tasks = domain_entry['tasks']['SS']
+            current_host_names = domain_entry['host_names']['SS']
+            new_tasks = [i for i in current_tasks if i != 'None'] + [task['task_name'] for task in domain_tasks]
+            new_host_names = [i for i in current_host_names if i != 'None']
+            new_host_names += [task['task_host_name'] for task in domain_tasks if task['task_host_name'] != 'None']
+            updates.append({
+                'Update': {
+                    'TableName': f'{self.deployment_name}-domains',
+                    'Key': {
+                        'domain_name': {'S': domain_name}
+                    },
+                    'UpdateExpression': 'set tasks=:tasks, host_names=:host_names',
+                    'ConditionExpression': 'tasks = :current_tasks AND host_names = :current_host_names',
+                    'ExpressionAttributeValues': {
+                        ':tasks': {'SS': new_tasks},
+                        ':host_names': {'SS': new_host_names or ['None']},
+                        ':current_tasks': {'SS': current_tasks},
+                        ':current_host_names': {'SS': current_host_names}
+                    }
+                }
+            })
+            new_entries.append((domain_entry, {'tasks': new_tasks, 'host_names': new_host_names or ['None']}))
+        for portgroup_name, portgroup_entry in portgroups.items():
+            portgroup_tasks = [task['task_name'] for task in tasks if portgroup_name in task['portgroups']]
+            if not portgroup_tasks:
+                continue
+            current_tasks = portgroup_entry['tasks']['SS']
+            new_tasks = [i for i in current_tasks if i != 'None'] + portgroup_tasks
+            updates.append({
+                'Update': {
+                    'TableName': f'{self.deployment_name}-portgroups',
+                    'Key': {
+                        'portgroup_name': {'S': portgroup_name}
+                    },
+                    'UpdateExpression': 'set tasks=:tasks',
+                    'ConditionExpression': 'tasks = :current_tasks',
+                    'ExpressionAttributeValues': {
+                        ':tasks': {'SS': new_tasks},
+                        ':current_tasks': {'SS': current_tasks}
+                    }
+                }
+            })
+            new_entries.append((portgroup_entry, {'tasks': new_tasks}))
+        return updates, new_entries
+
+    def task_puts(self, tasks):
+        """Returns the TransactWriteItems puts for the task entries, which fail if a task name has since been taken"""
+        return [{
+            'Put': {
+                'TableName': f'{self.deployment_name}-tasks',
+                'Item': self.task_entry(task),
+                'ConditionExpression': 'attribute_not_exists(task_name)'
+            }
+        } for task in tasks]
+
+    def deployment_update(self, tasks):
+        return {
+            'Update': {
+                'TableName': f'{self.deployment_name}-deployment',
+                'Key': {
+                    'deployment_name': {'S': self.deployment_name}
+                },
+                'UpdateExpression': 'ADD active_resources.#resource_type :resource_names',
+                'ConditionExpression': 'attribute_exists(active_resources)',
+                'ExpressionAttributeNames': {
+                    '#resource_type': 'tasks'
+                },
+                'ExpressionAttributeValues': {
+                    ':resource_names': {'SS': [task['task_name'] for task in tasks]}
+                }
+            }
+        }
+
+    def transaction_groups(self, tasks, domains, portgroups):
+        """Splits tasks into groups whose transactions fit in max_transact_items"""
+        groups = []
+        group = []
+        for task in tasks:
+            candidate = group + [task]
+            updates, _ = self.membership_updates(candidate, domains, portgroups)
+            if group and len(candidate) + len(updates) + 1 > self.max_transact_items:
+                groups.append(group)
+                group = [task]
+            else:
+                group = candidate
+        if group:
+            groups.append(group)
+        return groups
+
+    def refresh_entries(self, tasks, domains, portgroups):
+        """
+        Re-reads the rows a cancelled commit depended on. Returns the tasks that can still be recorded; the rest are
+        released.
+        """
+        request_items = {f'{self.deployment_name}-tasks': [{'task_name': {'S': task['task_name']}} for task in tasks]}
+        if domains:
+            request_items[f'{self.deployment_name}-domains'] = [{'domain_name': {'S': d}} for d in domains]
+        if portgroups:
+            request_items[f'{self.deployment_name}-portgroups'] = [{'portgroup_name': {'S': p}} for p in portgroups]
+        entries = self.batch_get_entries(request_items)
+        existing_tasks = {i['task_name']['S'] for i in entries.get(f'{self.deployment_name}-tasks', [])}
+        domains.clear()
+        domains.update({i['domain_name']['S']: i for i in entries.get(f'{self.deployment_name}-domains', [])})
+        portgroups.clear()
+        portgroups.update({i['portgroup_name']['S']: i for i in entries.get(f'{self.deployment_name}-portgroups', [])})
+        remaining = []
+        for task in tasks:
+            task_name = task['task_name']
+            if task_name in existing_tasks:
+                self.release_tasks([task], f'{task_name} already exists')
+            elif task['task_domain_name'] != 'None' and task['task_domain_name'] not in domains:
+                self.release_tasks([task], f'domain_name {task["task_domain_name"]} does not exist')
+            elif task['task_domain_name'] != 'None' and \
+                    task['task_host_name'] in domains[task['task_domain_name']]['host_names']['SS']:
+                self.release_tasks([task], f'{task["task_host_name"]} already exists')
+            elif [pg for pg in task['portgroups'] if pg != 'None' and pg not in portgroups]:
+                self.release_tasks([task], 'run_task failed: a portgroup was deleted during launch')
+            else:
+                remaining.append(task)
+        return remaining
+
+    def commit_tasks(self, tasks, domains, portgroups):
+        """
+        Records the launched tasks: each group's task entries, domain and portgroup memberships and active_resources
+        entry are written in one transaction. A cancelled transaction re-reads the rows and retries. Tasks that cannot
+        be recorded are released. Returns the tasks that were recorded.
+        """
+        committed = []
+        pending = list(tasks)
+        for attempt in range(self.max_commit_attempts):
+            try:
+                for group in self.transaction_groups(pending, domains, portgroups):
+                    updates, new_entries = self.membership_updates(group, domains, portgroups)
+                    transact_items = self.task_puts(group) + updates + [self.deployment_update(group)]
+                    self.aws_dynamodb_client.transact_write_items(TransactItems=transact_items)
+                    for entry, attributes in new_entries:
+                        for attribute, value in attributes.items():
+                            entry[attribute] = {'SS': value}
+                    committed.extend(group)
+                    pending = pending[len(group):]
+            except botocore.exceptions.ClientError as error:
+                if error.response['Error']['Code'] != 'TransactionCanceledException' or \
+                        attempt == self.max_commit_attempts - 1:
+                    self.release_tasks(pending, f'run_task failed with error {error}')
+                    return committed
+                t.sleep(0.05 * (2 ** attempt))
+                try:
+                    pending = self.refresh_entries(pending, domains, portgroups)
+                except (botocore.exceptions.ClientError, RuntimeError) as error:
+                    self.release_tasks(pending, f'run_task failed with error {error}')
+                    return committed
+                continue
+            except botocore.exceptions.ParamValidationError as error:
+                self.release_tasks(pending, f'run_task failed with error {error}')
+                return committed
+            return committed
+        return committed
+
+    def run_ecs_task(self, task):
+        try:
+            response = self.aws_ecs_client.run_task(
+                cluster=f'{self.deployment_name}-task-cluster',
+                count=1,
+                launchType='FARGATE',
+                networkConfiguration={
+                    'awsvpcConfiguration': {
+                        'subnets': [self.subnet],
+                        'securityGroups': task['securitygroups'],
+                        'assignPublicIp': 'ENABLED'
+                    }
+                },
+                overrides={
+                    'containerOverrides': [
+                        {
+                            'name': f'{self.deployment_name}-{self.task_type}',
+                            'environment': [
+                                {'name': 'REGION', 'value': self.region},
+                                {'name': 'DEPLOYMENT_NAME', 'value': self.deployment_name},
+                                {'name': 'USER_ID', 'value': self.user_id},
+                                {'name': 'TASK_NAME', 'value': task['task_name']},
+                                {'name': 'TASK_CONTEXT', 'value': self.task_context},
+                                {'name': 'END_TIME', 'value': task['end_time']}
+                            ]
+                        }
+                    ]
+                },
+                tags=[
+                    {
+                        'key': 'task_name',
+                        'value': task['task_name']
+                    }
+                ],
+                taskDefinition=f'{self.deployment_name}-{self.task_type}'
+            )
+        except botocore.exceptions.ClientError as error:
+            return error
+        except botocore.exceptions.ParamValidationError as error:
+            return error
+        if not response['tasks']:
+            return response['failures']
+        task['ecs_task_id'] = response['tasks'][0]['taskArn']
+        return 'ecs_task_ran'
+
+    def stop_ecs_task(self, ecs_task_id, reason):
+        try:
+            self.aws_ecs_client.stop_task(
+                cluster=f'{self.deployment_name}-task-cluster',
+                task=ecs_task_id,
+                reason=reason[:255]
+            )
+        except botocore.exceptions.ClientError as error:
+            return error
+        return 'ecs_task_stopped'
+
+    def delete_resource_record_sets(self, tasks):
+        dns_changes = ChangeBatcher(self.aws_route53_client)
+        for task in tasks:
+            dns_changes.delete(
+                task['task_hosted_zone'], f'{task["task_host_name"]}.{task["task_domain_name"]}', 'A', task['public_ip']
+            )
+        return dns_changes.flush()
+
+    def release_tasks(self, tasks, message):
+        """Stops launched tasks that could not be recorded, removes their DNS records and marks them failed"""
+        for task in tasks:
+            stop_response = self.stop_ecs_task(task['ecs_task_id'], message)
+            if stop_response != 'ecs_task_stopped':
+                print(f'Error stopping {task["task_name"]} after a failed run_tasks: {stop_response}')
+            self.task_failed(task['task_name'], message)
+        dns_tasks = [task for task in tasks if task.get('dns_created')]
+        if dns_tasks:
+            delete_response = self.delete_resource_record_sets(dns_tasks)
+            if delete_response != 'resource_record_sets_changed':
+                print(f'Error deleting resource record sets after a failed run_tasks: {delete_response}')
+
+    def upload_object(self, task):
+        payload = {
+            'instruct_user_id': 'None', 'instruct_id': task['instruct_id'], 'instruct_instance': 'None',
+            'instruct_command': 'Initialize', 'instruct_args': {'no_args': 'True'}, 'timestamp': task['timestamp'],
+            'end_time': task['end_time']
+        }
+        payload_bytes = json.dumps(payload).encode('utf-8')
+        try:
+            self.aws_s3_client.put_object(
+                Body=payload_bytes,
+                Bucket=f'{self.deployment_name}-workspace',
+                Key=task['task_name'] + '/init.txt'
+            )
+        except botocore.exceptions.ClientError as error:
+            return error
+        except botocore.exceptions.ParamValidationError as error:
+            return error
+        return 'object_uploaded'
+
+    def create_resource_record_sets(self, hosted_zone, tasks):
+        dns_changes = ChangeBatcher(self.aws_route53_client)
+        for task in tasks:
+            dns_changes.upsert(
+                hosted_zone, f'{task["task_host_name"]}.{task["task_domain_name"]}', 'A', task['public_ip']
+            )
+        flush_response = dns_changes.flush()
+        if flush_response != 'resource_record_sets_changed':
+            return flush_response
+        return 'resource_record_sets_created'
+
+    def task_entry(self, task):
+        return {
+            'task_name': {'S': task['task_name']},
+            'task_type': {'S': self.task_type},
+            'task_version': {'S': self.task_version},
+            'task_context': {'S': self.task_context},
+            'task_status': {'S': 'starting'},
+            'task_host_name': {'S': task['task_host_name']},
+            'task_domain_name': {'S': task['task_domain_name']},
+            'public_ip': {'S': task['public_ip']},
+            'local_ip': {'SS': ['None']},
+            'portgroups': {'SS': task['portgroups']},
+            'listeners': {'SS': ['None']},
+            'instruct_instances': {'SS': ['None']},
+            'last_instruct_user_id': {'S': 'None'},
+            'last_instruct_id': {'S': task['instruct_id']},
+            'last_instruct_instance': {'S': 'None'},
+            'last_instruct_command': {'S': 'Initialize'},
+            'last_instruct_args': {'M': {'no_args': {'S': 'True'}}},
+            'last_instruct_time': {'S': 'None'},
+            'create_time': {'S': task['timestamp']},
+            'scheduled_end_time': {'S': task['end_time']},
+            'user_id': {'S': self.user_id},
+            'ecs_task_id': {'S': task['ecs_task_id']}
+        }
+
+    def validate_task(self, task_detail, seen_host_names):
+        """Returns the normalized task definition, or an error message"""
+        task_name = task_detail['task_name']
+        portgroups = task_detail.get('portgroups', ['None'])
+        if not isinstance(portgroups, list):
+            return 'portgroups must be type list'
+        if len(portgroups) > 5:
+            return 'portgroups limit exceeded'
+        if not portgroups:
+            portgroups = ['None']
+
+        end_time = task_detail.get('end_time') or 'None'
+        if end_time != 'None':
+            try:
+                datetime.strptime(end_time, "%m/%d/%Y %H:%M:%S %z")
+            except:
+                return 'invalid detail: end_time must be formatted as "%m/%d/%Y %H:%M:%S %z"'
+
+        task_host_name = 'None'
+        task_domain_name = 'None'
+        if 'task_domain_name' in task_detail and 'task_host_name' in task_detail:
+            task_domain_name = task_detail['task_domain_name']
+            task_host_name = task_detail['task_host_name']
+            if task_domain_name != 'None':
+                if len(f'{task_host_name}.{task_domain_name}') > 253:
+                    return f'{task_host_name}.{task_domain_name} cannot exceed 253 characters'
+                valid_host_name = re.compile(
+                    '^(([a-zA-Z0-9]|[a-zA-Z0-9][a-zA-Z0-9\-]*[a-zA-Z0-9])\.)*'
+                    '([A-Za-z0-9]|[A-Za-z0-9][A-Za-z0-9\-]*[A-Za-z0-9])$'
+                )
+                if not valid_host_name.match(f'{task_host_name}.{task_domain_name}'):
+                    return f'{task_host_name}.{task_domain_name} is not DNS compliant'
+                if (task_domain_name, task_host_name) in seen_host_names:
+                    return f'{task_host_name} already exists'
+                seen_host_names.add((task_domain_name, task_host_name))
+        return {
+            'task_name': task_name, 'portgroups': portgroups, 'end_time': end_time,
+            'task_host_name': task_host_name, 'task_domain_name': task_domain_name
+        }
+
+    def run_tasks(self):
+        if 'task_type' not in self.detail or 'tasks' not in self.detail:
+            return format_response(400, 'failed', 'invalid detail', self.log)
+        self.task_type = self.detail['task_type']
+        task_details = self.detail['tasks']
+        if not isinstance(task_details, list) or not task_details:
+            return format_response(400, 'failed', 'tasks must be a non-empty list', self.log)
+        if len(task_details) > self.max_tasks:
+            return format_response(400, 'failed', f'tasks limit of {self.max_tasks} exceeded', self.log)
+
+        task_type_entry = self.get_task_type_entry()
+        if 'Item' not in task_type_entry:
+            return format_response(404, 'failed', f'task_type {self.task_type} does not exist', self.log)
+        self.task_version = task_type_entry['Item']['task_version']['S']
+
+        # Merge batch level defaults with each task's overrides and validate them.
+        defaults = {k: v for k, v in self.detail.items() if k in ['portgroups', 'end_time', 'task_domain_name']}
+        task_names = []
+        tasks = []
+        seen_host_names = set()
+        for task_override in task_details:
+            if not isinstance(task_override, dict) or 'task_name' not in task_override:
+                return format_response(400, 'failed', 'each entry in tasks must contain task_name', self.log)
+            task_name = task_override['task_name']
+            if task_name in task_names:
+                return format_response(400, 'failed', f'duplicate task_name {task_name}', self.log)
+            task_names.append(task_name)
+            task_validated = self.validate_task({**defaults, **task_override}, seen_host_names)
+            if isinstance(task_validated, str):
+                self.task_failed(task_name, task_validated)
+            else:
+                tasks.append(task_validated)
+
+        # Fetch the task name conflicts, domains and portgroups for the whole batch in one pass.
+        domain_names = {task['task_domain_name'] for task in tasks if task['task_domain_name'] != 'None'}
+        portgroup_names = {pg for task in tasks for pg in task['portgroups'] if pg != 'None'}
+        request_items = {f'{self.deployment_name}-tasks': [{'task_name': {'S': task['task_name']}} for task in tasks]}
+        if domain_names:
+            request_items[f'{self.deployment_name}-domains'] = [{'domain_name': {'S': d}} for d in domain_names]
+        if portgroup_names:
+            request_items[f'{self.deployment_name}-portgroups'] = [{'portgroup_name': {'S': p}} for p in portgroup_names]
+        try:
+            entries = self.batch_get_entries(request_items)
+        except (botocore.exceptions.ClientError, RuntimeError) as error:
+            return format_response(500, 'failed', f'run_tasks failed with error {error}', self.log)
+        existing_tasks = {i['task_name']['S'] for i in entries.get(f'{self.deployment_name}-tasks', [])}
+        domains = {i['domain_name']['S']: i for i in entries.get(f'{self.deployment_name}-domains', [])}
+        portgroups = {i['portgroup_name']['S']: i for i in entries.get(f'{self.deployment_name}-portgroups', [])}
+
+        launch = []
+        for task in tasks:
+            task_name = task['task_name']
+            if task_name in existing_tasks:
+                self.task_failed(task_name, f'{task_name} already exists')
+                continue
+            if task['task_domain_name'] != 'None':
+                domain_entry = domains.get(task['task_domain_name'])
+                if not domain_entry:
+                    self.task_failed(task_name, f'domain_name {task["task_domain_name"]} does not exist')
+                    continue
+                # Domains created before validation moved to the background have no domain_status
+                domain_status = domain_entry.get('domain_status', {}).get('S', 'ready')
+                if domain_status != 'ready':
+                    self.task_failed(task_name, f'domain_name {task["task_domain_name"]} is {domain_status}')
+                    continue
+                if task['task_host_name'] in domain_entry['host_names']['SS']:
+                    self.task_failed(task_name, f'{task["task_host_name"]} already exists')
+                    continue
+                task['task_hosted_zone'] = domain_entry['hosted_zone']['S']
+            missing = [pg for pg in task['portgroups'] if pg != 'None' and pg not in portgroups]
+            if missing:
+                self.task_failed(task_name, f'portgroup_name: {missing[0]} does not exist')
+                continue
+            task['securitygroups'] = [
+                portgroups[pg]['securitygroup_id']['S'] for pg in task['portgroups'] if pg != 'None'
+            ] + [self.default_security_group]
+            task['instruct_id'] = ''.join(random.choice(string.ascii_letters) for i in range(6))
+            task['timestamp'] = datetime.now().strftime('%s')
+            launch.append(task)
+
+        # Launch the tasks concurrently. Every task carries its own TASK_NAME override, so each one needs its own
+        # run_task call; only the calls themselves can be overlapped.
+        launched = []
+        if launch:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                run_responses = list(executor.map(self.run_ecs_task, launch))
+            for task, run_response in zip(launch, run_responses):
+                if run_response != 'ecs_task_ran':
+                    self.task_failed(task['task_name'], f'run_task failed with error {run_response}')
+                else:
+                    launched.append(task)
+
+        # Resolve every launched task's ENI and public IP with a shared describe_tasks/describe_network_interfaces poll.
+        ready = []
+        if launched:
+            waiter = TaskReadinessWaiter(
+                self.aws_ecs_client, self.aws_ec2_client, f'{self.deployment_name}-task-cluster', timeout=20
+            )
+            try:
+                network = waiter.wait([task['ecs_task_id'] for task in launched])
+            except botocore.exceptions.ClientError as error:
+                network = {task['ecs_task_id']: {'error': str(error)} for task in launched}
+            for task in launched:
+                task_network = network[task['ecs_task_id']]
+                if 'error' in task_network:
+                    self.release_tasks([task], f'run_task failed with error {task_network["error"]}')
+                else:
+                    task['public_ip'] = task_network['public_ip']
+                    ready.append(task)
+
+        # Create the Route53 records with one change batch per hosted zone.
+        hosted_zones = {}
+        for task in ready:
+            if task['task_host_name'] != 'None' and task['task_domain_name'] != 'None':
+                hosted_zones.setdefault(task['task_hosted_zone'], []).append(task)
+        for hosted_zone, zone_tasks in hosted_zones.items():
+            create_rr_response = self.create_resource_record_sets(hosted_zone, zone_tasks)
+            if create_rr_response != 'resource_record_sets_created':
+                self.release_tasks(zone_tasks, f'run_task failed with error {create_rr_response}')
+                for task in zone_tasks:
+                    ready.remove(task)
+            else:
+                for task in zone_tasks:
+                    task['dns_created'] = True
+
+        # Send the Initialize command to each task. Tasks that don't get it are released with their DNS records.
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            upload_responses = list(executor.map(self.upload_object, ready))
+        for task, upload_response in list(zip(ready, upload_responses)):
+            if upload_response != 'object_uploaded':
+                self.release_tasks([task], f'run_task failed with error {upload_response}')
+                ready.remove(task)
+
+        # Record the tasks and their domain, portgroup and deployment memberships. Tasks that cannot be recorded are
+        # stopped rather than left running untracked.
+        if ready:
+            ready = self.commit_tasks(ready, domains, portgroups)
+
+        for task in ready:
+            self.outcomes[task['task_name']] = {
+                'task_name': task['task_name'], 'outcome': 'success', 'public_ip': task['public_ip'],
+                'instruct_id': task['instruct_id']
+            }
+        print({'tasks_executed': {'user_id': self.user_id, 'task_type': self.task_type, 'task_names': list(self.outcomes)}})
+
+        # Send response
+        results = [self.outcomes[task_name] for task_name in task_names]
+        if ready and len(ready) == len(task_names):
+            return format_response(200, 'success', 'execute tasks succeeded', None, tasks=results)
+        if ready:
+            return format_response(200, 'success', 'execute tasks partially succeeded', None, tasks=results)
+        return format_response(400, 'failed', 'execute tasks failed', self.log, tasks=results)
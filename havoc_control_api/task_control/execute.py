@@ -3,9 +3,14 @@ import json
 import random
 import string
 import botocore
-import boto3
-from datetime import datetime
+import havoc_aws
 import time as t
+from datetime import datetime
+from readiness import TaskReadinessWaiter
+from dns_changes import ChangeBatcher
+import resource_registry
+import task_archive
+import task_teardown
 
 
 def format_response(status_code, result, message, log, **kwargs):
@@ -24,7 +29,12 @@ def format_response(status_code, result, message, log, **kwargs):
 
 class Task:
 
-    def __init__(self, deployment_name, task_name, subnet, default_security_group, region, detail: dict, user_id, log):
+    # Launches retry the pre-flight reads this many times when a concurrent request changes the same domain or
+    # portgroups between the read and the membership transaction.
+    max_preflight_attempts = 3
+
+    def __init__(self, deployment_name, task_name, subnet, default_security_group, region, detail: dict, user_id, log,
+                 function_arn=None):
         """
         Instantiate a Task instance
         """
@@ -37,146 +47,254 @@ class Task:
         self.detail = detail
         self.user_id = user_id
         self.log = log
+        self.function_arn = function_arn
         self.task_type = None
         self.task_version = None
         self.run_task_response = None
+        self.ecs_task_details = None
+        self.public_ip = None
         self.__aws_dynamodb_client = None
         self.__aws_ecs_client = None
         self.__aws_ec2_client = None
         self.__aws_s3_client = None
         self.__aws_route53_client = None
+        self.__aws_lambda_client = None
 
     @property
     def aws_dynamodb_client(self):
         """Returns the boto3 DynamoDB session (establishes one automatically if one does not already exist)"""
         if self.__aws_dynamodb_client is None:
-            self.__aws_dynamodb_client = boto3.client('dynamodb', region_name=self.region)
+            self.__aws_dynamodb_client = havoc_aws.client('dynamodb', self.region)
         return self.__aws_dynamodb_client
 
     @property
     def aws_ecs_client(self):
         """Returns the boto3 ECS session (establishes one automatically if one does not already exist)"""
         if self.__aws_ecs_client is None:
-            self.__aws_ecs_client = boto3.client('ecs', region_name=self.region)
+            self.__aws_ecs_client = havoc_aws.client('ecs', self.region)
         return self.__aws_ecs_client
 
     @property
     def aws_ec2_client(self):
         """Returns the boto3 EC2 session (establishes one automatically if one does not already exist)"""
         if self.__aws_ec2_client is None:
-            self.__aws_ec2_client = boto3.client('ec2', region_name=self.region)
+            self.__aws_ec2_client = havoc_aws.client('ec2', self.region)
         return self.__aws_ec2_client
 
     @property
     def aws_s3_client(self):
         """Returns the boto3 S3 session (establishes one automatically if one does not already exist)"""
         if self.__aws_s3_client is None:
-            self.__aws_s3_client = boto3.client('s3', region_name=self.region)
+            self.__aws_s3_client = havoc_aws.client('s3', self.region)
         return self.__aws_s3_client
 
     @property
     def aws_route53_client(self):
         """Returns the boto3 Route53 session for this project (establishes one automatically if one does not already exist)"""
         if self.__aws_route53_client is None:
-            self.__aws_route53_client = boto3.client('route53')
+            self.__aws_route53_client = havoc_aws.client('route53')
         return self.__aws_route53_client
 
-    def get_domain_entry(self, domain_name):
-        return self.aws_dynamodb_client.get_item(
-            TableName=f'{self.deployment_name}-domains',
-            Key={
-                'domain_name': {'S': domain_name}
-            }
-        )
+    @property
+    def aws_lambda_client(self):
+        """Returns the boto3 Lambda session (establishes one automatically if one does not already exist)"""
+        if self.__aws_lambda_client is None:
+            self.__aws_lambda_client = havoc_aws.client('lambda', self.region)
+        return self.__aws_lambda_client
 
     def create_resource_record_set(self, hosted_zone, host_name, domain_name, ip_address):
-        try:
-            self.aws_route53_client.change_resource_record_sets(
-                HostedZoneId=hosted_zone,
-                ChangeBatch={
-                    'Changes': [
-                        {
-                            'Action': 'UPSERT',
-                            'ResourceRecordSet':{
-                                'Name': f'{host_name}.{domain_name}',
-                                'Type': 'A',
-                                'TTL': 300,
-                                'ResourceRecords': [
-                                    {
-                                        'Value': ip_address
-                                    }
-                                ]
-                            }
-                        }
-                    ]
+        dns_changes = ChangeBatcher(self.aws_route53_client)
+        dns_changes.upsert(hosted_zone, f'{host_name}.{domain_name}', 'A', ip_address)
+        flush_response = dns_changes.flush()
+        if flush_response != 'resource_record_sets_changed':
+            return flush_response
+        return 'resource_record_set_created'
+
+    def delete_resource_record_set(self, hosted_zone, host_name, domain_name, ip_address):
+        dns_changes = ChangeBatcher(self.aws_route53_client)
+        dns_changes.delete(hosted_zone, f'{host_name}.{domain_name}', 'A', ip_address)
+        flush_response = dns_changes.flush()
+        if flush_response != 'resource_record_sets_changed':
+            return flush_response
+        return 'resource_record_set_deleted'
+
+    def batch_get_entries(self, request_items):
+        """
+        Returns the items found for request_items, keyed by table name, retrying any unprocessed keys. Raises
+        RuntimeError if keys are still unprocessed after task_teardown.max_batch_attempts.
+        """
+        return task_teardown.batch_get_entries(self.aws_dynamodb_client, request_items)
+
+    def get_preflight_entries(self, task_domain_name, portgroups):
+        """
+        Fetches the task type, any task with the same name, the domain and the portgroups in one BatchGetItem. Returns
+        (task_type_entry, task_entry, domain_entry, portgroup_entries), with None for rows that do not exist.
+        """
+        request_items = {
+            f'{self.deployment_name}-task-types': [{'task_type': {'S': self.task_type}}],
+            f'{self.deployment_name}-tasks': [{'task_name': {'S': self.task_name}}]
+        }
+        if task_domain_name != 'None':
+            request_items[f'{self.deployment_name}-domains'] = [{'domain_name': {'S': task_domain_name}}]
+        portgroup_names = [portgroup for portgroup in portgroups if portgroup != 'None']
+        if portgroup_names:
+            request_items[f'{self.deployment_name}-portgroups'] = [
+                {'portgroup_name': {'S': portgroup}} for portgroup in set(portgroup_names)
+            ]
+        entries = self.batch_get_entries(request_items)
+        task_types = entries.get(f'{self.deployment_name}-task-types', [])
+        tasks = entries.get(f'{self.deployment_name}-tasks', [])
+        domains = entries.get(f'{self.deployment_name}-domains', [])
+        portgroup_entries = {i['portgroup_name']['S']: i for i in entries.get(f'{self.deployment_name}-portgroups', [])}
+        return (
+            task_types[0] if task_types else None, tasks[0] if tasks else None, domains[0] if domains else None,
+            portgroup_entries
+        )
+
+    def membership_updates(self, domain_entry, task_host_name, portgroup_entries, rollback=False):
+        """
+        Returns the TransactWriteItems updates that add the task to its domain and portgroups (or, with rollback, take
+        it back out). Each update is conditioned on the sets it replaces, so a concurrent change cancels the
+        transaction instead of being overwritten.
+        """
+        updates = []
+        for portgroup_name, portgroup_entry in portgroup_entries.items():
+            current_tasks = portgroup_entry['tasks']['SS']
+            new_tasks = [i for i in current_tasks if i != 'None'] + [self.task_name]
+            if rollback:
+                current_tasks, new_tasks = new_tasks, current_tasks
+            updates.append({
+                'Update': {
+                    'TableName': f'{self.deployment_name}-portgroups',
+                    'Key': {
+                        'portgroup_name': {'S': portgroup_name}
+                    },
+                    'UpdateExpression': 'set tasks=:tasks',
+                    'ConditionExpression': 'tasks = :current_tasks',
+                    'ExpressionAttributeValues': {
+                        ':tasks': {'SS': new_tasks},
+                        ':current_tasks': {'SS': current_tasks}
+                    }
                 }
-            )
+            })
+        if domain_entry:
+            current_tasks = domain_entry['tasks']['SS']
+            current_host_names = domain_entry['host_names']['SS']
+            new_tasks = [i for i in current_tasks if i != 'None'] + [self.task_name]
+            new_host_names = [i for i in current_host_names if i != 'None'] + [task_host_name]
+            if rollback:
+                current_tasks, new_tasks = new_tasks, current_tasks
+                current_host_names, new_host_names = new_host_names, current_host_names
+            updates.append({
+                'Update': {
+                    'TableName': f'{self.deployment_name}-domains',
+                    'Key': {
+                        'domain_name': domain_entry['domain_name']
+                    },
+                    'UpdateExpression': 'set tasks=:tasks, host_names=:host_names',
+                    'ConditionExpression': 'tasks = :current_tasks AND host_names = :current_host_names',
+                    'ExpressionAttributeValues': {
+                        ':tasks': {'SS': new_tasks},
+                        ':host_names': {'SS': new_host_names},
+                        ':current_tasks': {'SS': current_tasks},
+                        ':current_host_names': {'SS': current_host_names}
+                    }
+                }
+            })
+        return updates
+
+    def add_memberships(self, domain_entry, task_host_name, portgroup_entries):
+        """
+        Adds the task to its domain and portgroups in one transaction, which also checks that the task name is still
+        free. Returns 'memberships_added', 'memberships_changed' if any of the rows changed since they were read, or
+        the error.
+        """
+        transact_items = [{
+            'ConditionCheck': {
+                'TableName': f'{self.deployment_name}-tasks',
+                'Key': {
+                    'task_name': {'S': self.task_name}
+                },
+                'ConditionExpression': 'attribute_not_exists(task_name)'
+            }
+        }]
+        transact_items.extend(self.membership_updates(domain_entry, task_host_name, portgroup_entries))
+        if len(transact_items) == 1:
+            return 'memberships_added'
+        try:
+            self.aws_dynamodb_client.transact_write_items(TransactItems=transact_items)
         except botocore.exceptions.ClientError as error:
+            if error.response['Error']['Code'] == 'TransactionCanceledException':
+                return 'memberships_changed'
             return error
         except botocore.exceptions.ParamValidationError as error:
             return error
-        return 'resource_record_set_created'
+        return 'memberships_added'
 
-    def update_domain_entry(self, domain_name, domain_tasks, host_names):
+    def remove_memberships(self, domain_entry, task_host_name, portgroup_entries):
+        """Reverts add_memberships after a failed launch, unless the rows have been changed again since"""
+        transact_items = self.membership_updates(domain_entry, task_host_name, portgroup_entries, rollback=True)
+        if not transact_items:
+            return 'memberships_removed'
         try:
-            self.aws_dynamodb_client.update_item(
-                TableName=f'{self.deployment_name}-domains',
-                Key={
-                    'domain_name': {'S': domain_name}
-                },
-                UpdateExpression='set tasks=:tasks, host_names=:host_names',
-                ExpressionAttributeValues={
-                    ':tasks': {'SS': domain_tasks},
-                    ':host_names': {'SS': host_names}
-                }
-            )
+            self.aws_dynamodb_client.transact_write_items(TransactItems=transact_items)
         except botocore.exceptions.ClientError as error:
             return error
         except botocore.exceptions.ParamValidationError as error:
             return error
-        return 'domain_entry_updated'
+        return 'memberships_removed'
 
-    def get_task_type_entry(self):
-        return self.aws_dynamodb_client.get_item(
-            TableName=f'{self.deployment_name}-task-types',
-            Key={
-                'task_type': {'S': self.task_type}
-            }
-        )
-
-    def get_task_entry(self):
-        return self.aws_dynamodb_client.get_item(
-            TableName=f'{self.deployment_name}-tasks',
-            Key={
-                'task_name': {'S': self.task_name}
-            }
-        )
-
-    def get_portgroup_entry(self, portgroup_name):
-        return self.aws_dynamodb_client.get_item(
-            TableName=f'{self.deployment_name}-portgroups',
-            Key={
-                'portgroup_name': {'S': portgroup_name}
-            }
-        )
+    def stop_ecs_task(self, ecs_task_id, reason):
+        try:
+            self.aws_ecs_client.stop_task(
+                cluster=f'{self.deployment_name}-task-cluster',
+                task=ecs_task_id,
+                reason=reason[:255]
+            )
+        except botocore.exceptions.ClientError as error:
+            return error
+        return 'ecs_task_stopped'
 
-    def update_portgroup_entry(self, portgroup_name, portgroup_tasks):
+    def delete_task_entry(self, ecs_task_id):
         try:
-            self.aws_dynamodb_client.update_item(
-                TableName=f'{self.deployment_name}-portgroups',
+            self.aws_dynamodb_client.delete_item(
+                TableName=f'{self.deployment_name}-tasks',
                 Key={
-                    'portgroup_name': {'S': portgroup_name}
+                    'task_name': {'S': self.task_name}
                 },
-                UpdateExpression='set tasks=:tasks',
+                ConditionExpression='ecs_task_id = :ecs_task_id',
                 ExpressionAttributeValues={
-                    ':tasks': {'SS': portgroup_tasks}
+                    ':ecs_task_id': {'S': ecs_task_id}
                 }
             )
         except botocore.exceptions.ClientError as error:
             return error
-        except botocore.exceptions.ParamValidationError as error:
-            return error
-        return 'portgroup_entry_updated'
+        return 'task_entry_deleted'
+
+    def abort_launch(self, ecs_task_id, domain_entry, task_host_name, portgroup_entries, error, dns_record=None,
+                     task_entry_added=False, active_resource_added=False):
+        """
+        Undoes a launch that failed after its ECS task started: stops the task and removes whatever was recorded for
+        it, so a failed run_task leaves no running task, DNS record, task entry, active_resources entry or
+        portgroup/domain memberships behind. Returns the failure response.
+        """
+        cleanup_responses = [self.stop_ecs_task(ecs_task_id, f'run_task failed: {error}')]
+        if dns_record:
+            cleanup_responses.append(self.delete_resource_record_set(*dns_record))
+        if active_resource_added:
+            cleanup_responses.append(resource_registry.remove_active_resources(
+                self.aws_dynamodb_client, self.deployment_name, 'tasks', self.task_name
+            ))
+        if task_entry_added:
+            cleanup_responses.append(self.delete_task_entry(ecs_task_id))
+        cleanup_responses.append(self.remove_memberships(domain_entry, task_host_name, portgroup_entries))
+        for cleanup_response in cleanup_responses:
+            if cleanup_response not in [
+                'ecs_task_stopped', 'resource_record_set_deleted', 'deployment_updated', 'task_entry_deleted',
+                'memberships_removed'
+            ]:
+                print(f'Error cleaning up failed run_task for {self.task_name}: {cleanup_response}')
+        return format_response(500, 'failed', f'run_task failed with error {error}', self.log)
 
     def upload_object(self, user_id, instruct_id, instruct_instance, instruct_command, instruct_args, timestamp, end_time):
         payload = {
@@ -237,19 +355,60 @@ class Task:
             return error
         except botocore.exceptions.ParamValidationError as error:
             return error
+        # Capacity and placement errors come back as failures rather than an exception
+        if not response['tasks']:
+            return response['failures']
         self.run_task_response = response
         return 'ecs_task_ran'
 
-    def get_ecstask_details(self, ecs_task_id):
-        return self.aws_ecs_client.describe_tasks(
-            cluster=f'{self.deployment_name}-task-cluster',
-            tasks=[ecs_task_id]
+    def wait_for_task_network(self, ecs_task_id, timeout):
+        waiter = TaskReadinessWaiter(
+            self.aws_ecs_client, self.aws_ec2_client, f'{self.deployment_name}-task-cluster', timeout=timeout
         )
+        try:
+            ready = waiter.wait([ecs_task_id])[ecs_task_id]
+        except botocore.exceptions.ClientError as error:
+            return error
+        except botocore.exceptions.ParamValidationError as error:
+            return error
+        if 'error' in ready:
+            return ready['error']
+        self.ecs_task_details = waiter.task_details.get(ecs_task_id)
+        self.public_ip = ready['public_ip']
+        return 'task_network_ready'
+
+    def invoke_complete_startup(self, startup_detail):
+        payload = {'action': 'complete_startup', 'user_id': self.user_id, 'detail': startup_detail}
+        try:
+            self.aws_lambda_client.invoke(
+                FunctionName=self.function_arn,
+                InvocationType='Event',
+                Payload=json.dumps(payload).encode('utf-8')
+            )
+        except botocore.exceptions.ClientError as error:
+            return error
+        except botocore.exceptions.ParamValidationError as error:
+            return error
+        return 'complete_startup_invoked'
 
-    def get_interface_details(self, interface_id):
-        return self.aws_ec2_client.describe_network_interfaces(
-            NetworkInterfaceIds=[interface_id],
-        )
+    def update_task_public_ip(self, public_ip):
+        try:
+            self.aws_dynamodb_client.update_item(
+                TableName=f'{self.deployment_name}-tasks',
+                Key={
+                    'task_name': {'S': self.task_name}
+                },
+                UpdateExpression='set public_ip=:public_ip',
+                ConditionExpression='attribute_exists(task_name)',
+                ExpressionAttributeValues={
+                    ':public_ip': {'S': public_ip}
+                }
+            )
+        except botocore.exceptions.ClientError as error:
+            return error
+        except botocore.exceptions.ParamValidationError as error:
+            return error
+        return 'task_entry_updated'
 
     def add_task_entry(self, user_id, instruct_id, instruct_instance, instruct_command, instruct_args, task_host_name,
                        task_domain_name, public_ip, portgroups, ecs_task_id, timestamp, end_time):
@@ -262,6 +421,8 @@ class Task:
                 Key={
                     'task_name': {'S': self.task_name}
                 },
+                # Another launch of the same name may have written its row since the pre-flight checks
+                ConditionExpression='attribute_not_exists(task_name)',
                 UpdateExpression='set '
                                 'task_type=:task_type, '
                                 'task_version=:task_version, '
@@ -273,7 +434,6 @@ class Task:
                                 'local_ip=:local_ip, '
                                 'portgroups=:portgroups, '
                                 'listeners=:listeners, '
-                                'instruct_ids=:instruct_ids, '
                                 'instruct_instances=:instruct_instances, '
                                 'last_instruct_user_id=:last_instruct_user_id, '
                                 'last_instruct_id=:last_instruct_id, '
@@ -296,7 +456,6 @@ class Task:
                     ':local_ip': {'SS': local_ip},
                     ':portgroups': {'SS': portgroups},
                     ':listeners': {'SS': listeners},
-                    ':instruct_ids': {'SS': [instruct_id]},
                     ':instruct_instances': {'SS': [instruct_instance]},
                     ':last_instruct_user_id': {'S': user_id},
                     ':last_instruct_id': {'S': instruct_id},
@@ -316,42 +475,11 @@ class Task:
             return error
         return 'task_entry_added'
     
-    def get_deployment_entry(self):
-        return self.aws_dynamodb_client.get_item(
-            TableName=f'{self.deployment_name}-deployment',
-            Key={
-                'deployment_name': {'S': self.deployment_name}
-            }
-        )
-    
-    def update_deployment_entry(self, active_resources):
-        try:
-            self.aws_dynamodb_client.update_item(
-                TableName=f'{self.deployment_name}-deployment',
-                Key={
-                    'deployment_name': {'S': self.deployment_name}
-                },
-                UpdateExpression='set active_resources=:active_resources',
-                ExpressionAttributeValues={
-                    ':active_resources': {'M': active_resources}
-                }
-            )
-        except botocore.exceptions.ClientError as error:
-            return error
-        except botocore.exceptions.ParamValidationError as error:
-            return error
-        return 'deployment_updated'
-
     def run_task(self):
         if 'task_type' not in self.detail:
             return format_response(400, 'failed', 'invalid detail', self.log)
         self.task_type = self.detail['task_type']
 
-        task_type_entry = self.get_task_type_entry()
-        if 'Item' not in task_type_entry:
-            return format_response(404, 'failed', f'task_type {self.task_type} does not exist', self.log)
-        self.task_version = task_type_entry['Item']['task_version']['S']
-
         # If portgroups are requested, do some sanity checks.
         if 'portgroups' in self.detail:
             portgroups = self.detail['portgroups']
@@ -374,17 +502,11 @@ class Task:
                     400, 'failed', 'invalid detail: end_time must be formatted as "%m/%d/%Y %H:%M:%S %z"', self.log
                 )
 
-        # Verify that the task_name is unique.
-        conflict = self.get_task_entry()
-        if 'Item' in conflict:
-            return format_response(409, 'failed', f'{self.task_name} already exists', self.log)
-
         task_host_name = 'None'
         task_domain_name = 'None'
         task_hosted_zone = None
         domain_entry = None
-        # If host_name and domain_name are present in the run_task request, make sure the domain_name exists
-        # and the host_name does not already exist for another task.
+        # If host_name and domain_name are present in the run_task request, make sure the name is DNS compliant.
         if 'task_domain_name' in self.detail and 'task_host_name' in self.detail:
             task_domain_name = self.detail['task_domain_name']
             task_host_name = self.detail['task_host_name']
@@ -403,41 +525,81 @@ class Task:
                     return format_response(
                         400, 'failed', f'{task_host_name}.{task_domain_name} is not DNS compliant', self.log
                     )
-                domain_entry = self.get_domain_entry(task_domain_name)
-                if 'Item' not in domain_entry:
+
+        # Read the task type, task name, domain and portgroups in one pass and validate them all before writing
+        # anything. The domain and portgroup memberships are then added in one transaction; if another request changed
+        # those rows in between, the transaction is cancelled and the checks are run again against fresh rows.
+        for attempt in range(self.max_preflight_attempts):
+            try:
+                task_type_entry, task_entry, domain_entry, portgroup_entries = self.get_preflight_entries(
+                    task_domain_name, portgroups
+                )
+            except (botocore.exceptions.ClientError, RuntimeError) as error:
+                return format_response(500, 'failed', f'run_task failed with error {error}', self.log)
+            if task_type_entry is None:
+                return format_response(404, 'failed', f'task_type {self.task_type} does not exist', self.log)
+            self.task_version = task_type_entry['task_version']['S']
+            if task_entry is not None:
+                return format_response(409, 'failed', f'{self.task_name} already exists', self.log)
+            if task_domain_name != 'None':
+                if domain_entry is None:
                     return format_response(404, 'failed', f'domain_name {task_domain_name} does not exist', self.log)
-                if task_host_name in domain_entry['Item']['host_names']['SS']:
+                # Domains created before validation moved to the background have no domain_status
+                domain_status = domain_entry.get('domain_status', {}).get('S', 'ready')
+                if domain_status != 'ready':
+                    return format_response(
+                        409, 'failed', f'domain_name {task_domain_name} is {domain_status}', self.log
+                    )
+                if task_host_name in domain_entry['host_names']['SS']:
                     return format_response(409, 'failed', f'{task_host_name} already exists', self.log)
-                task_hosted_zone = domain_entry['Item']['hosted_zone']['S']
-
-        securitygroups = []
-        if 'None' not in portgroups:
+                task_hosted_zone = domain_entry['hosted_zone']['S']
             for portgroup in portgroups:
-                portgroup_entry = self.get_portgroup_entry(portgroup)
-                if 'Item' in portgroup_entry:
-                    securitygroup_id = portgroup_entry['Item']['securitygroup_id']['S']
-                    securitygroups.append(securitygroup_id)
-                    if 'None' in portgroup_entry['Item']['tasks']['SS']:
-                        portgroup_tasks = []
-                    else:
-                        portgroup_tasks = portgroup_entry['Item']['tasks']['SS']
-                    portgroup_tasks.append(self.task_name)
-                    update_portgroup_entry_response = self.update_portgroup_entry(portgroup, portgroup_tasks)
-                    if update_portgroup_entry_response != 'portgroup_entry_updated':
-                        return format_response(500, 'failed', f'run_task failed with error {update_portgroup_entry_response}', self.log)
-                else:
+                if portgroup != 'None' and portgroup not in portgroup_entries:
                     return format_response(404, 'failed', f'portgroup_name: {portgroup} does not exist', self.log)
+
+            # Only a task with both a host_name and a domain_name is recorded against the domain.
+            if task_host_name == 'None' or task_domain_name == 'None':
+                domain_entry = None
+            add_memberships_response = self.add_memberships(domain_entry, task_host_name, portgroup_entries)
+            if add_memberships_response == 'memberships_added':
+                break
+            if add_memberships_response != 'memberships_changed':
+                return format_response(500, 'failed', f'run_task failed with error {add_memberships_response}', self.log)
+            t.sleep(0.05 * (2 ** attempt))
+        else:
+            return format_response(
+                409, 'failed', f'{self.task_name} conflicts with concurrent changes to its domain or portgroups', self.log
+            )
+
+        securitygroups = [
+            portgroup_entries[portgroup]['securitygroup_id']['S'] for portgroup in portgroups if portgroup != 'None'
+        ]
         securitygroups.append(self.default_security_group)
         run_ecs_task_response = self.run_ecs_task(securitygroups, end_time)
         if run_ecs_task_response != 'ecs_task_ran':
+            # Nothing was launched, so take the task back out of its domain and portgroups.
+            self.remove_memberships(domain_entry, task_host_name, portgroup_entries)
             return format_response(500, 'failed', f'run_task failed with error {run_ecs_task_response}', self.log)
-        # Log task execution details
         ecs_task_id = self.run_task_response['tasks'][0]['taskArn']
-        t.sleep(15)
-        ecs_task_details = self.get_ecstask_details(ecs_task_id)
-        interface_id = ecs_task_details['tasks'][0]['attachments'][0]['details'][1]['value']
-        interface_details = self.get_interface_details(interface_id)
-        public_ip = interface_details['NetworkInterfaces'][0]['Association']['PublicIp']
+
+        # Initialize command details for the task
+        instruct_user_id = 'None'
+        instruct_id = ''.join(random.choice(string.ascii_letters) for i in range(6))
+        instruct_instance = 'None'
+        instruct_command = 'Initialize'
+        instruct_args = {'no_args': 'True'}
+        timestamp = datetime.now().strftime('%s')
+
+        # With async_startup, record the task as starting and hand the network wait, DNS record and Initialize
+        # command off to a follow-up invocation instead of holding the API request open.
+        async_startup = str(self.detail.get('async_startup', 'no')).lower() == 'yes'
+        if async_startup:
+            public_ip = 'None'
+        else:
+            wait_response = self.wait_for_task_network(ecs_task_id, 20)
+            if wait_response != 'task_network_ready':
+                return self.abort_launch(ecs_task_id, domain_entry, task_host_name, portgroup_entries, wait_response)
+            public_ip = self.public_ip
         recorded_info = {
             'task_executed': {
                 'user_id': self.user_id,
@@ -448,45 +610,27 @@ class Task:
                 'task_domain_name': task_domain_name,
                 'task_host_name': task_host_name
             },
-            'task_details': ecs_task_details,
+            'task_details': self.ecs_task_details,
             'interface_details': public_ip
         }
         print(recorded_info)
 
-        # Send Initialize command to the task
-        instruct_user_id = 'None'
-        instruct_id = ''.join(random.choice(string.ascii_letters) for i in range(6))
-        instruct_instance = 'None'
-        instruct_command = 'Initialize'
-        instruct_args = {'no_args': 'True'}
-        if 'end_time' in self.detail:
-            end_time = self.detail['end_time']
-        else:
-            end_time = 'None'
-        timestamp = datetime.now().strftime('%s')
-        upload_object_response = self.upload_object(
-            instruct_user_id, instruct_id, instruct_instance, instruct_command, instruct_args, timestamp, end_time)
-        if upload_object_response != 'object_uploaded':
-            return format_response(500, 'failed', f'run_task failed with error {upload_object_response}', self.log)
+        if not async_startup:
+            # Send Initialize command to the task
+            upload_object_response = self.upload_object(
+                instruct_user_id, instruct_id, instruct_instance, instruct_command, instruct_args, timestamp, end_time)
+            if upload_object_response != 'object_uploaded':
+                return self.abort_launch(
+                    ecs_task_id, domain_entry, task_host_name, portgroup_entries, upload_object_response
+                )
 
         # Create a Route53 resource record if a host_name/domain_name is requested for the task.
-        if task_host_name != 'None' and task_domain_name != 'None':
+        dns_record = None
+        if task_host_name != 'None' and task_domain_name != 'None' and not async_startup:
             create_rr_response = self.create_resource_record_set(task_hosted_zone, task_host_name, task_domain_name, public_ip)
             if create_rr_response != 'resource_record_set_created':
-                return format_response(500, 'failed', f'run_task failed with error {create_rr_response}', self.log)
-            if 'None' in domain_entry['Item']['tasks']['SS']:
-                domain_tasks = []
-            else:
-                domain_tasks = domain_entry['Item']['tasks']['SS']
-            domain_tasks.append(self.task_name)
-            if 'None' in domain_entry['Item']['host_names']['SS']:
-                domain_host_names = []
-            else:
-                domain_host_names = domain_entry['Item']['host_names']['SS']
-            domain_host_names.append(task_host_name)
-            update_domain_entry_response = self.update_domain_entry(task_domain_name, domain_tasks, domain_host_names)
-            if update_domain_entry_response != 'domain_entry_updated':
-                return format_response(500, 'failed', f'run_task failed with error {update_domain_entry_response}', self.log)
+                return self.abort_launch(ecs_task_id, domain_entry, task_host_name, portgroup_entries, create_rr_response)
+            dns_record = (task_hosted_zone, task_host_name, task_domain_name, public_ip)
 
         # Add task entry to tasks table in DynamoDB
         instruct_args_fixup = {'no_args': {'S': 'True'}}
@@ -494,20 +638,106 @@ class Task:
                                                       instruct_args_fixup, task_host_name, task_domain_name, public_ip, portgroups,
                                                       ecs_task_id, timestamp, end_time)
         if add_task_entry_response != 'task_entry_added':
-            return format_response(500, 'failed', f'run_task failed with error {add_task_entry_response}', self.log)
+            return self.abort_launch(
+                ecs_task_id, domain_entry, task_host_name, portgroup_entries, add_task_entry_response,
+                dns_record=dns_record
+            )
         
         # Add task to active_resources in deployment table
-        deployment_details = self.get_deployment_entry()
-        active_resources = deployment_details['Item']['active_resources']['M']
-        active_tasks = active_resources['tasks']['SS']
-        if active_tasks == ['None']:
-            active_tasks = [self.task_name]
-        else:
-            active_tasks.append(self.task_name)
-        active_resources['tasks']['SS'] = active_tasks
-        update_deployment_entry_response = self.update_deployment_entry(active_resources)
+        update_deployment_entry_response = resource_registry.add_active_resources(
+            self.aws_dynamodb_client, self.deployment_name, 'tasks', self.task_name
+        )
         if update_deployment_entry_response != 'deployment_updated':
-            return update_deployment_entry_response
+            return self.abort_launch(
+                ecs_task_id, domain_entry, task_host_name, portgroup_entries, update_deployment_entry_response,
+                dns_record=dns_record, task_entry_added=True
+            )
+
+        if async_startup:
+            startup_detail = {
+                'task_name': self.task_name,
+                'ecs_task_id': ecs_task_id,
+                'task_host_name': task_host_name,
+                'task_domain_name': task_domain_name,
+                'task_hosted_zone': task_hosted_zone,
+                'portgroups': portgroups,
+                'instruct_id': instruct_id,
+                'timestamp': timestamp,
+                'end_time': end_time
+            }
+            invoke_response = self.invoke_complete_startup(startup_detail)
+            if invoke_response != 'complete_startup_invoked':
+                return self.abort_launch(
+                    ecs_task_id, domain_entry, task_host_name, portgroup_entries, invoke_response,
+                    task_entry_added=True, active_resource_added=True
+                )
+            return format_response(
+                200, 'success', 'execute task started', None, task_status='starting', instruct_id=instruct_id
+            )
 
         # Send response
         return format_response(200, 'success', 'execute task succeeded', None, public_ip=public_ip, instruct_id=instruct_id)
+
+    def fail_startup(self, error):
+        """
+        Ends an async_startup task whose startup failed: stops the ECS task, releases its portgroups, host name, DNS
+        record and active_resources entry, and archives it as terminated. Raises if the release fails, so the async
+        invocation is retried; every step is a no-op when already done.
+        """
+        ecs_task_id = self.detail['ecs_task_id']
+        stop_ecs_task_response = self.stop_ecs_task(ecs_task_id, f'complete_startup failed: {error}')
+        if stop_ecs_task_response != 'ecs_task_stopped':
+            print(f'Error stopping task {self.task_name}: {stop_ecs_task_response}')
+        teardown_task = {
+            'task_name': self.task_name,
+            'portgroups': self.detail['portgroups'],
+            'task_host_name': self.detail['task_host_name'],
+            'task_domain_name': self.detail['task_domain_name'],
+            'public_ip': self.public_ip or 'None'
+        }
+        teardown_response = task_teardown.Teardown(
+            self.aws_dynamodb_client, self.aws_route53_client, self.deployment_name, [teardown_task],
+            task_status='terminated'
+        ).run()
+        if teardown_response != 'teardown_completed':
+            raise RuntimeError(f'cleanup of failed startup for {self.task_name} failed: {"; ".join(teardown_response)}')
+        archive_task_response = task_archive.archive_task(self.aws_dynamodb_client, self.deployment_name, self.task_name)
+        if archive_task_response not in ['task_archived', 'task_not_found']:
+            print(f'Error archiving task {self.task_name}: {archive_task_response}')
+        return format_response(500, 'failed', f'complete_startup failed with error {error}', self.log)
+
+    def complete_startup(self, timeout):
+        """
+        Finish an async_startup run_task: wait for the task's public IP, record it, create the task's Route53 resource
+        record and send the Initialize command. If any step fails the task is stopped and its resources released.
+        """
+        for i in ['ecs_task_id', 'task_host_name', 'task_domain_name', 'portgroups', 'instruct_id', 'timestamp',
+                  'end_time']:
+            if i not in self.detail:
+                return format_response(400, 'failed', f'invalid detail: missing {i}', self.log)
+        ecs_task_id = self.detail['ecs_task_id']
+        task_host_name = self.detail['task_host_name']
+        task_domain_name = self.detail['task_domain_name']
+
+        wait_response = self.wait_for_task_network(ecs_task_id, timeout)
+        if wait_response != 'task_network_ready':
+            return self.fail_startup(wait_response)
+        update_task_response = self.update_task_public_ip(self.public_ip)
+        if update_task_response != 'task_entry_updated':
+            return self.fail_startup(update_task_response)
+
+        if task_host_name != 'None' and task_domain_name != 'None':
+            create_rr_response = self.create_resource_record_set(
+                self.detail['task_hosted_zone'], task_host_name, task_domain_name, self.public_ip
+            )
+            if create_rr_response != 'resource_record_set_created':
+                return self.fail_startup(create_rr_response)
+
+        # Send Initialize command to the task
+        upload_object_response = self.upload_object(
+            'None', self.detail['instruct_id'], 'None', 'Initialize', {'no_args': 'True'}, self.detail['timestamp'],
+            self.detail['end_time']
+        )
+        if upload_object_response != 'object_uploaded':
+            return self.fail_startup(upload_object_response)
+        return format_response(200, 'success', 'complete_startup succeeded', self.log, public_ip=self.public_ip)
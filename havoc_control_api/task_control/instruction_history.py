@@ -0,0 +1,80 @@
+import json
+import botocore
+import havoc_aws
+import result_pages
+
+
+def format_response(status_code, result, message, log, **kwargs):
+    response = {'outcome': result}
+    if message:
+        response['message'] = message
+    if kwargs:
+        for k, v in kwargs.items():
+            if v:
+                response[k] = v
+    if log:
+        log['response'] = response
+        print(log)
+    return {'statusCode': status_code, 'body': json.dumps(response)}
+
+
+class History:
+
+    field_attributes = {
+        'task_name': 'task_name',
+        'instruct_seq': 'seq',
+        'instruct_user_id': 'user_id',
+        'instruct_id': 'instruct_id',
+        'instruct_instance': 'instruct_instance',
+        'instruct_command': 'instruct_command',
+        'instruct_args': 'instruct_args',
+        'instruct_time': 'instruct_time'
+    }
+    key_attributes = ['task_name', 'seq']
+
+    def __init__(self, deployment_name, task_name, region, detail: dict, user_id, log):
+        self.deployment_name = deployment_name
+        self.task_name = task_name
+        self.region = region
+        self.user_id = user_id
+        self.detail = detail
+        self.log = log
+        self.__aws_dynamodb_client = None
+
+    @property
+    def aws_dynamodb_client(self):
+        """Returns the boto3 DynamoDB session (establishes one automatically if one does not already exist)"""
+        if self.__aws_dynamodb_client is None:
+            self.__aws_dynamodb_client = havoc_aws.client('dynamodb', self.region)
+        return self.__aws_dynamodb_client
+
+    def query_instructions(self, limit, start_key, newest_first):
+        query_kwargs = {
+            'TableName': f'{self.deployment_name}-task-instructions',
+            'KeyConditionExpression': 'task_name = :task_name',
+            'ExpressionAttributeValues': {
+                ':task_name': {'S': self.task_name}
+            }
+        }
+        return result_pages.query_results(
+            self.aws_dynamodb_client, query_kwargs, self.key_attributes, limit, start_key=start_key,
+            newest_first=newest_first
+        )
+
+    def get_instructions(self):
+        """Returns a page of the instructions sent to the task, newest first unless sort_order is ascending"""
+        try:
+            limit, next_token, newest_first = result_pages.parse_page_detail(self.detail)
+            start_key = None
+            if next_token:
+                start_key = result_pages.decode_next_token(next_token, 'task_name', self.task_name)
+            instruction_data, next_token = self.query_instructions(limit, start_key, newest_first)
+        except ValueError as error:
+            return format_response(400, 'failed', f'invalid detail: {error}', self.log)
+        except botocore.exceptions.ClientError as error:
+            return format_response(500, 'failed', f'get_instructions failed with error {error}', self.log)
+
+        instructions = [result_pages.unpack_item(item, self.field_attributes) for item in instruction_data]
+        return format_response(
+            200, 'success', 'get_instructions succeeded', None, instructions=instructions, next_token=next_token
+        )
@@ -1,8 +1,10 @@
+import os
 import json
 import random
 import string
 import botocore
-import boto3
+import havoc_aws
+import instruction_transport
 
 from datetime import datetime
 
@@ -31,28 +33,22 @@ class Task:
         self.user_id = user_id
         self.log = log
         self.__aws_dynamodb_client = None
-        self.__aws_s3_client = None
 
     @property
     def aws_dynamodb_client(self):
         """Returns the boto3 DynamoDB session (establishes one automatically if one does not already exist)"""
         if self.__aws_dynamodb_client is None:
-            self.__aws_dynamodb_client = boto3.client('dynamodb', region_name=self.region)
+            self.__aws_dynamodb_client = havoc_aws.client('dynamodb', self.region)
         return self.__aws_dynamodb_client
 
-    @property
-    def aws_s3_client(self):
-        """Returns the boto3 S3 session (establishes one automatically if one does not already exist)"""
-        if self.__aws_s3_client is None:
-            self.__aws_s3_client = boto3.client('s3', region_name=self.region)
-        return self.__aws_s3_client
-
     def get_task_entry(self):
+        # Only the attributes instruct checks are read, so the request stays the same size however long the task runs
         return self.aws_dynamodb_client.get_item(
             TableName=f'{self.deployment_name}-tasks',
             Key={
                 'task_name': {'S': self.task_name}
-            }
+            },
+            ProjectionExpression='task_type, task_status, listeners, instruct_instances, ecs_task_id'
         )
 
     def get_task_type(self, task_type):
@@ -63,26 +59,33 @@ class Task:
             }
         )
 
-    def set_task_busy(self, i_ids, i_id, instances, instance, command, args, timestamp):
+    def set_task_busy(self, i_id, instances, instance, command, args, timestamp):
+        """
+        Marks the task busy and takes the next instruction sequence number in one conditional update, so two
+        concurrent instructions cannot both find the task idle. Returns the sequence number, 'task_not_idle' or the
+        error.
+        """
         task_status = 'busy'
         try:
-            self.aws_dynamodb_client.update_item(
+            response = self.aws_dynamodb_client.update_item(
                 TableName=f'{self.deployment_name}-tasks',
                 Key={
                     'task_name': {'S': self.task_name}
                 },
                 UpdateExpression='set task_status=:task_status, '
-                                'instruct_ids=:instruct_ids, '
                                 'instruct_instances=:instruct_instances, '
                                 'last_instruct_user_id=:last_instruct_user_id, '
                                 'last_instruct_id=:last_instruct_id, '
                                 'last_instruct_instance=:last_instruct_instance, '
                                 'last_instruct_command=:last_instruct_command, '
                                 'last_instruct_args=:last_instruct_args, '
-                                'last_instruct_time=:last_instruct_time',
+                                'last_instruct_time=:last_instruct_time '
+                                'add instruct_seq :one',
+                ConditionExpression='task_status = :idle',
                 ExpressionAttributeValues={
                     ':task_status': {'S': task_status},
-                    ':instruct_ids': {'SS': i_ids},
+                    ':idle': {'S': 'idle'},
+                    ':one': {'N': '1'},
                     ':instruct_instances': {'SS': instances},
                     ':last_instruct_user_id': {'S': self.user_id},
                     ':last_instruct_id': {'S': i_id},
@@ -90,32 +93,50 @@ class Task:
                     ':last_instruct_command': {'S': command},
                     ':last_instruct_args': {'M': args},
                     ':last_instruct_time': {'S': timestamp}
-                }
+                },
+                ReturnValues='UPDATED_NEW'
             )
         except botocore.exceptions.ClientError as error:
+            if error.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return 'task_not_idle'
             return error
         except botocore.exceptions.ParamValidationError as error:
             return error
-        return 'task_set_as_busy'
+        return int(response['Attributes']['instruct_seq']['N'])
 
-    def upload_object(self, instruct_id, instruct_instance, instruct_command, instruct_args, end_time, timestamp):
-        payload = {
-            'instruct_user_id': self.user_id, 'instruct_id': instruct_id, 'instruct_instance': instruct_instance,
-            'instruct_command': instruct_command, 'instruct_args': instruct_args, 'timestamp': timestamp,
-            'end_time': end_time
-        }
-        payload_bytes = json.dumps(payload).encode('utf-8')
+    def add_history_entry(self, seq, instruct_id, instruct_instance, instruct_command, instruct_args, timestamp):
+        """Records the instruction in the task-instructions table, where get_instructions pages through it"""
         try:
-            self.aws_s3_client.put_object(
-                Body=payload_bytes,
-                Bucket=f'{self.deployment_name}-workspace',
-                Key=self.task_name + '/' + timestamp
+            self.aws_dynamodb_client.put_item(
+                TableName=f'{self.deployment_name}-task-instructions',
+                Item={
+                    'task_name': {'S': self.task_name},
+                    'seq': {'N': str(seq)},
+                    'user_id': {'S': self.user_id},
+                    'instruct_id': {'S': instruct_id},
+                    'instruct_instance': {'S': instruct_instance},
+                    'instruct_command': {'S': instruct_command},
+                    'instruct_args': {'M': instruct_args},
+                    'instruct_time': {'S': timestamp}
+                }
             )
         except botocore.exceptions.ClientError as error:
             return error
         except botocore.exceptions.ParamValidationError as error:
             return error
-        return 'object_uploaded'
+        return 'history_entry_added'
+
+    def send_instruction(self, ecs_task_id, seq, instruct_id, instruct_instance, instruct_command, instruct_args, end_time,
+                         timestamp):
+        payload = {
+            'instruct_user_id': self.user_id, 'instruct_id': instruct_id, 'instruct_instance': instruct_instance,
+            'instruct_command': instruct_command, 'instruct_args': instruct_args, 'timestamp': timestamp,
+            'end_time': end_time
+        }
+        transport = instruction_transport.get_task_transport(
+            os.environ.get('INSTRUCTION_TRANSPORT', 's3'), ecs_task_id, self.region, self.deployment_name
+        )
+        return transport.send(self.task_name, payload, seq=seq)
 
     def instruct(self):
         timestamp = datetime.now().strftime('%s')
@@ -141,6 +162,9 @@ class Task:
         task_entry = self.get_task_entry()
         if 'Item' not in task_entry:
             return format_response(404, 'failed', f'task_name {self.task_name} not found', self.log)
+        # Checked first: a terminated task may only have its tombstone attributes left
+        if task_entry['Item']['task_status']['S'] == 'terminated':
+            return format_response(409, 'failed', f'task {self.task_name} no longer running', self.log)
 
         # Get task capabilities from the task and validate instruct_command
         task_type = task_entry['Item']['task_type']['S']
@@ -161,16 +185,10 @@ class Task:
             return format_response(409, 'failed', f'task {self.task_name} is still starting', self.log)
         if task_entry['Item']['task_status']['S'] == 'busy':
             return format_response(409, 'failed', f'task {self.task_name} is busy', self.log)
-        if task_entry['Item']['task_status']['S'] == 'terminated':
-            return format_response(409, 'failed', f'task {self.task_name} no longer running', self.log)
 
-        # Add new instruct_id to instruct_ids list
+        # Instruction IDs go to the task-instructions table rather than accumulating on the task row
         instruct_id = ''.join(random.choice(string.ascii_letters) for i in range(6))
-        instruct_ids = task_entry['Item']['instruct_ids']['SS']
-        if instruct_ids[0] == 'None':
-            instruct_ids.clear()
-        instruct_ids.append(instruct_id)
-        
+
         # Add new instruct_instance to instruct_instances list
         instruct_instances = task_entry['Item']['instruct_instances']['SS']
         if instruct_instances[0] == 'None':
@@ -190,15 +208,24 @@ class Task:
             if isinstance(v, bytes):
                 instruct_args_fixup[k] = {'B': f'{v}'}
 
-        # Set task to busy and send instructions to the task
-        set_task_busy_response = self.set_task_busy(
-            instruct_ids, instruct_id, instruct_instances, instruct_instance, instruct_command, instruct_args_fixup, timestamp
+        # Set task to busy, record the instruction and send it to the task
+        instruct_seq = self.set_task_busy(
+            instruct_id, instruct_instances, instruct_instance, instruct_command, instruct_args_fixup, timestamp
+        )
+        if instruct_seq == 'task_not_idle':
+            return format_response(409, 'failed', f'task {self.task_name} is not idle', self.log)
+        if not isinstance(instruct_seq, int):
+            return format_response(500, 'failed', f'interact failed with error {instruct_seq}', self.log)
+        add_history_entry_response = self.add_history_entry(
+            instruct_seq, instruct_id, instruct_instance, instruct_command, instruct_args_fixup, timestamp
+        )
+        if add_history_entry_response != 'history_entry_added':
+            return format_response(500, 'failed', f'interact failed with error {add_history_entry_response}', self.log)
+        send_instruction_response = self.send_instruction(
+            task_entry['Item']['ecs_task_id']['S'], instruct_seq, instruct_id, instruct_instance, instruct_command, instruct_args, end_time, timestamp
         )
-        if set_task_busy_response != 'task_set_as_busy':
-            return format_response(500, 'failed', f'interact failed with error {set_task_busy_response}', self.log)
-        upload_object_response = self.upload_object(instruct_id, instruct_instance, instruct_command, instruct_args, end_time, timestamp)
-        if upload_object_response != 'object_uploaded':
-            return format_response(500, 'failed', f'interact failed with error {upload_object_response}', self.log)
+        if send_instruction_response != 'instruction_sent':
+            return format_response(500, 'failed', f'interact failed with error {send_instruction_response}', self.log)
 
         # Send response
         return format_response(200, 'success', f'interact with {self.task_name} succeeded', None, instruct_id=instruct_id)
@@ -2,8 +2,11 @@ import re
 import os
 import json
 import execute
+import batch_execute
 import interact
+import instruction_history
 import results_queue
+import task_status
 
 
 def format_response(status_code, result, message, log, **kwargs):
@@ -27,8 +30,15 @@ def lambda_handler(event, context):
     default_security_group = os.environ['SECURITY_GROUP']
     log = {'event': event}
 
-    user_id = event['requestContext']['authorizer']['user_id']
-    data = json.loads(event['body'])
+    # Requests arrive through API Gateway; complete_startup is only accepted from this function's own async invocation
+    if 'requestContext' in event:
+        user_id = event['requestContext']['authorizer']['user_id']
+        data = json.loads(event['body'])
+        internal_request = False
+    else:
+        data = event
+        user_id = event['user_id']
+        internal_request = True
 
     if 'action' not in data:
         return format_response(400, 'failed', 'request must contain valid action', log)
@@ -38,22 +48,50 @@ def lambda_handler(event, context):
         return format_response(400, 'failed', 'request must contain valid detail', log)
     detail = data['detail']
 
+    if action == 'run_tasks':
+        # Execute a batch of container tasks of the same task_type
+        new_tasks = batch_execute.TaskBatch(deployment_name, subnet, default_security_group, region, detail, user_id, log)
+        response = new_tasks.run_tasks()
+        return response
+
     if 'task_name' not in detail:
         return format_response(400, 'failed', 'request detail must contain task_name', log)
     task_name = detail['task_name']
 
     if action == 'execute':
         # Execute container task
-        new_task = execute.Task(deployment_name, task_name, subnet, default_security_group, region, detail, user_id, log)
+        new_task = execute.Task(
+            deployment_name, task_name, subnet, default_security_group, region, detail, user_id, log,
+            function_arn=context.invoked_function_arn
+        )
         response = new_task.run_task()
         return response
 
+    if action == 'complete_startup' and internal_request:
+        # Finish an async_startup execute request
+        timeout = max(context.get_remaining_time_in_millis() / 1000 - 10, 1)
+        new_task = execute.Task(deployment_name, task_name, subnet, default_security_group, region, detail, user_id, log)
+        response = new_task.complete_startup(timeout)
+        return response
+
     if action == 'interact':
         # Send instructions to existing container task
         interact_task = interact.Task(deployment_name, task_name, region, detail, user_id, log)
         response = interact_task.instruct()
         return response
 
+    if action == 'get_instructions':
+        # Page through the instructions sent to the task
+        history = instruction_history.History(deployment_name, task_name, region, detail, user_id, log)
+        response = history.get_instructions()
+        return response
+
+    if action == 'wait_for_status':
+        # Long-poll until the task reaches a status
+        status_waiter = task_status.Task(deployment_name, task_name, region, detail, user_id, log)
+        response = status_waiter.wait_for_status()
+        return response
+
     if action == 'get_results':
         # Get results from task instructions
         task_results = results_queue.Queue(deployment_name, task_name, region, detail, user_id, log)
@@ -0,0 +1,91 @@
+import random
+import botocore
+import time as t
+
+
+class TaskReadinessWaiter:
+
+    def __init__(self, aws_ecs_client, aws_ec2_client, cluster, timeout=20, initial_delay=1, max_delay=5):
+        """
+        Wait for Fargate tasks to attach an ENI and receive a public IP address, polling with backoff and jitter
+        instead of sleeping for a fixed interval.
+        """
+        self.aws_ecs_client = aws_ecs_client
+        self.aws_ec2_client = aws_ec2_client
+        self.cluster = cluster
+        self.timeout = timeout
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.task_details = {}
+
+    def backoff(self, attempt, deadline):
+        delay = min(self.max_delay, self.initial_delay * (1.5 ** attempt))
+        delay = random.uniform(delay / 2, delay)
+        remaining = deadline - t.time()
+        if remaining > 0:
+            t.sleep(min(delay, remaining))
+
+    @staticmethod
+    def get_interface_id(ecs_task):
+        for attachment in ecs_task.get('attachments', []):
+            if attachment['type'] != 'ElasticNetworkInterface':
+                continue
+            for detail in attachment.get('details', []):
+                if detail['name'] == 'networkInterfaceId':
+                    return detail['value']
+        return None
+
+    def describe_ecs_tasks(self, ecs_task_ids, interface_ids, results):
+        response = self.aws_ecs_client.describe_tasks(cluster=self.cluster, tasks=ecs_task_ids)
+        for ecs_task in response['tasks']:
+            ecs_task_id = ecs_task['taskArn']
+            self.task_details[ecs_task_id] = ecs_task
+            if ecs_task['lastStatus'] in ['DEACTIVATING', 'STOPPING', 'DEPROVISIONING', 'STOPPED']:
+                results[ecs_task_id] = {'error': f'task stopped: {ecs_task.get("stoppedReason", "unknown")}'}
+                continue
+            interface_id = self.get_interface_id(ecs_task)
+            if interface_id:
+                interface_ids[ecs_task_id] = interface_id
+        for failure in response.get('failures', []):
+            if failure.get('arn') in ecs_task_ids and failure.get('reason') != 'MISSING':
+                results[failure['arn']] = {'error': f'describe_tasks failed: {failure.get("reason")}'}
+
+    def describe_interfaces(self, interface_ids, results):
+        pending = {v: k for k, v in interface_ids.items() if k not in results}
+        if not pending:
+            return
+        try:
+            response = self.aws_ec2_client.describe_network_interfaces(NetworkInterfaceIds=list(pending.keys()))
+        except botocore.exceptions.ClientError as error:
+            # The ENI ID can be reported by ECS before EC2 can describe it, so try again on the next pass.
+            if error.response['Error']['Code'] == 'InvalidNetworkInterfaceID.NotFound':
+                return
+            raise
+        for interface in response['NetworkInterfaces']:
+            public_ip = interface.get('Association', {}).get('PublicIp')
+            if public_ip:
+                ecs_task_id = pending[interface['NetworkInterfaceId']]
+                results[ecs_task_id] = {'interface_id': interface['NetworkInterfaceId'], 'public_ip': public_ip}
+
+    def wait(self, ecs_task_ids):
+        """
+        Returns a dict keyed by ECS task ARN containing either the task's interface_id and public_ip or an error.
+        """
+        deadline = t.time() + self.timeout
+        results = {}
+        interface_ids = {}
+        attempt = 0
+        while True:
+            pending = [ecs_task_id for ecs_task_id in ecs_task_ids if ecs_task_id not in results]
+            if pending:
+                self.describe_ecs_tasks(pending, interface_ids, results)
+                self.describe_interfaces(interface_ids, results)
+            if len(results) == len(ecs_task_ids):
+                return results
+            if t.time() >= deadline:
+                for ecs_task_id in ecs_task_ids:
+                    if ecs_task_id not in results:
+                        results[ecs_task_id] = {'error': 'timed out waiting for task network interface'}
+                return results
+            self.backoff(attempt, deadline)
+            attempt += 1
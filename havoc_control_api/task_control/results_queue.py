@@ -1,6 +1,9 @@
 import json
 import botocore
-import boto3
+import havoc_aws
+import result_pages
+import result_store
+from concurrent.futures import ThreadPoolExecutor
 from dateutil import parser
 from datetime import datetime
 from datetime import timedelta
@@ -22,6 +25,29 @@ def format_response(status_code, result, message, log, **kwargs):
 
 class Queue:
 
+    field_attributes = {
+        'task_name': 'task_name',
+        'task_type': 'task_type',
+        'task_version': 'task_version',
+        'task_context': 'task_context',
+        'task_host_name': 'task_host_name',
+        'task_domain_name': 'task_domain_name',
+        'task_public_ip': 'public_ip',
+        'task_local_ip': 'local_ip',
+        'instruct_user_id': 'user_id',
+        'instruct_id': 'instruct_id',
+        'instruct_instance': 'instruct_instance',
+        'instruct_command': 'instruct_command',
+        'instruct_args': 'instruct_args',
+        'instruct_command_output': 'instruct_command_output',
+        'instruct_command_output_ref': 'instruct_command_output_ref',
+        'instruct_command_output_size': 'instruct_command_output_size',
+        'run_time': 'run_time'
+    }
+    key_attributes = ['task_name', 'run_time']
+    max_workers = 8
+    max_resolved_outputs = 32
+
     def __init__(self, deployment_name, task_name, region, detail: dict, user_id, log):
         self.deployment_name = deployment_name
         self.task_name = task_name
@@ -30,17 +56,63 @@ class Queue:
         self.detail = detail
         self.log = log
         self.__aws_client = None
+        self.__aws_s3_client = None
 
     @property
     def aws_client(self):
         """Returns the boto3 session (establishes one automatically if one does not already exist)"""
         if self.__aws_client is None:
-            self.__aws_client = boto3.client('dynamodb', region_name=self.region)
+            self.__aws_client = havoc_aws.client('dynamodb', self.region)
         return self.__aws_client
 
-    def query_queue(self, start_timestamp, end_timestamp):
-        queue_results = {'Items': []}
-        scan_kwargs = {
+    @property
+    def aws_s3_client(self):
+        """Returns the boto3 S3 session (establishes one automatically if one does not already exist)"""
+        if self.__aws_s3_client is None:
+            self.__aws_s3_client = havoc_aws.client('s3', self.region)
+        return self.__aws_s3_client
+
+    def resolve_outputs(self, queue_list):
+        """
+        Replaces instruct_command_output_ref pointers with the stored outputs, fetched concurrently. Only as many
+        pointers as fit what is left of the page size budget by their recorded sizes are fetched, up to
+        max_resolved_outputs; the rest are left in place for the caller to resolve with a narrower request.
+        """
+        # The rows already on the page count against the same budget as the outputs added to it.
+        page_bytes = len(json.dumps(queue_list, default=str))
+        refs = []
+        budget_bytes = page_bytes
+        for result in queue_list:
+            if 'instruct_command_output_ref' not in result:
+                continue
+            # Rows stored before sizes were recorded are counted as the smallest output that is stored outside the row.
+            size = int(result.get('instruct_command_output_size', result_store.inline_limit))
+            if len(refs) >= self.max_resolved_outputs or budget_bytes + size > result_pages.max_page_bytes:
+                break
+            refs.append(result)
+            budget_bytes += size
+        if not refs:
+            return 'outputs_resolved'
+        try:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(refs))) as executor:
+                outputs = list(executor.map(
+                    lambda r: result_store.load_output(self.aws_s3_client, self.deployment_name, r['instruct_command_output_ref']),
+                    refs
+                ))
+        except botocore.exceptions.ClientError as error:
+            return error
+        for result, output in zip(refs, outputs):
+            # The output is embedded as a JSON string, so count it with its escaping.
+            page_bytes += len(json.dumps(output))
+            if page_bytes > result_pages.max_page_bytes:
+                break
+            result['instruct_command_output'] = output
+            del result['instruct_command_output_ref']
+            result.pop('instruct_command_output_size', None)
+        return 'outputs_resolved'
+
+    def query_queue(self, start_timestamp, end_timestamp, limit, start_key, newest_first, fields):
+        query_kwargs = {
             'TableName': f'{self.deployment_name}-task-queue',
             'KeyConditionExpression': 'task_name = :task_name AND run_time BETWEEN :start_time AND :end_time',
             'ExpressionAttributeValues': {
@@ -49,23 +121,16 @@ class Queue:
                 ':end_time': {'N': end_timestamp}
             }
         }
-
-        done = False
-        start_key = None
-        while not done:
-            if start_key:
-                scan_kwargs['ExclusiveStartKey'] = start_key
-            response = self.aws_client.query(**scan_kwargs)
-            for item in response['Items']:
-                queue_results['Items'].append(item)
-            start_key = response.get('LastEvaluatedKey', None)
-            done = start_key is None
-        return queue_results
+        projection_expression, projection_names = result_pages.projection(fields, self.field_attributes, self.key_attributes)
+        if projection_expression:
+            query_kwargs['ProjectionExpression'] = projection_expression
+            query_kwargs['ExpressionAttributeNames'] = projection_names
+        return result_pages.query_results(
+            self.aws_client, query_kwargs, self.key_attributes, limit, start_key=start_key, newest_first=newest_first
+        )
 
     def get_results(self):
 
-        queue_list = []
-
         # Build query time range
         start_time = None
         if 'start_time' in self.detail:
@@ -74,66 +139,68 @@ class Queue:
         if 'end_time' in self.detail:
             end_time = self.detail['end_time']
         if start_time != '' and start_time is not None:
-            start = parser.parse(start_time)
+            start_timestamp = None
+            try:
+                start_timestamp = str(int(start_time))
+            except:
+                pass
+            if not start_timestamp:
+                start = parser.parse(start_time)
+                start_timestamp = str(int(datetime.timestamp(start)))
         else:
             start = datetime.now() - timedelta(minutes=1440)
+            start_timestamp = str(int(datetime.timestamp(start)))
 
         if end_time != '' and end_time is not None:
-            end = parser.parse(end_time)
+            end_timestamp = None
+            try:
+                end_timestamp = str(int(end_time))
+            except:
+                pass
+            if not end_timestamp:
+                end = parser.parse(end_time)
+                end_timestamp = str(int(datetime.timestamp(end)))
         else:
             end = datetime.now()
+            end_timestamp = str(int(datetime.timestamp(end)))
+
+        # Only return results newer than after_run_time when a caller is following the queue
+        if self.detail.get('after_run_time'):
+            try:
+                after_run_time = int(self.detail['after_run_time'])
+            except (TypeError, ValueError):
+                return format_response(400, 'failed', 'invalid detail: after_run_time must be an integer', self.log)
+            start_timestamp = str(max(int(start_timestamp), after_run_time + 1))
+            if int(start_timestamp) > int(end_timestamp):
+                return format_response(200, 'success', 'get_results succeeded', None, queue=[])
+
+        # Assign paging parameters and run query. Results are only paginated when a caller asks for a page.
+        try:
+            limit, next_token, newest_first = result_pages.parse_page_detail(self.detail, opt_in=True)
+            start_key = None
+            if next_token:
+                start_key = result_pages.decode_next_token(next_token, 'task_name', self.task_name)
+            fields = self.detail.get('fields') or None
+            if isinstance(fields, str):
+                fields = [fields]
+            if fields:
+                fields = list(fields) + ['run_time']
+                if 'instruct_command_output' in fields:
+                    fields.extend(['instruct_command_output_ref', 'instruct_command_output_size'])
+            queue_data, next_token = self.query_queue(
+                start_timestamp, end_timestamp, limit, start_key, newest_first, fields
+            )
+        except ValueError as error:
+            return format_response(400, 'failed', f'invalid detail: {error}', self.log)
+
+        # Build results
+        queue_list = [result_pages.unpack_item(item, self.field_attributes, fields) for item in queue_data]
 
-        # Assign query parameters
-        start_timestamp = str(int(datetime.timestamp(start)))
-        end_timestamp = str(int(datetime.timestamp(end)))
-            
-        # Run query
-        queue_data = self.query_queue(start_timestamp, end_timestamp)
-        if queue_data:
-            for item in queue_data['Items']:
-                run_time = item['run_time']['N']
-                task_name = item['task_name']['S']
-                task_type = item['task_type']['S']
-                task_version = item['task_version']['S']
-                task_context = item['task_context']['S']
-                task_host_name = item['task_host_name']['S']
-                task_domain_name = item['task_domain_name']['S']
-                instruct_command_output = item['instruct_command_output']['S']
-                public_ip = item['public_ip']['S']
-                local_ip = item['local_ip']['SS']
-                instruct_user_id = item['user_id']['S']
-                instruct_id = item['instruct_id']['S']
-                instruct_instance = item['instruct_instance']['S']
-                instruct_command = item['instruct_command']['S']
-                instruct_args = item['instruct_args']['M']
-                instruct_args_fixup = {}
-                for key, value in instruct_args.items():
-                    if 'S' in value:
-                        instruct_args_fixup[key] = value['S']
-                    if 'N' in value:
-                        instruct_args_fixup[key] = value['N']
-                    if 'BOOL' in value:
-                        instruct_args_fixup[key] = value['BOOL']
-                    if 'B' in value:
-                        instruct_args_fixup[key] = value['B']
-
-                # Add queue entry to results
-                queue_list.append({
-                    'task_name': task_name,
-                    'task_type': task_type,
-                    'task_version': task_version,
-                    'task_context': task_context,
-                    'task_host_name': task_host_name,
-                    'task_domain_name': task_domain_name,
-                    'task_public_ip': public_ip,
-                    'task_local_ip': local_ip,
-                    'instruct_user_id': instruct_user_id,
-                    'instruct_id': instruct_id,
-                    'instruct_instance': instruct_instance,
-                    'instruct_command': instruct_command,
-                    'instruct_args': instruct_args_fixup,
-                    'instruct_command_output': instruct_command_output,
-                    'run_time': run_time
-                    })
-
-        return format_response(200, 'success', 'get_results succeeded', None, queue=queue_list)
+        # Large outputs are stored in the workspace bucket and only fetched when asked for
+        if str(self.detail.get('resolve_output', '')).lower() in ['true', 'yes']:
+            resolve_outputs_response = self.resolve_outputs(queue_list)
+            if resolve_outputs_response != 'outputs_resolved':
+                return format_response(500, 'failed', f'get_results failed with error {resolve_outputs_response}', self.log)
+        return format_response(
+            200, 'success', 'get_results succeeded', None, queue=queue_list, next_token=next_token
+        )
@@ -0,0 +1,104 @@
+import json
+import botocore
+import havoc_aws
+import time as t
+
+
+def format_response(status_code, result, message, log, **kwargs):
+    response = {'outcome': result}
+    if message:
+        response['message'] = message
+    if kwargs:
+        for k, v in kwargs.items():
+            if v:
+                response[k] = v
+    if log:
+        log['response'] = response
+        print(log)
+    return {'statusCode': status_code, 'body': json.dumps(response)}
+
+
+class Task:
+
+    # Long-polls must return inside API Gateway's 29 second integration timeout.
+    max_wait_seconds = 25
+    default_wait_seconds = 20
+    initial_poll_interval = 0.2
+    max_poll_interval = 1
+
+    def __init__(self, deployment_name, task_name, region, detail: dict, user_id, log):
+        self.deployment_name = deployment_name
+        self.task_name = task_name
+        self.region = region
+        self.detail = detail
+        self.user_id = user_id
+        self.log = log
+        self.__aws_dynamodb_client = None
+
+    @property
+    def aws_dynamodb_client(self):
+        """Returns the boto3 DynamoDB session (establishes one automatically if one does not already exist)"""
+        if self.__aws_dynamodb_client is None:
+            self.__aws_dynamodb_client = havoc_aws.client('dynamodb', self.region)
+        return self.__aws_dynamodb_client
+
+    def get_task_status(self):
+        """Returns the task's current status, None if the task does not exist, or the error"""
+        try:
+            response = self.aws_dynamodb_client.get_item(
+                TableName=f'{self.deployment_name}-tasks',
+                Key={
+                    'task_name': {'S': self.task_name}
+                },
+                ProjectionExpression='task_status',
+                ConsistentRead=True
+            )
+        except botocore.exceptions.ClientError as error:
+            return error
+        if 'Item' not in response:
+            return None
+        return response['Item']['task_status']['S']
+
+    def wait_for_status(self):
+        """
+        Holds the request until the task reaches one of the requested statuses or wait_seconds elapse, re-reading only
+        the task_status attribute with backoff. Fails at once if the task is terminated and that wasn't asked for.
+        """
+        task_statuses = self.detail.get('task_status') or 'idle'
+        if isinstance(task_statuses, str):
+            task_statuses = [task_statuses]
+        wait_seconds = self.detail.get('wait_seconds') or self.default_wait_seconds
+        try:
+            wait_seconds = min(float(wait_seconds), self.max_wait_seconds)
+        except (TypeError, ValueError):
+            return format_response(400, 'failed', 'invalid detail: wait_seconds must be a number', self.log)
+        if wait_seconds < 0:
+            return format_response(400, 'failed', 'invalid detail: wait_seconds must not be negative', self.log)
+
+        deadline = t.monotonic() + wait_seconds
+        poll_interval = self.initial_poll_interval
+        while True:
+            task_status = self.get_task_status()
+            if task_status is None:
+                return format_response(404, 'failed', f'task {self.task_name} does not exist', self.log)
+            if not isinstance(task_status, str):
+                return format_response(500, 'failed', f'wait_for_status failed with error {task_status}', self.log)
+            if task_status in task_statuses:
+                return format_response(
+                    200, 'success', 'task status reached', None, task_name=self.task_name, task_status=task_status,
+                    status_reached='yes'
+                )
+            # A terminated task never changes status again, so don't hold the caller until wait_seconds expire.
+            if task_status == 'terminated':
+                return format_response(
+                    409, 'failed', f'task {self.task_name} no longer running', self.log, task_name=self.task_name,
+                    task_status=task_status, status_reached='no'
+                )
+            remaining = deadline - t.monotonic()
+            if remaining <= 0:
+                return format_response(
+                    200, 'success', 'task status not reached before wait_seconds expired', None,
+                    task_name=self.task_name, task_status=task_status, status_reached='no'
+                )
+            t.sleep(min(poll_interval, remaining))
+            poll_interval = min(poll_interval * 1.5, self.max_poll_interval)
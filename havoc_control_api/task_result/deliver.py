@@ -1,169 +1,137 @@
-import re
-import ast
 import json
 import copy
 import zlib
 import base64
 import botocore
-import boto3
+import havoc_aws
 import time as t
 from datetime import datetime, timedelta
+import task_teardown
+import task_archive
+import result_envelope
+import result_store
+from log_writer import LogWriter, log_stream_name
+
+# Keys and items a throttled BatchGetItem or BatchWriteItem hands back unprocessed are retried with backoff, up to
+# this many times per call.
+max_batch_attempts = 8
 
 
 class Deliver:
 
-    def __init__(self, region, deployment_name, results_queue_expiration, enable_task_results_logging, results):
+    def __init__(self, region, deployment_name, results_queue_expiration, enable_task_results_logging, log_events,
+                 function_arn=None):
+        """
+        Delivers a batch of task results from a CloudWatch Logs subscription. Results are grouped by task so each
+        task row is read once, queue rows are batch written, log events are forwarded once per stream and the task
+        status is written once per task.
+        """
         self.region = region
         self.deployment_name = deployment_name
         self.results_queue_expiration = results_queue_expiration
         self.enable_task_results_logging = enable_task_results_logging
-        self.user_id = None
-        self.results = results
-        self.task_name = None
-        self.task_context = None
-        self.task_type = None
-        self.task_version = None
+        self.log_events = log_events
+        self.function_arn = function_arn
         self.__aws_dynamodb_client = None
         self.__aws_route53_client = None
         self.__aws_logs_client = None
+        self.__aws_lambda_client = None
+        self.__aws_s3_client = None
 
     @property
     def aws_dynamodb_client(self):
         """Returns the Dynamodb boto3 session (establishes one automatically if one does not already exist)"""
         if self.__aws_dynamodb_client is None:
-            self.__aws_dynamodb_client = boto3.client('dynamodb', region_name=self.region)
+            self.__aws_dynamodb_client = havoc_aws.client('dynamodb', self.region)
         return self.__aws_dynamodb_client
 
     @property
     def aws_route53_client(self):
         """Returns the boto3 Route53 session (establishes one automatically if one does not already exist)"""
         if self.__aws_route53_client is None:
-            self.__aws_route53_client = boto3.client('route53', region_name=self.region)
+            self.__aws_route53_client = havoc_aws.client('route53', self.region)
         return self.__aws_route53_client
     
     @property
     def aws_logs_client(self):
         """Returns the boto3 logs session (establishes one automatically if one does not already exist)"""
         if self.__aws_logs_client is None:
-            self.__aws_logs_client = boto3.client('logs', region_name=self.region)
+            self.__aws_logs_client = havoc_aws.client('logs', self.region)
         return self.__aws_logs_client
 
-    def get_domain_entry(self, domain_name):
-        return self.aws_dynamodb_client.get_item(
-            TableName=f'{self.deployment_name}-domains',
-            Key={
-                'domain_name': {'S': domain_name}
-            }
-        )
+    @property
+    def aws_s3_client(self):
+        """Returns the boto3 S3 session (establishes one automatically if one does not already exist)"""
+        if self.__aws_s3_client is None:
+            self.__aws_s3_client = havoc_aws.client('s3', self.region)
+        return self.__aws_s3_client
 
-    def update_domain_entry(self, domain_name, domain_tasks, host_names):
-        try:
-            self.aws_dynamodb_client.update_item(
-                TableName=f'{self.deployment_name}-domains',
-                Key={
-                    'domain_name': {'S': domain_name}
-                },
-                UpdateExpression='set tasks=:tasks, host_names=:host_names',
-                ExpressionAttributeValues={
-                    ':tasks': {'SS': domain_tasks},
-                    ':host_names': {'SS': host_names}
-                }
-            )
-        except botocore.exceptions.ClientError as error:
-            return error
-        except botocore.exceptions.ParamValidationError as error:
-            return error
-        return 'domain_entry_updated'
+    @property
+    def aws_lambda_client(self):
+        """Returns the boto3 Lambda session (establishes one automatically if one does not already exist)"""
+        if self.__aws_lambda_client is None:
+            self.__aws_lambda_client = havoc_aws.client('lambda', self.region)
+        return self.__aws_lambda_client
 
-    def delete_resource_record_set(self, hosted_zone, host_name, domain_name, ip_address):
-        try:
-            self.aws_route53_client.change_resource_record_sets(
-                HostedZoneId=hosted_zone,
-                ChangeBatch={
-                    'Changes': [
-                        {
-                            'Action': 'DELETE',
-                            'ResourceRecordSet': {
-                                'Name': f'{host_name}.{domain_name}',
-                                'Type': 'A',
-                                'TTL': 300,
-                                'ResourceRecords': [
-                                    {
-                                        'Value': ip_address
-                                    }
-                                ]
-                            }
-                        }
-                    ]
+    def get_task_entries(self, task_names):
+        """
+        Returns {task_name: task_entry} for task_names, read with BatchGetItem and retrying any unprocessed keys.
+        Raises RuntimeError if keys are still unprocessed after max_batch_attempts; nothing has been delivered at this
+        point, so Lambda's retry of the subscription batch starts over cleanly.
+        """
+        table_name = f'{self.deployment_name}-tasks'
+        task_entries = {}
+        pending = [{'task_name': {'S': task_name}} for task_name in task_names]
+        attempt = 0
+        while pending:
+            chunk, pending = pending[:100], pending[100:]
+            response = self.aws_dynamodb_client.batch_get_item(
+                RequestItems={
+                    table_name: {
+                        'Keys': chunk,
+                        'ProjectionExpression': 'task_name, portgroups, task_host_name, task_domain_name, archived'
+                    }
                 }
             )
-        except botocore.exceptions.ClientError as error:
-            return error
-        except botocore.exceptions.ParamValidationError as error:
-            return error
-        return 'resource_record_set_deleted'
+            for item in response['Responses'].get(table_name, []):
+                task_entries[item['task_name']['S']] = item
+            unprocessed = response.get('UnprocessedKeys', {}).get(table_name)
+            if unprocessed:
+                attempt += 1
+                if attempt >= max_batch_attempts:
+                    raise RuntimeError(f'task entries were still unprocessed after {attempt} attempts')
+                pending.extend(unprocessed['Keys'])
+                t.sleep(min(0.05 * (2 ** attempt), 1))
+        return task_entries
 
-    def add_queue_attribute(self, stime, expire_time, task_instruct_id, task_instruct_instance, task_instruct_command,
-                            task_instruct_args, task_host_name, task_domain_name, task_public_ip, task_local_ip, json_payload):
+    def add_queue_entries(self, queue_entries):
+        """Writes results queue rows with BatchWriteItem, retrying unprocessed items up to max_batch_attempts times"""
+        table_name = f'{self.deployment_name}-task-queue'
         try:
-            self.aws_dynamodb_client.update_item(
-                TableName=f'{self.deployment_name}-task-queue',
-                Key={
-                    'task_name': {'S': self.task_name},
-                    'run_time': {'N': stime}
-                },
-                UpdateExpression='set '
-                                'expire_time=:expire_time, '
-                                'user_id=:user_id, '
-                                'task_context=:task_context, '
-                                'task_type=:task_type, '
-                                'task_version=:task_version, '
-                                'instruct_id=:instruct_id, '
-                                'instruct_instance=:instruct_instance, '
-                                'instruct_command=:instruct_command, '
-                                'instruct_args=:instruct_args, '
-                                'task_host_name=:task_host_name, '
-                                'task_domain_name=:task_domain_name, '
-                                'public_ip=:public_ip, '
-                                'local_ip=:local_ip, '
-                                'instruct_command_output=:payload',
-                ExpressionAttributeValues={
-                    ':expire_time': {'N': expire_time},
-                    ':user_id': {'S': self.user_id},
-                    ':task_context': {'S': self.task_context},
-                    ':task_type': {'S': self.task_type},
-                    ':task_version': {'S': self.task_version},
-                    ':instruct_id': {'S': task_instruct_id},
-                    ':instruct_instance': {'S': task_instruct_instance},
-                    ':instruct_command': {'S': task_instruct_command},
-                    ':instruct_args': {'M': task_instruct_args},
-                    ':task_host_name': {'S': task_host_name},
-                    ':task_domain_name': {'S': task_domain_name},
-                    ':public_ip': {'S': task_public_ip},
-                    ':local_ip': {'SS': task_local_ip},
-                    ':payload': {'S': json_payload}
-                }
-            )
+            pending = [{'PutRequest': {'Item': item}} for item in queue_entries]
+            attempt = 0
+            while pending:
+                chunk, pending = pending[:25], pending[25:]
+                response = self.aws_dynamodb_client.batch_write_item(RequestItems={table_name: chunk})
+                unprocessed = response.get('UnprocessedItems', {}).get(table_name, [])
+                if unprocessed:
+                    attempt += 1
+                    if attempt >= max_batch_attempts:
+                        return f'queue entries were still unprocessed after {attempt} attempts'
+                    pending.extend(unprocessed)
+                    t.sleep(min(0.05 * (2 ** attempt), 1))
         except botocore.exceptions.ClientError as error:
             return error
         except botocore.exceptions.ParamValidationError as error:
             return error
-        return 'queue_attribute_added'
-
-    def get_task_entry(self):
-        return self.aws_dynamodb_client.get_item(
-            TableName=f'{self.deployment_name}-tasks',
-            Key={
-                'task_name': {'S': self.task_name}
-            }
-        )
+        return 'queue_entries_added'
 
-    def update_task_entry(self, stime, task_status, task_end_time):
+    def update_task_entry(self, task_name, stime, task_status, task_end_time):
         try:
             self.aws_dynamodb_client.update_item(
                 TableName=f'{self.deployment_name}-tasks',
                 Key={
-                    'task_name': {'S': self.task_name}
+                    'task_name': {'S': task_name}
                 },
                 UpdateExpression='set task_status=:task_status, last_instruct_time=:last_instruct_time, '
                                 'scheduled_end_time=:scheduled_end_time',
@@ -179,167 +147,54 @@ class Deliver:
             return error
         return 'task_entry_updated'
 
-    def get_portgroup_entry(self, portgroup_name):
-        return self.aws_dynamodb_client.get_item(
-            TableName=f'{self.deployment_name}-portgroups',
-            Key={
-                'portgroup_name': {'S': portgroup_name}
-            }
-        )
-
-    def update_portgroup_entry(self, portgroup_name, portgroup_tasks):
-        try:
-            self.aws_dynamodb_client.update_item(
-                TableName=f'{self.deployment_name}-portgroups',
-                Key={
-                    'portgroup_name': {'S': portgroup_name}
-                },
-                UpdateExpression='set tasks=:tasks',
-                ExpressionAttributeValues={
-                    ':tasks': {'SS': portgroup_tasks}
-                }
-            )
-        except botocore.exceptions.ClientError as error:
-            return error
-        except botocore.exceptions.ParamValidationError as error:
-            return error
-        return 'portgroup_entry_updated'
-    
-    def put_log_event(self, payload, stime):
-        log_stream_time = datetime.strftime(datetime.now(), '%Y/%m/%d')
-        log_stream_name = f'{log_stream_time}/{self.task_name}'
-        try:
-            self.aws_logs_client.create_log_stream(
-                logGroupName=f'{self.deployment_name}/task_results_logging',
-                logStreamName=log_stream_name
-            )
-        except self.aws_logs_client.exceptions.ResourceAlreadyExistsException:
-            pass
-        try:
-            self.aws_logs_client.put_log_events(
-                logGroupName=f'{self.deployment_name}/task_results_logging',
-                logStreamName=log_stream_name,
-                logEvents=[
-                    {
-                        'timestamp': int(stime) * 1000,
-                        'message': payload
-                    }
-                ]
-            )
-        except botocore.exceptions.ClientError as error:
-            return error
-        except botocore.exceptions.ParamValidationError as error:
-            return error
-        return 'log_event_written'
-    
-    def get_deployment_entry(self):
-        return self.aws_dynamodb_client.get_item(
-            TableName=f'{self.deployment_name}-deployment',
-            Key={
-                'deployment_name': {'S': self.deployment_name}
-            }
-        )
-    
-    def update_deployment_entry(self, active_resources):
-        try:
-            self.aws_dynamodb_client.update_item(
-                TableName=f'{self.deployment_name}-deployment',
-                Key={
-                    'deployment_name': {'S': self.deployment_name}
-                },
-                UpdateExpression='set active_resources=:active_resources',
-                ExpressionAttributeValues={
-                    ':active_resources': {'M': active_resources}
-                }
-            )
-        except botocore.exceptions.ClientError as error:
-            return error
-        except botocore.exceptions.ParamValidationError as error:
-            return error
-        return 'deployment_updated'
-
-    def deliver_result(self):
-        # Set vars
-        payload = None
-        try:
-            payload = json.loads(self.results['message'])
-        except:
-            pass
-        if not payload:
-            raw = re.search('\d+-\d+-\d+ \d+:\d+:\d+\+\d+ \[-\] ({.+})', self.results['message']).group(1)
-            payload = ast.literal_eval(raw)
+    def parse_result(self, log_event):
+        """Returns the task result carried by a subscription log event"""
+        payload = result_envelope.parse_result(log_event['message'])
 
         if payload['instruct_user_id'] == 'None':
-            self.user_id = payload['user_id']
-        else:
-            self.user_id = payload['instruct_user_id']
-        self.task_name = payload['task_name']
-        self.task_context = payload['task_context']
-        self.task_type = payload['task_type']
-        self.task_version = payload['task_version']
-        task_instruct_id = payload['instruct_id']
-        task_instruct_instance = payload['instruct_instance']
-        task_instruct_command = payload['instruct_command']
-        task_instruct_args = payload['instruct_args']
-        task_public_ip = payload['public_ip']
-        task_local_ip = payload['local_ip']
-        task_forward_log = payload['forward_log']
-        if 'end_time' in payload:
-            task_end_time = payload['end_time']
+            user_id = payload['user_id']
         else:
-            task_end_time = 'None'
+            user_id = payload['instruct_user_id']
         stime = payload['timestamp']
         from_timestamp = datetime.utcfromtimestamp(int(stime))
         expiration_time = from_timestamp + timedelta(days=self.results_queue_expiration)
-        expiration_stime = expiration_time.strftime('%s')
-
-        # Get task portgroups
-        task_entry = self.get_task_entry()
-        portgroups = task_entry['Item']['portgroups']['SS']
-        task_host_name = task_entry['Item']['task_host_name']['S']
-        task_domain_name = task_entry['Item']['task_domain_name']['S']
+        result = {
+            'user_id': user_id,
+            'task_name': payload['task_name'],
+            'instruct_command': payload['instruct_command'],
+            'public_ip': payload['public_ip'],
+            'forward_log': payload['forward_log'],
+            'end_time': payload.get('end_time', 'None'),
+            'stime': stime,
+            'expiration_stime': expiration_time.strftime('%s'),
+        }
 
         # Clear out unwanted payload entries
         del payload['instruct_user_id']
-        del payload['end_time']
+        payload.pop('end_time', None)
         del payload['forward_log']
+        result['payload'] = payload
+        return result
 
-        # Log task result to CloudWatch Logs if enable_task_results_logging is set to true
-        if self.enable_task_results_logging == 'true' and task_forward_log == 'True':
-            cwlogs_payload = copy.deepcopy(payload)
-            if task_instruct_command == 'terminate':
-                del cwlogs_payload['instruct_args']
-            if 'status' in cwlogs_payload['instruct_command_output']:
-                if cwlogs_payload['instruct_command_output']['status'] == 'ready':
-                    del cwlogs_payload['instruct_args']
-            if 'get_shell_command_results' in cwlogs_payload['instruct_command_output']:
-                get_shell_command_results = cwlogs_payload['instruct_command_output']['get_shell_command_results']
-                tmp_results = json.loads(zlib.decompress(base64.b64decode(get_shell_command_results.encode())).decode())
-                cwlogs_payload['instruct_command_output']['get_shell_command_results'] = tmp_results
-
-            # Send result to CloudWatch Logs
-            cwlogs_payload_json = json.dumps(cwlogs_payload)
-            put_log_event_response = self.put_log_event(cwlogs_payload_json, stime)
-            if put_log_event_response != 'log_event_written':
-                print(f'Error writing task result log entry to CloudWatch Logs: {put_log_event_response}')
+    def log_message(self, result):
+        """Returns the CloudWatch Logs message for a task result"""
+        cwlogs_payload = copy.deepcopy(result['payload'])
+        if result['instruct_command'] == 'terminate':
+            del cwlogs_payload['instruct_args']
+        if 'status' in cwlogs_payload['instruct_command_output']:
+            if cwlogs_payload['instruct_command_output']['status'] == 'ready':
+                cwlogs_payload.pop('instruct_args', None)
+        if 'get_shell_command_results' in cwlogs_payload['instruct_command_output']:
+            get_shell_command_results = cwlogs_payload['instruct_command_output']['get_shell_command_results']
+            tmp_results = json.loads(zlib.decompress(base64.b64decode(get_shell_command_results.encode())).decode())
+            cwlogs_payload['instruct_command_output']['get_shell_command_results'] = tmp_results
+        return json.dumps(cwlogs_payload)
 
-        # Add job to results queue
-        db_payload = copy.deepcopy(payload)
-        del db_payload['task_name']
-        del db_payload['task_type']
-        del db_payload['task_version']
-        del db_payload['task_context']
-        del db_payload['instruct_id']
-        del db_payload['instruct_instance']
-        del db_payload['instruct_command']
-        del db_payload['instruct_args']
-        del db_payload['public_ip']
-        del db_payload['local_ip']
-        del db_payload['timestamp']
-        del db_payload['user_id']
-        json_payload = json.dumps(db_payload['instruct_command_output'])
+    def queue_entry(self, result, task_host_name, task_domain_name):
+        """Returns the results queue row for a task result, or the error if a large output could not be stored"""
+        payload = result['payload']
         task_instruct_args_fixup = {}
-        for k, v in task_instruct_args.items():
+        for k, v in payload['instruct_args'].items():
             if isinstance(v, str):
                 task_instruct_args_fixup[k] = {'S': v}
             if isinstance(v, int) and not isinstance(v, bool):
@@ -348,62 +203,162 @@ class Deliver:
                 task_instruct_args_fixup[k] = {'BOOL': v}
             if isinstance(v, bytes):
                 task_instruct_args_fixup[k] = {'B': v}
-        if task_instruct_command == 'terminate':
-            for portgroup in portgroups:
-                if portgroup != 'None':
-                    portgroup_entry = self.get_portgroup_entry(portgroup)
-                    portgroup_tasks = portgroup_entry['Item']['tasks']['SS']
-                    if self.task_name in portgroup_tasks:
-                        portgroup_tasks.remove(self.task_name)
-                    if not portgroup_tasks:
-                        portgroup_tasks.append('None')
-                    update_portgroup_entry_response = self.update_portgroup_entry(portgroup, portgroup_tasks)
-                    if update_portgroup_entry_response != 'portgroup_entry_updated':
-                        print(f'Error updating portgroup entry: {update_portgroup_entry_response}')
-            if task_host_name != 'None':
-                domain_entry = self.get_domain_entry(task_domain_name)
-                hosted_zone = domain_entry['Item']['hosted_zone']['S']
-                domain_tasks = domain_entry['Item']['tasks']['SS']
-                if self.task_name in domain_tasks:
-                    domain_tasks.remove(self.task_name)
-                if not domain_tasks:
-                    domain_tasks.append('None')
-                domain_host_names = domain_entry['Item']['host_names']['SS']
-                if task_host_name in domain_host_names:
-                    domain_host_names.remove(task_host_name)
-                if not domain_host_names:
-                    domain_host_names.append('None')
-                update_domain_entry_response = self.update_domain_entry(task_domain_name, domain_tasks, domain_host_names)
-                if update_domain_entry_response != 'domain_entry_updated':
-                    print(f'Error updating domain entry: {update_domain_entry_response}')
-                delete_resource_record_set_response = self.delete_resource_record_set(hosted_zone, task_host_name, task_domain_name, task_public_ip)
-                if delete_resource_record_set_response != 'resource_record_set_deleted':
-                    print(f'Error deleting resource record set: {delete_resource_record_set_response}')
-            completed_instruction = self.update_task_entry(stime, 'terminated', task_end_time)
-            if completed_instruction != 'task_entry_updated':
-                print(f'Error updating task entry: {completed_instruction}')
-            # Remove task from active_resources in deployment table
-            deployment_details = self.get_deployment_entry()
-            active_resources = deployment_details['Item']['active_resources']['M']
-            active_tasks = active_resources['tasks']['SS']
-            active_tasks.remove(self.task_name)
-            if len(active_tasks) == 0:
-                active_tasks = ['None']
-            active_resources['tasks']['SS'] = active_tasks
-            update_deployment_entry_response = self.update_deployment_entry(active_resources)
-            if update_deployment_entry_response != 'deployment_updated':
-                print(f'Error updating deployment entry: {update_deployment_entry_response}')
-            t.sleep(20)
-        else:
-            completed_instruction = self.update_task_entry(stime, 'idle', task_end_time)
-            if completed_instruction != 'task_entry_updated':
-                print(f'Error updating task entry: {completed_instruction}')
+        output = result_store.store_output(
+            self.aws_s3_client, self.deployment_name, 'instruct_command_output',
+            result_store.output_key('task', result['task_name'], result['stime']),
+            json.dumps(payload['instruct_command_output'])
+        )
+        if not isinstance(output, dict):
+            return output
+        queue_entry = {
+            'task_name': {'S': result['task_name']},
+            'run_time': {'N': result['stime']},
+            'expire_time': {'N': result['expiration_stime']},
+            'user_id': {'S': result['user_id']},
+            'task_context': {'S': payload['task_context']},
+            'task_type': {'S': payload['task_type']},
+            'task_version': {'S': payload['task_version']},
+            'instruct_id': {'S': payload['instruct_id']},
+            'instruct_instance': {'S': payload['instruct_instance']},
+            'instruct_command': {'S': payload['instruct_command']},
+            'instruct_args': {'M': task_instruct_args_fixup},
+            'task_host_name': {'S': task_host_name},
+            'task_domain_name': {'S': task_domain_name},
+            'public_ip': {'S': payload['public_ip']},
+            'local_ip': {'SS': payload['local_ip']}
+        }
+        queue_entry.update(output)
+        return queue_entry
+
+    def invoke_terminate_cleanup(self, cleanup_detail):
+        payload = {'action': 'cleanup_terminated_task', 'detail': cleanup_detail}
+        try:
+            self.aws_lambda_client.invoke(
+                FunctionName=self.function_arn,
+                InvocationType='Event',
+                Payload=json.dumps(payload).encode('utf-8')
+            )
+        except botocore.exceptions.ClientError as error:
+            return error
+        except botocore.exceptions.ParamValidationError as error:
+            return error
+        return 'terminate_cleanup_invoked'
+
+    def cleanup_terminated_task(self, cleanup_detail):
+        """
+        Releases terminated tasks' portgroups, host names and DNS records and removes them from active_resources, for
+        every task in cleanup_detail['tasks'] (or the single task cleanup_detail describes) in one teardown.
+        Every step is a no-op when already done, so a failed cleanup is raised for Lambda to retry in full.
+        """
+        tasks = cleanup_detail.get('tasks') or [cleanup_detail]
+        task_names = [task['task_name'] for task in tasks]
+        errors = []
+        teardown_response = task_teardown.Teardown(
+            self.aws_dynamodb_client, self.aws_route53_client, self.deployment_name, tasks
+        ).run()
+        if teardown_response != 'teardown_completed':
+            errors.extend(teardown_response)
+        if not errors:
+            # Move the terminated tasks' rows out of the tasks table once nothing else needs them
+            for task_name in task_names:
+                archive_task_response = task_archive.archive_task(self.aws_dynamodb_client, self.deployment_name, task_name)
+                if archive_task_response not in ['task_archived', 'task_not_found']:
+                    errors.append(f'Error archiving task {task_name}: {archive_task_response}')
+        if errors:
+            raise RuntimeError(f'cleanup of terminated tasks {", ".join(task_names)} failed: {"; ".join(errors)}')
+        return 'terminate_cleanup_completed'
+
+    def terminate_task(self, task_name, task_entry, result):
+        """Marks a task terminated and returns the detail its resource cleanup needs"""
+        update_task_entry_response = self.update_task_entry(task_name, result['stime'], 'terminated', result['end_time'])
+        if update_task_entry_response != 'task_entry_updated':
+            print(f'Error updating task entry: {update_task_entry_response}')
+        return {
+            'task_name': task_name,
+            'portgroups': task_entry['portgroups']['SS'],
+            'task_host_name': task_entry['task_host_name']['S'],
+            'task_domain_name': task_entry['task_domain_name']['S'],
+            'public_ip': result['public_ip']
+        }
+
+    def cleanup_terminated_tasks(self, cleanup_tasks):
+        """Hands the cleanup of every task terminated in this delivery to one asynchronous invocation"""
+        cleanup_detail = {'tasks': cleanup_tasks}
+        invoke_terminate_cleanup_response = self.invoke_terminate_cleanup(cleanup_detail)
+        if invoke_terminate_cleanup_response != 'terminate_cleanup_invoked':
+            print(f'Error invoking terminate cleanup: {invoke_terminate_cleanup_response}')
+            try:
+                self.cleanup_terminated_task(cleanup_detail)
+            except RuntimeError as error:
+                print(error)
+
+    def deliver_results(self):
+        # Parse and group results by task
+        task_results = {}
+        for log_event in self.log_events:
+            try:
+                result = self.parse_result(log_event)
+            except Exception as error:
+                print(f'Error parsing task result {log_event.get("id")}: {error}')
+                continue
+            task_results.setdefault(result['task_name'], []).append(result)
+        if not task_results:
+            return True
+
+        # Get task portgroups, host names and domains in one pass
+        task_entries = self.get_task_entries(list(task_results.keys()))
+
+        queue_entries = {}
+        cleanup_tasks = []
+        log_writer = LogWriter(self.aws_logs_client, f'{self.deployment_name}/task_results_logging')
+        for task_name, results in task_results.items():
+            if task_name not in task_entries:
+                print(f'Error delivering task results: task {task_name} does not exist')
+                continue
+            task_entry = task_entries[task_name]
+            if 'archived' in task_entry:
+                print(f'Error delivering task results: task {task_name} has been terminated and archived')
+                continue
+            task_host_name = task_entry['task_host_name']['S']
+            task_domain_name = task_entry['task_domain_name']['S']
+
+            # Log task results to CloudWatch Logs if enable_task_results_logging is set to true
+            if self.enable_task_results_logging == 'true':
+                for result in results:
+                    if result['forward_log'] == 'True':
+                        log_writer.add(log_stream_name(task_name), int(result['stime']) * 1000, self.log_message(result))
+
+            # A row per run_time; later results for the same second replace earlier ones as the old updates did
+            for result in results:
+                queue_entry = self.queue_entry(result, task_host_name, task_domain_name)
+                if not isinstance(queue_entry, dict):
+                    print(f'Error storing task result output: {queue_entry}')
+                    continue
+                queue_entries[(task_name, result['stime'])] = queue_entry
+
+            # Set the task status once, from a terminate result if there is one, otherwise from the latest result
+            terminate_results = [result for result in results if result['instruct_command'] == 'terminate']
+            if terminate_results:
+                cleanup_tasks.append(self.terminate_task(task_name, task_entry, terminate_results[-1]))
+            else:
+                latest = max(results, key=lambda r: int(r['stime']))
+                update_task_entry_response = self.update_task_entry(task_name, latest['stime'], 'idle', latest['end_time'])
+                if update_task_entry_response != 'task_entry_updated':
+                    print(f'Error updating task entry: {update_task_entry_response}')
+
+        # Release the terminated tasks' resources together
+        if cleanup_tasks:
+            self.cleanup_terminated_tasks(cleanup_tasks)
+
+        # Send results to CloudWatch Logs, one put_log_events call per stream
+        flush_response = log_writer.flush()
+        if flush_response != 'log_events_written':
+            print(f'Error writing task result log entries to CloudWatch Logs: {flush_response}')
 
-        if completed_instruction:
-            add_queue_attribute_response = self.add_queue_attribute(stime, expiration_stime, task_instruct_id, task_instruct_instance,
-                                                                    task_instruct_command, task_instruct_args_fixup, task_host_name,
-                                                                    task_domain_name, task_public_ip, task_local_ip, json_payload)
-            if add_queue_attribute_response != 'queue_attribute_added':
-                print(f'Error adding queue attribute: {add_queue_attribute_response}')
+        # Add results to the results queue
+        if queue_entries:
+            add_queue_entries_response = self.add_queue_entries(list(queue_entries.values()))
+            if add_queue_entries_response != 'queue_entries_added':
+                print(f'Error adding queue entries: {add_queue_entries_response}')
 
         return True
@@ -11,11 +11,17 @@ def lambda_handler(event, context):
     deployment_name = os.environ['DEPLOYMENT_NAME']
     results_queue_expiration = int(os.environ['RESULTS_QUEUE_EXPIRATION'])
     enable_task_results_logging = os.environ['ENABLE_TASK_RESULTS_LOGGING']
+
+    if event.get('action') == 'cleanup_terminated_task':
+        # Asynchronous terminate cleanup handed off by an earlier delivery
+        d = Deliver(region, deployment_name, results_queue_expiration, enable_task_results_logging, [])
+        return d.cleanup_terminated_task(event['detail'])
+
     zipped = base64.b64decode(event['awslogs']['data'])
     raw = zlib.decompress(zipped, 15 + 32)
     data = json.loads(raw.decode('utf-8'))
     log_events = data['logEvents']
 
-    for event in log_events:
-        d = Deliver(region, deployment_name, results_queue_expiration, enable_task_results_logging, event)
-        d.deliver_result()
+    d = Deliver(region, deployment_name, results_queue_expiration, enable_task_results_logging, log_events,
+                function_arn=context.invoked_function_arn)
+    d.deliver_results()
@@ -5,7 +5,8 @@ import dpath
 import signal
 import havoc
 import botocore
-import boto3
+import havoc_aws
+import payload_codec
 from datetime import datetime
 from datetime import timedelta
 
@@ -55,7 +56,7 @@ class Trigger:
     def aws_dynamodb_client(self):
         """Returns the boto3 DynamoDB session (establishes one automatically if one does not already exist)"""
         if self.__aws_dynamodb_client is None:
-            self.__aws_dynamodb_client = boto3.client('dynamodb', region_name=self.region)
+            self.__aws_dynamodb_client = havoc_aws.client('dynamodb', self.region)
         return self.__aws_dynamodb_client
     
     @property
@@ -140,11 +141,11 @@ class Trigger:
                     ':filter_command': {'S': filter_command},
                     ':filter_command_args': {'S': json.dumps(filter_command_args)},
                     ':filter_command_timeout': {'N': str(filter_command_timeout)},
-                    ':filter_command_result': {'S': filter_command_result},
+                    ':filter_command_result': payload_codec.encode(filter_command_result),
                     ':execute_command': {'S': execute_command},
                     ':execute_command_args': {'S': json.dumps(execute_command_args)},
                     ':execute_command_timeout': {'N': str(execute_command_timeout)},
-                    ':execute_command_result': {'S': execute_command_result}
+                    ':execute_command_result': payload_codec.encode(execute_command_result)
                 }
             )
         except botocore.exceptions.ClientError as error:
@@ -155,6 +156,24 @@ class Trigger:
             return error
         return 'queue_attribute_added'
 
+    def wait_for_idle_task(self, task_name):
+        """
+        Waits for a task to go idle using the task_control wait_for_status long-poll, or the havoc client's own
+        wait_for_idle_task if the client can't post to the task_control API directly
+        """
+        if not hasattr(self.havoc_client, 'post') or not hasattr(self.havoc_client, 'task_control_api_endpoint'):
+            return self.havoc_client.wait_for_idle_task(task_name=task_name)
+        detail = {'task_name': task_name, 'task_status': 'idle', 'wait_seconds': 25}
+        while True:
+            response = self.havoc_client.post(
+                self.havoc_client.task_control_api_endpoint, {'action': 'wait_for_status', 'detail': detail}
+            )
+            # A terminated task fails the long-poll, so it can't hold the executor until the filter timeout.
+            if response.get('outcome') != 'success' or response.get('task_status') == 'terminated':
+                return response
+            if response.get('status_reached') == 'yes':
+                return self.havoc_client.get_task(task_name)
+
     def execute(self):
         signal.signal(signal.SIGALRM, timeout_handler)
         stime = datetime.utcnow().strftime('%s')
@@ -263,7 +282,10 @@ class Trigger:
         if filter_command:
             signal.alarm(filter_command_timeout)
             try:
-                filter_command_method = getattr(self.havoc_client, filter_command)
+                if filter_command == 'wait_for_idle_task':
+                    filter_command_method = self.wait_for_idle_task
+                else:
+                    filter_command_method = getattr(self.havoc_client, filter_command)
                 if filter_command_args:
                     filter_command_response = filter_command_method(**filter_command_args)
                 else:
@@ -1,5 +1,6 @@
 import json
-import boto3
+import havoc_aws
+import result_pages
 from dateutil import parser
 from datetime import datetime
 from datetime import timedelta
@@ -21,6 +22,22 @@ def format_response(status_code, result, message, log, **kwargs):
 
 class Queue:
 
+    field_attributes = {
+        'trigger_name': 'trigger_name',
+        'scheduled_triger': 'scheduled_trigger',
+        'filter_command': 'filter_command',
+        'filter_command_args': 'filter_command_args',
+        'filter_command_timeout': 'filter_command_timeout',
+        'filter_command_result': 'filter_command_result',
+        'execute_command': 'execute_command',
+        'execute_command_args': 'execute_command_args',
+        'execute_command_timeout': 'execute_command_timeout',
+        'execute_command_result': 'execute_command_result',
+        'user_id': 'user_id',
+        'run_time': 'run_time'
+    }
+    key_attributes = ['trigger_name', 'run_time']
+
     def __init__(self, deployment_name, trigger_name, region, detail: dict, user_id, log):
         self.deployment_name = deployment_name
         self.trigger_name = trigger_name
@@ -34,12 +51,11 @@ class Queue:
     def aws_client(self):
         """Returns the boto3 session (establishes one automatically if one does not already exist)"""
         if self.__aws_client is None:
-            self.__aws_client = boto3.client('dynamodb', region_name=self.region)
+            self.__aws_client = havoc_aws.client('dynamodb', self.region)
         return self.__aws_client
 
-    def query_queue(self, start_timestamp, end_timestamp):
-        queue_results = {'Items': []}
-        scan_kwargs = {
+    def query_queue(self, start_timestamp, end_timestamp, limit, start_key, newest_first, fields):
+        query_kwargs = {
             'TableName': f'{self.deployment_name}-trigger-queue',
             'KeyConditionExpression': 'trigger_name = :trigger_name AND run_time BETWEEN :start_time AND :end_time',
             'ExpressionAttributeValues': {
@@ -48,23 +64,16 @@ class Queue:
                 ':end_time': {'N': end_timestamp}
             }
         }
-
-        done = False
-        start_key = None
-        while not done:
-            if start_key:
-                scan_kwargs['ExclusiveStartKey'] = start_key
-            response = self.aws_client.query(**scan_kwargs)
-            for item in response['Items']:
-                queue_results['Items'].append(item)
-            start_key = response.get('LastEvaluatedKey', None)
-            done = start_key is None
-        return queue_results
+        projection_expression, projection_names = result_pages.projection(fields, self.field_attributes, self.key_attributes)
+        if projection_expression:
+            query_kwargs['ProjectionExpression'] = projection_expression
+            query_kwargs['ExpressionAttributeNames'] = projection_names
+        return result_pages.query_results(
+            self.aws_client, query_kwargs, self.key_attributes, limit, start_key=start_key, newest_first=newest_first
+        )
 
     def get_results(self):
 
-        queue_list = []
-
         # Build query time range
         start_time = None
         if 'start_time' in self.detail:
@@ -86,37 +95,25 @@ class Queue:
         start_timestamp = str(int(datetime.timestamp(start)))
         end_timestamp = str(int(datetime.timestamp(end)))
             
-        # Run query
-        queue_data = self.query_queue(start_timestamp, end_timestamp)
-        if queue_data:
-            for item in queue_data['Items']:
-                run_time = item['run_time']['N']
-                trigger_name = item['trigger_name']['S']
-                scheduled_trigger = item['scheduled_trigger']['S']
-                filter_command = item['filter_command']['S']
-                filter_command_args = item['filter_command_args']['S']
-                filter_command_timeout = item['filter_command_timeout']['N']
-                filter_command_result = item['filter_command_result']['S']
-                execute_command = item['execute_command']['S']
-                execute_command_args = item['execute_command_args']['S']
-                execute_command_timeout = item['execute_command_timeout']['N']
-                execute_command_result = item['execute_command_result']['S']
-                user_id = item['user_id']['S']
-
-                # Add queue entry to results
-                queue_list.append({
-                    'trigger_name': trigger_name,
-                    'scheduled_triger': scheduled_trigger,
-                    'filter_command': filter_command,
-                    'filter_command_args': filter_command_args,
-                    'filter_command_timeout': filter_command_timeout,
-                    'filter_command_result': filter_command_result,
-                    'execute_command': execute_command,
-                    'execute_command_args': execute_command_args,
-                    'execute_command_timeout': execute_command_timeout,
-                    'execute_command_result': execute_command_result,
-                    'user_id': user_id,
-                    'run_time': run_time
-                    })
+        # Assign paging parameters and run query. Results are only paginated when a caller asks for a page.
+        try:
+            limit, next_token, newest_first = result_pages.parse_page_detail(self.detail, opt_in=True)
+            start_key = None
+            if next_token:
+                start_key = result_pages.decode_next_token(next_token, 'trigger_name', self.trigger_name)
+            fields = self.detail.get('fields') or None
+            if isinstance(fields, str):
+                fields = [fields]
+            if fields:
+                fields = list(fields) + ['run_time']
+            queue_data, next_token = self.query_queue(
+                start_timestamp, end_timestamp, limit, start_key, newest_first, fields
+            )
+        except ValueError as error:
+            return format_response(400, 'failed', f'invalid detail: {error}', self.log)
 
-        return format_response(200, 'success', 'get_results succeeded', None, queue=queue_list)
+        # Build results
+        queue_list = [result_pages.unpack_item(item, self.field_attributes, fields) for item in queue_data]
+        return format_response(
+            200, 'success', 'get_results succeeded', None, queue=queue_list, next_token=next_token
+        )
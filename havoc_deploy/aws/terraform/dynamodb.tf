@@ -410,6 +410,74 @@ resource "aws_dynamodb_table" "tasks" {
   name = "task_name"
   type = "S"
   }
+
+  attribute {
+  name = "task_status"
+  type = "S"
+  }
+
+  attribute {
+  name = "task_type"
+  type = "S"
+  }
+
+  global_secondary_index {
+    name               = "${var.deployment_name}-TaskStatusIndex"
+    hash_key           = "task_status"
+    range_key          = "task_type"
+    projection_type    = "KEYS_ONLY"
+  }
+}
+
+resource "aws_dynamodb_table" "tasks_archive" {
+  name           = "${var.deployment_name}-tasks-archive"
+  billing_mode   = "PAY_PER_REQUEST"
+  hash_key       = "task_name"
+  range_key      = "archive_time"
+
+  attribute {
+  name = "task_name"
+  type = "S"
+  }
+
+  attribute {
+  name = "archive_time"
+  type = "N"
+  }
+}
+
+resource "aws_dynamodb_table" "task_instructions" {
+  name           = "${var.deployment_name}-task-instructions"
+  billing_mode   = "PAY_PER_REQUEST"
+  hash_key       = "task_name"
+  range_key      = "seq"
+
+  attribute {
+  name = "task_name"
+  type = "S"
+  }
+
+  attribute {
+  name = "seq"
+  type = "N"
+  }
+}
+
+resource "aws_dynamodb_table" "instruction_queue" {
+  name           = "${var.deployment_name}-instruction-queue"
+  billing_mode   = "PAY_PER_REQUEST"
+  hash_key       = "task_name"
+  range_key      = "seq"
+
+  attribute {
+  name = "task_name"
+  type = "S"
+  }
+
+  attribute {
+  name = "seq"
+  type = "N"
+  }
 }
 
 resource "aws_dynamodb_table" "triggers" {
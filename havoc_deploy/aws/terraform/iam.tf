@@ -16,11 +16,18 @@ data "template_file" "lambda_policy" {
   portgroups_table            = aws_dynamodb_table.portgroups.arn,
   task_queue_table            = aws_dynamodb_table.task_queue.arn,
   tasks_table                 = aws_dynamodb_table.tasks.arn,
+  tasks_archive_table         = aws_dynamodb_table.tasks_archive.arn,
+  task_instructions_table     = aws_dynamodb_table.task_instructions.arn,
+  instruction_queue_table     = aws_dynamodb_table.instruction_queue.arn,
+  tasks_status_index          = "${aws_dynamodb_table.tasks.arn}/index/${var.deployment_name}-TaskStatusIndex",
   triggers_table              = aws_dynamodb_table.triggers.arn,
   trigger_queue_table         = aws_dynamodb_table.trigger_queue.arn,
   playbooks_bucket            = "${var.deployment_name}-playbooks",
   playbook_types_bucket       = "${var.deployment_name}-playbook-types",
   workspace_bucket            = "${var.deployment_name}-workspace",
+  task_control_function       = "arn:aws:lambda:${var.aws_region}:${local.account_id}:function:${var.deployment_name}-task-control",
+  manage_function             = "arn:aws:lambda:${var.aws_region}:${local.account_id}:function:${var.deployment_name}-manage",
+  task_result_function        = "arn:aws:lambda:${var.aws_region}:${local.account_id}:function:${var.deployment_name}-task-result",
   task_role                   = aws_iam_role.ecs_task_role.arn,
   task_exec_role              = aws_iam_role.ecs_task_execution_role.arn,
   playbook_operator_role      = aws_iam_role.ecs_playbook_operator_role.arn,
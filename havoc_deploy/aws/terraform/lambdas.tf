@@ -100,6 +100,7 @@ resource "aws_lambda_function" "remote_task" {
       DEPLOYMENT_NAME             = var.deployment_name
       RESULTS_QUEUE_EXPIRATION    = var.results_queue_expiration
       ENABLE_TASK_RESULTS_LOGGING = var.enable_task_results_logging
+      INSTRUCTION_TRANSPORT       = var.instruction_transport
     }
   }
 }
@@ -123,9 +124,10 @@ resource "aws_lambda_function" "task_control" {
 
   environment {
     variables = {
-      DEPLOYMENT_NAME = var.deployment_name
-      SUBNET          = aws_subnet.deployment_subnet_0.id
-      SECURITY_GROUP  = aws_security_group.tasks_default.id
+      DEPLOYMENT_NAME       = var.deployment_name
+      SUBNET                = aws_subnet.deployment_subnet_0.id
+      SECURITY_GROUP        = aws_security_group.tasks_default.id
+      INSTRUCTION_TRANSPORT = var.instruction_transport
     }
   }
 }
@@ -56,4 +56,20 @@ resource "aws_s3_bucket_server_side_encryption_configuration" "terraform_state"
       sse_algorithm = "AES256"
     }
   }
-}
\ No newline at end of file
+}
+resource "aws_s3_bucket_lifecycle_configuration" "workspace" {
+  bucket = aws_s3_bucket.workspace.id
+
+  rule {
+    id     = "expire-results"
+    status = "Enabled"
+
+    filter {
+      prefix = "_results/"
+    }
+
+    expiration {
+      days = var.results_queue_expiration + 1
+    }
+  }
+}
@@ -48,6 +48,11 @@ variable "deployment_admin_email" {
   description = "The email address that will be referenced as the deployment admin."
 }
 
+variable "instruction_transport" {
+  description = "Where remote task instructions are queued: s3 (one workspace object per instruction) or dynamodb (an ordered per-task queue table). ECS task containers read the workspace bucket, so their instructions always go to s3."
+  default     = "s3"
+}
+
 variable "results_queue_expiration" {
   description = "The number of days to keep task results in the queue."
   default     = 30
@@ -0,0 +1,53 @@
+import os
+import sys
+import importlib.util
+import pytest
+
+api_root = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'havoc_control_api')
+
+# Every Lambda package is zipped together with common/ and imports its modules by bare name.
+sys.path.insert(0, os.path.join(api_root, 'common'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+
+
+def load_module(package, module_name):
+    """
+    Imports havoc_control_api/<package>/<module_name>.py. Packages reuse module names (results_queue,
+    lambda_function), so each one is loaded under a package-qualified name with its package directory on the path.
+    """
+    package_path = os.path.join(api_root, package)
+    sys.path.insert(0, package_path)
+    try:
+        spec = importlib.util.spec_from_file_location(
+            f'{package}_{module_name}', os.path.join(package_path, f'{module_name}.py')
+        )
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        sys.path.remove(package_path)
+    return module
+
+
+@pytest.fixture
+def api_module():
+    return load_module
+
+
+def pytest_addoption(parser):
+    parser.addoption('--run-benchmarks', action='store_true', help='run the wall-clock benchmarks')
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'benchmark: wall-clock budget check, skipped unless --run-benchmarks is given')
+
+
+def pytest_collection_modifyitems(config, items):
+    """Timings depend on the machine running the suite, so the benchmarks only run when asked for"""
+    if config.getoption('--run-benchmarks'):
+        return
+    skip_benchmark = pytest.mark.skip(reason='wall-clock benchmark, run with --run-benchmarks')
+    for item in items:
+        if 'benchmark' in item.keywords:
+            item.add_marker(skip_benchmark)
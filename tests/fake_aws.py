@@ -0,0 +1,441 @@
+"""
+In-memory stand-ins for the AWS clients the control API uses. FakeDynamoDB evaluates the subset of the expression
+language this code base writes: SET/REMOVE/ADD/DELETE updates, '=' comparisons joined with AND, attribute_exists and
+attribute_not_exists conditions, and key conditions with an optional BETWEEN on the range key.
+"""
+import copy
+import io
+import re
+import threading
+import botocore.exceptions
+
+# Key attributes of each table, by the table name's suffix after the deployment name.
+key_schemas = {
+    'tasks': ['task_name'],
+    'tasks-archive': ['task_name', 'archive_time'],
+    'task-types': ['task_type'],
+    'task-queue': ['task_name', 'run_time'],
+    'playbook-queue': ['playbook_name', 'run_time'],
+    'trigger-queue': ['trigger_name', 'run_time'],
+    'instruction-queue': ['task_name', 'seq'],
+    'deployment': ['deployment_name'],
+    'domains': ['domain_name'],
+    'portgroups': ['portgroup_name'],
+    'listeners': ['listener_name'],
+    'authorizer': ['user_id'],
+    'playbooks': ['playbook_name'],
+    'playbook-types': ['playbook_type'],
+    'workspace-access': ['object_access']
+}
+
+
+def client_error(code, message='', operation='operation', **extra):
+    error_response = {'Error': {'Code': code, 'Message': message}}
+    error_response.update(extra)
+    return botocore.exceptions.ClientError(error_response, operation)
+
+
+def comparable(value):
+    """Sets compare without regard to order, as they do in DynamoDB"""
+    for set_type in ['SS', 'NS', 'BS']:
+        if set_type in value:
+            return set_type, frozenset(value[set_type])
+    if 'N' in value:
+        return 'N', float(value['N'])
+    return value
+
+
+class FakeDynamoDB:
+
+    def __init__(self, deployment_name='havoc'):
+        self.deployment_name = deployment_name
+        self.tables = {}
+        self.calls = []
+        # Maps an operation name to a list of errors (or None for success) returned by its next calls.
+        self.failures = {}
+        # Returned as UnprocessedKeys/UnprocessedItems by the next batch calls, one count per call.
+        self.unprocessed = []
+
+    # Table helpers
+
+    def key_attributes(self, table_name):
+        suffix = table_name[len(self.deployment_name) + 1:]
+        return key_schemas[suffix]
+
+    def key_of(self, table_name, item):
+        return tuple((a, item[a]['S'] if 'S' in item[a] else item[a]['N']) for a in self.key_attributes(table_name))
+
+    def table(self, table_name):
+        return self.tables.setdefault(table_name, {})
+
+    def put(self, table_name, item):
+        self.table(table_name)[self.key_of(table_name, item)] = copy.deepcopy(item)
+
+    def get(self, table_name, **key_values):
+        key = tuple((a, key_values[a]) for a in self.key_attributes(table_name))
+        return self.table(table_name).get(key)
+
+    def items(self, table_name):
+        return list(self.table(table_name).values())
+
+    def check_failure(self, operation):
+        self.calls.append(operation)
+        pending = self.failures.get(operation)
+        if pending:
+            error = pending.pop(0)
+            if error is not None:
+                raise error
+
+    # Expression evaluation
+
+    @staticmethod
+    def path(expression_path, names):
+        return [names.get(part, part) for part in expression_path.strip().split('.')]
+
+    @staticmethod
+    def resolve(item, path):
+        value = item
+        for i, part in enumerate(path):
+            if i:
+                if 'M' not in value:
+                    return None
+                value = value['M']
+            if part not in value:
+                return None
+            value = value[part]
+        return value
+
+    def condition_holds(self, item, expression, names, values):
+        if not expression:
+            return True
+        for clause in re.split(r'\s+AND\s+', expression.strip()):
+            match = re.fullmatch(r'(attribute_exists|attribute_not_exists)\((.+)\)', clause.strip())
+            if match:
+                exists = item is not None and self.resolve(item, self.path(match.group(2), names)) is not None
+                if exists != (match.group(1) == 'attribute_exists'):
+                    return False
+                continue
+            attribute, placeholder = [part.strip() for part in clause.split('=')]
+            current = self.resolve(item, self.path(attribute, names)) if item is not None else None
+            if current is None or comparable(current) != comparable(values[placeholder]):
+                return False
+        return True
+
+    def apply_update(self, item, expression, names, values):
+        clauses = re.split(r'\b(SET|REMOVE|ADD|DELETE)\b', expression.strip(), flags=re.IGNORECASE)
+        for action, body in zip(clauses[1::2], clauses[2::2]):
+            action = action.upper()
+            for part in [p.strip() for p in body.split(',') if p.strip()]:
+                if action == 'SET':
+                    attribute, placeholder = [p.strip() for p in part.split('=')]
+                    self.set_path(item, self.path(attribute, names), copy.deepcopy(values[placeholder]))
+                elif action == 'REMOVE':
+                    path = self.path(part, names)
+                    parent = self.parent(item, path)
+                    if parent is not None:
+                        parent.pop(path[-1], None)
+                else:
+                    attribute, placeholder = part.split()
+                    path = self.path(attribute, names)
+                    current = self.resolve(item, path)
+                    value = values[placeholder]
+                    if action == 'ADD' and 'N' in value:
+                        total = float(current['N']) if current else 0
+                        total += float(value['N'])
+                        self.set_path(item, path, {'N': str(int(total)) if total.is_integer() else str(total)})
+                        continue
+                    set_type = next(iter(value))
+                    members = set(current[set_type]) if current else set()
+                    if action == 'ADD':
+                        members |= set(value[set_type])
+                    else:
+                        members -= set(value[set_type])
+                    if members:
+                        self.set_path(item, path, {set_type: sorted(members)})
+                    elif current is not None:
+                        self.parent(item, path).pop(path[-1])
+
+    def parent(self, item, path):
+        if len(path) == 1:
+            return item
+        container = self.resolve(item, path[:-1])
+        return container['M'] if container is not None else None
+
+    def set_path(self, item, path, value):
+        if len(path) > 1:
+            container = self.resolve(item, path[:-1])
+            if container is None:
+                raise client_error('ValidationException', 'The document path provided in the update expression is invalid')
+            container['M'][path[-1]] = value
+        else:
+            item[path[0]] = value
+
+    @staticmethod
+    def project(item, projection, names):
+        if not projection:
+            return copy.deepcopy(item)
+        attributes = [names.get(a.strip(), a.strip()) for a in projection.split(',')]
+        return {a: copy.deepcopy(item[a]) for a in attributes if a in item}
+
+    # Client operations
+
+    def get_item(self, TableName, Key, ProjectionExpression=None, ExpressionAttributeNames=None, **kwargs):
+        self.check_failure('get_item')
+        item = self.table(TableName).get(self.key_of(TableName, Key))
+        if item is None:
+            return {}
+        return {'Item': self.project(item, ProjectionExpression, ExpressionAttributeNames or {})}
+
+    def put_item(self, TableName, Item, ConditionExpression=None, ExpressionAttributeNames=None,
+                 ExpressionAttributeValues=None, **kwargs):
+        self.check_failure('put_item')
+        current = self.table(TableName).get(self.key_of(TableName, Item))
+        if not self.condition_holds(current, ConditionExpression, ExpressionAttributeNames or {},
+                                    ExpressionAttributeValues or {}):
+            raise client_error('ConditionalCheckFailedException', 'The conditional request failed', 'PutItem')
+        self.put(TableName, Item)
+        return {}
+
+    def update_item(self, TableName, Key, UpdateExpression, ConditionExpression=None, ExpressionAttributeNames=None,
+                    ExpressionAttributeValues=None, ReturnValues=None, **kwargs):
+        self.check_failure('update_item')
+        table = self.table(TableName)
+        key = self.key_of(TableName, Key)
+        names = ExpressionAttributeNames or {}
+        values = ExpressionAttributeValues or {}
+        current = table.get(key)
+        if not self.condition_holds(current, ConditionExpression, names, values):
+            raise client_error('ConditionalCheckFailedException', 'The conditional request failed', 'UpdateItem')
+        item = copy.deepcopy(current) if current is not None else copy.deepcopy(Key)
+        self.apply_update(item, UpdateExpression, names, values)
+        table[key] = item
+        if ReturnValues:
+            return {'Attributes': copy.deepcopy(item)}
+        return {}
+
+    def delete_item(self, TableName, Key, ConditionExpression=None, ExpressionAttributeNames=None,
+                    ExpressionAttributeValues=None, **kwargs):
+        self.check_failure('delete_item')
+        table = self.table(TableName)
+        key = self.key_of(TableName, Key)
+        if not self.condition_holds(table.get(key), ConditionExpression, ExpressionAttributeNames or {},
+                                    ExpressionAttributeValues or {}):
+            raise client_error('ConditionalCheckFailedException', 'The conditional request failed', 'DeleteItem')
+        table.pop(key, None)
+        return {}
+
+    def transact_write_items(self, TransactItems):
+        self.check_failure('transact_write_items')
+        if len(TransactItems) > 100:
+            raise client_error('ValidationException', 'Member must have length less than or equal to 100')
+        reasons = []
+        for transact_item in TransactItems:
+            (operation, request), = transact_item.items()
+            table_name = request['TableName']
+            key = self.key_of(table_name, request['Item'] if operation == 'Put' else request['Key'])
+            holds = self.condition_holds(
+                self.table(table_name).get(key), request.get('ConditionExpression'),
+                request.get('ExpressionAttributeNames', {}), request.get('ExpressionAttributeValues', {})
+            )
+            reasons.append({'Code': 'None'} if holds else {'Code': 'ConditionalCheckFailed'})
+        if any(reason['Code'] != 'None' for reason in reasons):
+            raise client_error(
+                'TransactionCanceledException', 'Transaction cancelled', 'TransactWriteItems',
+                CancellationReasons=reasons
+            )
+        for transact_item in TransactItems:
+            (operation, request), = transact_item.items()
+            table_name = request['TableName']
+            if operation == 'Put':
+                self.put(table_name, request['Item'])
+            elif operation == 'Delete':
+                self.table(table_name).pop(self.key_of(table_name, request['Key']), None)
+            elif operation == 'Update':
+                key = self.key_of(table_name, request['Key'])
+                item = copy.deepcopy(self.table(table_name).get(key) or request['Key'])
+                self.apply_update(
+                    item, request['UpdateExpression'], request.get('ExpressionAttributeNames', {}),
+                    request.get('ExpressionAttributeValues', {})
+                )
+                self.table(table_name)[key] = item
+        return {}
+
+    def batch_get_item(self, RequestItems):
+        self.check_failure('batch_get_item')
+        if sum(len(request['Keys']) for request in RequestItems.values()) > 100:
+            raise client_error('ValidationException', 'Too many items requested for the BatchGetItem call')
+        hold_back = self.unprocessed.pop(0) if self.unprocessed else 0
+        responses = {}
+        unprocessed = {}
+        for table_name, request in RequestItems.items():
+            for key in request['Keys']:
+                if hold_back:
+                    hold_back -= 1
+                    unprocessed.setdefault(table_name, {'Keys': []})['Keys'].append(key)
+                    continue
+                item = self.table(table_name).get(self.key_of(table_name, key))
+                if item is not None:
+                    responses.setdefault(table_name, []).append(copy.deepcopy(item))
+        return {'Responses': responses, 'UnprocessedKeys': unprocessed}
+
+    def batch_write_item(self, RequestItems):
+        self.check_failure('batch_write_item')
+        if sum(len(requests) for requests in RequestItems.values()) > 25:
+            raise client_error('ValidationException', 'Too many items requested for the BatchWriteItem call')
+        hold_back = self.unprocessed.pop(0) if self.unprocessed else 0
+        unprocessed = {}
+        for table_name, requests in RequestItems.items():
+            for request in requests:
+                if hold_back:
+                    hold_back -= 1
+                    unprocessed.setdefault(table_name, []).append(request)
+                    continue
+                if 'PutRequest' in request:
+                    self.put(table_name, request['PutRequest']['Item'])
+                else:
+                    self.table(table_name).pop(self.key_of(table_name, request['DeleteRequest']['Key']), None)
+        return {'UnprocessedItems': unprocessed}
+
+    def query(self, TableName, KeyConditionExpression, ExpressionAttributeValues, ExpressionAttributeNames=None,
+              ScanIndexForward=True, Limit=None, ExclusiveStartKey=None, ProjectionExpression=None, **kwargs):
+        self.check_failure('query')
+        hash_key, range_key = (self.key_attributes(TableName) + [None])[:2]
+        match = re.fullmatch(
+            r'(\w+) = (:\w+)(?: AND (\w+) BETWEEN (:\w+) AND (:\w+))?', KeyConditionExpression.strip()
+        )
+        hash_value = ExpressionAttributeValues[match.group(2)]
+        items = [item for item in self.items(TableName) if item.get(hash_key) == hash_value]
+        if match.group(3):
+            low = float(ExpressionAttributeValues[match.group(4)]['N'])
+            high = float(ExpressionAttributeValues[match.group(5)]['N'])
+            items = [item for item in items if low <= float(item[range_key]['N']) <= high]
+        if range_key:
+            items.sort(key=lambda item: comparable(item[range_key]), reverse=not ScanIndexForward)
+        if ExclusiveStartKey:
+            keys = [self.key_of(TableName, item) for item in items]
+            items = items[keys.index(self.key_of(TableName, ExclusiveStartKey)) + 1:]
+        response = {}
+        if Limit is not None and len(items) > Limit:
+            items = items[:Limit]
+            response['LastEvaluatedKey'] = {a: items[-1][a] for a in self.key_attributes(TableName)}
+        names = ExpressionAttributeNames or {}
+        response['Items'] = [self.project(item, ProjectionExpression, names) for item in items]
+        response['Count'] = len(items)
+        return response
+
+
+class FakeRoute53:
+    """
+    Hosted zone records by (name, type), rejecting DELETEs of missing records the way Route53 does. Each change is
+    INSYNC as soon as it is made, except that the next unsynced waits time out.
+    """
+
+    def __init__(self):
+        self.records = {}
+        self.requests = []
+        self.failures = []
+        self.waits = []
+        self.unsynced = 0
+
+    def get_waiter(self, waiter_name):
+        route53 = self
+
+        class Waiter:
+
+            def wait(self, Id, WaiterConfig=None):
+                route53.waits.append(Id)
+                if route53.unsynced:
+                    route53.unsynced -= 1
+                    raise botocore.exceptions.WaiterError(waiter_name, 'Max attempts exceeded', {})
+
+        return Waiter()
+
+    def change_resource_record_sets(self, HostedZoneId, ChangeBatch):
+        self.requests.append(ChangeBatch['Changes'])
+        if self.failures:
+            error = self.failures.pop(0)
+            if error is not None:
+                raise error
+        missing = []
+        for change in ChangeBatch['Changes']:
+            record = change['ResourceRecordSet']
+            key = (HostedZoneId, record['Name'].rstrip('.').lower(), record['Type'])
+            if change['Action'] == 'DELETE' and key not in self.records:
+                missing.append(
+                    f"Tried to delete resource record set [name='{record['Name']}.', type='{record['Type']}'] but it "
+                    f"was not found"
+                )
+        if missing:
+            raise client_error('InvalidChangeBatch', f'[{", ".join(missing)}]', 'ChangeResourceRecordSets')
+        for change in ChangeBatch['Changes']:
+            record = change['ResourceRecordSet']
+            key = (HostedZoneId, record['Name'].rstrip('.').lower(), record['Type'])
+            if change['Action'] == 'DELETE':
+                del self.records[key]
+            else:
+                self.records[key] = [r['Value'] for r in record['ResourceRecords']]
+        return {'ChangeInfo': {'Id': f'change{len(self.requests)}', 'Status': 'PENDING'}}
+
+
+class FakeECS:
+    """
+    Launches tasks with sequential ARNs. Each entry of capacity_failures makes one launch return only a failure, as
+    does launching a task whose task_name tag is in task_failures.
+    """
+
+    def __init__(self):
+        self.running = set()
+        self.stopped = {}
+        self.launched = 0
+        self.capacity_failures = []
+        self.task_failures = {}
+        self.lock = threading.Lock()
+
+    def run_task(self, count=1, tags=(), **kwargs):
+        task_name = next((tag['value'] for tag in tags if tag['key'] == 'task_name'), None)
+        tasks = []
+        failures = []
+        with self.lock:
+            for _ in range(count):
+                if self.capacity_failures or task_name in self.task_failures:
+                    reason = self.task_failures.get(task_name) or self.capacity_failures.pop(0)
+                    failures.append({'arn': 'capacity', 'reason': reason})
+                    continue
+                self.launched += 1
+                task_arn = f'arn:aws:ecs:us-east-1:123456789012:task/cluster/{self.launched}'
+                self.running.add(task_arn)
+                tasks.append({'taskArn': task_arn})
+        return {'tasks': tasks, 'failures': failures}
+
+    def stop_task(self, cluster, task, reason=''):
+        self.running.discard(task)
+        self.stopped[task] = reason
+        return {}
+
+
+class FakeS3:
+    """A bucket store; failures are raised by the next puts in order, key_failures by puts to those keys"""
+
+    def __init__(self):
+        self.objects = {}
+        self.failures = []
+        self.key_failures = {}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        if Key in self.key_failures:
+            raise self.key_failures[Key]
+        if self.failures:
+            error = self.failures.pop(0)
+            if error is not None:
+                raise error
+        self.objects[(Bucket, Key)] = Body
+        return {}
+
+    def get_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise client_error('NoSuchKey', '', 'GetObject')
+        return {'Body': io.BytesIO(self.objects[(Bucket, Key)])}
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key), None)
+        return {}
@@ -0,0 +1,175 @@
+import json
+import types
+import pytest
+import task_teardown
+from fake_aws import FakeDynamoDB, FakeECS, FakeRoute53, FakeS3, client_error
+
+
+@pytest.fixture
+def batch(api_module, monkeypatch):
+    batch_execute = api_module('task_control', 'batch_execute')
+    dynamodb = FakeDynamoDB()
+    dynamodb.put('havoc-deployment', {
+        'deployment_name': {'S': 'havoc'}, 'active_resources': {'M': {'tasks': {'SS': ['None']}}}
+    })
+    dynamodb.put('havoc-task-types', {'task_type': {'S': 'nmap'}, 'task_version': {'S': '1'}})
+    for domain_name, hosted_zone in [('example.com', 'Z1'), ('example.org', 'Z2')]:
+        dynamodb.put('havoc-domains', {
+            'domain_name': {'S': domain_name}, 'hosted_zone': {'S': hosted_zone}, 'domain_status': {'S': 'ready'},
+            'tasks': {'SS': ['None']}, 'host_names': {'SS': ['None']}
+        })
+    dynamodb.put('havoc-portgroups', {
+        'portgroup_name': {'S': 'web'}, 'securitygroup_id': {'S': 'sg-1'}, 'tasks': {'SS': ['None']}
+    })
+    clients = {'dynamodb': dynamodb, 'ecs': FakeECS(), 'route53': FakeRoute53(), 's3': FakeS3()}
+    network_errors = set()
+
+    class Waiter:
+        """Gives every task a public IP from its ARN, except the tasks in network_errors"""
+
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def wait(self, ecs_task_ids):
+            return {
+                ecs_task_id: {'error': 'no network'} if ecs_task_id in network_errors
+                else {'public_ip': f'10.0.0.{ecs_task_id.rsplit("/", 1)[1]}'}
+                for ecs_task_id in ecs_task_ids
+            }
+
+    monkeypatch.setattr(batch_execute, 'TaskReadinessWaiter', Waiter)
+
+    def run_tasks(tasks):
+        task_batch = batch_execute.TaskBatch(
+            'havoc', 'subnet-1', 'sg-default', 'us-east-1', {'task_type': 'nmap', 'tasks': tasks}, 'user1', {}
+        )
+        for service, client in clients.items():
+            setattr(task_batch, f'_TaskBatch__aws_{service}_client', client)
+        response = task_batch.run_tasks()
+        body = json.loads(response['body'])
+        return response['statusCode'], body['message'], {task['task_name']: task for task in body['tasks']}
+
+    return run_tasks, clients
+
+
+batch_tasks = [
+    {'task_name': 'task1', 'task_host_name': 'www', 'task_domain_name': 'example.com', 'portgroups': ['web']},
+    {'task_name': 'task2', 'task_host_name': 'api', 'task_domain_name': 'example.com'},
+    {'task_name': 'task3', 'task_host_name': 'www', 'task_domain_name': 'example.org'}
+]
+
+
+def recorded(dynamodb):
+    """Returns the task names recorded in the tasks table, domains, portgroup and active_resources"""
+    domains = {
+        item['domain_name']['S']: (set(item['tasks']['SS']) - {'None'}, set(item['host_names']['SS']) - {'None'})
+        for item in dynamodb.items('havoc-domains')
+    }
+    return {
+        'tasks': {item['task_name']['S'] for item in dynamodb.items('havoc-tasks')},
+        'domains': domains,
+        'portgroup': set(dynamodb.get('havoc-portgroups', portgroup_name='web')['tasks']['SS']) - {'None'},
+        'active_resources': set(
+            dynamodb.get('havoc-deployment', deployment_name='havoc')['active_resources']['M']['tasks']['SS']
+        ) - {'None'}
+    }
+
+
+def test_all_tasks_launch(batch):
+    run_tasks, clients = batch
+    status_code, message, outcomes = run_tasks(batch_tasks)
+    assert (status_code, message) == (200, 'execute tasks succeeded')
+    assert {outcome['outcome'] for outcome in outcomes.values()} == {'success'}
+    assert recorded(clients['dynamodb']) == {
+        'tasks': {'task1', 'task2', 'task3'},
+        'domains': {'example.com': ({'task1', 'task2'}, {'www', 'api'}), 'example.org': ({'task3'}, {'www'})},
+        'portgroup': {'task1'},
+        'active_resources': {'task1', 'task2', 'task3'}
+    }
+    assert len(clients['route53'].records) == 3
+
+
+def test_partial_ecs_failure(batch):
+    run_tasks, clients = batch
+    clients['ecs'].task_failures['task2'] = 'RESOURCE:MEMORY'
+    status_code, message, outcomes = run_tasks(batch_tasks)
+    assert (status_code, message) == (200, 'execute tasks partially succeeded')
+    assert outcomes['task2']['outcome'] == 'failed'
+    assert 'RESOURCE:MEMORY' in outcomes['task2']['message']
+    assert recorded(clients['dynamodb'])['tasks'] == {'task1', 'task3'}
+    assert recorded(clients['dynamodb'])['domains']['example.com'] == ({'task1'}, {'www'})
+
+
+def test_dns_failure_releases_the_zone_tasks(batch):
+    run_tasks, clients = batch
+    clients['route53'].failures.append(client_error('AccessDenied'))
+    status_code, _, outcomes = run_tasks(batch_tasks)
+    assert status_code == 200
+    assert [name for name, outcome in outcomes.items() if outcome['outcome'] == 'failed'] == ['task1', 'task2']
+    assert len(clients['ecs'].running) == 1
+    assert recorded(clients['dynamodb'])['tasks'] == {'task3'}
+    assert list(clients['route53'].records) == [('Z2', 'www.example.org', 'A')]
+
+
+def test_upload_failure_deletes_the_dns_record(batch):
+    run_tasks, clients = batch
+    clients['s3'].key_failures['task1/init.txt'] = client_error('AccessDenied')
+    status_code, _, outcomes = run_tasks(batch_tasks)
+    assert status_code == 200
+    assert outcomes['task1']['outcome'] == 'failed'
+    assert len(clients['ecs'].stopped) == 1
+    assert ('Z1', 'www.example.com', 'A') not in clients['route53'].records
+    assert len(clients['route53'].records) == 2
+    assert recorded(clients['dynamodb'])['domains']['example.com'] == ({'task2'}, {'api'})
+    assert recorded(clients['dynamodb'])['portgroup'] == set()
+
+
+def test_failed_commit_releases_every_task(batch):
+    run_tasks, clients = batch
+    clients['dynamodb'].failures['transact_write_items'] = [client_error('InternalServerError')]
+    status_code, _, outcomes = run_tasks(batch_tasks)
+    assert status_code == 400
+    assert {outcome['outcome'] for outcome in outcomes.values()} == {'failed'}
+    assert clients['ecs'].running == set()
+    assert clients['route53'].records == {}
+    assert recorded(clients['dynamodb']) == {
+        'tasks': set(),
+        'domains': {'example.com': (set(), set()), 'example.org': (set(), set())},
+        'portgroup': set(),
+        'active_resources': set()
+    }
+
+
+def test_cancelled_commit_is_retried_without_the_conflicting_task(batch):
+    run_tasks, clients = batch
+    dynamodb = clients['dynamodb']
+    transact_write_items = dynamodb.transact_write_items
+
+    def name_taken_concurrently(TransactItems):
+        if dynamodb.get('havoc-tasks', task_name='task2') is None:
+            dynamodb.put('havoc-tasks', {'task_name': {'S': 'task2'}, 'task_status': {'S': 'idle'}})
+        return transact_write_items(TransactItems)
+
+    dynamodb.transact_write_items = name_taken_concurrently
+    status_code, _, outcomes = run_tasks(batch_tasks)
+    assert status_code == 200
+    assert outcomes['task2'] == {'task_name': 'task2', 'outcome': 'failed', 'message': 'task2 already exists'}
+    assert recorded(dynamodb)['active_resources'] == {'task1', 'task3'}
+    assert recorded(dynamodb)['domains']['example.com'] == ({'task1'}, {'www'})
+    assert len(clients['ecs'].running) == 2
+    assert ('Z1', 'api.example.com', 'A') not in clients['route53'].records
+
+
+def test_unread_rows_after_a_cancelled_commit_release_every_task(batch, monkeypatch):
+    run_tasks, clients = batch
+    monkeypatch.setattr(task_teardown, 't', types.SimpleNamespace(sleep=lambda seconds: None))
+    dynamodb = clients['dynamodb']
+    dynamodb.failures['transact_write_items'] = [client_error('TransactionCanceledException', 'Transaction cancelled')]
+    # The pre-flight read goes through; the re-read after the cancelled commit never does
+    dynamodb.unprocessed = [0] + [1] * task_teardown.max_batch_attempts
+    status_code, _, outcomes = run_tasks(batch_tasks)
+    assert status_code == 400
+    assert all('still unprocessed' in outcome['message'] for outcome in outcomes.values())
+    assert clients['ecs'].running == set()
+    assert clients['route53'].records == {}
+    assert recorded(dynamodb)['tasks'] == set()
@@ -0,0 +1,71 @@
+import botocore.exceptions
+import dns_changes
+
+
+class FakeRoute53:
+    """Rejects a whole batch whose DELETEs target missing records, naming them the way Route53 does"""
+
+    def __init__(self, records, name_missing=True):
+        self.records = records
+        self.name_missing = name_missing
+        self.requests = []
+
+    def change_resource_record_sets(self, HostedZoneId, ChangeBatch):
+        changes = ChangeBatch['Changes']
+        self.requests.append(len(changes))
+        missing = [
+            change['ResourceRecordSet'] for change in changes
+            if change['Action'] == 'DELETE' and change['ResourceRecordSet']['Name'] not in self.records
+        ]
+        if missing:
+            if self.name_missing:
+                message = ', '.join(
+                    f"Tried to delete resource record set [name='{record['Name']}.', type='{record['Type']}'] "
+                    f"but it was not found" for record in missing
+                )
+            else:
+                message = 'one or more records were not found'
+            raise botocore.exceptions.ClientError(
+                {'Error': {'Code': 'InvalidChangeBatch', 'Message': f'[{message}]'}}, 'ChangeResourceRecordSets'
+            )
+        for change in changes:
+            if change['Action'] == 'DELETE':
+                self.records.discard(change['ResourceRecordSet']['Name'])
+            else:
+                self.records.add(change['ResourceRecordSet']['Name'])
+        return {'ChangeInfo': {'Id': f'change{len(self.requests)}'}}
+
+
+def delete_all(route53, count):
+    batcher = dns_changes.ChangeBatcher(route53)
+    for i in range(count):
+        batcher.delete('Z1', f'host{i}.example.com', 'A', '10.0.0.1')
+    return batcher.flush()
+
+
+def test_named_missing_records_are_dropped_and_the_rest_resent():
+    route53 = FakeRoute53({f'host{i}.example.com' for i in range(100) if i % 10})
+    assert delete_all(route53, 100) == 'resource_record_sets_changed'
+    assert route53.records == set()
+    assert route53.requests == [100, 90]
+
+
+def test_unnamed_missing_records_are_found_by_bisecting():
+    route53 = FakeRoute53({f'host{i}.example.com' for i in range(1, 64)}, name_missing=False)
+    assert delete_all(route53, 64) == 'resource_record_sets_changed'
+    assert route53.records == set()
+    # Only the halves holding host0 are split again: 1 + 2 * 6 requests rather than one per change.
+    assert len(route53.requests) == 13
+
+
+class DeniedRoute53:
+
+    def change_resource_record_sets(self, HostedZoneId, ChangeBatch):
+        raise botocore.exceptions.ClientError({'Error': {'Code': 'AccessDenied', 'Message': ''}}, 'ChangeResourceRecordSets')
+
+
+def test_other_errors_are_returned():
+    batcher = dns_changes.ChangeBatcher(DeniedRoute53())
+    batcher.upsert('Z1', 'www.example.com', 'A', '10.0.0.1')
+    errors = batcher.flush()
+    assert len(errors) == 1
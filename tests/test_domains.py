@@ -0,0 +1,151 @@
+import json
+import pytest
+from fake_aws import FakeDynamoDB, FakeRoute53, client_error
+
+
+class FakeACM:
+    """Issues certificates whose validation record is published straight away"""
+
+    def __init__(self):
+        self.certificates = {}
+
+    def request_certificate(self, DomainName, **kwargs):
+        certificate_arn = f'arn:aws:acm:us-east-1:123456789012:certificate/{len(self.certificates) + 1}'
+        self.certificates[certificate_arn] = DomainName
+        return {'CertificateArn': certificate_arn}
+
+    def describe_certificate(self, CertificateArn):
+        if CertificateArn not in self.certificates:
+            raise client_error('ResourceNotFoundException')
+        return {'Certificate': {'DomainValidationOptions': [{'ResourceRecord': {
+            'Name': f'_acme.{self.certificates[CertificateArn][2:]}.', 'Value': '_validation.acm-validations.aws.'
+        }}]}}
+
+    def delete_certificate(self, CertificateArn):
+        if CertificateArn not in self.certificates:
+            raise client_error('ResourceNotFoundException')
+        del self.certificates[CertificateArn]
+
+
+class FakeDomainRoute53(FakeRoute53):
+
+    def get_hosted_zone(self, Id):
+        return {'HostedZone': {'Id': Id, 'Name': 'example.com.'}}
+
+
+class FakeLambda:
+
+    def __init__(self):
+        self.errors = []
+        self.invocations = []
+
+    def invoke(self, FunctionName, InvocationType, Payload):
+        if self.errors:
+            raise self.errors.pop(0)
+        self.invocations.append(json.loads(Payload))
+        return {}
+
+
+@pytest.fixture
+def domains(api_module, monkeypatch):
+    monkeypatch.setenv('AWS_LAMBDA_FUNCTION_NAME', 'havoc-manage')
+    domains_module = api_module('manage', 'domains')
+    dynamodb = FakeDynamoDB()
+    dynamodb.put('havoc-deployment', {
+        'deployment_name': {'S': 'havoc'}, 'active_resources': {'M': {'domains': {'SS': ['None']}}}
+    })
+    clients = {'dynamodb': dynamodb, 'route53': FakeDomainRoute53(), 'acm': FakeACM(), 'lambda': FakeLambda()}
+
+    def new_domain(detail):
+        domain = domains_module.Domain('havoc', 'us-east-1', 'user1', detail, {})
+        for service, client in clients.items():
+            setattr(domain, f'_Domain__aws_{service}_client', client)
+        return domain
+
+    return new_domain, clients
+
+
+create_detail = {'domain_name': 'example.com', 'hosted_zone': 'Z1'}
+
+
+def active_domains(dynamodb):
+    return set(dynamodb.get('havoc-deployment', deployment_name='havoc')['active_resources']['M']['domains']['SS'])
+
+
+def test_create_validate_and_delete(domains):
+    new_domain, clients = domains
+    assert new_domain(dict(create_detail)).create()['statusCode'] == 200
+    assert active_domains(clients['dynamodb']) == {'None', 'example.com'}
+
+    validate_detail = clients['lambda'].invocations[0]['detail']
+    assert new_domain(validate_detail).validate_domain()['statusCode'] == 200
+    assert clients['dynamodb'].get('havoc-domains', domain_name='example.com')['domain_status']['S'] == 'ready'
+    assert list(clients['route53'].records) == [('Z1', '_acme.example.com', 'CNAME')]
+
+    assert new_domain({'domain_name': 'example.com'}).delete()['statusCode'] == 200
+    assert clients['dynamodb'].get('havoc-domains', domain_name='example.com') is None
+    assert clients['route53'].records == {}
+    assert clients['acm'].certificates == {}
+    assert active_domains(clients['dynamodb']) == {'None'}
+
+
+def test_failed_validation_invoke_rolls_back_the_create(domains):
+    new_domain, clients = domains
+    clients['lambda'].errors.append(client_error('TooManyRequestsException'))
+    assert new_domain(dict(create_detail)).create()['statusCode'] == 500
+    assert clients['dynamodb'].get('havoc-domains', domain_name='example.com') is None
+    assert clients['acm'].certificates == {}
+    assert active_domains(clients['dynamodb']) == {'None'}
+    assert new_domain(dict(create_detail)).create()['statusCode'] == 200
+
+
+def test_failed_active_resources_update_rolls_back_the_create(domains):
+    new_domain, clients = domains
+    clients['dynamodb'].failures['update_item'] = [None, client_error('InternalServerError')]
+    assert new_domain(dict(create_detail)).create()['statusCode'] == 500
+    assert clients['dynamodb'].get('havoc-domains', domain_name='example.com') is None
+    assert clients['acm'].certificates == {}
+    assert clients['lambda'].invocations == []
+
+
+def test_delete_during_validation_leaves_no_validation_record(domains):
+    new_domain, clients = domains
+    new_domain(dict(create_detail)).create()
+    validating = new_domain(clients['lambda'].invocations[0]['detail'])
+    create_validate_cert = validating.create_validate_cert
+
+    def deleted_before_the_record_is_written():
+        assert new_domain({'domain_name': 'example.com'}).delete()['statusCode'] == 200
+        return create_validate_cert()
+
+    validating.create_validate_cert = deleted_before_the_record_is_written
+    response = validating.validate_domain()
+    assert json.loads(response['body'])['message'] == 'validate domain skipped'
+    assert clients['route53'].records == {}
+    assert clients['dynamodb'].get('havoc-domains', domain_name='example.com') is None
+
+
+def test_validation_skips_a_deleted_domain(domains):
+    new_domain, clients = domains
+    new_domain(dict(create_detail)).create()
+    validate_detail = clients['lambda'].invocations[0]['detail']
+    new_domain({'domain_name': 'example.com'}).delete()
+    response = new_domain(validate_detail).validate_domain()
+    assert response['statusCode'] == 200
+    assert clients['route53'].records == {}
+
+
+def test_validation_waits_for_the_record_to_sync(domains):
+    new_domain, clients = domains
+    new_domain(dict(create_detail)).create()
+    clients['route53'].unsynced = 1
+    response = new_domain(clients['lambda'].invocations[0]['detail']).validate_domain()
+    assert json.loads(response['body'])['message'] == 'validate domain continued'
+    assert clients['dynamodb'].get('havoc-domains', domain_name='example.com')['domain_status']['S'] == \
+        'pending_validation'
+
+    # The next invocation writes the record again and finds it in sync
+    assert clients['lambda'].invocations[1]['detail']['invocation'] == 2
+    assert new_domain(clients['lambda'].invocations[1]['detail']).validate_domain()['statusCode'] == 200
+    assert clients['dynamodb'].get('havoc-domains', domain_name='example.com')['domain_status']['S'] == 'ready'
+    assert clients['route53'].waits == ['change1', 'change2']
@@ -0,0 +1,147 @@
+import json
+import types
+import pytest
+import task_teardown
+from fake_aws import FakeDynamoDB, FakeECS, FakeRoute53, FakeS3, client_error
+
+
+class FakeLambda:
+
+    def __init__(self, error=None):
+        self.error = error
+        self.invocations = []
+
+    def invoke(self, FunctionName, InvocationType, Payload):
+        if self.error:
+            raise self.error
+        self.invocations.append(json.loads(Payload))
+        return {}
+
+
+@pytest.fixture
+def launch(api_module):
+    execute = api_module('task_control', 'execute')
+    dynamodb = FakeDynamoDB()
+    dynamodb.put('havoc-deployment', {
+        'deployment_name': {'S': 'havoc'}, 'active_resources': {'M': {'tasks': {'SS': ['None']}}}
+    })
+    dynamodb.put('havoc-task-types', {'task_type': {'S': 'nmap'}, 'task_version': {'S': '1'}})
+    dynamodb.put('havoc-domains', {
+        'domain_name': {'S': 'example.com'}, 'hosted_zone': {'S': 'Z1'}, 'domain_status': {'S': 'ready'},
+        'tasks': {'SS': ['None']}, 'host_names': {'SS': ['None']}
+    })
+    dynamodb.put('havoc-portgroups', {
+        'portgroup_name': {'S': 'web'}, 'securitygroup_id': {'S': 'sg-1'}, 'tasks': {'SS': ['None']}
+    })
+    clients = {'dynamodb': dynamodb, 'ecs': FakeECS(), 'route53': FakeRoute53(), 's3': FakeS3(), 'lambda': FakeLambda()}
+
+    def new_task(detail, task_name='task1', public_ip='1.2.3.4'):
+        task = execute.Task('havoc', task_name, 'subnet-1', 'sg-default', 'us-east-1', detail, 'user1', {},
+                            function_arn='arn:aws:lambda:us-east-1:123456789012:function:havoc-task-control')
+        for service, client in clients.items():
+            setattr(task, f'_Task__aws_{service}_client', client)
+
+        def wait_for_task_network(ecs_task_id, timeout):
+            task.public_ip = public_ip
+            return 'task_network_ready'
+        task.wait_for_task_network = wait_for_task_network
+        return task
+
+    return new_task, clients
+
+
+run_detail = {
+    'task_type': 'nmap', 'task_host_name': 'www', 'task_domain_name': 'example.com', 'portgroups': ['web']
+}
+
+
+def assert_nothing_reserved(dynamodb):
+    assert dynamodb.get('havoc-domains', domain_name='example.com')['host_names']['SS'] == ['None']
+    assert dynamodb.get('havoc-domains', domain_name='example.com')['tasks']['SS'] == ['None']
+    assert dynamodb.get('havoc-portgroups', portgroup_name='web')['tasks']['SS'] == ['None']
+    assert dynamodb.get('havoc-deployment', deployment_name='havoc')['active_resources']['M']['tasks']['SS'] == ['None']
+
+
+def test_run_task(launch):
+    new_task, clients = launch
+    response = new_task(dict(run_detail)).run_task()
+    assert response['statusCode'] == 200
+    dynamodb = clients['dynamodb']
+    assert dynamodb.get('havoc-tasks', task_name='task1')['task_status']['S'] == 'starting'
+    assert dynamodb.get('havoc-domains', domain_name='example.com')['host_names']['SS'] == ['www']
+    assert clients['route53'].records == {('Z1', 'www.example.com', 'A'): ['1.2.3.4']}
+
+
+def test_capacity_failure_is_reported(launch):
+    new_task, clients = launch
+    clients['ecs'].capacity_failures.append('RESOURCE:FARGATE')
+    response = new_task(dict(run_detail)).run_task()
+    assert response['statusCode'] == 500
+    assert 'RESOURCE:FARGATE' in json.loads(response['body'])['message']
+    assert_nothing_reserved(clients['dynamodb'])
+
+
+def test_task_name_is_reserved_without_memberships(launch):
+    new_task, clients = launch
+    detail = {'task_type': 'nmap'}
+    assert new_task(dict(detail)).run_task()['statusCode'] == 200
+    first_ecs_task_id = clients['dynamodb'].get('havoc-tasks', task_name='task1')['ecs_task_id']['S']
+    # A concurrent launch that passed the pre-flight read before the first one wrote its row
+    task = new_task(dict(detail))
+    task.get_preflight_entries = lambda *args: (
+        clients['dynamodb'].get('havoc-task-types', task_type='nmap'), None, None, {}
+    )
+    assert task.run_task()['statusCode'] == 500
+    assert clients['dynamodb'].get('havoc-tasks', task_name='task1')['ecs_task_id']['S'] == first_ecs_task_id
+    assert clients['ecs'].running == {first_ecs_task_id}
+
+
+def test_failed_async_startup_invoke_is_rolled_back(launch):
+    new_task, clients = launch
+    clients['lambda'].error = client_error('TooManyRequestsException')
+    response = new_task(dict(run_detail, async_startup='yes')).run_task()
+    assert response['statusCode'] == 500
+    assert clients['ecs'].running == set()
+    assert clients['dynamodb'].get('havoc-tasks', task_name='task1') is None
+    assert_nothing_reserved(clients['dynamodb'])
+
+
+def test_failed_complete_startup_releases_the_task(launch):
+    new_task, clients = launch
+    response = new_task(dict(run_detail, async_startup='yes')).run_task()
+    assert response['statusCode'] == 200
+    startup_detail = clients['lambda'].invocations[0]['detail']
+
+    clients['s3'].failures.append(client_error('AccessDenied'))
+    response = new_task(startup_detail).complete_startup(10)
+    assert response['statusCode'] == 500
+    assert clients['ecs'].running == set()
+    assert clients['route53'].records == {}
+    assert_nothing_reserved(clients['dynamodb'])
+    task_entry = clients['dynamodb'].get('havoc-tasks', task_name='task1')
+    assert task_entry['task_status']['S'] == 'terminated'
+    assert 'archived' in task_entry
+
+    # A retried invocation finds everything already released
+    clients['s3'].failures.append(client_error('AccessDenied'))
+    assert new_task(startup_detail).complete_startup(10)['statusCode'] == 500
+
+
+def test_complete_startup_raises_when_release_fails(launch):
+    new_task, clients = launch
+    new_task(dict(run_detail, async_startup='yes')).run_task()
+    startup_detail = clients['lambda'].invocations[0]['detail']
+    clients['route53'].failures.append(client_error('AccessDenied'))
+    clients['dynamodb'].failures['transact_write_items'] = [client_error('InternalServerError')]
+    with pytest.raises(RuntimeError):
+        new_task(startup_detail).complete_startup(10)
+
+
+def test_unread_preflight_entries_fail_before_launch(launch, monkeypatch):
+    new_task, clients = launch
+    monkeypatch.setattr(task_teardown, 't', types.SimpleNamespace(sleep=lambda seconds: None))
+    clients['dynamodb'].unprocessed = [1] * task_teardown.max_batch_attempts
+    response = new_task(dict(run_detail)).run_task()
+    assert response['statusCode'] == 500
+    assert 'still unprocessed' in json.loads(response['body'])['message']
+    assert clients['ecs'].launched == 0
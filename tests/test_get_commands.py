@@ -0,0 +1,91 @@
+import json
+import pytest
+from fake_aws import FakeDynamoDB
+
+
+class FakeClock:
+    """Stands in for the time module: sleeping advances the clock and runs the next scheduled callback"""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+        self.callbacks = {}
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+        callback = self.callbacks.pop(len(self.sleeps), None)
+        if callback:
+            callback()
+
+
+@pytest.fixture
+def get_commands(api_module, monkeypatch):
+    get_commands_module = api_module('remote_task', 'get_commands')
+    instruction_transport = api_module('common', 'instruction_transport')
+    clock = FakeClock()
+    monkeypatch.setattr(get_commands_module, 't', clock)
+    dynamodb = FakeDynamoDB()
+    dynamodb.put('havoc-authorizer', {'user_id': {'S': 'user1'}, 'task_name': {'S': '*'}})
+    dynamodb.put('havoc-tasks', {'task_name': {'S': 'task1'}, 'task_status': {'S': 'idle'}})
+    transport = instruction_transport.DynamoDBTransport(dynamodb, 'havoc')
+
+    def retrieve(detail):
+        retrieve_commands = get_commands_module.Retrieve('us-east-1', 'havoc', 'user1', detail, {})
+        retrieve_commands._Retrieve__aws_dynamodb_client = dynamodb
+        retrieve_commands._Retrieve__transport = transport
+        response = retrieve_commands.retrieve_commands()
+        return response['statusCode'], json.loads(response['body'])
+
+    return retrieve, transport, clock, dynamodb
+
+
+def test_commands_are_returned_in_issue_order_and_acked(get_commands):
+    retrieve, transport, _, dynamodb = get_commands
+    for seq, command in [(10, 'ls'), (2, 'Initialize'), (9, 'whoami')]:
+        transport.send('task1', {'instruct_command': command, 'timestamp': '1790000000'}, seq=seq)
+    status_code, body = retrieve({'task_name': 'task1'})
+    assert status_code == 200
+    assert [command['instruct_command'] for command in body['commands']] == ['Initialize', 'whoami', 'ls']
+    assert dynamodb.items('havoc-instruction-queue') == []
+
+
+def test_long_poll_returns_once_a_command_is_queued(get_commands):
+    retrieve, transport, clock, _ = get_commands
+    clock.callbacks[3] = lambda: transport.send('task1', {'instruct_command': 'ls', 'timestamp': '1'}, seq=1)
+    status_code, body = retrieve({'task_name': 'task1', 'wait_seconds': 20})
+    assert status_code == 200
+    assert [command['instruct_command'] for command in body['commands']] == ['ls']
+    # The poll backs off between listings
+    assert clock.sleeps == [0.25, 0.375, 0.5625]
+
+
+def test_long_poll_gives_up_after_wait_seconds(get_commands):
+    retrieve, _, clock, _ = get_commands
+    status_code, body = retrieve({'task_name': 'task1', 'wait_seconds': 60})
+    assert (status_code, 'commands' in body) == (200, False)
+    # wait_seconds is capped under API Gateway's integration timeout
+    assert clock.now == pytest.approx(25)
+    assert max(clock.sleeps) == 2
+
+
+def test_invalid_wait_seconds_are_rejected(get_commands):
+    retrieve, _, clock, _ = get_commands
+    assert retrieve({'task_name': 'task1', 'wait_seconds': 'soon'})[0] == 400
+    assert retrieve({'task_name': 'task1', 'wait_seconds': -1})[0] == 400
+    assert clock.sleeps == []
+
+
+def test_acks_still_unprocessed_fail_the_request(get_commands, monkeypatch):
+    retrieve, transport, _, dynamodb = get_commands
+    monkeypatch.setattr(type(transport), 'max_ack_attempts', 2)
+    transport.send('task1', {'instruct_command': 'ls', 'timestamp': '1'}, seq=1)
+    dynamodb.unprocessed = [1, 1]
+    status_code, body = retrieve({'task_name': 'task1'})
+    assert status_code == 500
+    assert 'still unprocessed after 2 attempts' in body['message']
+    # The command stays queued for the next poll
+    assert len(dynamodb.items('havoc-instruction-queue')) == 1
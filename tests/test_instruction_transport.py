@@ -0,0 +1,108 @@
+import io
+import json
+import botocore.exceptions
+import instruction_transport
+
+
+def test_ecs_tasks_always_use_s3():
+    transport = instruction_transport.get_task_transport('dynamodb', 'arn:aws:ecs:task/1', 'us-east-1', 'havoc')
+    assert transport.name == 's3'
+
+
+def test_remote_tasks_use_configured_transport():
+    transport = instruction_transport.get_task_transport('dynamodb', 'remote_task', 'us-east-1', 'havoc')
+    assert transport.name == 'dynamodb'
+    transport = instruction_transport.get_task_transport('s3', 'remote_task', 'us-east-1', 'havoc')
+    assert transport.name == 's3'
+
+
+class FakeDynamoDB:
+
+    def __init__(self):
+        self.items = {}
+
+    def put_item(self, TableName, Item):
+        self.items[(Item['task_name']['S'], int(Item['seq']['N']))] = Item
+
+    def query(self, TableName, KeyConditionExpression, ExpressionAttributeValues, ConsistentRead, Limit):
+        task_name = ExpressionAttributeValues[':task_name']['S']
+        keys = sorted(key for key in self.items if key[0] == task_name)[:Limit]
+        return {'Items': [self.items[key] for key in keys]}
+
+    def batch_write_item(self, RequestItems):
+        for requests in RequestItems.values():
+            for request in requests:
+                key = request['DeleteRequest']['Key']
+                self.items.pop((key['task_name']['S'], int(key['seq']['N'])), None)
+        return {}
+
+
+def test_dynamodb_queue_delivers_in_sequence_order_and_acks():
+    transport = instruction_transport.DynamoDBTransport(FakeDynamoDB(), 'havoc')
+    transport.send('task1', {'instruct_command': 'ls'}, seq=2)
+    transport.send('task1', {'instruct_command': 'Initialize'}, seq=0)
+    assert transport.pending('task1') is True
+
+    received = transport.receive('task1')
+    assert [instruction['instruct_command'] for _, instruction in received] == ['Initialize', 'ls']
+    assert transport.ack('task1', [handle for handle, _ in received]) == 'instructions_acked'
+    assert transport.pending('task1') is False
+
+
+class FakeS3:
+    """A workspace bucket that lists 1000 keys per page and counts delete_objects requests"""
+
+    def __init__(self, objects):
+        self.objects = objects
+        self.delete_requests = []
+
+    def get_paginator(self, operation_name):
+        objects = self.objects
+
+        class Paginator:
+            def paginate(self, Bucket, Prefix):
+                keys = sorted(key for key in objects if key.startswith(Prefix))
+                for i in range(0, len(keys), 1000):
+                    yield {'Contents': [{'Key': key} for key in keys[i:i + 1000]]}
+        return Paginator()
+
+    def get_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise botocore.exceptions.ClientError({'Error': {'Code': 'NoSuchKey', 'Message': ''}}, 'GetObject')
+        return {'Body': io.BytesIO(self.objects[Key])}
+
+    def delete_objects(self, Bucket, Delete):
+        self.delete_requests.append(len(Delete['Objects']))
+        for entry in Delete['Objects']:
+            self.objects.pop(entry['Key'], None)
+        return {}
+
+
+def test_s3_queue_drains_more_than_one_listing_page():
+    objects = {
+        f'task1/{timestamp}': json.dumps({'instruct_command': 'ls', 'timestamp': str(timestamp)}).encode('utf-8')
+        for timestamp in range(1600000000, 1600002500)
+    }
+    objects['task1/'] = b''
+    s3 = FakeS3(objects)
+    transport = instruction_transport.S3Transport(s3, 'havoc')
+
+    received = transport.receive('task1')
+    assert len(received) == 2500
+    assert transport.ack('task1', [handle for handle, _ in received]) == 'instructions_acked'
+    assert s3.delete_requests == [1000, 1000, 500]
+    assert s3.objects == {'task1/': b''}
+
+
+def test_s3_queue_skips_instructions_taken_by_another_poll():
+    s3 = FakeS3({'task1/1': b'{"instruct_command": "ls"}', 'task1/2': b'{"instruct_command": "pwd"}'})
+    transport = instruction_transport.S3Transport(s3, 'havoc')
+    get_instruction = transport.get_instruction
+
+    def taken_concurrently(key):
+        if key == 'task1/1':
+            s3.objects.pop(key)
+        return get_instruction(key)
+
+    transport.get_instruction = taken_concurrently
+    assert transport.receive('task1') == [('task1/2', {'instruct_command': 'pwd'})]
@@ -0,0 +1,26 @@
+def test_cache_is_cleared_when_the_epoch_moves(api_module):
+    key_cache = api_module('authorizer', 'key_cache')
+    cache = key_cache.KeyCache(epoch_check_interval=0)
+    epochs = ['1']
+    cache.check_epoch(lambda: epochs[-1])
+    cache.put('key1', {'user_id': 'user1'})
+    cache.check_epoch(lambda: epochs[-1])
+    assert cache.get('key1') == (True, {'user_id': 'user1'})
+
+    epochs.append('2')
+    cache.check_epoch(lambda: epochs[-1])
+    assert cache.get('key1') == (False, None)
+
+
+def test_epoch_is_read_at_most_once_per_interval(api_module):
+    key_cache = api_module('authorizer', 'key_cache')
+    cache = key_cache.KeyCache(epoch_check_interval=60)
+    reads = []
+
+    def read_epoch():
+        reads.append(1)
+        return '1'
+
+    for _ in range(10):
+        cache.check_epoch(read_epoch)
+    assert len(reads) == 1
@@ -0,0 +1,194 @@
+import botocore.exceptions
+import pytest
+
+
+def client_error(code, message=''):
+    return botocore.exceptions.ClientError({'Error': {'Code': code, 'Message': message}}, 'operation')
+
+
+class FakeDynamoDB:
+    """Just enough of DynamoDB for the listener's get, set and delete calls, keyed by the table's hash key value"""
+
+    def __init__(self, items):
+        self.items = items
+
+    @staticmethod
+    def key_value(Key):
+        return next(iter(Key.values()))['S']
+
+    def get_item(self, TableName, Key, **kwargs):
+        item = self.items.get((TableName, self.key_value(Key)))
+        return {'Item': item} if item is not None else {}
+
+    def update_item(self, TableName, Key, UpdateExpression, ExpressionAttributeValues, **kwargs):
+        item = self.items.setdefault((TableName, self.key_value(Key)), {})
+        if UpdateExpression.startswith('DELETE active_resources'):
+            resource_type = kwargs['ExpressionAttributeNames']['#resource_type']
+            members = item['active_resources']['M'].setdefault(resource_type, {'SS': []})['SS']
+            for name in ExpressionAttributeValues[':resource_names']['SS']:
+                if name in members:
+                    members.remove(name)
+            return {}
+        for assignment in UpdateExpression[len('set '):].split(','):
+            attribute, value = [part.strip() for part in assignment.split('=')]
+            item[attribute] = ExpressionAttributeValues[value]
+        return {}
+
+    def delete_item(self, TableName, Key, **kwargs):
+        self.items.pop((TableName, self.key_value(Key)), None)
+        return {}
+
+
+class FakeELBv2:
+
+    def __init__(self, resources):
+        self.resources = resources
+        self.fail_load_balancer_delete = False
+
+    def delete_listener(self, ListenerArn):
+        if ListenerArn not in self.resources:
+            raise client_error('ListenerNotFound')
+        self.resources.remove(ListenerArn)
+
+    def delete_target_group(self, TargetGroupArn):
+        if TargetGroupArn not in self.resources:
+            raise client_error('TargetGroupNotFound')
+        self.resources.remove(TargetGroupArn)
+
+    def delete_load_balancer(self, LoadBalancerArn):
+        if self.fail_load_balancer_delete:
+            raise client_error('ResourceInUse')
+        self.resources.discard(LoadBalancerArn)
+
+
+class FakeRoute53:
+
+    def __init__(self, records):
+        self.records = records
+
+    def change_resource_record_sets(self, HostedZoneId, ChangeBatch):
+        for change in ChangeBatch['Changes']:
+            name = change['ResourceRecordSet']['Name']
+            if change['Action'] == 'DELETE' and name not in self.records:
+                raise client_error('InvalidChangeBatch', f'Tried to delete resource record set [name={name}] but it was not found')
+        for change in ChangeBatch['Changes']:
+            self.records.discard(change['ResourceRecordSet']['Name'])
+        return {'ChangeInfo': {'Id': 'change1'}}
+
+
+@pytest.fixture
+def listener_setup(api_module, monkeypatch):
+    for name in ['VPC_ID', 'SUBNET_0', 'SUBNET_1', 'SECURITY_GROUP']:
+        monkeypatch.setenv(name, 'test')
+    listeners = api_module('manage', 'listeners')
+    listener_config = (
+        '{"80": {"listener_type": "HTTP", "target_group_arn": "tg80", "listener_arn": "l80"}, '
+        '"443": {"listener_type": "HTTPS", "target_group_arn": "tg443", "listener_arn": "l443"}}'
+    )
+    items = {
+        ('havoc-listeners', 'web'): {
+            'listener_name': {'S': 'web'}, 'load_balancer_arn': {'S': 'lb'}, 'load_balancer_dns_name': {'S': 'lb.aws'},
+            'certificate_arn': {'S': 'cert'}, 'task_name': {'S': 'task1'}, 'target_ip': {'S': '10.0.0.1'},
+            'host_name': {'S': 'www'}, 'domain_name': {'S': 'example.com'}, 'portgroups': {'SS': ['web_pg']},
+            'listener_config': {'S': listener_config}
+        },
+        ('havoc-domains', 'example.com'): {
+            'hosted_zone': {'S': 'Z1'}, 'listeners': {'SS': ['web', 'other']}, 'host_names': {'SS': ['www', 'api']}
+        },
+        ('havoc-portgroups', 'web_pg'): {'listeners': {'SS': ['web']}},
+        ('havoc-tasks', 'task1'): {'listeners': {'SS': ['web']}},
+        ('havoc-deployment', 'havoc'): {'active_resources': {'M': {'listeners': {'SS': ['web']}}}}
+    }
+    dynamodb = FakeDynamoDB(items)
+    elbv2 = FakeELBv2({'lb', 'tg80', 'l80', 'tg443', 'l443'})
+    route53 = FakeRoute53({'www.example.com'})
+
+    def new_listener():
+        listener = listeners.Listener('havoc', 'us-east-1', 'user1', {'listener_name': 'web'}, {})
+        listener.listener_name = 'web'
+        listener._Listener__aws_dynamodb_client = dynamodb
+        listener._Listener__aws_elbv2_client = elbv2
+        listener._Listener__aws_route53_client = route53
+        return listener
+
+    return new_listener, dynamodb, elbv2, route53
+
+
+def test_partially_failed_delete_can_be_run_again(listener_setup):
+    new_listener, dynamodb, elbv2, route53 = listener_setup
+    elbv2.fail_load_balancer_delete = True
+    assert new_listener().delete_listener() != 'listener_deleted'
+    # The domain and ports were already released by the failed run
+    assert dynamodb.items[('havoc-domains', 'example.com')]['listeners']['SS'] == ['other']
+    assert route53.records == set()
+
+    elbv2.fail_load_balancer_delete = False
+    assert new_listener().delete_listener() == 'listener_deleted'
+    assert elbv2.resources == set()
+    assert dynamodb.items[('havoc-domains', 'example.com')]['host_names']['SS'] == ['api']
+    assert dynamodb.items[('havoc-portgroups', 'web_pg')]['listeners']['SS'] == ['None']
+    assert dynamodb.items[('havoc-tasks', 'task1')]['listeners']['SS'] == ['None']
+    assert ('havoc-listeners', 'web') not in dynamodb.items
+
+
+def test_rollback_removes_recorded_references(listener_setup):
+    new_listener, dynamodb, elbv2, route53 = listener_setup
+    listener = new_listener()
+    listener.task_name = 'task1'
+    listener.host_name = 'www'
+    listener.domain_name = 'example.com'
+    listener.portgroups = ['web_pg']
+    listener.load_balancer_arn = 'lb'
+    listener.load_balancer_dns_name = 'lb.aws'
+    listener.listener_config = {'80': {'listener_type': 'HTTP', 'target_group_arn': 'tg80', 'listener_arn': 'l80'}}
+
+    assert listener.rollback_listener('failed') == 'failed'
+    assert elbv2.resources == {'tg443', 'l443'}
+    assert dynamodb.items[('havoc-portgroups', 'web_pg')]['listeners']['SS'] == ['None']
+    assert dynamodb.items[('havoc-domains', 'example.com')]['listeners']['SS'] == ['other']
+    assert ('havoc-listeners', 'web') not in dynamodb.items
+
+
+class FakeACM:
+
+    def __init__(self, certificates):
+        self.certificates = certificates
+
+    def describe_certificate(self, CertificateArn):
+        if CertificateArn not in self.certificates:
+            raise client_error('ResourceNotFoundException')
+        return {'Certificate': {'Status': self.certificates[CertificateArn]['Status']}}
+
+    def get_paginator(self, operation_name):
+        certificates = self.certificates
+
+        class Paginator:
+            def paginate(self, CertificateStatuses):
+                yield {'CertificateSummaryList': [
+                    {'CertificateArn': arn, 'DomainName': certificate['DomainName']}
+                    for arn, certificate in certificates.items() if certificate['Status'] in CertificateStatuses
+                ]}
+        return Paginator()
+
+
+def test_certificate_lookup(listener_setup):
+    new_listener = listener_setup[0]
+    acm = FakeACM({
+        'old': {'DomainName': '*.example.com', 'Status': 'ISSUED'},
+        'pending': {'DomainName': '*.example.com', 'Status': 'PENDING_VALIDATION'}
+    })
+
+    def get_certificate(domain_certificate_arn=None):
+        listener = new_listener()
+        listener.domain_name = 'example.com'
+        listener._Listener__aws_acm_client = acm
+        listener.get_certificate(domain_certificate_arn)
+        return listener.certificate_arn
+
+    # A domain's own certificate that is still pending is never replaced by another match
+    assert get_certificate('pending') is None
+    assert get_certificate() == 'old'
+    # A cached certificate that was deleted is not reused
+    del acm.certificates['old']
+    acm.certificates['new'] = {'DomainName': '*.example.com', 'Status': 'ISSUED'}
+    assert get_certificate() == 'new'
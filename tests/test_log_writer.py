@@ -0,0 +1,119 @@
+import types
+import pytest
+import log_writer
+from fake_aws import client_error
+
+
+class ResourceAlreadyExistsException(Exception):
+    pass
+
+
+class FakeLogs:
+    """Log streams of one group; each entry of failures is raised by the next put_log_events call"""
+
+    exceptions = types.SimpleNamespace(ResourceAlreadyExistsException=ResourceAlreadyExistsException)
+
+    def __init__(self):
+        self.streams = {}
+        self.created = []
+        self.puts = []
+        self.failures = []
+
+    def create_log_stream(self, logGroupName, logStreamName):
+        self.created.append(logStreamName)
+        if logStreamName in self.streams:
+            raise ResourceAlreadyExistsException()
+        self.streams[logStreamName] = []
+
+    def put_log_events(self, logGroupName, logStreamName, logEvents):
+        self.puts.append((logStreamName, len(logEvents)))
+        if self.failures:
+            raise self.failures.pop(0)
+        if logStreamName not in self.streams:
+            raise client_error('ResourceNotFoundException', 'The specified log stream does not exist.')
+        self.streams[logStreamName].extend(logEvents)
+        return {'nextSequenceToken': '1'}
+
+
+@pytest.fixture
+def logs(monkeypatch):
+    monkeypatch.setattr(log_writer, '_known_streams', set())
+    sleeps = []
+    monkeypatch.setattr(log_writer, 't', types.SimpleNamespace(sleep=sleeps.append))
+    return FakeLogs(), sleeps
+
+
+def test_events_are_written_in_order_with_one_call_per_stream(logs):
+    aws_logs_client, _ = logs
+    writer = log_writer.LogWriter(aws_logs_client, 'havoc/task_results_logging')
+    for timestamp in [3000, 1000, 2000]:
+        writer.add('task1', timestamp, f'event {timestamp}')
+    writer.add('task2', 1000, 'event')
+    assert writer.flush() == 'log_events_written'
+    assert [event['timestamp'] for event in aws_logs_client.streams['task1']] == [1000, 2000, 3000]
+    assert aws_logs_client.puts == [('task1', 3), ('task2', 1)]
+    assert writer.flush() == 'log_events_written'
+    assert len(aws_logs_client.puts) == 2
+
+
+def test_batches_stay_within_the_put_log_events_limits():
+    writer = log_writer.LogWriter(None, 'group')
+    events = [{'timestamp': i, 'message': 'x'} for i in range(log_writer.max_batch_events + 1)]
+    assert [len(batch) for batch in writer.batches(events)] == [log_writer.max_batch_events, 1]
+
+    message = 'x' * (300 * 1024)
+    events = [{'timestamp': i, 'message': message} for i in range(4)]
+    assert [len(batch) for batch in writer.batches(events)] == [3, 1]
+
+    day = 24 * 60 * 60 * 1000
+    events = [{'timestamp': 0, 'message': 'x'}, {'timestamp': day, 'message': 'x'}, {'timestamp': day + 1, 'message': 'x'}]
+    assert [len(batch) for batch in writer.batches(events)] == [2, 1]
+
+
+def test_streams_are_created_once_per_container(logs):
+    aws_logs_client, _ = logs
+    aws_logs_client.streams['task1'] = []
+    for _ in range(2):
+        writer = log_writer.LogWriter(aws_logs_client, 'group')
+        writer.add('task1', 1000, 'event')
+        assert writer.flush() == 'log_events_written'
+    assert aws_logs_client.created == ['task1']
+    assert len(aws_logs_client.streams['task1']) == 2
+
+
+def test_a_deleted_stream_is_created_again(logs):
+    aws_logs_client, sleeps = logs
+    writer = log_writer.LogWriter(aws_logs_client, 'group')
+    writer.add('task1', 1000, 'event')
+    writer.flush()
+    del aws_logs_client.streams['task1']
+    writer.add('task1', 2000, 'event')
+    assert writer.flush() == 'log_events_written'
+    assert aws_logs_client.created == ['task1', 'task1']
+    assert sleeps == []
+
+
+def test_throttled_puts_are_retried_with_backoff(logs):
+    aws_logs_client, sleeps = logs
+    aws_logs_client.failures = [client_error('ThrottlingException')] * 2
+    writer = log_writer.LogWriter(aws_logs_client, 'group')
+    writer.add('task1', 1000, 'event')
+    assert writer.flush() == 'log_events_written'
+    assert len(sleeps) == 2
+
+    aws_logs_client.failures = [client_error('ThrottlingException')] * 5
+    writer.add('task1', 2000, 'event')
+    assert writer.flush().response['Error']['Code'] == 'ThrottlingException'
+    assert len(aws_logs_client.streams['task1']) == 1
+
+
+def test_flush_reports_the_first_error_and_writes_the_other_streams(logs):
+    aws_logs_client, sleeps = logs
+    aws_logs_client.failures = [client_error('AccessDeniedException')]
+    writer = log_writer.LogWriter(aws_logs_client, 'group')
+    writer.add('task1', 1000, 'event')
+    writer.add('task2', 1000, 'event')
+    assert writer.flush().response['Error']['Code'] == 'AccessDeniedException'
+    assert aws_logs_client.streams['task1'] == []
+    assert len(aws_logs_client.streams['task2']) == 1
+    assert sleeps == []
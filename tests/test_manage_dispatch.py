@@ -0,0 +1,56 @@
+import json
+import os
+import subprocess
+import sys
+import pytest
+from conftest import api_root
+
+# The manage function must stay cheap to load: none of its resource modules (or boto3) are imported at cold start.
+cold_start_budget_seconds = 0.25
+
+cold_start_script = '''
+import json, sys, time
+start = time.perf_counter()
+import lambda_function
+elapsed = time.perf_counter() - start
+loaded = sorted(name for name, _ in lambda_function.resource_handlers.values() if name in sys.modules)
+print(json.dumps({'elapsed': elapsed, 'loaded': loaded, 'boto3': 'boto3' in sys.modules}))
+'''
+
+
+def cold_start():
+    """Imports the manage lambda_function in a fresh interpreter and reports what the import loaded"""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([os.path.join(api_root, 'manage'), os.path.join(api_root, 'common')]))
+    output = subprocess.run(
+        [sys.executable, '-c', cold_start_script], env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output)
+
+
+def test_cold_start_imports_no_resource_modules():
+    loaded = cold_start()
+    assert loaded['loaded'] == []
+    assert loaded['boto3'] is False
+
+
+@pytest.mark.benchmark
+def test_cold_start_benchmark():
+    elapsed = min(cold_start()['elapsed'] for _ in range(3))
+    print(f'manage cold start import: {elapsed * 1000:.1f} ms')
+    assert elapsed < cold_start_budget_seconds
+
+
+class Context:
+    invoked_function_arn = 'arn:aws:lambda:us-east-1:123456789012:function:havoc-manage'
+
+
+def test_invalid_requests_are_rejected_before_dispatch(api_module, monkeypatch):
+    monkeypatch.setenv('DEPLOYMENT_NAME', 'havoc')
+    lambda_function = api_module('manage', 'lambda_function')
+    event = {'requestContext': {'authorizer': {'user_id': 'user1'}}}
+
+    event['body'] = json.dumps({'command': 'list', 'resource': 'nothing'})
+    assert lambda_function.lambda_handler(event, Context())['statusCode'] == 400
+    event['body'] = json.dumps({'command': 'drop', 'resource': 'task'})
+    assert lambda_function.lambda_handler(event, Context())['statusCode'] == 400
+    assert lambda_function.lambda_handler({'action': 'delete_everything'}, Context())['statusCode'] == 400
@@ -0,0 +1,68 @@
+import json
+import math
+import time
+import pytest
+import payload_codec
+import result_pages
+
+# Encoding and decoding a 400 KB result must stay well inside a Lambda invocation's budget.
+round_trip_budget_seconds = 0.1
+# A strongly consistent read consumes one read capacity unit per 4 KB of item, an eventually consistent read half that.
+read_unit_bytes = 4 * 1024
+output_attribute = 'instruct_command_output'
+
+
+def shell_output(size):
+    lines = [f'-rw-r--r-- 1 root root {i:8d} Jan  1 00:00 file_{i:06d}.txt' for i in range(size // 50)]
+    return json.dumps({'outcome': 'success', 'results': lines})
+
+
+def test_small_payloads_stay_strings():
+    small = json.dumps('x' * (payload_codec.min_compress_bytes - 3))
+    assert payload_codec.encode(small) == {'S': small}
+    assert 'B' in payload_codec.encode(json.dumps('x' * payload_codec.min_compress_bytes))
+
+
+def test_payloads_read_back_through_get_results():
+    output_json = shell_output(20 * 1024)
+    value = payload_codec.encode(output_json)
+    assert 'B' in value and payload_codec.is_encoded(value['B'])
+    assert result_pages.unpack_attribute(value) == output_json
+    assert result_pages.unpack_attribute({'S': output_json}) == output_json
+    # Binary attributes that weren't written by the codec are returned base64 encoded, on their own or in a map
+    assert result_pages.unpack_attribute({'B': b'raw'}) == 'cmF3'
+    args = result_pages.unpack_attribute({'M': {'key': {'B': b'raw'}, 'output': value, 'flag': {'BOOL': True}}})
+    assert json.loads(json.dumps(args)) == {'key': 'cmF3', 'output': output_json, 'flag': True}
+
+
+def read_cost(value):
+    """Returns the bytes the output attribute adds to a queue row and the read units a strong read of it consumes"""
+    item_bytes = len(output_attribute) + payload_codec.attribute_size(value)
+    return item_bytes, math.ceil(item_bytes / read_unit_bytes)
+
+
+def test_compression_cuts_read_units():
+    # Command output is repetitive text, so it is stored, and read back, in a fraction of its size.
+    output_json = shell_output(100 * 1024)
+    plain_bytes, plain_units = read_cost({'S': output_json})
+    encoded_bytes, encoded_units = read_cost(payload_codec.encode(output_json))
+    assert encoded_bytes * 4 < plain_bytes
+    assert encoded_units * 4 < plain_units
+
+
+@pytest.mark.benchmark
+def test_codec_benchmark():
+    output_json = shell_output(400 * 1024)
+    timings = []
+    for _ in range(3):
+        start = time.perf_counter()
+        value = payload_codec.encode(output_json)
+        assert payload_codec.decode(value) == output_json
+        timings.append(time.perf_counter() - start)
+    plain_bytes, plain_units = read_cost({'S': output_json})
+    encoded_bytes, encoded_units = read_cost(value)
+    print(f'400 KB result round trip: {min(timings) * 1000:.1f} ms')
+    print(f'bytes read: {plain_bytes} plain, {encoded_bytes} compressed')
+    print(f'read units (strong/eventual): {plain_units}/{plain_units / 2} plain, '
+          f'{encoded_units}/{encoded_units / 2} compressed')
+    assert min(timings) < round_trip_budget_seconds
@@ -0,0 +1,60 @@
+import pytest
+import resource_registry
+from fake_aws import FakeDynamoDB
+
+
+@pytest.fixture
+def dynamodb():
+    dynamodb = FakeDynamoDB()
+    dynamodb.put('havoc-deployment', {
+        'deployment_name': {'S': 'havoc'},
+        'active_resources': {'M': {'tasks': {'SS': ['None']}, 'domains': {'SS': ['None', 'example.com']}}}
+    })
+    return dynamodb
+
+
+def active_resources(dynamodb):
+    return dynamodb.get('havoc-deployment', deployment_name='havoc')['active_resources']['M']
+
+
+def test_members_are_added_and_removed_without_reading_the_set(dynamodb):
+    assert resource_registry.add_active_resources(dynamodb, 'havoc', 'tasks', ['task1', 'task2']) == 'deployment_updated'
+    assert resource_registry.add_active_resources(dynamodb, 'havoc', 'tasks', 'task3') == 'deployment_updated'
+    assert resource_registry.remove_active_resources(dynamodb, 'havoc', 'tasks', 'task2') == 'deployment_updated'
+    assert set(active_resources(dynamodb)['tasks']['SS']) == {'None', 'task1', 'task3'}
+    # Other resource types are untouched, and each change is a single UpdateItem
+    assert active_resources(dynamodb)['domains'] == {'SS': ['None', 'example.com']}
+    assert dynamodb.calls == ['update_item'] * 3
+
+
+def test_placeholder_and_duplicate_names_are_not_sent(dynamodb):
+    resource_registry.add_active_resources(dynamodb, 'havoc', 'tasks', ['task1', 'task1', 'None'])
+    assert resource_registry.remove_active_resources(dynamodb, 'havoc', 'tasks', ['None']) == 'deployment_updated'
+    assert dynamodb.calls == ['update_item']
+    assert set(active_resources(dynamodb)['tasks']['SS']) == {'None', 'task1'}
+
+
+def test_a_set_emptied_by_delete_can_be_added_to_again(dynamodb):
+    resource_registry.add_active_resources(dynamodb, 'havoc', 'listeners', 'listener1')
+    resource_registry.remove_active_resources(dynamodb, 'havoc', 'listeners', 'listener1')
+    # DynamoDB removes a set once its last member is deleted
+    assert 'listeners' not in active_resources(dynamodb)
+    assert resource_registry.list_active_resources(active_resources(dynamodb), ['listeners']) == {'listeners': ['None']}
+    assert resource_registry.add_active_resources(dynamodb, 'havoc', 'listeners', 'listener2') == 'deployment_updated'
+    assert resource_registry.list_active_resources(active_resources(dynamodb)) == {
+        'tasks': ['None'], 'domains': ['example.com'], 'listeners': ['listener2']
+    }
+
+
+def test_missing_deployment_row_is_not_created():
+    dynamodb = FakeDynamoDB()
+    error = resource_registry.add_active_resources(dynamodb, 'havoc', 'tasks', 'task1')
+    assert error.response['Error']['Code'] == 'ConditionalCheckFailedException'
+    assert dynamodb.items('havoc-deployment') == []
+
+
+def test_list_normalizes_the_placeholder():
+    listed = resource_registry.list_active_resources({
+        'tasks': {'SS': ['task2', 'None', 'task1']}, 'domains': {'SS': ['None']}
+    }, ['tasks', 'domains', 'listeners'])
+    assert listed == {'tasks': ['task1', 'task2'], 'domains': ['None'], 'listeners': ['None']}
@@ -0,0 +1,58 @@
+import json
+import time
+import pytest
+import result_envelope
+
+
+def shell_results_payload(size):
+    """A get_shell_command_results payload with about size bytes of command output"""
+    lines = [f'drwxr-xr-x 2 root root 4096 Jan  1 00:00 directory_{i:06d}' for i in range(size // 50)]
+    return {
+        'instruct_command': 'get_shell_command_results', 'instruct_id': 'abc123', 'instruct_instance': 'shell1',
+        'instruct_command_output': {'outcome': 'success', 'results': lines}
+    }
+
+
+def legacy_message(payload):
+    return f'2023-01-01 00:00:00+0000 [-] {payload!r}'
+
+
+def test_every_result_format_parses():
+    payload = shell_results_payload(2000)
+    assert result_envelope.parse_result(result_envelope.build_envelope(payload)) == payload
+    assert result_envelope.parse_result(result_envelope.build_envelope(payload, compress=True)) == payload
+    assert result_envelope.parse_result(json.dumps(payload)) == payload
+    assert result_envelope.parse_result(legacy_message(payload)) == payload
+
+
+def test_bad_results_are_rejected():
+    for message in ['starting task', '[1, 2]', '{"havoc_result": 2, "payload": {}}', '{"havoc_result": 1, "body": ""}']:
+        with pytest.raises(ValueError):
+            result_envelope.parse_result(message)
+
+
+def best_parse_time(message, rounds=3):
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        result_envelope.parse_result(message)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def test_large_results_parse():
+    payload = shell_results_payload(400 * 1024)
+    envelope = result_envelope.build_envelope(payload)
+    assert len(envelope) > 400 * 1024
+    assert result_envelope.parse_result(envelope) == payload
+    assert result_envelope.parse_result(legacy_message(payload)) == payload
+
+
+@pytest.mark.benchmark
+def test_envelope_parse_benchmark():
+    # A 400 KB result parses several times faster as an envelope than through the legacy literal_eval path.
+    payload = shell_results_payload(400 * 1024)
+    envelope_seconds = best_parse_time(result_envelope.build_envelope(payload))
+    legacy_seconds = best_parse_time(legacy_message(payload))
+    print(f'400 KB result parse: envelope {envelope_seconds * 1000:.1f} ms, legacy {legacy_seconds * 1000:.1f} ms')
+    assert envelope_seconds * 3 < legacy_seconds
@@ -0,0 +1,60 @@
+import pytest
+import result_pages
+
+
+class FakeQueue:
+    """A DynamoDB query over one partition of items sorted by run_time, honouring Limit and ExclusiveStartKey"""
+
+    def __init__(self, count, page_size=3):
+        self.items = [{'task_name': {'S': 'task1'}, 'run_time': {'N': str(i)}} for i in range(count)]
+        self.page_size = page_size
+
+    def query(self, **kwargs):
+        items = self.items if kwargs['ScanIndexForward'] else list(reversed(self.items))
+        if 'ExclusiveStartKey' in kwargs:
+            start = items.index(kwargs['ExclusiveStartKey']) + 1
+            items = items[start:]
+        page = items[:min(kwargs.get('Limit', self.page_size), self.page_size)]
+        response = {'Items': page}
+        if len(page) < len(items):
+            response['LastEvaluatedKey'] = page[-1]
+        return response
+
+
+def run_times(items):
+    return [int(item['run_time']['N']) for item in items]
+
+
+def test_unpaged_request_returns_everything_oldest_first():
+    limit, next_token, newest_first = result_pages.parse_page_detail({}, opt_in=True)
+    assert (limit, next_token, newest_first) == (None, None, False)
+    items, next_token = result_pages.query_results(FakeQueue(10), {}, ['task_name', 'run_time'], limit,
+                                                   newest_first=newest_first)
+    assert run_times(items) == list(range(10))
+    assert next_token is None
+
+
+def test_paged_request_follows_next_token():
+    queue = FakeQueue(10)
+    limit, _, newest_first = result_pages.parse_page_detail({'limit': 4}, opt_in=True)
+    assert newest_first is True
+    collected = []
+    start_key = None
+    while True:
+        items, next_token = result_pages.query_results(queue, {}, ['task_name', 'run_time'], limit,
+                                                       start_key=start_key, newest_first=newest_first)
+        assert len(items) <= 4
+        collected.extend(items)
+        if not next_token:
+            break
+        start_key = result_pages.decode_next_token(next_token, 'task_name', 'task1')
+    assert run_times(collected) == list(reversed(range(10)))
+
+
+def test_page_detail_is_validated():
+    with pytest.raises(ValueError):
+        result_pages.parse_page_detail({'limit': 5000})
+    with pytest.raises(ValueError):
+        result_pages.parse_page_detail({'sort_order': 'sideways'}, opt_in=True)
+    with pytest.raises(ValueError):
+        result_pages.decode_next_token(result_pages.encode_next_token({'task_name': {'S': 'other'}}), 'task_name', 'task1')
@@ -0,0 +1,61 @@
+import gzip
+import io
+import json
+import os
+import result_pages
+import result_store
+
+
+class FakeS3:
+
+    def __init__(self):
+        self.objects = {}
+        self.gets = []
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[Key] = Body
+
+    def get_object(self, Bucket, Key):
+        self.gets.append(Key)
+        return {'Body': io.BytesIO(self.objects[Key])}
+
+
+def test_large_output_is_stored_with_its_size():
+    s3 = FakeS3()
+    output_json = json.dumps(os.urandom(result_store.inline_limit).hex())
+    output = result_store.store_output(s3, 'havoc', 'instruct_command_output', 'key1', output_json)
+    assert output == {
+        'instruct_command_output_ref': {'S': 'key1'}, 'instruct_command_output_size': {'N': str(len(output_json))}
+    }
+    assert gzip.decompress(s3.objects['key1']).decode('utf-8') == output_json
+    assert set(output) < set(result_store.output_attributes('instruct_command_output'))
+
+
+def resolve(api_module, monkeypatch, queue_list, output_budget):
+    """Resolves queue_list with output_budget bytes left on the page after its rows. Returns the keys fetched."""
+    results_queue = api_module('task_control', 'results_queue')
+    monkeypatch.setattr(result_pages, 'max_page_bytes', len(json.dumps(queue_list)) + output_budget)
+    s3 = FakeS3()
+    for result in queue_list:
+        if 'instruct_command_output_ref' in result:
+            s3.objects[result['instruct_command_output_ref']] = gzip.compress(b'o' * 100)
+    queue = results_queue.Queue('havoc', 'task1', 'us-east-1', {}, 'user1', {})
+    queue._Queue__aws_s3_client = s3
+    assert queue.resolve_outputs(queue_list) == 'outputs_resolved'
+    return sorted(s3.gets)
+
+
+def test_outputs_beyond_the_budget_are_not_fetched(api_module, monkeypatch):
+    queue_list = [
+        {'instruct_command_output_ref': f'key{i}', 'instruct_command_output_size': '100'} for i in range(5)
+    ]
+    assert resolve(api_module, monkeypatch, queue_list, 250) == ['key0', 'key1']
+    assert [result.get('instruct_command_output') for result in queue_list[:2]] == ['o' * 100] * 2
+    assert queue_list[2] == {'instruct_command_output_ref': 'key2', 'instruct_command_output_size': '100'}
+
+
+def test_inline_rows_count_against_the_budget(api_module, monkeypatch):
+    queue_list = [{'instruct_command_output': 'i' * 1000}] + [
+        {'instruct_command_output_ref': f'key{i}', 'instruct_command_output_size': '100'} for i in range(2)
+    ]
+    assert resolve(api_module, monkeypatch, queue_list, 50) == []
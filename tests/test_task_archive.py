@@ -0,0 +1,59 @@
+import pytest
+import task_archive
+from fake_aws import FakeDynamoDB
+
+
+@pytest.fixture
+def dynamodb():
+    dynamodb = FakeDynamoDB()
+    dynamodb.put('havoc-tasks', {
+        'task_name': {'S': 'task1'}, 'task_type': {'S': 'nmap'}, 'task_status': {'S': 'terminated'},
+        'create_time': {'S': '2026-10-01 12:00:00'}, 'instruct_seq': {'N': '7'}, 'public_ip': {'S': '1.2.3.4'},
+        'local_ip': {'SS': ['10.0.0.1']}
+    })
+    return dynamodb
+
+
+def test_terminated_task_is_moved_to_the_archive(dynamodb):
+    assert task_archive.archive_task(dynamodb, 'havoc', 'task1') == 'task_archived'
+    archived_item = task_archive.get_archived_task(dynamodb, 'havoc', 'task1')
+    assert archived_item['public_ip'] == {'S': '1.2.3.4'}
+    tombstone = dynamodb.get('havoc-tasks', task_name='task1')
+    assert set(tombstone) == {'task_name', 'task_type', 'task_status', 'create_time', 'instruct_seq', 'archived'}
+    # Both rows record the archive time as a number
+    assert tombstone['archived'] == archived_item['archive_time']
+    assert 'N' in tombstone['archived']
+
+
+def test_archiving_again_changes_nothing(dynamodb):
+    task_archive.archive_task(dynamodb, 'havoc', 'task1')
+    tombstone = dynamodb.get('havoc-tasks', task_name='task1')
+    assert task_archive.archive_task(dynamodb, 'havoc', 'task1') == 'task_archived'
+    assert dynamodb.get('havoc-tasks', task_name='task1') == tombstone
+    assert len(dynamodb.items('havoc-tasks-archive')) == 1
+
+
+def test_only_terminated_tasks_are_archived(dynamodb):
+    dynamodb.put('havoc-tasks', {
+        'task_name': {'S': 'task2'}, 'task_status': {'S': 'idle'}, 'create_time': {'S': '2026-10-01 12:00:00'}
+    })
+    assert task_archive.archive_task(dynamodb, 'havoc', 'task2') == 'task_not_terminated'
+    assert task_archive.archive_task(dynamodb, 'havoc', 'task3') == 'task_not_found'
+    assert dynamodb.items('havoc-tasks-archive') == []
+
+
+def test_task_re_registered_after_the_read_is_not_archived(dynamodb):
+    transact_write_items = dynamodb.transact_write_items
+
+    def re_registered_first(TransactItems):
+        dynamodb.put('havoc-tasks', {
+            'task_name': {'S': 'task1'}, 'task_status': {'S': 'terminated'},
+            'create_time': {'S': '2026-10-02 08:00:00'}, 'public_ip': {'S': '5.6.7.8'}
+        })
+        return transact_write_items(TransactItems)
+
+    dynamodb.transact_write_items = re_registered_first
+    archive_task_response = task_archive.archive_task(dynamodb, 'havoc', 'task1')
+    assert archive_task_response.response['Error']['Code'] == 'TransactionCanceledException'
+    assert dynamodb.items('havoc-tasks-archive') == []
+    assert dynamodb.get('havoc-tasks', task_name='task1')['public_ip'] == {'S': '5.6.7.8'}
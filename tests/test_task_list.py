@@ -0,0 +1,99 @@
+import json
+import time
+import pytest
+
+# Listing the running tasks of a deployment with 50k tasks on record must not pay for the terminated history.
+list_budget_seconds = 0.5
+
+
+class FakeStatusIndex:
+    """
+    Queries a KEYS_ONLY task_status/task_type index the way DynamoDB does: Limit and the page size count evaluated
+    items, and the FilterExpression is applied to each page afterwards.
+    """
+
+    def __init__(self, tasks, page_size=5000):
+        self.partitions = {}
+        for task_name, task_type, task_status in tasks:
+            self.partitions.setdefault(task_status, []).append({
+                'task_name': {'S': task_name}, 'task_type': {'S': task_type}, 'task_status': {'S': task_status}
+            })
+        self.positions = {}
+        for items in self.partitions.values():
+            items.sort(key=lambda item: (item['task_type']['S'], item['task_name']['S']))
+            self.positions.update((item['task_name']['S'], position) for position, item in enumerate(items))
+        self.page_size = page_size
+        self.evaluated = 0
+
+    def query(self, **kwargs):
+        values = kwargs['ExpressionAttributeValues']
+        items = self.partitions.get(values[':task_status']['S'], [])
+        start = 0
+        if 'ExclusiveStartKey' in kwargs:
+            start = self.positions[kwargs['ExclusiveStartKey']['task_name']['S']] + 1
+        page = items[start:start + min(kwargs.get('Limit', self.page_size), self.page_size)]
+        self.evaluated += len(page)
+        response = {'Items': [
+            item for item in page
+            if values.get(':task_name_contains', {'S': ''})['S'] in item['task_name']['S'] and
+            values.get(':task_type_contains', {'S': ''})['S'] in item['task_type']['S']
+        ]}
+        if start + len(page) < len(items):
+            response['LastEvaluatedKey'] = page[-1]
+        return response
+
+
+def deployment_tasks(count=50000, running=1000):
+    statuses = ['starting', 'idle', 'busy']
+    for i in range(count):
+        task_status = statuses[i % 3] if i < running else 'terminated'
+        yield f'task{i:05d}', ['nmap', 'metasploit', 'powershell_empire'][i % 3], task_status
+
+
+def list_tasks(api_module, index, detail):
+    tasks = api_module('manage', 'tasks')
+    task_list = tasks.Tasks('havoc', 'us-east-1', 'user1', detail, {})
+    task_list._Tasks__aws_dynamodb_client = index
+    response = task_list.list()
+    assert response['statusCode'] == 200
+    return json.loads(response['body'])
+
+
+def test_running_tasks_list_reads_only_running_partitions(api_module):
+    index = FakeStatusIndex(deployment_tasks())
+    body = list_tasks(api_module, index, {})
+    assert len(body['tasks']) == 1000
+    assert {task['task_status'] for task in body['tasks']} == {'starting', 'idle', 'busy'}
+    # Only the running status partitions were read
+    assert index.evaluated == 1000
+
+
+@pytest.mark.benchmark
+def test_running_tasks_list_benchmark(api_module):
+    index = FakeStatusIndex(deployment_tasks())
+    start = time.perf_counter()
+    list_tasks(api_module, index, {})
+    elapsed = time.perf_counter() - start
+    print(f'running tasks list of a 50k-task deployment: {elapsed * 1000:.1f} ms')
+    assert elapsed < list_budget_seconds
+
+
+def test_paged_list_of_all_tasks(api_module):
+    index = FakeStatusIndex(deployment_tasks())
+    task_names = []
+    detail = {'task_status': 'all', 'limit': 1000}
+    while True:
+        body = list_tasks(api_module, index, detail)
+        assert len(body['tasks']) <= 1000
+        task_names.extend(task['task_name'] for task in body['tasks'])
+        if 'next_token' not in body:
+            break
+        detail['next_token'] = body['next_token']
+    assert len(task_names) == 50000
+    assert len(set(task_names)) == 50000
+
+
+def test_filters_apply_within_the_status_partitions(api_module):
+    index = FakeStatusIndex(deployment_tasks())
+    body = list_tasks(api_module, index, {'task_type': 'nmap', 'task_name_contains': 'task000'})
+    assert {task['task_name'] for task in body['tasks']} == {f'task{i:05d}' for i in range(0, 100, 3)}
@@ -0,0 +1,197 @@
+import json
+import types
+import pytest
+import result_envelope
+from fake_aws import FakeDynamoDB, FakeRoute53, FakeS3, client_error
+
+
+class FakeLambda:
+
+    def __init__(self):
+        self.errors = []
+        self.invocations = []
+
+    def invoke(self, FunctionName, InvocationType, Payload):
+        if self.errors:
+            raise self.errors.pop(0)
+        self.invocations.append(json.loads(Payload))
+        return {}
+
+
+def log_event(task_name, stime, instruct_command='ls', output=None):
+    payload = {
+        'instruct_user_id': 'user1', 'user_id': 'user1', 'task_name': task_name, 'timestamp': str(stime),
+        'instruct_command': instruct_command, 'instruct_id': f'id{stime}', 'instruct_instance': 'None',
+        'instruct_args': {'path': '/tmp', 'count': 2}, 'instruct_command_output': output or {'outcome': 'success'},
+        'task_context': 'None', 'task_type': 'nmap', 'task_version': '1', 'public_ip': '1.2.3.4',
+        'local_ip': ['10.0.0.1'], 'forward_log': 'False', 'end_time': 'None'
+    }
+    return {'id': f'{task_name}-{stime}', 'message': result_envelope.build_envelope(payload)}
+
+
+@pytest.fixture
+def deliver(api_module, monkeypatch):
+    deliver_module = api_module('task_result', 'deliver')
+    sleeps = []
+    monkeypatch.setattr(deliver_module, 't', types.SimpleNamespace(sleep=sleeps.append))
+    dynamodb = FakeDynamoDB()
+    for i in range(150):
+        dynamodb.put('havoc-tasks', {
+            'task_name': {'S': f'task{i}'}, 'task_status': {'S': 'busy'}, 'portgroups': {'SS': ['None']},
+            'task_host_name': {'S': 'None'}, 'task_domain_name': {'S': 'None'}
+        })
+    clients = {'dynamodb': dynamodb, 's3': FakeS3(), 'route53': FakeRoute53(), 'lambda': FakeLambda()}
+
+    def new_delivery(log_events):
+        delivery = deliver_module.Deliver('us-east-1', 'havoc', 7, 'false', log_events,
+                                          function_arn='arn:aws:lambda:us-east-1:123456789012:function:havoc-task-result')
+        for service, client in clients.items():
+            setattr(delivery, f'_Deliver__aws_{service}_client', client)
+        return delivery
+
+    def deliver_results(log_events):
+        return new_delivery(log_events).deliver_results()
+
+    return types.SimpleNamespace(
+        deliver_results=deliver_results, new_delivery=new_delivery, sleeps=sleeps, dynamodb=dynamodb,
+        route53=clients['route53'], lambda_client=clients['lambda']
+    )
+
+
+def run_times(dynamodb, task_name):
+    return sorted(int(item['run_time']['N']) for item in dynamodb.items('havoc-task-queue')
+                  if item['task_name']['S'] == task_name)
+
+
+def test_results_for_many_tasks_are_delivered_in_batches(deliver):
+    deliver_results, dynamodb = deliver.deliver_results, deliver.dynamodb
+    deliver_results([log_event(f'task{i}', 1790000000 + j) for i in range(150) for j in range(2)])
+    assert len(dynamodb.items('havoc-task-queue')) == 300
+    assert dynamodb.get('havoc-tasks', task_name='task149')['last_instruct_time']['S'] == '1790000001'
+    # 150 task rows in two BatchGetItem calls and 300 queue rows in twelve BatchWriteItem calls
+    assert dynamodb.calls.count('batch_get_item') == 2
+    assert dynamodb.calls.count('batch_write_item') == 12
+    assert dynamodb.calls.count('update_item') == 150
+
+
+def test_results_for_the_same_second_are_written_once(deliver):
+    deliver_results, dynamodb = deliver.deliver_results, deliver.dynamodb
+    deliver_results([
+        log_event('task1', 1790000000, output={'outcome': 'first'}),
+        log_event('task1', 1790000000, output={'outcome': 'second'}),
+        log_event('task1', 1790000001),
+        log_event('task2', 1790000000)
+    ])
+    assert run_times(dynamodb, 'task1') == [1790000000, 1790000001]
+    assert run_times(dynamodb, 'task2') == [1790000000]
+    row = dynamodb.get('havoc-task-queue', task_name='task1', run_time='1790000000')
+    assert 'second' in row['instruct_command_output']['S']
+
+
+def test_unprocessed_keys_and_items_are_retried_with_backoff(deliver):
+    deliver_results, dynamodb, sleeps = deliver.deliver_results, deliver.dynamodb, deliver.sleeps
+    dynamodb.unprocessed = [1, 0, 10, 5]
+    deliver_results([log_event(f'task{i}', 1790000000) for i in range(20)])
+    assert len(dynamodb.items('havoc-task-queue')) == 20
+    assert len(sleeps) == 3
+    assert sleeps == sorted(sleeps)
+
+
+def test_task_entries_still_unprocessed_fail_the_delivery(deliver):
+    deliver_results, dynamodb, sleeps = deliver.deliver_results, deliver.dynamodb, deliver.sleeps
+    dynamodb.unprocessed = [1] * 8
+    with pytest.raises(RuntimeError):
+        deliver_results([log_event('task1', 1790000000)])
+    assert len(sleeps) == 7
+    assert dynamodb.items('havoc-task-queue') == []
+    assert dynamodb.get('havoc-tasks', task_name='task1')['task_status']['S'] == 'busy'
+
+
+def test_queue_entries_still_unprocessed_are_given_up_on(deliver, capsys):
+    deliver_results, dynamodb, sleeps = deliver.deliver_results, deliver.dynamodb, deliver.sleeps
+    dynamodb.unprocessed = [0] + [1] * 8
+    assert deliver_results([log_event('task1', 1790000000), log_event('task2', 1790000000)]) is True
+    assert 'still unprocessed after 8 attempts' in capsys.readouterr().out
+    assert len(sleeps) == 7
+    assert run_times(dynamodb, 'task1') == []
+    assert run_times(dynamodb, 'task2') == [1790000000]
+
+
+def test_results_of_unknown_and_archived_tasks_are_dropped(deliver):
+    deliver_results, dynamodb = deliver.deliver_results, deliver.dynamodb
+    dynamodb.put('havoc-tasks', {'task_name': {'S': 'task1'}, 'archived': {'N': '1790000000'}})
+    dynamodb.failures['update_item'] = [client_error('InternalServerError')]
+    deliver_results([log_event('task1', 1790000000), log_event('missing', 1790000000), log_event('task2', 1790000000)])
+    assert [item['task_name']['S'] for item in dynamodb.items('havoc-task-queue')] == ['task2']
+
+
+def add_terminating_tasks(deliver):
+    """Adds term1 and term2, each with a portgroup membership, a host name and a DNS record on example.com"""
+    deliver.dynamodb.put('havoc-deployment', {
+        'deployment_name': {'S': 'havoc'}, 'active_resources': {'M': {'tasks': {'SS': ['None', 'term1', 'term2']}}}
+    })
+    deliver.dynamodb.put('havoc-portgroups', {'portgroup_name': {'S': 'web'}, 'tasks': {'SS': ['term1', 'term2']}})
+    deliver.dynamodb.put('havoc-domains', {
+        'domain_name': {'S': 'example.com'}, 'hosted_zone': {'S': 'Z1'}, 'tasks': {'SS': ['term1', 'term2']},
+        'host_names': {'SS': ['www1', 'www2']}
+    })
+    for i in [1, 2]:
+        deliver.dynamodb.put('havoc-tasks', {
+            'task_name': {'S': f'term{i}'}, 'task_status': {'S': 'idle'}, 'portgroups': {'SS': ['web']},
+            'task_host_name': {'S': f'www{i}'}, 'task_domain_name': {'S': 'example.com'},
+            'create_time': {'S': '2026-10-01 12:00:00'}
+        })
+        deliver.route53.records[('Z1', f'www{i}.example.com', 'A')] = ['1.2.3.4']
+
+
+def assert_released(deliver):
+    assert deliver.dynamodb.get('havoc-portgroups', portgroup_name='web')['tasks']['SS'] == ['None']
+    domain_entry = deliver.dynamodb.get('havoc-domains', domain_name='example.com')
+    assert (domain_entry['tasks']['SS'], domain_entry['host_names']['SS']) == (['None'], ['None'])
+    assert deliver.route53.records == {}
+    assert set(
+        deliver.dynamodb.get('havoc-deployment', deployment_name='havoc')['active_resources']['M']['tasks']['SS']
+    ) == {'None'}
+    for task_name in ['term1', 'term2']:
+        assert 'archived' in deliver.dynamodb.get('havoc-tasks', task_name=task_name)
+
+
+def test_terminated_tasks_are_cleaned_up_in_one_async_invocation(deliver):
+    add_terminating_tasks(deliver)
+    deliver.deliver_results([
+        log_event('term1', 1790000000, instruct_command='terminate'), log_event('term2', 1790000000, 'terminate'),
+        log_event('task1', 1790000000)
+    ])
+    assert deliver.dynamodb.get('havoc-tasks', task_name='term1')['task_status']['S'] == 'terminated'
+    # The delivery only hands the cleanup off
+    assert deliver.dynamodb.get('havoc-portgroups', portgroup_name='web')['tasks']['SS'] == ['term1', 'term2']
+    assert len(deliver.lambda_client.invocations) == 1
+    invocation = deliver.lambda_client.invocations[0]
+    assert invocation['action'] == 'cleanup_terminated_task'
+    assert [task['task_name'] for task in invocation['detail']['tasks']] == ['term1', 'term2']
+
+    assert deliver.new_delivery([]).cleanup_terminated_task(invocation['detail']) == 'terminate_cleanup_completed'
+    assert_released(deliver)
+    # A retried invocation finds everything already done
+    assert deliver.new_delivery([]).cleanup_terminated_task(invocation['detail']) == 'terminate_cleanup_completed'
+
+
+def test_cleanup_runs_inline_when_the_invoke_fails(deliver):
+    add_terminating_tasks(deliver)
+    deliver.lambda_client.errors.append(client_error('TooManyRequestsException'))
+    deliver.deliver_results([log_event('term1', 1790000000, 'terminate'), log_event('term2', 1790000000, 'terminate')])
+    assert deliver.lambda_client.invocations == []
+    assert_released(deliver)
+
+
+def test_failed_cleanup_is_raised_for_lambda_to_retry(deliver):
+    add_terminating_tasks(deliver)
+    deliver.deliver_results([log_event('term1', 1790000000, 'terminate'), log_event('term2', 1790000000, 'terminate')])
+    detail = deliver.lambda_client.invocations[0]['detail']
+    deliver.route53.failures.append(client_error('AccessDenied'))
+    with pytest.raises(RuntimeError):
+        deliver.new_delivery([]).cleanup_terminated_task(detail)
+    # Nothing is archived until the cleanup has succeeded
+    assert 'archived' not in deliver.dynamodb.get('havoc-tasks', task_name='term1')
+    deliver.new_delivery([]).cleanup_terminated_task(detail)
+    assert_released(deliver)
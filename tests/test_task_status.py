@@ -0,0 +1,48 @@
+import json
+
+
+class FakeDynamoDB:
+
+    def __init__(self, statuses):
+        self.statuses = statuses
+        self.reads = 0
+
+    def get_item(self, TableName, Key, **kwargs):
+        self.reads += 1
+        task_status = self.statuses[min(self.reads, len(self.statuses)) - 1]
+        if task_status is None:
+            return {}
+        return {'Item': {'task_status': {'S': task_status}}}
+
+
+def wait_for_status(api_module, statuses, detail):
+    task_status = api_module('task_control', 'task_status')
+    task_status.Task.initial_poll_interval = 0
+    task = task_status.Task('havoc', 'task1', 'us-east-1', detail, 'user1', {})
+    dynamodb = FakeDynamoDB(statuses)
+    task._Task__aws_dynamodb_client = dynamodb
+    response = task.wait_for_status()
+    return response['statusCode'], json.loads(response['body']), dynamodb.reads
+
+
+def test_status_reached(api_module):
+    status_code, body, reads = wait_for_status(api_module, ['busy', 'busy', 'idle'], {'wait_seconds': 5})
+    assert status_code == 200
+    assert body['status_reached'] == 'yes'
+    assert reads == 3
+
+
+def test_terminated_task_fails_without_waiting(api_module):
+    status_code, body, reads = wait_for_status(api_module, ['busy', 'terminated'], {'wait_seconds': 25})
+    assert status_code == 409
+    assert body['task_status'] == 'terminated'
+    assert reads == 2
+
+    status_code, body, _ = wait_for_status(api_module, ['terminated'], {'task_status': 'terminated'})
+    assert status_code == 200
+    assert body['status_reached'] == 'yes'
+
+
+def test_missing_task(api_module):
+    status_code, _, _ = wait_for_status(api_module, [None], {})
+    assert status_code == 404
@@ -0,0 +1,107 @@
+import types
+import pytest
+import task_teardown
+from fake_aws import FakeDynamoDB, FakeRoute53, client_error
+
+
+@pytest.fixture
+def teardown(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(task_teardown, 't', types.SimpleNamespace(sleep=sleeps.append))
+    dynamodb = FakeDynamoDB()
+    route53 = FakeRoute53()
+    tasks = []
+    for i in range(6):
+        task = {
+            'task_name': f'task{i}', 'portgroups': [f'pg{i}', 'shared'], 'task_host_name': f'www{i}',
+            'task_domain_name': 'example.com', 'public_ip': f'10.0.0.{i}'
+        }
+        tasks.append(task)
+        dynamodb.put('havoc-tasks', {'task_name': {'S': task['task_name']}, 'task_status': {'S': 'idle'}})
+        dynamodb.put('havoc-portgroups', {'portgroup_name': {'S': f'pg{i}'}, 'tasks': {'SS': [task['task_name']]}})
+        route53.records[('Z1', f'www{i}.example.com', 'A')] = [task['public_ip']]
+    task_names = [task['task_name'] for task in tasks]
+    dynamodb.put('havoc-portgroups', {'portgroup_name': {'S': 'shared'}, 'tasks': {'SS': task_names + ['other']}})
+    dynamodb.put('havoc-domains', {
+        'domain_name': {'S': 'example.com'}, 'hosted_zone': {'S': 'Z1'}, 'tasks': {'SS': task_names + ['other']},
+        'host_names': {'SS': [task['task_host_name'] for task in tasks] + ['mail']}
+    })
+    dynamodb.put('havoc-deployment', {
+        'deployment_name': {'S': 'havoc'}, 'active_resources': {'M': {'tasks': {'SS': task_names + ['other']}}}
+    })
+
+    def run(task_status='terminated'):
+        return task_teardown.Teardown(dynamodb, route53, 'havoc', tasks, task_status=task_status).run()
+
+    return types.SimpleNamespace(run=run, dynamodb=dynamodb, route53=route53, sleeps=sleeps)
+
+
+def assert_released(teardown):
+    dynamodb = teardown.dynamodb
+    for i in range(6):
+        assert dynamodb.get('havoc-portgroups', portgroup_name=f'pg{i}')['tasks']['SS'] == ['None']
+        assert dynamodb.get('havoc-tasks', task_name=f'task{i}')['task_status']['S'] == 'terminated'
+    assert dynamodb.get('havoc-portgroups', portgroup_name='shared')['tasks']['SS'] == ['other']
+    domain_entry = dynamodb.get('havoc-domains', domain_name='example.com')
+    assert (domain_entry['tasks']['SS'], domain_entry['host_names']['SS']) == (['other'], ['mail'])
+    assert dynamodb.get('havoc-deployment', deployment_name='havoc')['active_resources']['M']['tasks']['SS'] == ['other']
+    assert teardown.route53.records == {}
+
+
+def test_teardown_commits_in_one_transaction_and_can_be_repeated(teardown):
+    assert teardown.run() == 'teardown_completed'
+    assert_released(teardown)
+    assert teardown.dynamodb.calls == ['batch_get_item', 'transact_write_items']
+    # One DNS change batch for the zone
+    assert len(teardown.route53.requests) == 1
+
+    assert teardown.run() == 'teardown_completed'
+    assert_released(teardown)
+
+
+def test_large_teardowns_are_split_into_transactions_that_fit(teardown, monkeypatch):
+    # Three tasks fit in 9 items: their portgroup and task rows, the shared portgroup, the domain and the deployment
+    monkeypatch.setattr(task_teardown, 'max_transact_items', 9)
+    assert teardown.run() == 'teardown_completed'
+    assert teardown.dynamodb.calls.count('transact_write_items') == 2
+    # The shared portgroup and domain rows carry each group's committed values into the next group's conditions,
+    # so no group is cancelled
+    assert teardown.sleeps == []
+    assert_released(teardown)
+
+
+def test_a_concurrent_change_is_read_again_and_kept(teardown):
+    dynamodb = teardown.dynamodb
+    transact_write_items = dynamodb.transact_write_items
+
+    def joined_concurrently(TransactItems):
+        shared = dynamodb.get('havoc-portgroups', portgroup_name='shared')
+        if 'late' not in shared['tasks']['SS']:
+            shared['tasks']['SS'] = shared['tasks']['SS'] + ['late']
+        return transact_write_items(TransactItems)
+
+    dynamodb.transact_write_items = joined_concurrently
+    assert teardown.run() == 'teardown_completed'
+    assert dynamodb.calls.count('batch_get_item') == 2
+    assert dynamodb.get('havoc-portgroups', portgroup_name='shared')['tasks']['SS'] == ['other', 'late']
+    assert len(teardown.sleeps) == 1
+
+
+def test_teardown_gives_up_after_max_attempts(teardown):
+    cancelled = client_error('TransactionCanceledException', 'Transaction cancelled')
+    teardown.dynamodb.failures['transact_write_items'] = [cancelled] * task_teardown.max_attempts
+    teardown_response = teardown.run()
+    assert len(teardown_response) == 1 and 'TransactionCanceledException' in teardown_response[0]
+    # Nothing was released, including the DNS records
+    assert len(teardown.route53.records) == 6
+    assert teardown.run() == 'teardown_completed'
+
+
+def test_unprocessed_keys_are_retried_up_to_a_limit(teardown):
+    teardown.dynamodb.unprocessed = [3, 1]
+    assert teardown.run() == 'teardown_completed'
+    assert teardown.sleeps == [0.1, 0.2]
+
+    teardown.dynamodb.unprocessed = [1] * task_teardown.max_batch_attempts
+    teardown_response = teardown.run()
+    assert 'still unprocessed' in teardown_response[0]
@@ -0,0 +1,63 @@
+import json
+import pytest
+import task_archive
+from fake_aws import FakeDynamoDB
+
+
+def task_item(task_name, task_status='idle', create_time='2026-10-01 12:00:00', **overrides):
+    item = {
+        'task_name': {'S': task_name}, 'task_type': {'S': 'nmap'}, 'task_version': {'S': '1'},
+        'task_context': {'S': 'None'}, 'task_status': {'S': task_status}, 'public_ip': {'S': '1.2.3.4'},
+        'local_ip': {'SS': ['10.0.0.1']}, 'portgroups': {'SS': ['None']}, 'listeners': {'SS': ['None']},
+        'instruct_instances': {'SS': ['None']}, 'last_instruct_user_id': {'S': 'user1'},
+        'last_instruct_id': {'S': 'id1'}, 'last_instruct_instance': {'S': 'None'},
+        'last_instruct_command': {'S': 'Initialize'}, 'last_instruct_args': {'M': {'no_args': {'S': 'True'}}},
+        'last_instruct_time': {'S': create_time}, 'user_id': {'S': 'user1'}, 'create_time': {'S': create_time},
+        'scheduled_end_time': {'S': 'None'}, 'ecs_task_id': {'S': 'arn:aws:ecs:task/1'},
+        'task_host_name': {'S': 'None'}, 'task_domain_name': {'S': 'None'}
+    }
+    item.update(overrides)
+    return item
+
+
+@pytest.fixture
+def tasks(api_module):
+    tasks_module = api_module('manage', 'tasks')
+    dynamodb = FakeDynamoDB()
+
+    def new_tasks(detail):
+        task_list = tasks_module.Tasks('havoc', 'us-east-1', 'user1', detail, {})
+        task_list._Tasks__aws_dynamodb_client = dynamodb
+        return task_list
+
+    return new_tasks, dynamodb
+
+
+def test_get_returns_binary_args_as_base64(tasks):
+    new_tasks, dynamodb = tasks
+    dynamodb.put('havoc-tasks', task_item('task1', last_instruct_args={'M': {
+        'key_file': {'B': b'\x00\x01'}, 'port': {'N': '22'}
+    }}))
+    response = new_tasks({'task_name': 'task1'}).get()
+    assert response['statusCode'] == 200
+    assert json.loads(response['body'])['last_instruct_args'] == {'key_file': 'AAE=', 'port': '22'}
+
+
+def test_get_reads_archived_tasks_through_the_tombstone(tasks):
+    new_tasks, dynamodb = tasks
+    dynamodb.put('havoc-tasks', task_item('task1', task_status='terminated', public_ip={'S': '5.6.7.8'}))
+    assert task_archive.archive_task(dynamodb, 'havoc', 'task1') == 'task_archived'
+    assert 'public_ip' not in dynamodb.get('havoc-tasks', task_name='task1')
+
+    response = new_tasks({'task_name': 'task1'}).get()
+    assert response['statusCode'] == 200
+    body = json.loads(response['body'])
+    assert (body['task_status'], body['public_ip']) == ('terminated', '5.6.7.8')
+
+
+def test_get_of_a_tombstone_without_an_archived_row(tasks):
+    new_tasks, dynamodb = tasks
+    dynamodb.put('havoc-tasks', {
+        'task_name': {'S': 'task1'}, 'task_status': {'S': 'terminated'}, 'archived': {'N': '1790000000'}
+    })
+    assert new_tasks({'task_name': 'task1'}).get()['statusCode'] == 404